@@ -0,0 +1,206 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+sys.path.insert(0, "./")
+
+import cfn_flip
+
+from modules.cf_tables import create_template as create_cf_tables
+from modules.cf_orchestrator import create_template as create_cf_orchestrator
+from modules.cf_individual import create_template as create_cf_individual
+from modules.template_yaml import template_to_yaml
+
+# Benchmark the CloudFormation template generator (see run.py).
+#
+# For each template, times create_template() and writing it as YAML (like run.py,
+# including with --cfn-flip), measures the peak memory used while generating it, and reports its
+# resource, parameter, condition, mapping and output counts and byte size against
+# the CloudFormation limits. Fails if a template exceeds its budget in
+# template-budgets.json, or a CloudFormation limit.
+
+TEMPLATES = [
+    ("tables", create_cf_tables),
+    ("orchestrator", create_cf_orchestrator),
+    ("individual-codebuild", create_cf_individual),
+]
+
+# CloudFormation limits for a template. Conditions have no documented limit.
+CF_LIMITS = {
+    "resources": 500,
+    "parameters": 200,
+    "conditions": None,
+    "mappings": 200,
+    "outputs": 200,
+    "bytes": 1048576,
+}
+
+# Templates larger than this must be uploaded to S3 rather than passed in the request.
+CF_DIRECT_UPLOAD_BYTES = 51200
+
+COUNTS = ["resources", "parameters", "conditions", "mappings", "outputs"]
+
+parser = argparse.ArgumentParser(
+    description='Benchmark the CloudFormation template generator for CBuildCI and check its output against budgets',
+)
+
+parser.add_argument('--iterations', type=int, default=10, help='Timed iterations of each template')
+parser.add_argument('--budgets', type=str, default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "template-budgets.json"), help='JSON file of budgets per template')
+parser.add_argument('--no-budgets', action='store_true', help='Only report, without checking budgets')
+parser.add_argument('--cfn-flip', action='store_true', help='Convert the templates to YAML with cfn_flip, like run.py --cfn-flip')
+parser.add_argument('--json', action='store_true', help='Output the report as JSON')
+
+args = parser.parse_args()
+
+
+def to_yaml(template):
+    if args.cfn_flip:
+        return cfn_flip.to_yaml(template.to_json(sort_keys = False), True)
+    return template_to_yaml(template)
+
+
+# Time each step of generating a template, keeping the fastest of the iterations.
+def time_template(create_template, iterations):
+    timings = {
+        "create": [],
+        "yaml": [],
+    }
+
+    for _ in range(iterations):
+        gc.collect()
+
+        start = time.perf_counter()
+        template = create_template()
+        created = time.perf_counter()
+        to_yaml(template)
+        end = time.perf_counter()
+
+        timings["create"].append(created - start)
+        timings["yaml"].append(end - created)
+
+    ret = dict((step, round(min(values), 4)) for step, values in timings.items())
+    ret["total"] = round(sum(ret.values()), 4)
+    return ret
+
+
+# Measure the peak memory allocated while generating a template, which is
+# done separately from the timing since tracing allocations slows it down.
+def measure_peak_memory(create_template):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        to_yaml(create_template())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def benchmark(name, create_template):
+    template = create_template()
+    template_json = template.to_json(sort_keys = False)
+    template_yaml = to_yaml(template)
+
+    return {
+        "name": name,
+        "counts": {
+            "resources": len(template.resources),
+            "parameters": len(template.parameters),
+            "conditions": len(template.conditions),
+            "mappings": len(template.mappings),
+            "outputs": len(template.outputs),
+        },
+        "bytes": {
+            "json": len(template_json.encode("utf-8")),
+            "yaml": len(template_yaml.encode("utf-8")),
+        },
+        "seconds": time_template(create_template, args.iterations),
+        "peakMemoryBytes": measure_peak_memory(create_template),
+    }
+
+
+# Check a template's report against the CloudFormation limits and its budget.
+# The deployed templates are YAML, so that is the size that is checked.
+def check(report, budget):
+    failures = []
+
+    def check_value(label, value, limit, kind):
+        if limit is not None and value > limit:
+            failures.append("%s %s is %s, over the %s of %s" % (report["name"], label, value, kind, limit))
+
+    for count in COUNTS:
+        check_value(count, report["counts"][count], CF_LIMITS[count], "CloudFormation limit")
+    check_value("size in bytes", report["bytes"]["yaml"], CF_LIMITS["bytes"], "CloudFormation limit")
+
+    if budget is not None:
+        for count in COUNTS:
+            check_value(count, report["counts"][count], budget.get(count), "budget")
+        check_value("size in bytes", report["bytes"]["yaml"], budget.get("bytes"), "budget")
+        check_value("total seconds", report["seconds"]["total"], budget.get("seconds"), "budget")
+        check_value("peak memory bytes", report["peakMemoryBytes"], budget.get("peakMemoryBytes"), "budget")
+
+    return failures
+
+
+budgets = {}
+if not args.no_budgets:
+    with open(args.budgets, "r") as stream:
+        budgets = json.load(stream)
+        stream.close()
+
+reports = []
+failures = []
+for name, create_template in TEMPLATES:
+    report = benchmark(name, create_template)
+    reports.append(report)
+
+    if not args.no_budgets and name not in budgets:
+        failures.append("%s has no budget in %s" % (name, args.budgets))
+    failures.extend(check(report, budgets.get(name)))
+
+if args.json:
+    print(json.dumps({"templates": reports, "failures": failures}, indent = 2))
+    exit(1 if failures else 0)
+
+
+def format_count(value, limit):
+    return "%d" % value if limit is None else "%d/%d" % (value, limit)
+
+
+print("%-22s %9s %11s %11s %9s %9s %10s %10s %10s %10s %10s %10s" % (
+    "Template", "Resources", "Parameters", "Conditions", "Mappings", "Outputs",
+    "JSON", "YAML", "Create", "To YAML", "Total", "Peak mem",
+))
+for report in reports:
+    counts = report["counts"]
+    print("%-22s %9s %11s %11s %9s %9s %10d %10d %8.1fms %8.1fms %8.1fms %9.1fM" % (
+        report["name"],
+        format_count(counts["resources"], CF_LIMITS["resources"]),
+        format_count(counts["parameters"], CF_LIMITS["parameters"]),
+        format_count(counts["conditions"], CF_LIMITS["conditions"]),
+        format_count(counts["mappings"], CF_LIMITS["mappings"]),
+        format_count(counts["outputs"], CF_LIMITS["outputs"]),
+        report["bytes"]["json"],
+        report["bytes"]["yaml"],
+        report["seconds"]["create"] * 1000,
+        report["seconds"]["yaml"] * 1000,
+        report["seconds"]["total"] * 1000,
+        report["peakMemoryBytes"] / 1024.0 / 1024.0,
+    ))
+
+print("")
+for report in reports:
+    if report["bytes"]["yaml"] > CF_DIRECT_UPLOAD_BYTES:
+        print("%s is over the %d byte limit for templates passed directly to CloudFormation, so it must be deployed from S3" % (
+            report["name"],
+            CF_DIRECT_UPLOAD_BYTES,
+        ))
+
+if failures:
+    print("")
+    for failure in failures:
+        print("FAILED: %s" % failure)
+    exit(1)
@@ -0,0 +1,252 @@
+import argparse
+import json
+import os
+import sys
+sys.path.insert(0, "./")
+
+from modules.cf_orchestrator import create_express_state_machine_definition
+from modules.local_states import VirtualClock, run_execution, from_timestamp
+
+# Compare the "standard" and "express" state machines for executions of different
+# lengths, by running both definitions in the local stand-in for Step Functions.
+#
+# Transition and invocation counts are measured by running the definitions.
+# The per-transition latency and the prices are inputs to the comparison. The
+# prices default to the published us-east-1 prices.
+
+# Seconds the step lambda hands off before the express workflow duration limit (see execution/index.js).
+EXPRESS_MAX_DURATION_SECONDS = 300
+EXPRESS_HANDOFF_MARGIN_SECONDS = 60
+
+parser = argparse.ArgumentParser(
+    description='Compare the standard and express state machines for CBuildCI',
+)
+
+parser.add_argument(
+    '--build-minutes',
+    type=float,
+    nargs='+',
+    default=[1, 3, 5, 10, 30, 60],
+    help='How long the builds of each simulated execution take, in minutes',
+)
+
+parser.add_argument(
+    '--wait-seconds',
+    type=int,
+    default=30,
+    help='Seconds to wait between checking the status of running builds',
+)
+
+parser.add_argument(
+    '--lambda-seconds',
+    type=float,
+    default=1.0,
+    help='Seconds each step lambda invocation takes',
+)
+
+parser.add_argument(
+    '--standard-transition-ms',
+    type=float,
+    default=50.0,
+    help='Latency added to each state transition by a standard workflow',
+)
+
+parser.add_argument(
+    '--express-transition-ms',
+    type=float,
+    default=10.0,
+    help='Latency added to each state transition by an express workflow',
+)
+
+parser.add_argument(
+    '--standard-price-per-transition',
+    type=float,
+    default=0.000025,
+)
+
+parser.add_argument(
+    '--express-price-per-request',
+    type=float,
+    default=0.000001,
+)
+
+parser.add_argument(
+    '--express-price-per-gb-second',
+    type=float,
+    default=0.00001667,
+)
+
+parser.add_argument(
+    '--express-memory-mb',
+    type=int,
+    default=64,
+    help='Memory billed for each express workflow execution, in 64 MB increments',
+)
+
+parser.add_argument(
+    '--lambda-price-per-request',
+    type=float,
+    default=0.0000002,
+)
+
+parser.add_argument(
+    '--json',
+    action='store_true',
+    help='Output the comparison as JSON',
+)
+
+args = parser.parse_args()
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+with open(os.path.join(script_dir, "modules", "state-machine-definition.json"), "r") as stream:
+    standard_definition = json.load(stream)
+    stream.close()
+
+express_definition = create_express_state_machine_definition()
+
+
+# Stands in for the step lambda, with builds that all finish "build_seconds"
+# after the CBuildCI execution starts.
+class StepLambdaStandIn(object):
+
+    def __init__(self, clock, mode, build_seconds):
+        self.clock = clock
+        self.mode = mode
+        self.builds_done_time = clock.now + build_seconds
+        self.state_version = 0
+        self.invocations = 0
+        self.handoff_input = None
+
+    def __call__(self, resource, payload, context):
+        self.invocations += 1
+
+        # Tasks using the "lambda:invoke" integration pass the lambda's event in "Payload".
+        payload = payload.get("Payload", payload)
+
+        if payload["runTask"] == "RunWait":
+            return {}, args.lambda_seconds
+
+        if payload["runTask"] in ("RunEnd", "RunError"):
+            return {"isRunning": False}, args.lambda_seconds
+
+        self.state_version += 1
+        is_running = self.clock.now + args.lambda_seconds < self.builds_done_time
+
+        pointer = {
+            "runTask": "RunMain",
+            "repoId": payload["repoId"],
+            "executionId": payload["executionId"],
+            "stateVersion": self.state_version,
+            "isRunning": is_running,
+            "handedOff": False,
+            "waitSeconds": args.wait_seconds,
+            "debounceSeconds": 0,
+            "errorInfo": None,
+        }
+
+        if self.mode == "express" and is_running:
+            elapsed = self.clock.now + args.lambda_seconds - from_timestamp(context["Execution"]["StartTime"])
+            if elapsed + args.wait_seconds + EXPRESS_HANDOFF_MARGIN_SECONDS >= EXPRESS_MAX_DURATION_SECONDS:
+                self.handoff_input = dict(pointer, debounceSeconds = args.wait_seconds)
+                pointer = dict(pointer, isRunning = False, handedOff = True)
+
+        return pointer, args.lambda_seconds
+
+
+def simulate(mode, build_minutes):
+    definition = standard_definition if mode == "standard" else express_definition
+    transition_seconds = (
+        args.standard_transition_ms if mode == "standard" else args.express_transition_ms
+    ) / 1000.0
+
+    clock = VirtualClock()
+    start_time = clock.now
+    step_lambda = StepLambdaStandIn(clock, mode, build_minutes * 60)
+
+    execution_input = {
+        "runTask": "RunMain",
+        "repoId": "owner/repo",
+        "executionId": "0" * 40 + "/0001",
+        "stateVersion": 0,
+        "isRunning": True,
+        "waitSeconds": args.wait_seconds,
+        "debounceSeconds": 0,
+        "errorInfo": None,
+    }
+
+    executions = 0
+    transitions = 0
+    billed_gb_seconds = 0.0
+
+    while execution_input is not None:
+        step_lambda.handoff_input = None
+        result = run_execution(definition, execution_input, step_lambda, clock, transition_seconds)
+
+        if result.status != "SUCCEEDED":
+            raise Exception("Simulated %s execution failed: %s" % (mode, json.dumps(result.error)))
+
+        if mode == "express" and result.duration > EXPRESS_MAX_DURATION_SECONDS:
+            raise Exception("Simulated express execution ran for %.0f seconds" % result.duration)
+
+        executions += 1
+        transitions += result.transitions
+        billed_gb_seconds += (
+            max(0.1, round(result.duration + 0.05, 1))
+            * (args.express_memory_mb / 1024.0)
+        )
+        execution_input = step_lambda.handoff_input
+
+    if mode == "standard":
+        state_machine_cost = transitions * args.standard_price_per_transition
+    else:
+        state_machine_cost = (
+            executions * args.express_price_per_request
+            + billed_gb_seconds * args.express_price_per_gb_second
+        )
+
+    return {
+        "mode": mode,
+        "buildMinutes": build_minutes,
+        "stateMachineExecutions": executions,
+        "transitions": transitions,
+        "lambdaInvocations": step_lambda.invocations,
+        "durationSeconds": round(clock.now - start_time, 2),
+        "completionDelaySeconds": round(clock.now - step_lambda.builds_done_time, 2),
+        "transitionLatencySeconds": round(transitions * transition_seconds, 2),
+        "stateMachineCost": state_machine_cost,
+        "lambdaRequestCost": step_lambda.invocations * args.lambda_price_per_request,
+    }
+
+
+results = [
+    simulate(mode, build_minutes)
+    for build_minutes in args.build_minutes
+    for mode in ("standard", "express")
+]
+
+if args.json:
+    print(json.dumps(results, indent = 2))
+    exit(0)
+
+columns = [
+    ("Build min", "buildMinutes", "%g"),
+    ("Mode", "mode", "%s"),
+    ("Executions", "stateMachineExecutions", "%d"),
+    ("Transitions", "transitions", "%d"),
+    ("Lambda calls", "lambdaInvocations", "%d"),
+    ("Transition latency s", "transitionLatencySeconds", "%.2f"),
+    ("Completion delay s", "completionDelaySeconds", "%.2f"),
+    ("State machine $/exec", "stateMachineCost", "%.6f"),
+    ("Lambda requests $/exec", "lambdaRequestCost", "%.6f"),
+]
+
+rows = [[label for label, _, _ in columns]] + [
+    [fmt % result[key] for _, key, fmt in columns]
+    for result in results
+]
+
+widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+
+for row in rows:
+    print("  ".join(value.rjust(widths[i]) for i, value in enumerate(row)))
@@ -0,0 +1,345 @@
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+sys.path.insert(0, "./")
+
+import yaml
+
+from modules.cf_orchestrator import create_express_state_machine_definition
+from modules.local_lambda import StepLambdaBridge
+from modules.local_services import LocalServices
+from modules.local_states import VirtualClock, Scheduler, StatesError, iter_execution
+
+# Load test the build state machine and the step lambda without deploying.
+#
+# The state machine definition is run by the local stand-in for Step Functions,
+# and its tasks invoke the real step lambda handler (src/lambda/execution/index.js)
+# in a Node.js process. The handler's calls to AWS and GitHub are answered by local
+# stand-ins for CodeBuild, DynamoDB, GitHub and the other services, which are rate
+# limited like the real services. Everything runs against a virtual clock, so hours
+# of simulated builds take seconds or minutes.
+#
+# Executions are created directly in the executions table, with their sources already
+# uploaded, so the load test starts at the state machine rather than the webhook.
+#
+# The logs that ended builds queue to be archived are archived by the real log archive
+# lambda handler (src/lambda/execution/archiveLogs.js), once the queue delivers them.
+#
+# Requires the npm dependencies of the lambda functions to be installed.
+
+DEFAULT_BUILDS = {
+    "lint": {"commitStatus": "CBuildCI / lint"},
+    "compile": {"commitStatus": "CBuildCI / compile"},
+    "test": {"commitStatus": "CBuildCI / test", "dependsOn": ["compile"]},
+    "package": {"commitStatus": "CBuildCI / package", "dependsOn": ["compile"]},
+    "deploy": {"commitStatus": "CBuildCI / deploy", "dependsOn": ["test", "lint", "package"]},
+}
+
+parser = argparse.ArgumentParser(
+    description='Load test the CBuildCI state machine and step lambda with local stand-ins for AWS and GitHub',
+)
+
+parser.add_argument('--executions', type=int, default=1000, help='Number of executions to run')
+parser.add_argument('--arrival-seconds', type=float, default=600, help='Executions start evenly over this many seconds')
+parser.add_argument('--repos', type=int, default=50, help='Number of repos the executions are spread over')
+parser.add_argument('--builds-yml', type=str, help='A CBuildCI yaml file whose "builds" (and "defaults") are used for every execution')
+parser.add_argument('--build-minutes', type=float, nargs=2, default=[2, 8], metavar=('MIN', 'MAX'), help='Range of how long each build takes')
+parser.add_argument('--build-failure-rate', type=float, default=0.05)
+parser.add_argument('--mode', choices=['standard', 'express'], default='standard', help='Which state machine definition to run')
+parser.add_argument('--wait-seconds', type=int, default=30)
+parser.add_argument('--lambda-seconds', type=float, default=0.05, help='Seconds each step lambda invocation takes, not counting its remote calls')
+parser.add_argument('--lambda-concurrency', type=int, default=1000, help='Concurrent invocations of the step lambda before it is throttled')
+parser.add_argument('--transition-ms', type=float, default=20.0, help='Latency added to each state transition')
+parser.add_argument('--codebuild-rps', type=float, default=25, help='CodeBuild requests per second (0 for unlimited)')
+parser.add_argument('--codebuild-concurrent-builds', type=int, default=60, help='CodeBuild builds that can run at once (0 for unlimited)')
+parser.add_argument('--dynamodb-rps', type=float, default=0, help='DynamoDB requests per second (0 for unlimited)')
+parser.add_argument('--kms-rps', type=float, default=5500, help='KMS requests per second (0 for unlimited)')
+parser.add_argument('--states-rps', type=float, default=1300, help='Step Functions requests per second (0 for unlimited)')
+parser.add_argument('--logs-rps', type=float, default=25, help='CloudWatch Logs GetLogEvents requests per second (0 for unlimited)')
+parser.add_argument('--log-events', type=int, default=2000, help='Log events written by each build')
+parser.add_argument('--github-requests-per-hour', type=float, default=5000, help='GitHub API requests per hour (0 for unlimited)')
+parser.add_argument('--build-account-limit', type=int, default=0, help='Max concurrent builds for the account, which enables the build slots table (0 for unlimited)')
+parser.add_argument('--build-project-limit', type=int, default=0, help='Max concurrent builds per CodeBuild project, which enables the build slots table (0 for unlimited)')
+parser.add_argument('--build-repo-limit', type=int, default=0, help='Max concurrent builds per repo, which enables the build slots table (0 for unlimited)')
+parser.add_argument('--build-priority-reserve', type=int, default=0, help='Account builds reserved for default branch builds')
+parser.add_argument('--seed', type=int, default=1)
+parser.add_argument('--node', type=str, default='node', help='Command used to run Node.js')
+parser.add_argument('--verbose', action='store_true', help='Show the step lambda logs')
+parser.add_argument('--json', action='store_true', help='Output the report as JSON')
+
+args = parser.parse_args()
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+if args.mode == "express":
+    definition = create_express_state_machine_definition()
+else:
+    with open(os.path.join(script_dir, "modules", "state-machine-definition.json"), "r") as stream:
+        definition = json.load(stream)
+        stream.close()
+
+builds = DEFAULT_BUILDS
+build_defaults = {}
+if args.builds_yml:
+    with open(args.builds_yml, "r") as stream:
+        builds_yml = yaml.safe_load(stream)
+        stream.close()
+    builds = builds_yml["builds"]
+    build_defaults = builds_yml.get("defaults") or {}
+
+build_defaults = dict({
+    "codeBuildProjectArn": "arn:aws:codebuild:us-east-1:123456789012:project/cbuildci-load-test",
+    "image": "aws/codebuild/standard:4.0",
+}, **build_defaults)
+
+rng = random.Random(args.seed)
+clock = VirtualClock()
+scheduler = Scheduler(clock)
+start_time = clock.now
+
+# Like the log archive queue's visibility timeout and max receive count.
+LOG_ARCHIVE_RETRY_SECONDS = 300
+LOG_ARCHIVE_MAX_RECEIVES = 5
+
+state_machine_results = Counter()
+log_archive_results = Counter()
+log_archive_messages = [0]
+state_machine_errors = Counter()
+lambda_errors = Counter()
+lambda_throttles = [0]
+transitions = [0]
+running_invocations = []
+execution_arns = [0]
+
+
+def start_state_machine_execution(execution_input, delay = 0.0):
+    execution_arns[0] += 1
+    scheduler.add(
+        iter_execution(definition, execution_input, invoke, clock, args.transition_ms / 1000.0),
+        delay,
+        on_state_machine_done,
+    )
+    return "arn:aws:states:us-east-1:123456789012:execution:cbuildci-statemachine:%d" % execution_arns[0]
+
+
+def on_state_machine_done(result):
+    state_machine_results[result.status] += 1
+    transitions[0] += result.transitions
+    if result.error:
+        state_machine_errors[result.error["Error"]] += 1
+
+
+def on_start_execution(params):
+    return start_state_machine_execution(json.loads(params["input"]))
+
+
+# Deliver a queued log archive message to the log archive lambda after its delay,
+# and again after the visibility timeout each time it fails.
+def iter_log_archive(params, message_id):
+    for receive in range(LOG_ARCHIVE_MAX_RECEIVES):
+        try:
+            output, seconds = bridge.invoke(
+                {"Records": [{"messageId": message_id, "body": params["MessageBody"]}]},
+                "%s-%d" % (message_id, receive + 1),
+                "archiveLogs",
+            )
+        except StatesError:
+            log_archive_results["retries"] += 1
+            yield LOG_ARCHIVE_RETRY_SECONDS
+            continue
+
+        yield seconds
+        return "archived" if output["archived"] else "skipped"
+
+    return "deadLetter"
+
+
+def on_log_archive_done(result):
+    log_archive_results[result] += 1
+
+
+def on_send_message(params):
+    log_archive_messages[0] += 1
+    scheduler.add(
+        iter_log_archive(params, "message-%d" % log_archive_messages[0]),
+        params.get("DelaySeconds", 0),
+        on_log_archive_done,
+    )
+
+
+services = LocalServices(
+    clock,
+    {
+        "codebuild": args.codebuild_rps,
+        "codebuild_builds": args.codebuild_concurrent_builds,
+        "dynamodb": args.dynamodb_rps,
+        "kms": args.kms_rps,
+        "states": args.states_rps,
+        "logs": args.logs_rps,
+        "github": args.github_requests_per_hour,
+    },
+    lambda project_name: rng.uniform(*args.build_minutes) * 60,
+    args.build_failure_rate,
+    args.seed,
+    on_start_execution,
+    args.log_events,
+    on_send_message,
+)
+
+lambda_env = {
+    "STATE_MACHINE_MODE": args.mode,
+    "STATE_MACHINE_WAIT_SECONDS_DEFAULT": str(args.wait_seconds),
+}
+if args.build_account_limit or args.build_project_limit or args.build_repo_limit:
+    lambda_env["TABLE_BUILD_SLOTS_NAME"] = "cbuildci-build-slots"
+    lambda_env["BUILD_ACCOUNT_CONCURRENCY_LIMIT"] = str(args.build_account_limit)
+    lambda_env["BUILD_PROJECT_CONCURRENCY_LIMIT"] = str(args.build_project_limit)
+    lambda_env["BUILD_REPO_CONCURRENCY_LIMIT"] = str(args.build_repo_limit)
+    lambda_env["BUILD_PRIORITY_RESERVE"] = str(args.build_priority_reserve)
+
+bridge = StepLambdaBridge(services, clock, lambda_env, args.node, args.verbose)
+
+
+# Invoke the step lambda for a Task state, throttling it like Lambda does
+# once its concurrent invocations reach the limit.
+def invoke(resource, payload, context):
+    event = payload["Payload"] if ":lambda:invoke" in resource else payload
+
+    while running_invocations and running_invocations[0] <= clock.now:
+        heapq.heappop(running_invocations)
+
+    if args.lambda_concurrency and len(running_invocations) >= args.lambda_concurrency:
+        lambda_throttles[0] += 1
+        raise StatesError("Lambda.TooManyRequestsException", "Rate Exceeded.")
+
+    try:
+        output, seconds = bridge.invoke(event, "req-%d" % (bridge.invocations + 1))
+    except StatesError as err:
+        lambda_errors[err.error] += 1
+        heapq.heappush(running_invocations, clock.now + args.lambda_seconds)
+        raise
+
+    seconds += args.lambda_seconds
+    heapq.heappush(running_invocations, clock.now + seconds)
+    return output, seconds
+
+
+real_start = time.time()
+
+for i in range(args.executions):
+    repo_id = "load-test/repo-%d" % (i % args.repos)
+    commit_sha = hashlib.sha1(("%d" % i).encode("utf-8")).hexdigest()
+    execution_id = "%s/0001" % commit_sha
+    trace_id = "load-test:%d" % i
+    arrival = args.arrival_seconds * i / max(1, args.executions)
+
+    created = bridge.create_state({
+        "repoId": repo_id,
+        "executionId": execution_id,
+        "commitSHA": commit_sha,
+        "traceId": trace_id,
+        "waitSeconds": args.wait_seconds,
+        "debounceSeconds": 0,
+        "builds": builds,
+        "buildDefaults": build_defaults,
+    })
+
+    services.put_execution(repo_id, execution_id, {"createTime": start_time + arrival}, created["state"])
+    services.put_lock(created["lockId"], trace_id)
+
+    start_state_machine_execution(
+        {
+            "runTask": "RunMain",
+            "errorInfo": None,
+            "repoId": repo_id,
+            "executionId": execution_id,
+            "stateVersion": 0,
+            "isRunning": True,
+            "waitSeconds": args.wait_seconds,
+            "debounceSeconds": 0,
+        },
+        arrival,
+    )
+
+scheduler.run()
+bridge.close()
+
+real_seconds = time.time() - real_start
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+conclusions = Counter()
+execution_seconds = []
+for execution in services.executions.values():
+    conclusions[execution["conclusion"] or execution["status"]] += 1
+    if execution.get("conclusionTime"):
+        execution_seconds.append(execution["conclusionTime"] - execution["meta"]["createTime"])
+
+report = {
+    "mode": args.mode,
+    "executions": args.executions,
+    "conclusions": dict(conclusions),
+    "stateMachineExecutions": dict(state_machine_results),
+    "stateMachineErrors": dict(state_machine_errors),
+    "stateTransitions": transitions[0],
+    "lambdaInvocations": bridge.invocations,
+    "lambdaThrottles": lambda_throttles[0],
+    "lambdaErrors": dict(lambda_errors),
+    "logArchives": dict(log_archive_results),
+    "apiCalls": dict(sorted(services.calls.items())),
+    "throttledRequests": dict(services.throttles),
+    "failedRequests": dict(services.failures),
+    "peakRunningBuilds": services.peak_running_builds,
+    "simulatedSeconds": round(clock.now - start_time, 1),
+    "executionSeconds": {
+        "p50": percentile(execution_seconds, 50),
+        "p95": percentile(execution_seconds, 95),
+        "max": percentile(execution_seconds, 100),
+    },
+    "realSeconds": round(real_seconds, 1),
+}
+
+if args.json:
+    print(json.dumps(report, indent = 2))
+    exit(0)
+
+print("Mode:                     %s" % report["mode"])
+print("Executions:               %d" % report["executions"])
+print("Conclusions:              %s" % ", ".join("%s %d" % item for item in sorted(conclusions.items())))
+print("State machine executions: %s" % ", ".join("%s %d" % item for item in sorted(state_machine_results.items())))
+for error, count in sorted(state_machine_errors.items()):
+    print("  Failed with %-29s %d" % (error, count))
+print("State transitions:        %d" % report["stateTransitions"])
+print("Lambda invocations:       %d (%d throttled)" % (report["lambdaInvocations"], report["lambdaThrottles"]))
+for error, count in sorted(report["lambdaErrors"].items()):
+    print("  Lambda error %-28s %d" % (error, count))
+print("Log archives:             %s" % ", ".join("%s %d" % item for item in sorted(log_archive_results.items())))
+print("Peak running builds:      %d" % report["peakRunningBuilds"])
+print("Simulated wall time:      %.1f s" % report["simulatedSeconds"])
+if execution_seconds:
+    print("Execution time:           p50 %.1f s, p95 %.1f s, max %.1f s" % (
+        report["executionSeconds"]["p50"],
+        report["executionSeconds"]["p95"],
+        report["executionSeconds"]["max"],
+    ))
+print("Real time:                %.1f s" % report["realSeconds"])
+print("")
+print("API calls:")
+for call, count in sorted(services.calls.items()):
+    print("  %-40s %d" % (call, count))
+print("")
+print("Throttling (throttled requests / requests that failed):")
+for service in sorted(set(services.throttles) | set(services.failures)):
+    print("  %-40s %d / %d" % (service, services.throttles[service], services.failures[service]))
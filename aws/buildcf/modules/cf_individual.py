@@ -38,7 +38,7 @@ def create_template():
 
     p_api_lambda_role = t.add_parameter(Parameter(
         "ApiLambdaRole",
-        Description = "The IAM role used by the API lambda function, which will receive permission to monitor builds.",
+        Description = "The IAM role used by the API lambda function, which will receive permission to monitor and stop builds.",
         Type = "String",
     ))
 
@@ -350,6 +350,7 @@ def create_template():
                         GetAtt(r_code_build, "Arn")
                     ],
                     Action = [
+                        ac_codebuild.StopBuild,
                         ac_codebuild.BatchGetBuilds,
                     ],
                 ),
@@ -362,6 +363,21 @@ def create_template():
                         ac_logs.GetLogEvents,
                     ],
                 ),
+                # Read the archived build logs, which the log archive lambda writes under the artifact prefix.
+                Statement(
+                    Effect = Allow,
+                    Resource = [
+                        Sub(ac_s3.ARN(
+                            resource = "${%s}/${%s}*" % (
+                                p_artifact_bucket.title,
+                                p_artifact_key_prefix.title,
+                            ),
+                        )),
+                    ],
+                    Action = [
+                        ac_s3.GetObject,
+                    ],
+                ),
             ],
         ),
     ))
@@ -385,6 +401,30 @@ def create_template():
                         ac_codebuild.BatchGetBuilds,
                     ],
                 ),
+                # Archive the logs of ended builds under the artifact prefix.
+                Statement(
+                    Effect = Allow,
+                    Resource = [
+                        GetAtt(r_log_group, "Arn"),
+                    ],
+                    Action = [
+                        ac_logs.GetLogEvents,
+                    ],
+                ),
+                Statement(
+                    Effect = Allow,
+                    Resource = [
+                        Sub(ac_s3.ARN(
+                            resource = "${%s}/${%s}*" % (
+                                p_artifact_bucket.title,
+                                p_artifact_key_prefix.title,
+                            ),
+                        )),
+                    ],
+                    Action = [
+                        ac_s3.PutObject,
+                    ],
+                ),
             ],
         ),
     ))
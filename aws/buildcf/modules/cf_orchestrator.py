@@ -1,3 +1,5 @@
+import hashlib
+import json
 import os
 
 from .tags import build_tags_list
@@ -5,16 +7,27 @@ from .tags import build_tags_list
 from troposphere import \
     Template, Parameter, Output, Name, \
     Ref, Sub, GetAtt, \
-    Equals, Not, If, NoValue, Split
+    Equals, Not, And, If, Condition, NoValue, Split
 from troposphere.iam import Role, Policy, PolicyType
 from troposphere.kms import Key, Alias
-from troposphere.awslambda import Function, Code, Permission, Environment, TracingConfig
+from troposphere.awslambda import \
+    Function, Code, Permission, Environment, TracingConfig, EventSourceMapping, ScalingConfig, \
+    Version, Alias as LambdaAlias, ProvisionedConcurrencyConfiguration
 from troposphere.apigateway import \
     RestApi, Resource, \
     Method, MethodResponse, \
     Integration, IntegrationResponse
 from troposphere.logs import LogGroup
-from troposphere.stepfunctions import StateMachine
+from troposphere.stepfunctions import \
+    StateMachine, LoggingConfiguration, LogDestination, CloudWatchLogsLogGroup
+from troposphere.sqs import Queue, RedrivePolicy
+from troposphere.s3 import BucketPolicy
+from troposphere.cloudfront import \
+    Distribution, DistributionConfig, Origin, S3OriginConfig, CustomOriginConfig, \
+    DefaultCacheBehavior, CacheBehavior, \
+    CachePolicy, CachePolicyConfig, ParametersInCacheKeyAndForwardedToOrigin, \
+    CacheCookiesConfig, CacheHeadersConfig, CacheQueryStringsConfig, \
+    CloudFrontOriginAccessIdentity, CloudFrontOriginAccessIdentityConfig
 
 # Access Control
 from awacs.aws import Action, Allow, Statement, Principal, PolicyDocument
@@ -25,10 +38,12 @@ from awacs import \
     states as ac_states, \
     execute_api as ac_execute_api, \
     s3 as ac_s3, \
+    sqs as ac_sqs, \
     ssm as ac_ssm, \
     xray as ac_xray, \
     kms as ac_kms, \
     logs as ac_logs, \
+    events as ac_events, \
     awslambda as ac_lambda
 
 vAWSRegion = "${AWS::Region}"
@@ -38,6 +53,346 @@ vWebhookLambdaKMSActions = [ac_kms.Encrypt, ac_kms.Decrypt]
 vStepLambdaKMSActions = [ac_kms.Encrypt, ac_kms.Decrypt]
 vApiLambdaKMSActions = [ac_kms.Encrypt, ac_kms.Decrypt]
 
+# Runtimes the lambda code can run on. Only nodejs12.x and later support arm64.
+vLambdaRuntimes = ["nodejs8.10", "nodejs10.x", "nodejs12.x", "nodejs14.x", "nodejs16.x"]
+vLambdaX86OnlyRuntimes = ["nodejs8.10", "nodejs10.x"]
+
+# Sizing of the lambda functions, from the step lambda benchmarks
+# (npm run bench, then npm run bench:sizing). Estimated mean latency of a poll,
+# excluding remote calls, which Lambda allocates CPU for in proportion to memory:
+#
+#   Poll                      Peak RSS  128 MB    256 MB    512 MB    1024 MB
+#   start, 10 builds          53 MB     7.9 ms    4.0 ms    2.0 ms    1.0 ms
+#   complete, 10 builds       53 MB     12.8 ms   6.4 ms    3.2 ms    1.6 ms
+#   start, 100 builds         66 MB     65.8 ms   32.9 ms   16.5 ms   8.2 ms
+#   complete, 100 builds      66 MB     101.8 ms  50.9 ms   25.5 ms   12.7 ms
+#   start, 500 builds         121 MB    OOM       271.3 ms  135.7 ms  67.8 ms
+#   complete, 500 builds      121 MB    OOM       271.0 ms  135.5 ms  67.8 ms
+#
+# The step lambda defaults to 256 MB, which fits executions of up to 500 builds.
+# Use 512 MB or more for executions with hundreds of builds, or to halve the time
+# spent re-compressing GitHub zipballs. Billing is per millisecond, so CPU bound
+# work costs about the same at any size up to 1769 MB (one vCPU). The webhook and
+# API lambdas mostly wait on remote calls and default to 128 MB.
+
+# Longest timeout of the webhook lambda, which the queue lambda shares. The queue's
+# visibility timeout is 6 times this, as recommended for lambdas that consume a queue.
+vWebhookLambdaMaxTimeout = 60
+
+vAllHttpMethods = ["GET", "HEAD", "OPTIONS", "PUT", "PATCH", "POST", "DELETE"]
+
+# CloudFront managed policies.
+vCachingDisabledCachePolicyId = "4135ea2d-6df8-44a3-9df3-4b5a84be39ad"
+vAllViewerExceptHostHeaderOriginRequestPolicyId = "b689b0a8-53d0-40ab-baf2-68738e2966ac"
+
+
+# A lambda function with the Architectures property, which troposphere 2.7.1 predates.
+class ArchitecturesFunction(Function):
+    props = dict(Function.props, Architectures = ([str], False))
+
+
+# The "fanout" state machine runs a child execution of the build state machine
+# (see create_fanout_build_state_machine_definition) per build through Map states,
+# one level of the dependency graph at a time. Unlike the standard definition,
+# the execution state is not passed between states. Each child only reads and
+# writes its own build in the executions table, and returns a small summary of
+# the build to the parent.
+#
+# The children poll their builds in their own execution histories, so the parent's
+# history only grows by about 8 events per build, rather than with each poll.
+# This keeps executions of a few thousand builds under the 25,000 event limit.
+def create_fanout_state_machine_definition():
+    level_iterator = {
+        "StartAt": "Builds",
+        "States": {
+            "Builds": {
+                "Type": "Map",
+                "ItemsPath": "$.buildKeys",
+                "MaxConcurrency": 0,
+                "Parameters": {
+                    "repoId.$": "$.repoId",
+                    "executionId.$": "$.executionId",
+                    "waitSeconds.$": "$.waitSeconds",
+                    "buildKey.$": "$$.Map.Item.Value",
+                },
+                "Iterator": {
+                    "StartAt": "Build",
+                    "States": {
+                        "Build": {
+                            "Type": "Task",
+                            "Resource": "arn:aws:states:::states:startExecution.sync:2",
+                            "Parameters": {
+                                "StateMachineArn": "${BuildChildStateMachine}",
+                                "Input": {
+                                    "repoId.$": "$.repoId",
+                                    "executionId.$": "$.executionId",
+                                    "buildKey.$": "$.buildKey",
+                                    "waitSeconds.$": "$.waitSeconds",
+                                    # Links the child to the parent, so stopping the parent stops the child.
+                                    "AWS_STEP_FUNCTIONS_STARTED_BY_EXECUTION_ID.$": "$$.Execution.Id",
+                                },
+                            },
+                            "ResultSelector": {
+                                "buildKey.$": "$.Output.buildKey",
+                                "status.$": "$.Output.status",
+                            },
+                            "End": True,
+                            "Retry": [
+                                {
+                                    "ErrorEquals": [
+                                        "StepFunctions.ExecutionLimitExceededException",
+                                        "StepFunctions.SdkClientException",
+                                    ],
+                                    "IntervalSeconds": 3,
+                                    "MaxAttempts": 5,
+                                    "BackoffRate": 2,
+                                },
+                            ],
+                        },
+                    },
+                },
+                "End": True,
+            },
+        },
+    }
+
+    return {
+        "Comment": "Orchestrate builds for a commit, with a child workflow per build.",
+        "StartAt": "Debounce",
+        "States": {
+            "Debounce": {
+                "Type": "Wait",
+                "SecondsPath": "$.debounceSeconds",
+                "Next": "Levels",
+            },
+            # Run the levels in order, since builds can only depend on builds in earlier levels.
+            "Levels": {
+                "Type": "Map",
+                "ItemsPath": "$.levels",
+                "MaxConcurrency": 1,
+                "Parameters": {
+                    "repoId.$": "$.repoId",
+                    "executionId.$": "$.executionId",
+                    "waitSeconds.$": "$.waitSeconds",
+                    "buildKeys.$": "$$.Map.Item.Value",
+                },
+                "Iterator": level_iterator,
+                "ResultPath": "$.builds",
+                "Next": "ToTaskEnd",
+                "Catch": [
+                    {
+                        "ErrorEquals": ["States.ALL"],
+                        "ResultPath": "$.errorInfo",
+                        "Next": "ToTaskError",
+                    },
+                ],
+            },
+            "ToTaskError": {
+                "Type": "Pass",
+                "Result": "RunError",
+                "ResultPath": "$.runTask",
+                "Next": "TaskEnd",
+            },
+            "ToTaskEnd": {
+                "Type": "Pass",
+                "Result": "RunEnd",
+                "ResultPath": "$.runTask",
+                "Next": "TaskEnd",
+            },
+            "TaskEnd": {
+                "Type": "Task",
+                "Resource": "${StepLambda.Arn}",
+                "Parameters": {
+                    "fanout": True,
+                    "runTask.$": "$.runTask",
+                    "repoId.$": "$.repoId",
+                    "executionId.$": "$.executionId",
+                    "errorInfo.$": "$.errorInfo",
+                },
+                "End": True,
+                "Retry": [
+                    {
+                        "ErrorEquals": ["States.ALL"],
+                        "IntervalSeconds": 3,
+                        "MaxAttempts": 3,
+                        "BackoffRate": 2,
+                    },
+                ],
+            },
+        },
+    }
+
+
+# The build state machine of the "fanout" mode, which starts one build and then
+# polls it until it ends. It returns the build's key and status to the parent.
+def create_fanout_build_state_machine_definition():
+    step_lambda_retry = {
+        "ErrorEquals": [
+            "Lambda.ServiceException",
+            "Lambda.AWSLambdaException",
+            "Lambda.SdkClientException",
+            "Lambda.TooManyRequestsException",
+        ],
+        "IntervalSeconds": 3,
+        "MaxAttempts": 3,
+        "BackoffRate": 2,
+    }
+
+    return {
+        "Comment": "Run one build of a commit, as a child of the fanout state machine.",
+        "StartAt": "Build",
+        "States": {
+            "Build": {
+                "Type": "Task",
+                "Resource": "${StepLambda.Arn}",
+                "Parameters": {
+                    "runTask": "RunBuild",
+                    "repoId.$": "$.repoId",
+                    "executionId.$": "$.executionId",
+                    "buildKey.$": "$.buildKey",
+                    "waitSeconds.$": "$.waitSeconds",
+                },
+                "Next": "BuildCheckRunning",
+                "Retry": [step_lambda_retry],
+            },
+            "BuildCheckRunning": {
+                "Type": "Choice",
+                "Choices": [
+                    {
+                        "Variable": "$.isRunning",
+                        "BooleanEquals": True,
+                        "Next": "BuildWait",
+                    },
+                ],
+                "Default": "BuildDone",
+            },
+            "BuildWait": {
+                "Type": "Wait",
+                "SecondsPath": "$.waitSeconds",
+                "Next": "Build",
+            },
+            "BuildDone": {
+                "Type": "Pass",
+                "Parameters": {
+                    "buildKey.$": "$.buildKey",
+                    "status.$": "$.status",
+                },
+                "End": True,
+            },
+        },
+    }
+
+
+# The "express" state machine runs the standard poll loop as an express workflow,
+# which is billed by duration rather than by state transition. Express workflows
+# cannot wait for a task token and are stopped after 5 minutes, so the poll loop
+# uses a plain "Wait" state, and the step lambda hands off to a new execution
+# (ending this one at "HandedOff") before the limit is reached.
+def create_express_state_machine_definition():
+    step_lambda_retry = {
+        "ErrorEquals": [
+            "Lambda.ServiceException",
+            "Lambda.AWSLambdaException",
+            "Lambda.SdkClientException",
+            "Lambda.TooManyRequestsException",
+        ],
+        "IntervalSeconds": 1,
+        "MaxAttempts": 3,
+        "BackoffRate": 2,
+    }
+
+    return {
+        "Comment": "Orchestrate builds for a commit, as an express workflow.",
+        "StartAt": "Debounce",
+        "States": {
+            "Debounce": {
+                "Type": "Wait",
+                "SecondsPath": "$.debounceSeconds",
+                "Next": "Main",
+            },
+            "Main": {
+                "Type": "Task",
+                "Resource": "${StepLambda.Arn}",
+                "Parameters": {
+                    "runTask.$": "$.runTask",
+                    "repoId.$": "$.repoId",
+                    "executionId.$": "$.executionId",
+                    "stateVersion.$": "$.stateVersion",
+                    "errorInfo.$": "$.errorInfo",
+                    "workflowStartTime.$": "$$.Execution.StartTime",
+                },
+                "Next": "CheckRunning",
+                # Express workflows run tasks at least once, so a conflicting save is retried from the latest state.
+                "Retry": [
+                    step_lambda_retry,
+                    {
+                        "ErrorEquals": ["StateVersionConflictError"],
+                        "IntervalSeconds": 1,
+                        "MaxAttempts": 3,
+                        "BackoffRate": 2,
+                    },
+                ],
+                "Catch": [
+                    {
+                        "ErrorEquals": ["States.ALL"],
+                        "ResultPath": "$.errorInfo",
+                        "Next": "ToTaskError",
+                    },
+                ],
+            },
+            "CheckRunning": {
+                "Type": "Choice",
+                "Choices": [
+                    {
+                        "Variable": "$.isRunning",
+                        "BooleanEquals": True,
+                        "Next": "Wait",
+                    },
+                    {
+                        "Variable": "$.handedOff",
+                        "BooleanEquals": True,
+                        "Next": "HandedOff",
+                    },
+                ],
+                "Default": "ToTaskEnd",
+            },
+            "Wait": {
+                "Type": "Wait",
+                "SecondsPath": "$.waitSeconds",
+                "Next": "Main",
+            },
+            "HandedOff": {
+                "Type": "Succeed",
+            },
+            "ToTaskError": {
+                "Type": "Pass",
+                "Result": "RunError",
+                "ResultPath": "$.runTask",
+                "Next": "TaskEnd",
+            },
+            "ToTaskEnd": {
+                "Type": "Pass",
+                "Result": "RunEnd",
+                "ResultPath": "$.runTask",
+                "Next": "TaskEnd",
+            },
+            "TaskEnd": {
+                "Type": "Task",
+                "Resource": "${StepLambda.Arn}",
+                "End": True,
+                "Retry": [
+                    step_lambda_retry,
+                    {
+                        "ErrorEquals": ["States.ALL"],
+                        "IntervalSeconds": 3,
+                        "MaxAttempts": 3,
+                        "BackoffRate": 2,
+                    },
+                ],
+            },
+        },
+    }
+
 
 def create_template():
     t = Template()
@@ -98,6 +453,75 @@ def create_template():
         Type = "String",
     ))
 
+    p_webhook_deliveries_table_name = t.add_parameter(Parameter(
+        "WebhookDeliveriesTableName",
+        Description = "Optional table used to skip redelivered and duplicate GitHub events.",
+        Type = "String",
+        Default = "-NONE-",
+    ))
+
+    p_webhook_delivery_dedupe_seconds = t.add_parameter(Parameter(
+        "WebhookDeliveryDedupeSeconds",
+        Description = "If WebhookDeliveriesTableName is set, number of seconds a GitHub delivery ID is remembered.",
+        Type = "Number",
+        Default = "86400",
+        MinValue = 60,
+    ))
+
+    p_webhook_event_dedupe_seconds = t.add_parameter(Parameter(
+        "WebhookEventDedupeSeconds",
+        Description = "If WebhookDeliveriesTableName is set, number of seconds during which events for the same repo, commit and action are treated as duplicates.",
+        Type = "Number",
+        Default = "60",
+        MinValue = 1,
+    ))
+
+    p_build_slots_table_name = t.add_parameter(Parameter(
+        "BuildSlotsTableName",
+        Description = "Optional table used to limit the number of concurrent builds.",
+        Type = "String",
+        Default = "-NONE-",
+    ))
+
+    p_build_account_limit = t.add_parameter(Parameter(
+        "BuildAccountConcurrencyLimit",
+        Description = "If BuildSlotsTableName is set, max number of concurrent builds for the account. 0 for no limit.",
+        Type = "Number",
+        Default = "0",
+        MinValue = 0,
+    ))
+
+    p_build_project_limit = t.add_parameter(Parameter(
+        "BuildProjectConcurrencyLimit",
+        Description = "If BuildSlotsTableName is set, max number of concurrent builds per CodeBuild project. 0 for no limit.",
+        Type = "Number",
+        Default = "0",
+        MinValue = 0,
+    ))
+
+    p_build_repo_limit = t.add_parameter(Parameter(
+        "BuildRepoConcurrencyLimit",
+        Description = "If BuildSlotsTableName is set, max number of concurrent builds per repo. 0 for no limit.",
+        Type = "Number",
+        Default = "0",
+        MinValue = 0,
+    ))
+
+    p_build_priority_reserve = t.add_parameter(Parameter(
+        "BuildPriorityReserve",
+        Description = "If BuildAccountConcurrencyLimit is set, number of the account's builds reserved for default branch builds.",
+        Type = "Number",
+        Default = "0",
+        MinValue = 0,
+    ))
+
+    p_build_results_table_name = t.add_parameter(Parameter(
+        "BuildResultsTableName",
+        Description = "Optional table used to reuse the results of identical builds that have already succeeded.",
+        Type = "String",
+        Default = "-NONE-",
+    ))
+
     p_artifact_bucket_name = t.add_parameter(Parameter(
         "ArtifactBucketName",
         Type = "String",
@@ -194,10 +618,47 @@ def create_template():
 
     p_lambda_zip_s3_key = t.add_parameter(Parameter(
         "LambdaZipS3Key",
-        Description = "Object key in LambdaZipS3Bucket for this stack's lambda code.",
+        Description = "Object key in LambdaZipS3Bucket for this stack's lambda code, for the functions whose own code key parameter is \"-DEFAULT-\".",
         Type = "String",
     ))
 
+    p_lambda_deploy_version = t.add_parameter(Parameter(
+        "LambdaDeployVersion",
+        Description = "Identifier of the deployed lambda code and settings, such as a git commit or a timestamp. "
+                      "Lambdas with provisioned concurrency only get a new version for their \"live\" alias "
+                      "when this, their code key or their sizing changes, so change it on every deploy.",
+        Type = "String",
+        Default = "-NONE-",
+    ))
+
+    # Add a parameter for the code key of one lambda function, which defaults to LambdaZipS3Key.
+    def add_lambda_zip_s3_key_parameter(name, description, bundle_name):
+        p_zip_s3_key = t.add_parameter(Parameter(
+            "%sZipS3Key" % name,
+            Description = "Object key in LambdaZipS3Bucket for the code of the %s, "
+                          "such as the %s.zip bundle built by \"npm run bundle\". "
+                          "Set to \"-DEFAULT-\" to use LambdaZipS3Key." % (description, bundle_name),
+            Type = "String",
+            Default = "-DEFAULT-",
+        ))
+
+        t.add_condition(
+            "Has%sZipS3Key" % name,
+            Not(Equals(Ref(p_zip_s3_key), "-DEFAULT-")),
+        )
+
+        return If(
+            "Has%sZipS3Key" % name,
+            Ref(p_zip_s3_key),
+            Ref(p_lambda_zip_s3_key),
+        )
+
+    webhook_lambda_zip_s3_key = add_lambda_zip_s3_key_parameter("WebhookLambda", "webhook lambda", "webhook-lambda")
+    queue_lambda_zip_s3_key = add_lambda_zip_s3_key_parameter("QueueLambda", "queue lambda", "queue-lambda")
+    api_lambda_zip_s3_key = add_lambda_zip_s3_key_parameter("ApiLambda", "API lambda", "api-lambda")
+    step_lambda_zip_s3_key = add_lambda_zip_s3_key_parameter("StepLambda", "step lambda", "step-lambda")
+    log_archive_lambda_zip_s3_key = add_lambda_zip_s3_key_parameter("LogArchiveLambda", "log archive lambda", "log-archive-lambda")
+
     p_wait_seconds_default = t.add_parameter(Parameter(
         "WaitSecondsDefault",
         Description = "Default number of seconds to wait between checking the status of running builds.",
@@ -207,6 +668,18 @@ def create_template():
         MaxValue = 120,
     ))
 
+    p_state_machine_mode = t.add_parameter(Parameter(
+        "StateMachineMode",
+        Description = "Set to \"fanout\" to run each build in its own child state machine execution through Map states, "
+                      "instead of one lambda invocation checking every build of an execution. "
+                      "Recommended for executions with many builds. "
+                      "Set to \"express\" to run the state machine as an express workflow, "
+                      "which is cheaper for short executions but cannot be woken early from its wait between checks.",
+        Type = "String",
+        AllowedValues = ["standard", "fanout", "express"],
+        Default = "standard",
+    ))
+
     p_lock_timeout_seconds = t.add_parameter(Parameter(
         "LockTimeoutSeconds",
         Description = "Number of seconds until an orphaned execution lock will expired. Must not be less than WaitSecondsDefault x 2.",
@@ -238,6 +711,161 @@ def create_template():
         Default = "false",
     ))
 
+    p_webhook_ingest_mode = t.add_parameter(Parameter(
+        "WebhookIngestMode",
+        Description = "Set to \"queue\" to have webhooks only verify and queue GitHub events, which are then processed by a separate lambda function.",
+        Type = "String",
+        AllowedValues = ["sync", "queue"],
+        Default = "sync",
+    ))
+
+    p_webhook_queue_batch_size = t.add_parameter(Parameter(
+        "WebhookQueueBatchSize",
+        Description = "If WebhookIngestMode is \"queue\", the max number of queued GitHub events processed per lambda invocation.",
+        Type = "Number",
+        Default = "5",
+        MinValue = 1,
+        MaxValue = 10,
+    ))
+
+    p_webhook_queue_max_receive_count = t.add_parameter(Parameter(
+        "WebhookQueueMaxReceiveCount",
+        Description = "If WebhookIngestMode is \"queue\", the number of attempts to process a GitHub event before it is moved to the dead-letter queue.",
+        Type = "Number",
+        Default = "3",
+        MinValue = 1,
+    ))
+
+    p_enable_cloudfront = t.add_parameter(Parameter(
+        "EnableCloudFront",
+        Description = "Set to true to create a CloudFront distribution in front of the API, which caches the static UI application resources at the edge. "
+                      "Set BaseUrl to the distribution's domain (see the CloudFrontDomainName output) to use it.",
+        Type = "String",
+        AllowedValues = ["true", "false"],
+        Default = "false",
+    ))
+
+    p_api_stage_name = t.add_parameter(Parameter(
+        "ApiStageName",
+        Description = "If EnableCloudFront is true, the stage of the API that the distribution forwards requests to.",
+        Type = "String",
+        Default = "prod",
+    ))
+
+    p_cloudfront_price_class = t.add_parameter(Parameter(
+        "CloudFrontPriceClass",
+        Description = "If EnableCloudFront is true, the price class of the distribution, which limits the edge locations it uses.",
+        Type = "String",
+        AllowedValues = ["PriceClass_100", "PriceClass_200", "PriceClass_All"],
+        Default = "PriceClass_100",
+    ))
+
+    p_cloudfront_create_bucket_policy = t.add_parameter(Parameter(
+        "CloudFrontCreateBucketPolicy",
+        Description = "If EnableCloudFront is true, set to true to create the policy of ArtifactBucketName that allows the distribution to read AppStaticKeyPrefix. "
+                      "This replaces any existing bucket policy, so set to false and grant access to the CloudFrontOriginAccessIdentity output instead if the bucket has one.",
+        Type = "String",
+        AllowedValues = ["true", "false"],
+        Default = "true",
+    ))
+
+    p_lambda_runtime = t.add_parameter(Parameter(
+        "LambdaRuntime",
+        Description = "Runtime of the lambda functions. The arm64 architecture requires nodejs12.x or later.",
+        Type = "String",
+        AllowedValues = vLambdaRuntimes,
+        Default = "nodejs8.10",
+    ))
+
+    # Add the parameters for the memory size, timeout, architecture and
+    # reserved concurrency of a lambda function.
+    def add_lambda_profile_parameters(name, description, memory_size, shared_note = "", max_timeout = 900):
+        profile = {}
+
+        profile["memory_size"] = t.add_parameter(Parameter(
+            "%sMemorySize" % name,
+            Description = "Memory in MB for the %s. CPU is allocated in proportion to memory.%s" % (description, shared_note),
+            Type = "Number",
+            Default = str(memory_size),
+            MinValue = 128,
+            MaxValue = 10240,
+        ))
+
+        profile["timeout"] = t.add_parameter(Parameter(
+            "%sTimeout" % name,
+            Description = "Number of seconds until the %s times out.%s" % (description, shared_note),
+            Type = "Number",
+            Default = "60",
+            MinValue = 1,
+            MaxValue = max_timeout,
+        ))
+
+        profile["architecture"] = t.add_parameter(Parameter(
+            "%sArchitecture" % name,
+            Description = "Instruction set architecture of the %s.%s" % (description, shared_note),
+            Type = "String",
+            AllowedValues = ["x86_64", "arm64"],
+            Default = "x86_64",
+        ))
+
+        profile["reserved_concurrency"] = t.add_parameter(Parameter(
+            "%sReservedConcurrency" % name,
+            Description = "Concurrent executions reserved for the %s, or -1 to use the unreserved concurrency of the account." % description,
+            Type = "Number",
+            Default = "-1",
+            MinValue = -1,
+        ))
+
+        t.add_condition(
+            "Has%sReservedConcurrency" % name,
+            Not(Equals(Ref(profile["reserved_concurrency"]), "-1")),
+        )
+
+        return profile
+
+    webhook_lambda_profile = add_lambda_profile_parameters(
+        "WebhookLambda",
+        "webhook lambda",
+        128,
+        " Also used for the queue lambda.",
+        max_timeout = vWebhookLambdaMaxTimeout,
+    )
+    api_lambda_profile = add_lambda_profile_parameters("ApiLambda", "API lambda", 128)
+    step_lambda_profile = add_lambda_profile_parameters("StepLambda", "step lambda", 256)
+
+    p_webhook_lambda_provisioned_concurrency = t.add_parameter(Parameter(
+        "WebhookLambdaProvisionedConcurrency",
+        Description = "Provisioned concurrency for the webhook lambda, which is then invoked through a \"live\" alias. "
+                      "The alias is published again when the lambda code or profile parameters change. "
+                      "Set to 0 to invoke the lambda directly.",
+        Type = "Number",
+        Default = "0",
+        MinValue = 0,
+    ))
+
+    p_api_lambda_provisioned_concurrency = t.add_parameter(Parameter(
+        "ApiLambdaProvisionedConcurrency",
+        Description = "Provisioned concurrency for the API lambda, which is then invoked through a \"live\" alias. "
+                      "The alias is published again when the lambda code or profile parameters change. "
+                      "Set to 0 to invoke the lambda directly.",
+        Type = "Number",
+        Default = "0",
+        MinValue = 0,
+    ))
+
+    t.add_rule("LambdaArchitectureRuntime", {
+        "RuleCondition": {
+            "Fn::Contains": [vLambdaX86OnlyRuntimes, Ref(p_lambda_runtime)],
+        },
+        "Assertions": [
+            {
+                "Assert": Equals(Ref(profile["architecture"]), "x86_64"),
+                "AssertDescription": "%s requires LambdaRuntime nodejs12.x or later" % profile["architecture"].title,
+            }
+            for profile in [webhook_lambda_profile, api_lambda_profile, step_lambda_profile]
+        ],
+    })
+
     t.add_condition(
         "DoCreateKMSKey",
         Equals(Ref(p_secrets_kms_arn), "-CREATE-"),
@@ -258,6 +886,59 @@ def create_template():
         Equals(Ref(p_enable_xray), "true"),
     )
 
+    t.add_condition(
+        "HasWebhookDeliveriesTable",
+        Not(Equals(Ref(p_webhook_deliveries_table_name), "-NONE-")),
+    )
+
+    t.add_condition(
+        "HasBuildSlotsTable",
+        Not(Equals(Ref(p_build_slots_table_name), "-NONE-")),
+    )
+
+    t.add_condition(
+        "HasBuildResultsTable",
+        Not(Equals(Ref(p_build_results_table_name), "-NONE-")),
+    )
+
+    t.add_condition(
+        "UseFanoutStateMachine",
+        Equals(Ref(p_state_machine_mode), "fanout"),
+    )
+
+    t.add_condition(
+        "UseExpressStateMachine",
+        Equals(Ref(p_state_machine_mode), "express"),
+    )
+
+    t.add_condition(
+        "UseWebhookQueue",
+        Equals(Ref(p_webhook_ingest_mode), "queue"),
+    )
+
+    t.add_condition(
+        "UseCloudFront",
+        Equals(Ref(p_enable_cloudfront), "true"),
+    )
+
+    t.add_condition(
+        "DoCreateCloudFrontBucketPolicy",
+        And(
+            Condition("UseCloudFront"),
+            Equals(Ref(p_cloudfront_create_bucket_policy), "true"),
+        ),
+    )
+
+    t.add_condition(
+        "HasWebhookLambdaProvisionedConcurrency",
+        Not(Equals(Ref(p_webhook_lambda_provisioned_concurrency), "0")),
+    )
+
+    t.add_condition(
+        "HasApiLambdaProvisionedConcurrency",
+        Not(Equals(Ref(p_api_lambda_provisioned_concurrency), "0")),
+    )
+
     # Replace with custom tags if desired.
     tags = build_tags_list(t)
 
@@ -343,6 +1024,21 @@ def create_template():
                                 ac_dynamodb.DeleteItem,
                             ],
                         ),
+                        Statement(
+                            Effect = Allow,
+                            Resource = [
+                                Sub(ac_dynamodb.ARN(
+                                    resource = "table/${%s}" % p_webhook_deliveries_table_name.title,
+                                    region = vAWSRegion,
+                                    account = vAWSAccountId,
+                                )),
+                            ],
+                            Action = [
+                                ac_dynamodb.PutItem,
+                                ac_dynamodb.DeleteItem,
+                                ac_dynamodb.BatchWriteItem,
+                            ],
+                        ),
                         Statement(
                             Effect = Allow,
                             Resource = [
@@ -572,6 +1268,34 @@ def create_template():
                                 ac_dynamodb.DeleteItem,
                             ],
                         ),
+                        Statement(
+                            Effect = Allow,
+                            Resource = [
+                                Sub(ac_dynamodb.ARN(
+                                    resource = "table/${%s}" % p_build_slots_table_name.title,
+                                    region = vAWSRegion,
+                                    account = vAWSAccountId,
+                                )),
+                            ],
+                            Action = [
+                                ac_dynamodb.GetItem,
+                                ac_dynamodb.UpdateItem,
+                            ],
+                        ),
+                        Statement(
+                            Effect = Allow,
+                            Resource = [
+                                Sub(ac_dynamodb.ARN(
+                                    resource = "table/${%s}" % p_build_results_table_name.title,
+                                    region = vAWSRegion,
+                                    account = vAWSAccountId,
+                                )),
+                            ],
+                            Action = [
+                                ac_dynamodb.GetItem,
+                                ac_dynamodb.PutItem,
+                            ],
+                        ),
                         Statement(
                             Effect = Allow,
                             Resource = [
@@ -751,6 +1475,99 @@ def create_template():
     grant_kms_actions(r_step_lambda_role, vStepLambdaKMSActions)
     grant_kms_actions(r_api_lambda_role, vApiLambdaKMSActions)
 
+    r_webhook_dead_letter_queue = t.add_resource(Queue(
+        "WebhookDeadLetterQueue",
+        Condition = "UseWebhookQueue",
+        MessageRetentionPeriod = 1209600,
+    ))
+
+    r_webhook_queue = t.add_resource(Queue(
+        "WebhookQueue",
+        Condition = "UseWebhookQueue",
+        # Must be larger than the timeout of the queue lambda.
+        VisibilityTimeout = 6 * vWebhookLambdaMaxTimeout,
+        RedrivePolicy = RedrivePolicy(
+            deadLetterTargetArn = GetAtt(r_webhook_dead_letter_queue, "Arn"),
+            maxReceiveCount = Ref(p_webhook_queue_max_receive_count),
+        ),
+    ))
+
+    # Allow the webhook lambda to queue events, and the queue
+    # lambda (which uses the same role) to consume them.
+    t.add_resource(PolicyType(
+        "WebhookLambdaQueuePolicy",
+        Condition = "UseWebhookQueue",
+        Roles = [
+            Ref(r_webhook_lambda_role),
+        ],
+        PolicyName = Sub(
+            "%s-queue" % r_webhook_lambda_role.title
+        ),
+        PolicyDocument = PolicyDocument(
+            Version = "2012-10-17",
+            Statement = [
+                Statement(
+                    Effect = Allow,
+                    Resource = [
+                        GetAtt(r_webhook_queue, "Arn"),
+                    ],
+                    Action = [
+                        ac_sqs.SendMessage,
+                        ac_sqs.ReceiveMessage,
+                        ac_sqs.DeleteMessage,
+                        ac_sqs.ChangeMessageVisibility,
+                        ac_sqs.GetQueueAttributes,
+                    ],
+                ),
+            ]
+        ),
+    ))
+
+    r_log_archive_dead_letter_queue = t.add_resource(Queue(
+        "LogArchiveDeadLetterQueue",
+        MessageRetentionPeriod = 1209600,
+    ))
+
+    r_log_archive_queue = t.add_resource(Queue(
+        "LogArchiveQueue",
+        # Must be larger than the timeout of the log archive lambda.
+        VisibilityTimeout = 360,
+        RedrivePolicy = RedrivePolicy(
+            deadLetterTargetArn = GetAtt(r_log_archive_dead_letter_queue, "Arn"),
+            maxReceiveCount = 5,
+        ),
+    ))
+
+    # Allow the step lambda to queue the logs of ended builds to be archived,
+    # and the log archive lambda (which uses the same role) to consume them.
+    t.add_resource(PolicyType(
+        "StepLambdaLogArchiveQueuePolicy",
+        Roles = [
+            Ref(r_step_lambda_role),
+        ],
+        PolicyName = Sub(
+            "%s-log-archive-queue" % r_step_lambda_role.title
+        ),
+        PolicyDocument = PolicyDocument(
+            Version = "2012-10-17",
+            Statement = [
+                Statement(
+                    Effect = Allow,
+                    Resource = [
+                        GetAtt(r_log_archive_queue, "Arn"),
+                    ],
+                    Action = [
+                        ac_sqs.SendMessage,
+                        ac_sqs.ReceiveMessage,
+                        ac_sqs.DeleteMessage,
+                        ac_sqs.ChangeMessageVisibility,
+                        ac_sqs.GetQueueAttributes,
+                    ],
+                ),
+            ]
+        ),
+    ))
+
     lambda_env_vars = Environment(
         Variables = {
             "LOCK_TIMEOUT_SECONDS": Ref(p_lock_timeout_seconds),
@@ -761,6 +1578,27 @@ def create_template():
             "TABLE_LOCKS_NAME": Ref(p_locks_table_name),
             "TABLE_SESSIONS_NAME": Ref(p_sessions_table_name),
             "TABLE_EXECUTIONS_NAME": Ref(p_executions_table_name),
+            "TABLE_WEBHOOK_DELIVERIES_NAME": If(
+                "HasWebhookDeliveriesTable",
+                Ref(p_webhook_deliveries_table_name),
+                "",
+            ),
+            "WEBHOOK_DELIVERY_DEDUPE_SECONDS": Ref(p_webhook_delivery_dedupe_seconds),
+            "WEBHOOK_EVENT_DEDUPE_SECONDS": Ref(p_webhook_event_dedupe_seconds),
+            "TABLE_BUILD_SLOTS_NAME": If(
+                "HasBuildSlotsTable",
+                Ref(p_build_slots_table_name),
+                "",
+            ),
+            "BUILD_ACCOUNT_CONCURRENCY_LIMIT": Ref(p_build_account_limit),
+            "BUILD_PROJECT_CONCURRENCY_LIMIT": Ref(p_build_project_limit),
+            "BUILD_REPO_CONCURRENCY_LIMIT": Ref(p_build_repo_limit),
+            "BUILD_PRIORITY_RESERVE": Ref(p_build_priority_reserve),
+            "TABLE_BUILD_RESULTS_NAME": If(
+                "HasBuildResultsTable",
+                Ref(p_build_results_table_name),
+                "",
+            ),
             "STATE_MACHINE_ARN": Sub(
                 ac_states.ARN(
                     resource = "stateMachine:${AWS::StackName}-statemachine",
@@ -769,6 +1607,13 @@ def create_template():
                 ),
             ),
             "STATE_MACHINE_WAIT_SECONDS_DEFAULT": Ref(p_wait_seconds_default),
+            "STATE_MACHINE_MODE": Ref(p_state_machine_mode),
+            "WEBHOOK_QUEUE_URL": If(
+                "UseWebhookQueue",
+                Ref(r_webhook_queue),
+                "",
+            ),
+            "LOG_ARCHIVE_QUEUE_URL": Ref(r_log_archive_queue),
             "SOURCE_S3_BUCKET_DEFAULT": Ref(p_artifact_bucket_name),
             "SOURCE_S3_KEY_PREFIX_DEFAULT": Sub(
                 "${%s}{GitHubDomain}/{GitHubUser}/{GitHubRepo}/"
@@ -804,18 +1649,24 @@ def create_template():
         }
     )
 
-    r_webhook_lambda = t.add_resource(Function(
+    r_webhook_lambda = t.add_resource(ArchitecturesFunction(
         "WebhookLambda",
         Description = "Handles webhook API requests",
         Code = Code(
             S3Bucket = Ref(p_lambda_zip_s3_bucket),
-            S3Key = Ref(p_lambda_zip_s3_key),
+            S3Key = webhook_lambda_zip_s3_key,
         ),
         Handler = "src/lambda/webhook/index.handler",
-        MemorySize = 128,
+        MemorySize = Ref(webhook_lambda_profile["memory_size"]),
+        Architectures = [Ref(webhook_lambda_profile["architecture"])],
         Role = GetAtt(r_webhook_lambda_role, "Arn"),
-        Runtime = "nodejs8.10",
-        Timeout = 60,
+        Runtime = Ref(p_lambda_runtime),
+        Timeout = Ref(webhook_lambda_profile["timeout"]),
+        ReservedConcurrentExecutions = If(
+            "HasWebhookLambdaReservedConcurrency",
+            Ref(webhook_lambda_profile["reserved_concurrency"]),
+            NoValue,
+        ),
         Environment = lambda_env_vars,
         Tags = tags,
         TracingConfig = TracingConfig(
@@ -827,18 +1678,24 @@ def create_template():
         ),
     ))
 
-    r_api_lambda = t.add_resource(Function(
+    r_api_lambda = t.add_resource(ArchitecturesFunction(
         "ApiLambda",
         Description = "Handles general API requests",
         Code = Code(
             S3Bucket = Ref(p_lambda_zip_s3_bucket),
-            S3Key = Ref(p_lambda_zip_s3_key),
+            S3Key = api_lambda_zip_s3_key,
         ),
         Handler = "src/lambda/api/index.handler",
-        MemorySize = 128,
+        MemorySize = Ref(api_lambda_profile["memory_size"]),
+        Architectures = [Ref(api_lambda_profile["architecture"])],
         Role = GetAtt(r_api_lambda_role, "Arn"),
-        Runtime = "nodejs8.10",
-        Timeout = 60,
+        Runtime = Ref(p_lambda_runtime),
+        Timeout = Ref(api_lambda_profile["timeout"]),
+        ReservedConcurrentExecutions = If(
+            "HasApiLambdaReservedConcurrency",
+            Ref(api_lambda_profile["reserved_concurrency"]),
+            NoValue,
+        ),
         Environment = lambda_env_vars,
         Tags = tags,
         TracingConfig = TracingConfig(
@@ -850,18 +1707,24 @@ def create_template():
         ),
     ))
 
-    r_step_lambda = t.add_resource(Function(
+    r_step_lambda = t.add_resource(ArchitecturesFunction(
         "StepLambda",
         Description = "Manages the execution of CodeBuilds for a commit",
         Code = Code(
             S3Bucket = Ref(p_lambda_zip_s3_bucket),
-            S3Key = Ref(p_lambda_zip_s3_key),
+            S3Key = step_lambda_zip_s3_key,
         ),
         Handler = "src/lambda/execution/index.handler",
-        MemorySize = 128,
+        MemorySize = Ref(step_lambda_profile["memory_size"]),
+        Architectures = [Ref(step_lambda_profile["architecture"])],
         Role = GetAtt(r_step_lambda_role, "Arn"),
-        Runtime = "nodejs8.10",
-        Timeout = 60,
+        Runtime = Ref(p_lambda_runtime),
+        Timeout = Ref(step_lambda_profile["timeout"]),
+        ReservedConcurrentExecutions = If(
+            "HasStepLambdaReservedConcurrency",
+            Ref(step_lambda_profile["reserved_concurrency"]),
+            NoValue,
+        ),
         Environment = lambda_env_vars,
         Tags = tags,
         TracingConfig = TracingConfig(
@@ -873,7 +1736,139 @@ def create_template():
         ),
     ))
 
-    def create_lambda_log_group(lambda_function, role):
+    r_queue_lambda = t.add_resource(ArchitecturesFunction(
+        "QueueLambda",
+        Condition = "UseWebhookQueue",
+        Description = "Processes GitHub events queued by the webhook",
+        Code = Code(
+            S3Bucket = Ref(p_lambda_zip_s3_bucket),
+            S3Key = queue_lambda_zip_s3_key,
+        ),
+        Handler = "src/lambda/webhook/queue.handler",
+        MemorySize = Ref(webhook_lambda_profile["memory_size"]),
+        Architectures = [Ref(webhook_lambda_profile["architecture"])],
+        Role = GetAtt(r_webhook_lambda_role, "Arn"),
+        Runtime = Ref(p_lambda_runtime),
+        Timeout = Ref(webhook_lambda_profile["timeout"]),
+        Environment = lambda_env_vars,
+        Tags = tags,
+        TracingConfig = TracingConfig(
+            Mode = If(
+                "HasXRay",
+                "Active",
+                "PassThrough",
+            ),
+        ),
+    ))
+
+    t.add_resource(EventSourceMapping(
+        "QueueLambdaEventSourceMapping",
+        Condition = "UseWebhookQueue",
+        DependsOn = [
+            "WebhookLambdaQueuePolicy",
+        ],
+        EventSourceArn = GetAtt(r_webhook_queue, "Arn"),
+        FunctionName = Ref(r_queue_lambda),
+        BatchSize = Ref(p_webhook_queue_batch_size),
+    ))
+
+    # Archives the logs of ended builds to S3 with the step lambda's role, which CodeBuild
+    # projects grant access to their logs and artifacts. One message is archived at a time,
+    # with little concurrency, to stay within the account's limit for GetLogEvents.
+    r_log_archive_lambda = t.add_resource(ArchitecturesFunction(
+        "LogArchiveLambda",
+        Description = "Archives the logs of ended CodeBuilds to S3",
+        Code = Code(
+            S3Bucket = Ref(p_lambda_zip_s3_bucket),
+            S3Key = log_archive_lambda_zip_s3_key,
+        ),
+        Handler = "src/lambda/execution/archiveLogs.handler",
+        MemorySize = Ref(step_lambda_profile["memory_size"]),
+        Architectures = [Ref(step_lambda_profile["architecture"])],
+        Role = GetAtt(r_step_lambda_role, "Arn"),
+        Runtime = Ref(p_lambda_runtime),
+        Timeout = 120,
+        Environment = lambda_env_vars,
+        Tags = tags,
+        TracingConfig = TracingConfig(
+            Mode = If(
+                "HasXRay",
+                "Active",
+                "PassThrough",
+            ),
+        ),
+    ))
+
+    t.add_resource(EventSourceMapping(
+        "LogArchiveLambdaEventSourceMapping",
+        DependsOn = [
+            "StepLambdaLogArchiveQueuePolicy",
+        ],
+        EventSourceArn = GetAtt(r_log_archive_queue, "Arn"),
+        FunctionName = Ref(r_log_archive_lambda),
+        BatchSize = 1,
+        ScalingConfig = ScalingConfig(
+            MaximumConcurrency = 2,
+        ),
+    ))
+
+    # Publish a version of a lambda function with a "live" alias, through which
+    # API Gateway invokes it with provisioned concurrency. Versions cannot be
+    # updated, so the description changes with the code, profile and deploy version
+    # parameters to have CloudFormation replace (and so publish) the version.
+    # It also has a hash of the environment variables as defined by the template,
+    # since CloudFormation cannot hash the parameter values passed to them.
+    def create_lambda_live_alias(lambda_function, zip_s3_key, profile, p_provisioned_concurrency, condition):
+        environment_hash = hashlib.sha1(
+            json.dumps(lambda_function.Environment.to_dict(), sort_keys = True).encode("utf-8"),
+        ).hexdigest()[:12]
+
+        version = t.add_resource(Version(
+            "%sVersion" % lambda_function.title,
+            Condition = condition,
+            FunctionName = Ref(lambda_function),
+            Description = Sub(
+                "${%s}/${ZipS3Key} ${%s} ${%s} ${%s} MB ${%s} seconds env:%s deploy:${%s}" % (
+                    p_lambda_zip_s3_bucket.title,
+                    p_lambda_runtime.title,
+                    profile["architecture"].title,
+                    profile["memory_size"].title,
+                    profile["timeout"].title,
+                    environment_hash,
+                    p_lambda_deploy_version.title,
+                ),
+                ZipS3Key = zip_s3_key,
+            ),
+        ))
+
+        return t.add_resource(LambdaAlias(
+            "%sLiveAlias" % lambda_function.title,
+            Condition = condition,
+            FunctionName = Ref(lambda_function),
+            FunctionVersion = GetAtt(version, "Version"),
+            Name = "live",
+            ProvisionedConcurrencyConfig = ProvisionedConcurrencyConfiguration(
+                ProvisionedConcurrentExecutions = Ref(p_provisioned_concurrency),
+            ),
+        ))
+
+    r_webhook_lambda_alias = create_lambda_live_alias(
+        r_webhook_lambda,
+        webhook_lambda_zip_s3_key,
+        webhook_lambda_profile,
+        p_webhook_lambda_provisioned_concurrency,
+        "HasWebhookLambdaProvisionedConcurrency",
+    )
+
+    r_api_lambda_alias = create_lambda_live_alias(
+        r_api_lambda,
+        api_lambda_zip_s3_key,
+        api_lambda_profile,
+        p_api_lambda_provisioned_concurrency,
+        "HasApiLambdaProvisionedConcurrency",
+    )
+
+    def create_lambda_log_group(lambda_function, role, condition = None):
         log_group = t.add_resource(LogGroup(
             "%sLogGroup" % Name(lambda_function).data,
             LogGroupName = Sub(
@@ -882,14 +1877,14 @@ def create_template():
             RetentionInDays = Ref(p_logs_retention_days),
         ))
 
-        t.add_resource(PolicyType(
+        policy = t.add_resource(PolicyType(
             "%sLogGroupPolicy" % Name(lambda_function).data,
             Roles = [
                 Ref(role),
             ],
             PolicyName = Sub(
-                "${%s}-policy"
-                % Name(role).data,
+                "${%s}-%s-logs-policy"
+                % (Name(role).data, lambda_function.title),
             ),
             PolicyDocument = PolicyDocument(
                 Version = "2012-10-17",
@@ -909,11 +1904,17 @@ def create_template():
             ),
         ))
 
+        if condition:
+            log_group.Condition = condition
+            policy.Condition = condition
+
         return log_group
 
     create_lambda_log_group(r_webhook_lambda, r_webhook_lambda_role)
     create_lambda_log_group(r_api_lambda, r_api_lambda_role)
     create_lambda_log_group(r_step_lambda, r_step_lambda_role)
+    create_lambda_log_group(r_log_archive_lambda, r_step_lambda_role)
+    create_lambda_log_group(r_queue_lambda, r_webhook_lambda_role, "UseWebhookQueue")
 
     r_state_machine_execution_role = t.add_resource(Role(
         "StateMachineExecutionRole",
@@ -951,22 +1952,151 @@ def create_template():
                     ],
                 ),
             ),
+            # Allow the "fanout" state machine to run the build state machine and wait for it.
+            If(
+                "UseFanoutStateMachine",
+                Policy(
+                    PolicyName = "states-child-execution-policy",
+                    PolicyDocument = PolicyDocument(
+                        Version = "2012-10-17",
+                        Statement = [
+                            Statement(
+                                Effect = Allow,
+                                Resource = [
+                                    Sub(ac_states.ARN(
+                                        resource = "stateMachine:${AWS::StackName}-build-statemachine",
+                                        region = vAWSRegion,
+                                        account = vAWSAccountId,
+                                    )),
+                                ],
+                                Action = [
+                                    ac_states.StartExecution,
+                                ],
+                            ),
+                            Statement(
+                                Effect = Allow,
+                                Resource = [
+                                    Sub(ac_states.ARN(
+                                        resource = "execution:${AWS::StackName}-build-statemachine:*",
+                                        region = vAWSRegion,
+                                        account = vAWSAccountId,
+                                    )),
+                                ],
+                                Action = [
+                                    ac_states.DescribeExecution,
+                                    ac_states.StopExecution,
+                                ],
+                            ),
+                            Statement(
+                                Effect = Allow,
+                                Resource = [
+                                    Sub(ac_events.ARN(
+                                        resource = "rule/StepFunctionsGetEventsForStepFunctionsExecutionRule",
+                                        region = vAWSRegion,
+                                        account = vAWSAccountId,
+                                    )),
+                                ],
+                                Action = [
+                                    ac_events.PutTargets,
+                                    ac_events.PutRule,
+                                    ac_events.DescribeRule,
+                                ],
+                            ),
+                        ],
+                    ),
+                ),
+                NoValue,
+            ),
+            If(
+                "UseExpressStateMachine",
+                Policy(
+                    PolicyName = "states-log-delivery-policy",
+                    PolicyDocument = PolicyDocument(
+                        Version = "2012-10-17",
+                        Statement = [
+                            Statement(
+                                Effect = Allow,
+                                Resource = ["*"],
+                                Action = [
+                                    Action("logs", "CreateLogDelivery"),
+                                    Action("logs", "GetLogDelivery"),
+                                    Action("logs", "UpdateLogDelivery"),
+                                    Action("logs", "DeleteLogDelivery"),
+                                    Action("logs", "ListLogDeliveries"),
+                                    ac_logs.PutResourcePolicy,
+                                    ac_logs.DescribeResourcePolicies,
+                                    ac_logs.DescribeLogGroups,
+                                ],
+                            ),
+                        ],
+                    ),
+                ),
+                NoValue,
+            ),
         ],
     ))
 
+    # Express workflows have no execution history, so they log to CloudWatch instead.
+    r_state_machine_log_group = t.add_resource(LogGroup(
+        "BuildStateMachineLogGroup",
+        Condition = "UseExpressStateMachine",
+        LogGroupName = Sub("/aws/vendedlogs/states/${AWS::StackName}-statemachine"),
+        RetentionInDays = Ref(p_logs_retention_days),
+    ))
+
+    # The child state machine of the "fanout" mode, which runs one build.
+    t.add_resource(StateMachine(
+        "BuildChildStateMachine",
+        Condition = "UseFanoutStateMachine",
+        StateMachineName = Sub("${AWS::StackName}-build-statemachine"),
+        StateMachineType = "STANDARD",
+        RoleArn = GetAtt(r_state_machine_execution_role, "Arn"),
+        DefinitionString = Sub(json.dumps(create_fanout_build_state_machine_definition(), indent = 2)),
+    ))
+
     r_build_state_machine = t.add_resource(StateMachine(
         "BuildStateMachine",
         StateMachineName = Sub("${AWS::StackName}-statemachine"),
+        StateMachineType = If(
+            "UseExpressStateMachine",
+            "EXPRESS",
+            "STANDARD",
+        ),
         RoleArn = GetAtt(r_state_machine_execution_role, "Arn"),
-        DefinitionString = Sub(state_machine_definition),
+        DefinitionString = If(
+            "UseFanoutStateMachine",
+            Sub(json.dumps(create_fanout_state_machine_definition(), indent = 2)),
+            If(
+                "UseExpressStateMachine",
+                Sub(json.dumps(create_express_state_machine_definition(), indent = 2)),
+                Sub(state_machine_definition),
+            ),
+        ),
+        LoggingConfiguration = If(
+            "UseExpressStateMachine",
+            LoggingConfiguration(
+                Level = "ALL",
+                IncludeExecutionData = True,
+                Destinations = [
+                    LogDestination(
+                        CloudWatchLogsLogGroup = CloudWatchLogsLogGroup(
+                            LogGroupArn = GetAtt(r_state_machine_log_group, "Arn"),
+                        ),
+                    ),
+                ],
+            ),
+            NoValue,
+        ),
     ))
 
-    # Allow the API to start step functions.
+    # Allow the API to start step functions, and to wake them from the "Wait" state.
+    # The step lambda starts a new execution when an "express" state machine hands off.
     t.add_resource(PolicyType(
         "StepLambdaStateMachinePolicy",
         Roles = [
             Ref(r_webhook_lambda_role),
             Ref(r_api_lambda_role),
+            Ref(r_step_lambda_role),
         ],
         PolicyName = Sub(
             "${%s.Name}-policy"
@@ -983,6 +2113,15 @@ def create_template():
                     Action = [
                         ac_states.StartExecution,
                     ],
+                ),
+                Statement(
+                    Effect = Allow,
+                    Resource = [
+                        Ref(r_build_state_machine),
+                    ],
+                    Action = [
+                        ac_states.SendTaskSuccess,
+                    ],
                 )
             ]
         ),
@@ -1252,12 +2391,22 @@ def create_template():
             Type = "AWS_PROXY",
             IntegrationHttpMethod = "POST",
             PassthroughBehavior = "WHEN_NO_TEMPLATES",
-            Uri = Sub(
-                "arn:aws:apigateway:%s:lambda:path/2015-03-31/functions/%s/invocations"
-                % (
-                    "${AWS::Region}",
-                    "${%s.Arn}" % r_webhook_lambda.title,
-                )
+            Uri = If(
+                "HasWebhookLambdaProvisionedConcurrency",
+                Sub(
+                    "arn:aws:apigateway:%s:lambda:path/2015-03-31/functions/%s/invocations"
+                    % (
+                        "${AWS::Region}",
+                        "${%s}" % r_webhook_lambda_alias.title,
+                    )
+                ),
+                Sub(
+                    "arn:aws:apigateway:%s:lambda:path/2015-03-31/functions/%s/invocations"
+                    % (
+                        "${AWS::Region}",
+                        "${%s.Arn}" % r_webhook_lambda.title,
+                    )
+                ),
             ),
             IntegrationResponses = [
                 IntegrationResponse(
@@ -1271,7 +2420,11 @@ def create_template():
         "WebhookLambdaInvokePermission",
         Action = "lambda:InvokeFunction",
         Principal = "apigateway.amazonaws.com",
-        FunctionName = GetAtt(r_webhook_lambda, "Arn"),
+        FunctionName = If(
+            "HasWebhookLambdaProvisionedConcurrency",
+            Ref(r_webhook_lambda_alias),
+            GetAtt(r_webhook_lambda, "Arn"),
+        ),
         SourceArn = Sub(
             ac_execute_api.ARN(
                 resource = "${%s}/*/*/webhook/*" % r_rest_api.title,
@@ -1305,12 +2458,22 @@ def create_template():
             Type = "AWS_PROXY",
             IntegrationHttpMethod = "POST",
             PassthroughBehavior = "WHEN_NO_TEMPLATES",
-            Uri = Sub(
-                "arn:aws:apigateway:%s:lambda:path/2015-03-31/functions/%s/invocations"
-                % (
-                    "${AWS::Region}",
-                    "${%s.Arn}" % r_api_lambda.title,
-                )
+            Uri = If(
+                "HasApiLambdaProvisionedConcurrency",
+                Sub(
+                    "arn:aws:apigateway:%s:lambda:path/2015-03-31/functions/%s/invocations"
+                    % (
+                        "${AWS::Region}",
+                        "${%s}" % r_api_lambda_alias.title,
+                    )
+                ),
+                Sub(
+                    "arn:aws:apigateway:%s:lambda:path/2015-03-31/functions/%s/invocations"
+                    % (
+                        "${AWS::Region}",
+                        "${%s.Arn}" % r_api_lambda.title,
+                    )
+                ),
             ),
             IntegrationResponses = [
                 IntegrationResponse(
@@ -1324,7 +2487,11 @@ def create_template():
         "ApiLambdaInvokePermission",
         Action = "lambda:InvokeFunction",
         Principal = "apigateway.amazonaws.com",
-        FunctionName = GetAtt(r_api_lambda, "Arn"),
+        FunctionName = If(
+            "HasApiLambdaProvisionedConcurrency",
+            Ref(r_api_lambda_alias),
+            GetAtt(r_api_lambda, "Arn"),
+        ),
         SourceArn = Sub(
             ac_execute_api.ARN(
                 resource = "${%s}/*/*/api/*" % r_rest_api.title,
@@ -1334,6 +2501,139 @@ def create_template():
         ),
     ))
 
+    # The CloudFront distribution, if enabled, forwards requests to the API without caching,
+    # except for the static UI application resources, which have hashed names and are cached
+    # for a year. API responses depend on the session, so the API marks them "private" and
+    # they are only cached by browsers (and revalidated through CloudFront with their ETag).
+    r_cloudfront_origin_access_identity = t.add_resource(CloudFrontOriginAccessIdentity(
+        "CloudFrontOriginAccessIdentity",
+        Condition = "UseCloudFront",
+        CloudFrontOriginAccessIdentityConfig = CloudFrontOriginAccessIdentityConfig(
+            Comment = Sub("${AWS::StackName} static UI application resources"),
+        ),
+    ))
+
+    t.add_resource(BucketPolicy(
+        "CloudFrontAppStaticBucketPolicy",
+        Condition = "DoCreateCloudFrontBucketPolicy",
+        Bucket = Ref(p_artifact_bucket_name),
+        PolicyDocument = PolicyDocument(
+            Version = "2012-10-17",
+            Statement = [
+                Statement(
+                    Effect = Allow,
+                    Principal = Principal(
+                        "CanonicalUser",
+                        GetAtt(r_cloudfront_origin_access_identity, "S3CanonicalUserId"),
+                    ),
+                    Resource = [
+                        Sub(ac_s3.ARN(
+                            resource = "${%s}/${%s}*" % (
+                                p_artifact_bucket_name.title,
+                                p_app_static_key_prefix.title,
+                            ),
+                        )),
+                    ],
+                    Action = [
+                        ac_s3.GetObject,
+                    ],
+                ),
+            ],
+        ),
+    ))
+
+    r_cloudfront_immutable_cache_policy = t.add_resource(CachePolicy(
+        "CloudFrontImmutableCachePolicy",
+        Condition = "UseCloudFront",
+        CachePolicyConfig = CachePolicyConfig(
+            Name = Sub("${AWS::StackName}-immutable"),
+            Comment = "Resources with hashed names, which never change",
+            MinTTL = 31536000,
+            DefaultTTL = 31536000,
+            MaxTTL = 31536000,
+            ParametersInCacheKeyAndForwardedToOrigin = ParametersInCacheKeyAndForwardedToOrigin(
+                EnableAcceptEncodingGzip = True,
+                EnableAcceptEncodingBrotli = True,
+                CookiesConfig = CacheCookiesConfig(
+                    CookieBehavior = "none",
+                ),
+                HeadersConfig = CacheHeadersConfig(
+                    HeaderBehavior = "none",
+                ),
+                QueryStringsConfig = CacheQueryStringsConfig(
+                    QueryStringBehavior = "none",
+                ),
+            ),
+        ),
+    ))
+
+    api_origin_id = "api"
+    app_static_origin_id = "app-static"
+
+    r_cloudfront_distribution = t.add_resource(Distribution(
+        "CloudFrontDistribution",
+        Condition = "UseCloudFront",
+        DistributionConfig = DistributionConfig(
+            Comment = Sub("${AWS::StackName}"),
+            Enabled = True,
+            HttpVersion = "http2",
+            IPV6Enabled = True,
+            PriceClass = Ref(p_cloudfront_price_class),
+            Origins = [
+                Origin(
+                    Id = api_origin_id,
+                    DomainName = Sub("${%s}.execute-api.${AWS::Region}.amazonaws.com" % r_rest_api.title),
+                    OriginPath = Sub("/${%s}" % p_api_stage_name.title),
+                    CustomOriginConfig = CustomOriginConfig(
+                        OriginProtocolPolicy = "https-only",
+                        OriginSSLProtocols = ["TLSv1.2"],
+                    ),
+                ),
+                Origin(
+                    Id = app_static_origin_id,
+                    DomainName = Sub("${%s}.s3.${AWS::Region}.amazonaws.com" % p_artifact_bucket_name.title),
+                    S3OriginConfig = S3OriginConfig(
+                        OriginAccessIdentity = Sub(
+                            "origin-access-identity/cloudfront/${%s}" % r_cloudfront_origin_access_identity.title,
+                        ),
+                    ),
+                ),
+            ],
+            DefaultCacheBehavior = DefaultCacheBehavior(
+                TargetOriginId = api_origin_id,
+                ViewerProtocolPolicy = "redirect-to-https",
+                AllowedMethods = vAllHttpMethods,
+                CachedMethods = ["GET", "HEAD"],
+                CachePolicyId = vCachingDisabledCachePolicyId,
+                OriginRequestPolicyId = vAllViewerExceptHostHeaderOriginRequestPolicyId,
+                Compress = True,
+            ),
+            CacheBehaviors = [
+                # Served by the API from AppStaticKeyPrefix.
+                CacheBehavior(
+                    PathPattern = "static/*",
+                    TargetOriginId = api_origin_id,
+                    ViewerProtocolPolicy = "redirect-to-https",
+                    AllowedMethods = ["GET", "HEAD"],
+                    CachedMethods = ["GET", "HEAD"],
+                    CachePolicyId = Ref(r_cloudfront_immutable_cache_policy),
+                    Compress = True,
+                ),
+                # The same resources straight from S3, for apps built to load them from there.
+                CacheBehavior(
+                    PathPattern = Sub("${%s}*" % p_app_static_key_prefix.title),
+                    TargetOriginId = app_static_origin_id,
+                    ViewerProtocolPolicy = "redirect-to-https",
+                    AllowedMethods = ["GET", "HEAD"],
+                    CachedMethods = ["GET", "HEAD"],
+                    CachePolicyId = Ref(r_cloudfront_immutable_cache_policy),
+                    Compress = True,
+                ),
+            ],
+        ),
+        Tags = tags,
+    ))
+
     t.add_output(Output(
         "SecretsKMSArn",
         Value = If(
@@ -1386,6 +2686,18 @@ def create_template():
         Value = Ref(r_api_lambda_role),
     ))
 
+    t.add_output(Output(
+        "WebhookLambdaAlias",
+        Condition = "HasWebhookLambdaProvisionedConcurrency",
+        Value = Ref(r_webhook_lambda_alias),
+    ))
+
+    t.add_output(Output(
+        "ApiLambdaAlias",
+        Condition = "HasApiLambdaProvisionedConcurrency",
+        Value = Ref(r_api_lambda_alias),
+    ))
+
     t.add_output(Output(
         "StepLambda",
         Value = Ref(r_step_lambda),
@@ -1396,4 +2708,40 @@ def create_template():
         Value = Ref(r_step_lambda_role),
     ))
 
+    t.add_output(Output(
+        "CloudFrontDistribution",
+        Condition = "UseCloudFront",
+        Value = Ref(r_cloudfront_distribution),
+    ))
+
+    t.add_output(Output(
+        "CloudFrontDomainName",
+        Condition = "UseCloudFront",
+        Value = GetAtt(r_cloudfront_distribution, "DomainName"),
+    ))
+
+    t.add_output(Output(
+        "CloudFrontOriginAccessIdentity",
+        Condition = "UseCloudFront",
+        Value = GetAtt(r_cloudfront_origin_access_identity, "S3CanonicalUserId"),
+    ))
+
+    t.add_output(Output(
+        "QueueLambda",
+        Condition = "UseWebhookQueue",
+        Value = Ref(r_queue_lambda),
+    ))
+
+    t.add_output(Output(
+        "WebhookQueue",
+        Condition = "UseWebhookQueue",
+        Value = Ref(r_webhook_queue),
+    ))
+
+    t.add_output(Output(
+        "WebhookDeadLetterQueue",
+        Condition = "UseWebhookQueue",
+        Value = Ref(r_webhook_dead_letter_queue),
+    ))
+
     return t
@@ -1,6 +1,6 @@
 from .tags import build_tags_list
 
-from troposphere import Template, Parameter, Ref
+from troposphere import Template, Parameter, Ref, Equals, Not
 from troposphere.dynamodb import \
     Table, KeySchema, \
     AttributeDefinition, ProvisionedThroughput, \
@@ -33,6 +33,27 @@ def create_template():
         Type = "String",
     ))
 
+    p_webhook_deliveries_table_name = t.add_parameter(Parameter(
+        "WebhookDeliveriesTableName",
+        Description = "Optional table used to skip redelivered and duplicate GitHub events.",
+        Type = "String",
+        Default = "-NONE-",
+    ))
+
+    p_build_slots_table_name = t.add_parameter(Parameter(
+        "BuildSlotsTableName",
+        Description = "Optional table used to limit the number of concurrent builds.",
+        Type = "String",
+        Default = "-NONE-",
+    ))
+
+    p_build_results_table_name = t.add_parameter(Parameter(
+        "BuildResultsTableName",
+        Description = "Optional table used to reuse the results of identical builds that have already succeeded.",
+        Type = "String",
+        Default = "-NONE-",
+    ))
+
     p_config_table_rcu = t.add_parameter(Parameter(
         "ConfigTableRCU",
         Type = "Number",
@@ -81,6 +102,42 @@ def create_template():
         Default = "5",
     ))
 
+    p_webhook_deliveries_table_rcu = t.add_parameter(Parameter(
+        "WebhookDeliveriesTableRCU",
+        Type = "Number",
+        Default = "1",
+    ))
+
+    p_webhook_deliveries_table_wcu = t.add_parameter(Parameter(
+        "WebhookDeliveriesTableWCU",
+        Type = "Number",
+        Default = "5",
+    ))
+
+    p_build_slots_table_rcu = t.add_parameter(Parameter(
+        "BuildSlotsTableRCU",
+        Type = "Number",
+        Default = "5",
+    ))
+
+    p_build_slots_table_wcu = t.add_parameter(Parameter(
+        "BuildSlotsTableWCU",
+        Type = "Number",
+        Default = "5",
+    ))
+
+    p_build_results_table_rcu = t.add_parameter(Parameter(
+        "BuildResultsTableRCU",
+        Type = "Number",
+        Default = "5",
+    ))
+
+    p_build_results_table_wcu = t.add_parameter(Parameter(
+        "BuildResultsTableWCU",
+        Type = "Number",
+        Default = "2",
+    ))
+
     p_executions_search_indexes_rcu = t.add_parameter(Parameter(
         "ExecutionsSearchIndexesRCU",
         Type = "Number",
@@ -93,6 +150,21 @@ def create_template():
         Default = "1",
     ))
 
+    t.add_condition(
+        "HasWebhookDeliveriesTable",
+        Not(Equals(Ref(p_webhook_deliveries_table_name), "-NONE-")),
+    )
+
+    t.add_condition(
+        "HasBuildSlotsTable",
+        Not(Equals(Ref(p_build_slots_table_name), "-NONE-")),
+    )
+
+    t.add_condition(
+        "HasBuildResultsTable",
+        Not(Equals(Ref(p_build_results_table_name), "-NONE-")),
+    )
+
     # Replace with custom tags if desired.
     tags = build_tags_list(t)
 
@@ -169,6 +241,86 @@ def create_template():
         Tags = tags,
     ))
 
+    t.add_resource(Table(
+        "WebhookDeliveriesTable",
+        Condition = "HasWebhookDeliveriesTable",
+        DeletionPolicy = "Retain",
+        TableName = Ref(p_webhook_deliveries_table_name),
+        KeySchema = [
+            KeySchema(
+                KeyType = "HASH",
+                AttributeName = "id",
+            ),
+        ],
+        AttributeDefinitions = [
+            AttributeDefinition(
+                AttributeName = "id",
+                AttributeType = "S",
+            ),
+        ],
+        ProvisionedThroughput = ProvisionedThroughput(
+            ReadCapacityUnits = Ref(p_webhook_deliveries_table_rcu),
+            WriteCapacityUnits = Ref(p_webhook_deliveries_table_wcu)
+        ),
+        TimeToLiveSpecification = TimeToLiveSpecification(
+            Enabled = True,
+            AttributeName = "ttlTime",
+        ),
+        Tags = tags,
+    ))
+
+    t.add_resource(Table(
+        "BuildSlotsTable",
+        Condition = "HasBuildSlotsTable",
+        DeletionPolicy = "Retain",
+        TableName = Ref(p_build_slots_table_name),
+        KeySchema = [
+            KeySchema(
+                KeyType = "HASH",
+                AttributeName = "id",
+            ),
+        ],
+        AttributeDefinitions = [
+            AttributeDefinition(
+                AttributeName = "id",
+                AttributeType = "S",
+            ),
+        ],
+        ProvisionedThroughput = ProvisionedThroughput(
+            ReadCapacityUnits = Ref(p_build_slots_table_rcu),
+            WriteCapacityUnits = Ref(p_build_slots_table_wcu)
+        ),
+        Tags = tags,
+    ))
+
+    t.add_resource(Table(
+        "BuildResultsTable",
+        Condition = "HasBuildResultsTable",
+        DeletionPolicy = "Retain",
+        TableName = Ref(p_build_results_table_name),
+        KeySchema = [
+            KeySchema(
+                KeyType = "HASH",
+                AttributeName = "id",
+            ),
+        ],
+        AttributeDefinitions = [
+            AttributeDefinition(
+                AttributeName = "id",
+                AttributeType = "S",
+            ),
+        ],
+        ProvisionedThroughput = ProvisionedThroughput(
+            ReadCapacityUnits = Ref(p_build_results_table_rcu),
+            WriteCapacityUnits = Ref(p_build_results_table_wcu)
+        ),
+        TimeToLiveSpecification = TimeToLiveSpecification(
+            Enabled = True,
+            AttributeName = "ttlTime",
+        ),
+        Tags = tags,
+    ))
+
     t.add_resource(Table(
         "ExecutionsTable",
         DeletionPolicy = "Retain",
@@ -196,6 +348,10 @@ def create_template():
                 AttributeName = "createTime",
                 AttributeType = "S",
             ),
+            AttributeDefinition(
+                AttributeName = "activeKey",
+                AttributeType = "S",
+            ),
         ],
         ProvisionedThroughput = ProvisionedThroughput(
             ReadCapacityUnits = Ref(p_executions_table_rcu),
@@ -263,6 +419,39 @@ def create_template():
                     WriteCapacityUnits = Ref(p_executions_search_indexes_wcu),
                 ),
             ),
+            # Sparse index of the executions that are queued or in progress, which only
+            # have an "activeKey" attribute while they are, so listing them does not read
+            # the history of every repo.
+            GlobalSecondaryIndex(
+                IndexName = "active-createTime-index",
+                KeySchema = [
+                    KeySchema(
+                        KeyType = "HASH",
+                        AttributeName = "activeKey",
+                    ),
+                    KeySchema(
+                        KeyType = "RANGE",
+                        AttributeName = "createTime",
+                    ),
+                ],
+                Projection = Projection(
+                    NonKeyAttributes = [
+                        "repoId",
+                        "executionId",
+                        "createTime",
+                        "updateTime",
+                        "status",
+                        "conclusion",
+                        "conclusionTime",
+                        "meta",
+                    ],
+                    ProjectionType = "INCLUDE",
+                ),
+                ProvisionedThroughput = ProvisionedThroughput(
+                    ReadCapacityUnits = Ref(p_executions_search_indexes_rcu),
+                    WriteCapacityUnits = Ref(p_executions_search_indexes_wcu),
+                ),
+            ),
         ],
     ))
 
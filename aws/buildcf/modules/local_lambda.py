@@ -0,0 +1,129 @@
+import json
+import os
+import shlex
+import subprocess
+
+from .local_services import ServiceError
+from .local_states import StatesError
+
+# Runs the step lambda's handler (or the log archive lambda's handler) in a Node.js process
+# (see step-lambda-bridge.js), with its calls to the "aws" and "github" utility modules answered by LocalServices.
+
+BRIDGE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "step-lambda-bridge.js")
+
+# Environment for the step lambda, as set by the orchestrator template.
+DEFAULT_LAMBDA_ENV = {
+    "LOCK_TIMEOUT_SECONDS": "300",
+    "MAX_SESSION_MINUTES": "30",
+    "BUILDS_YML_FILE": ".cbuildci.yml",
+    "BASE_URL": "https://cbuildci.example.com",
+    "TABLE_CONFIG_NAME": "cbuildci-config",
+    "TABLE_LOCKS_NAME": "cbuildci-locks",
+    "TABLE_SESSIONS_NAME": "cbuildci-sessions",
+    "TABLE_EXECUTIONS_NAME": "cbuildci-executions",
+    "STATE_MACHINE_ARN": "arn:aws:states:us-east-1:123456789012:stateMachine:cbuildci-statemachine",
+    "STATE_MACHINE_WAIT_SECONDS_DEFAULT": "30",
+    "STATE_MACHINE_MODE": "standard",
+    "LOG_ARCHIVE_QUEUE_URL": "https://sqs.us-east-1.amazonaws.com/123456789012/cbuildci-log-archive",
+    "SOURCE_S3_BUCKET_DEFAULT": "cbuildci-artifacts",
+    "SOURCE_S3_KEY_PREFIX_DEFAULT": "source/{GitHubDomain}/{GitHubUser}/{GitHubRepo}/",
+    "ARTIFACT_S3_BUCKET_DEFAULT": "cbuildci-artifacts",
+    "ARTIFACT_S3_KEY_PREFIX_DEFAULT": "artifact/{GitHubDomain}/{GitHubUser}/{GitHubRepo}/",
+    "CACHE_S3_BUCKET_DEFAULT": "cbuildci-artifacts",
+    "CACHE_S3_KEY_PREFIX_DEFAULT": "cache/{GitHubDomain}/{GitHubUser}/{GitHubRepo}/",
+    "SECRETS_KMS_ARN": "arn:aws:kms:us-east-1:123456789012:key/local",
+    "GH_URL": "https://github.com",
+    "GH_API_URL": "https://api.github.com",
+    "GH_APP_ID": "1",
+}
+
+
+class StepLambdaBridge(object):
+
+    def __init__(self, services, clock, env = None, node = "node", verbose = False):
+        self.services = services
+        self.clock = clock
+        self.invocations = 0
+
+        self.process = subprocess.Popen(
+            shlex.split(node) + [BRIDGE_PATH],
+            stdin = subprocess.PIPE,
+            stdout = subprocess.PIPE,
+            stderr = None if verbose else subprocess.DEVNULL,
+            env = dict(os.environ, **dict(DEFAULT_LAMBDA_ENV, **(env or {}))),
+            universal_newlines = True,
+            bufsize = 1,
+        )
+
+        self.request({
+            "type": "init",
+            "aws": sorted(services.methods["aws"]),
+            "github": sorted(services.methods["github"]),
+        })
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+    def send(self, message):
+        message["now"] = self.clock.now * 1000
+        self.process.stdin.write(json.dumps(message) + "\n")
+
+    def receive(self):
+        line = self.process.stdout.readline()
+        if not line:
+            raise Exception("The step lambda bridge exited unexpectedly")
+        return json.loads(line)
+
+    # Send a message and answer the handler's calls until it is done.
+    # Returns the result and the seconds spent on calls.
+    def request(self, message):
+        start_time = self.clock.now
+        elapsed = 0.0
+
+        self.send(message)
+
+        try:
+            while True:
+                reply = self.receive()
+
+                if reply["type"] == "done":
+                    return reply["result"], elapsed
+
+                if reply["type"] == "failed":
+                    raise StatesError(reply["errorType"], reply["errorMessage"])
+
+                # Calls happen at the virtual time the handler has reached.
+                self.clock.now = start_time + elapsed
+                try:
+                    result, latency = self.services.call(reply["module"], reply["method"], reply["args"])
+                    elapsed += latency
+                    self.send({"type": "result", "id": reply["id"], "result": result})
+                except ServiceError as err:
+                    elapsed += 0.01
+                    self.send({"type": "error", "id": reply["id"], "error": err.to_json()})
+        finally:
+            self.clock.now = start_time
+
+    def create_state(self, params):
+        result, _ = self.request({
+            "type": "createState",
+            "params": params,
+        })
+        return result
+
+    # Invoke the step lambda's handler, or the "archiveLogs" handler,
+    # returning its result and the seconds it took.
+    def invoke(self, event, request_id, handler = "step"):
+        if handler == "step":
+            self.invocations += 1
+        return self.request({
+            "type": "invoke",
+            "handler": handler,
+            "event": event,
+            "context": {
+                "logGroupName": "/aws/lambda/cbuildci-%s" % handler,
+                "logStreamName": "local",
+                "awsRequestId": request_id,
+            },
+        })
@@ -0,0 +1,462 @@
+import copy
+import random
+from collections import Counter
+
+from .local_states import to_timestamp
+
+
+# Local stand-ins for the services the step lambda (and the log archive lambda) call
+# through their "aws" and "github" utility modules, for the local state machine tools. Each stand-in
+# method takes the same arguments as the utility function it replaces.
+#
+# Requests are rate limited per service with token buckets on the virtual clock.
+# Throttled AWS requests are retried with backoff like the AWS SDK does, and only
+# fail once the retries run out. GitHub requests are not retried, and get a 403
+# response like the GitHub API gives once its rate limit is reached.
+
+# Modeled latency of one request, in seconds.
+DEFAULT_LATENCY_SECONDS = {
+    "codebuild": 0.08,
+    "dynamodb": 0.008,
+    "github": 0.25,
+    "kms": 0.01,
+    "logs": 0.05,
+    "s3": 0.05,
+    "sqs": 0.01,
+    "ssm": 0.02,
+    "states": 0.05,
+}
+
+# Retries and the base backoff delay used by the AWS SDK for JavaScript.
+SDK_RETRIES = {
+    "dynamodb": (10, 0.05),
+}
+SDK_DEFAULT_RETRIES = (3, 0.1)
+
+THROTTLING_ERROR_CODES = {
+    "codebuild": "ThrottlingException",
+    "dynamodb": "ProvisionedThroughputExceededException",
+    "kms": "ThrottlingException",
+    "logs": "ThrottlingException",
+    "s3": "SlowDown",
+    "sqs": "RequestThrottled",
+    "ssm": "ThrottlingException",
+    "states": "ThrottlingException",
+}
+
+CODEBUILD_ARN_PREFIX = "arn:aws:codebuild:us-east-1:123456789012:build/"
+
+# Most log events GetLogEvents returns at once (it also stops at 1 MB).
+LOG_EVENTS_PAGE_LIMIT = 10000
+
+# Seconds after a log event is written until CloudWatch Logs has ingested it.
+LOG_INGESTION_SECONDS = 2.0
+
+
+class ServiceError(Exception):
+
+    def __init__(self, code, message, name = None):
+        Exception.__init__(self, message)
+        self.code = code
+        self.name = name or code
+        self.message = message
+
+    def to_json(self):
+        return {
+            "name": self.name,
+            "code": self.code,
+            "message": self.message,
+        }
+
+
+class RateLimiter(object):
+
+    def __init__(self, clock, rate, burst = None):
+        self.clock = clock
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.last_time = clock.now
+
+    def try_acquire(self, now = None):
+        if not self.rate:
+            return True
+
+        now = self.clock.now if now is None else now
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.last_time) * self.rate)
+        self.last_time = max(self.last_time, now)
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+class LocalServices(object):
+
+    # "limits" has requests per second for "codebuild", "dynamodb", "kms", "logs", "s3",
+    # "sqs", "ssm" and "states", requests per hour for "github", and the number of builds
+    # that can run at once for "codebuild_builds". A limit of 0 is unlimited.
+    #
+    # "build_seconds" is called with the CodeBuild project name to get how long a build takes,
+    # and each build writes "log_events" log events, evenly over that time.
+    def __init__(self, clock, limits, build_seconds, build_failure_rate = 0.0, seed = None, on_start_execution = None,
+                 log_events = 2000, on_send_message = None):
+        self.clock = clock
+        self.limits = limits
+        self.build_seconds = build_seconds
+        self.build_failure_rate = build_failure_rate
+        self.random = random.Random(seed)
+        self.on_start_execution = on_start_execution
+        self.log_events = log_events
+        self.on_send_message = on_send_message
+
+        self.calls = Counter()
+        self.throttles = Counter()
+        self.failures = Counter()
+
+        self.rate_limiters = {
+            service: RateLimiter(clock, limits.get(service, 0))
+            for service in DEFAULT_LATENCY_SECONDS
+            if service != "github"
+        }
+        self.rate_limiters["github"] = RateLimiter(
+            clock,
+            limits.get("github", 0) / 3600.0,
+            limits.get("github", 0),
+        )
+
+        self.executions = {}
+        self.locks = {}
+        self.build_slots = {}
+        self.build_results = {}
+        self.builds = {}
+        self.build_sequence = 0
+        self.peak_running_builds = 0
+
+        self.methods = {
+            "aws": {
+                "getExecution": ("dynamodb", self.get_execution),
+                "updateExecution": ("dynamodb", self.update_execution),
+                "updateLock": ("dynamodb", self.update_lock),
+                "releaseLock": ("dynamodb", self.release_lock),
+                "getBuildSlots": ("dynamodb", self.get_build_slots),
+                "acquireBuildSlot": ("dynamodb", self.acquire_build_slot),
+                "renewBuildSlots": ("dynamodb", self.renew_build_slots),
+                "releaseBuildSlots": ("dynamodb", self.release_build_slots),
+                "getBuildResult": ("dynamodb", self.get_build_result),
+                "putBuildResult": ("dynamodb", self.put_build_result),
+                "startCodeBuild": ("codebuild", self.start_code_build),
+                "batchGetCodeBuilds": ("codebuild", self.batch_get_code_builds),
+                "stopCodeBuild": ("codebuild", self.stop_code_build),
+                "encryptString": ("kms", lambda key_id, plaintext, *args: "encrypted-token"),
+                "decryptString": ("kms", lambda encrypted, *args: "token"),
+                "getSSMParam": ("ssm", lambda name, *args: "secret"),
+                "putS3Object": ("s3", lambda params, *args: {}),
+                "getLogEvents": ("logs", self.get_log_events),
+                "sendSQSMessage": ("sqs", self.send_sqs_message),
+                "startStepFunctionExecution": ("states", self.start_step_function_execution),
+                "sendStepFunctionTaskSuccess": ("states", lambda token, output, *args: {}),
+            },
+            "github": {
+                "pushCommitStatus": ("github", lambda *args: {"statusCode": 201, "data": {}}),
+                "updateCheckRun": ("github", lambda *args: {"statusCode": 200, "data": {}}),
+                "getInstallationAccessToken": ("github", self.get_installation_access_token),
+            },
+        }
+
+    # Call a stand-in method, returning its result and the modeled latency in seconds.
+    def call(self, module, method, args):
+        if method not in self.methods.get(module, {}):
+            raise ServiceError("NotImplemented", "No local stand-in for %s.%s" % (module, method))
+
+        service, fn = self.methods[module][method]
+        self.calls["%s.%s" % (service, method)] += 1
+        latency = DEFAULT_LATENCY_SECONDS[service]
+
+        if service == "github":
+            if not self.rate_limiters[service].try_acquire():
+                self.throttles[service] += 1
+                self.failures[service] += 1
+                return {"statusCode": 403, "data": {"message": "API rate limit exceeded"}}, latency
+            return fn(*args), latency
+
+        retries, base_delay = SDK_RETRIES.get(service, SDK_DEFAULT_RETRIES)
+        for attempt in range(retries + 1):
+            if self.rate_limiters[service].try_acquire(self.clock.now + latency):
+                return fn(*args), latency
+
+            self.throttles[service] += 1
+            latency += base_delay * (2 ** attempt)
+
+        self.failures[service] += 1
+        raise ServiceError(THROTTLING_ERROR_CODES[service], "Rate exceeded")
+
+    # DynamoDB
+
+    def put_execution(self, repo_id, execution_id, meta, state):
+        self.executions[(repo_id, execution_id)] = {
+            "repoId": repo_id,
+            "executionId": execution_id,
+            "status": "IN_PROGRESS",
+            "updates": 0,
+            "stateVersion": 0,
+            "conclusion": None,
+            "meta": meta,
+            "state": state,
+        }
+
+    def put_lock(self, lock_id, trace_id):
+        self.locks[lock_id] = {
+            "id": lock_id,
+            "traceId": trace_id,
+            "lastUpdate": self.clock.now * 1000,
+        }
+
+    def get_execution(self, table_name, repo_id, execution_id, *args):
+        return copy.deepcopy(self.executions.get((repo_id, execution_id)))
+
+    def update_execution(self, table_name, repo_id, execution_id, updates = None, *args):
+        updates = updates or {}
+        execution = self.executions.get((repo_id, execution_id))
+        expected_state_version = updates.get("expectedStateVersion")
+
+        if execution is None:
+            raise ServiceError("ConditionalCheckFailedException", "The conditional request failed")
+
+        if expected_state_version is not None:
+            if execution["stateVersion"] != expected_state_version:
+                raise ServiceError(
+                    "ConditionalCheckFailedException",
+                    "State for execution \"%s\" is no longer at version %d" % (execution_id, expected_state_version),
+                    "StateVersionConflictError",
+                )
+            execution["stateVersion"] += 1
+
+        execution["updates"] += 1
+
+        if updates.get("status"):
+            execution["status"] = updates["status"]
+
+        if updates.get("conclusion"):
+            execution["conclusion"] = updates["conclusion"]
+            execution["conclusionTime"] = self.clock.now
+
+        if updates.get("state"):
+            execution["state"] = copy.deepcopy(updates["state"])
+
+        for key, value in (updates.get("stateProps") or {}).items():
+            execution["state"][key] = copy.deepcopy(value)
+
+        for key, value in (updates.get("builds") or {}).items():
+            execution["state"]["builds"][key] = copy.deepcopy(value)
+
+        for key, value in (updates.get("meta") or {}).items():
+            execution["meta"][key] = copy.deepcopy(value)
+
+        return copy.deepcopy(execution)
+
+    def update_lock(self, table_name, lock_id, trace_id, meta = None, *args):
+        lock = self.locks.get(lock_id)
+        if lock is None or lock["traceId"] != trace_id:
+            raise ServiceError("ConditionalCheckFailedException", "The conditional request failed")
+
+        previous = dict(lock)
+        lock["lastUpdate"] = self.clock.now * 1000
+        return previous
+
+    def release_lock(self, table_name, lock_id, trace_id, *args):
+        lock = self.locks.get(lock_id)
+        if lock is None or lock["traceId"] != trace_id:
+            raise ServiceError("ConditionalCheckFailedException", "The conditional request failed")
+
+        del self.locks[lock_id]
+
+    # Build slot leases are kept as a map of holder to expire time in milliseconds, like the table.
+    def get_build_slots(self, table_name, scope_id, *args):
+        leases = self.build_slots.get(scope_id)
+        if leases is None:
+            return None
+
+        return {
+            "id": scope_id,
+            "leases": dict(leases),
+        }
+
+    def acquire_build_slot(self, table_name, holder, scopes, lease_seconds, *args):
+        now = self.clock.now * 1000
+
+        for scope in scopes:
+            leases = self.build_slots.get(scope["id"], {})
+            for expired_holder in [key for key, expire_time in leases.items() if key != holder and expire_time < now]:
+                del leases[expired_holder]
+            if holder not in leases and len(leases) >= scope["limit"]:
+                return False
+
+        for scope in scopes:
+            self.build_slots.setdefault(scope["id"], {})[holder] = now + lease_seconds * 1000
+
+        return True
+
+    def renew_build_slots(self, table_name, holders_by_scope_id, lease_seconds, *args):
+        expire_time = self.clock.now * 1000 + lease_seconds * 1000
+        for scope_id, holders in holders_by_scope_id.items():
+            leases = self.build_slots.get(scope_id)
+            if leases is not None:
+                for holder in holders:
+                    leases[holder] = expire_time
+
+    def release_build_slots(self, table_name, holders_by_scope_id, *args):
+        for scope_id, holders in holders_by_scope_id.items():
+            for holder in holders:
+                self.build_slots.get(scope_id, {}).pop(holder, None)
+
+    def get_build_result(self, table_name, result_key, *args):
+        return copy.deepcopy(self.build_results.get(result_key))
+
+    def put_build_result(self, table_name, result_key, result, *args):
+        self.build_results[result_key] = dict(result, id = result_key)
+
+    # CodeBuild
+
+    def running_builds(self):
+        return sum(1 for build in self.builds.values() if self.get_build_status(build) == "IN_PROGRESS")
+
+    def get_build_status(self, build):
+        if build["stopped"]:
+            return "STOPPED"
+        if self.clock.now < build["endTime"]:
+            return "IN_PROGRESS"
+        return "FAILED" if build["fails"] else "SUCCEEDED"
+
+    def start_code_build(self, params, *args):
+        limit = self.limits.get("codebuild_builds", 0)
+        running = self.running_builds()
+        if limit and running >= limit:
+            raise ServiceError(
+                "AccountLimitExceededException",
+                "Cannot have more than %d builds in queue for the account" % limit,
+            )
+
+        self.build_sequence += 1
+        build_id = "%s:%08d" % (params["projectName"], self.build_sequence)
+        build = {
+            "id": build_id,
+            "startTime": self.clock.now,
+            "endTime": self.clock.now + self.build_seconds(params["projectName"]),
+            "fails": self.random.random() < self.build_failure_rate,
+            "stopped": False,
+        }
+        self.builds[build_id] = build
+        self.peak_running_builds = max(self.peak_running_builds, running + 1)
+
+        return {
+            "build": self.get_build_props(build),
+        }
+
+    def batch_get_code_builds(self, build_ids, *args):
+        if len(build_ids) > 100:
+            raise ServiceError("InvalidInputException", "Cannot get more than 100 builds at once")
+
+        return {
+            "builds": [
+                self.get_build_props(self.builds[build_id])
+                for build_id in build_ids
+                if build_id in self.builds
+            ],
+        }
+
+    def stop_code_build(self, build_id, *args):
+        build = self.builds.get(build_id)
+        if build is None:
+            raise ServiceError("ResourceNotFoundException", "Build %s does not exist" % build_id)
+
+        if self.get_build_status(build) == "IN_PROGRESS":
+            build["stopped"] = True
+            build["endTime"] = self.clock.now
+
+        return {}
+
+    def get_build_props(self, build):
+        status = self.get_build_status(build)
+        return {
+            "id": build["id"],
+            "arn": CODEBUILD_ARN_PREFIX + build["id"],
+            "startTime": to_timestamp(build["startTime"]),
+            "endTime": None if status == "IN_PROGRESS" else to_timestamp(build["endTime"]),
+            "currentPhase": "BUILD" if status == "IN_PROGRESS" else "COMPLETED",
+            "buildStatus": status,
+            "buildComplete": status != "IN_PROGRESS",
+            "logs": {
+                "groupName": "/aws/codebuild/%s" % build["id"].split(":")[0],
+                "streamName": build["id"].split(":")[1],
+            },
+        }
+
+    # CloudWatch Logs
+
+    # Tokens are "f/" and the number of events before the page, and the same token
+    # is returned at the end of the events ingested so far.
+    def get_log_events(self, log_group_name, log_stream_name, options = None, *args):
+        options = options or {}
+        build = self.builds.get("%s:%s" % (log_group_name.split("/")[-1], log_stream_name))
+        if build is None:
+            raise ServiceError("ResourceNotFoundException", "The specified log stream does not exist.")
+
+        # Events are written evenly over the build, and ingested shortly after.
+        written_seconds = max(0.0, min(self.clock.now, build["endTime"]) - build["startTime"])
+        duration = max(0.001, build["endTime"] - build["startTime"])
+        ingested = min(
+            self.log_events,
+            int(self.log_events * max(0.0, written_seconds - LOG_INGESTION_SECONDS) / duration),
+        )
+        if self.clock.now >= build["endTime"] + LOG_INGESTION_SECONDS:
+            ingested = self.log_events
+
+        token = options.get("nextToken")
+        start = int(token[2:]) if token else 0
+        end = min(ingested, start + min(options.get("limit") or LOG_EVENTS_PAGE_LIMIT, LOG_EVENTS_PAGE_LIMIT))
+
+        events = []
+        for i in range(start, end):
+            timestamp = build["startTime"] + duration * i / self.log_events
+            events.append({
+                "timestamp": int(timestamp * 1000),
+                "message": "[Container] Running command %d\n" % i,
+                "ingestionTime": int((timestamp + LOG_INGESTION_SECONDS) * 1000),
+            })
+
+        return {
+            "events": events,
+            "nextForwardToken": "f/%d" % end,
+            "nextBackwardToken": "b/%d" % start,
+        }
+
+    # SQS
+
+    def send_sqs_message(self, params, *args):
+        if self.on_send_message:
+            self.on_send_message(params)
+
+        return {
+            "messageId": "message-%d" % self.calls["sqs.sendSQSMessage"],
+        }
+
+    # Step Functions
+
+    def start_step_function_execution(self, params, *args):
+        if not self.on_start_execution:
+            raise ServiceError("NotImplemented", "Starting state machine executions is not supported")
+
+        return {
+            "executionArn": self.on_start_execution(params),
+        }
+
+    # GitHub
+
+    def get_installation_access_token(self, *args):
+        return {
+            "token": "token",
+            "expires_at": to_timestamp(self.clock.now + 3600),
+        }
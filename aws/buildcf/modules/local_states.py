@@ -0,0 +1,337 @@
+import copy
+import heapq
+import json
+from datetime import datetime, timezone
+
+
+# A local stand-in for AWS Step Functions, which runs a state machine definition
+# against a virtual clock. It supports the subset of the Amazon States Language
+# used by the CBuildCI state machines (Task, Choice, Wait, Pass, Succeed and Fail,
+# with Catch and Retry). Task states are handed to an "invoke" callback, which
+# returns the task result and how many seconds it took.
+#
+# Executions are generators that yield the number of seconds they are waiting for,
+# so many executions can be interleaved on one clock (see Scheduler).
+
+
+def to_timestamp(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def from_timestamp(timestamp):
+    return datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%fZ" if "." in timestamp else "%Y-%m-%dT%H:%M:%SZ") \
+        .replace(tzinfo = timezone.utc) \
+        .timestamp()
+
+
+class VirtualClock(object):
+
+    # Seconds since the epoch, so times can be passed to code that expects real dates.
+    def __init__(self, now = 1577836800.0):
+        self.now = now
+
+    def advance(self, seconds):
+        self.now += max(0.0, seconds)
+
+
+# Runs generators from iter_execution (or any generator yielding seconds to wait)
+# in virtual time order, until all of them have finished.
+class Scheduler(object):
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.queue = []
+        self.sequence = 0
+
+    def add(self, generator, delay = 0.0, on_done = None):
+        heapq.heappush(self.queue, (self.clock.now + delay, self.sequence, generator, on_done))
+        self.sequence += 1
+
+    def run(self):
+        while self.queue:
+            wake_time, _, generator, on_done = heapq.heappop(self.queue)
+            self.clock.now = max(self.clock.now, wake_time)
+
+            try:
+                seconds = next(generator)
+            except StopIteration as done:
+                if on_done:
+                    on_done(done.value)
+                continue
+
+            heapq.heappush(self.queue, (self.clock.now + max(0.0, seconds), self.sequence, generator, on_done))
+            self.sequence += 1
+
+
+class StatesError(Exception):
+
+    def __init__(self, error, cause = None):
+        Exception.__init__(self, error)
+        self.error = error
+        self.cause = cause
+
+    def to_error_info(self):
+        return {
+            "Error": self.error,
+            "Cause": self.cause,
+        }
+
+
+class ExecutionResult(object):
+
+    def __init__(self):
+        self.status = "RUNNING"
+        self.output = None
+        self.error = None
+        self.start_time = None
+        self.stop_time = None
+        self.transitions = 0
+        self.task_invocations = 0
+        self.visited = []
+
+    @property
+    def duration(self):
+        return self.stop_time - self.start_time
+
+
+def get_path(data, path, context = None):
+    if path is None:
+        return None
+
+    if path.startswith("$$"):
+        data = context or {}
+        path = path[1:]
+
+    if path == "$":
+        return data
+
+    if not path.startswith("$."):
+        raise StatesError("States.Runtime", "Unsupported path: %s" % path)
+
+    value = data
+    for key in path[2:].split("."):
+        if not isinstance(value, dict) or key not in value:
+            raise StatesError("States.Runtime", "Invalid path: %s" % path)
+        value = value[key]
+
+    return value
+
+
+def set_path(data, path, value):
+    if path is None:
+        return data
+
+    if path == "$":
+        return value
+
+    if not path.startswith("$."):
+        raise StatesError("States.Runtime", "Unsupported result path: %s" % path)
+
+    data = copy.deepcopy(data)
+    target = data
+    keys = path[2:].split(".")
+    for key in keys[:-1]:
+        target = target.setdefault(key, {})
+    target[keys[-1]] = value
+
+    return data
+
+
+def apply_parameters(parameters, data, context):
+    if isinstance(parameters, dict):
+        ret = {}
+        for key, value in parameters.items():
+            if key.endswith(".$"):
+                ret[key[:-2]] = get_path(data, value, context)
+            else:
+                ret[key] = apply_parameters(value, data, context)
+        return ret
+
+    if isinstance(parameters, list):
+        return [apply_parameters(value, data, context) for value in parameters]
+
+    return parameters
+
+
+def matches_error(error_equals, error):
+    return "States.ALL" in error_equals or error in error_equals
+
+
+def evaluate_choice_rule(rule, data):
+    if "And" in rule:
+        return all(evaluate_choice_rule(r, data) for r in rule["And"])
+
+    if "Or" in rule:
+        return any(evaluate_choice_rule(r, data) for r in rule["Or"])
+
+    if "Not" in rule:
+        return not evaluate_choice_rule(rule["Not"], data)
+
+    value = get_path(data, rule["Variable"])
+
+    if "BooleanEquals" in rule:
+        return value is rule["BooleanEquals"]
+
+    if "StringEquals" in rule:
+        return value == rule["StringEquals"]
+
+    if "NumericEquals" in rule:
+        return value == rule["NumericEquals"]
+
+    if "NumericGreaterThan" in rule:
+        return value > rule["NumericGreaterThan"]
+
+    if "NumericLessThan" in rule:
+        return value < rule["NumericLessThan"]
+
+    raise StatesError("States.Runtime", "Unsupported choice rule: %s" % json.dumps(rule))
+
+
+# Run one execution of a state machine definition, as a generator that yields
+# the seconds it is waiting for and returns an ExecutionResult.
+#
+# "invoke" is called as invoke(resource, payload, context) for each Task state,
+# and must return a (result, seconds) tuple or raise StatesError. Tasks with a
+# ".waitForTaskToken" resource are treated as never being woken, so they time out
+# after "TimeoutSecondsPath" like an unattended callback.
+#
+# "transition_seconds" models the latency the service adds to each state transition.
+def iter_execution(definition, execution_input, invoke, clock, transition_seconds = 0.0, max_transitions = 25000):
+    result = ExecutionResult()
+    result.start_time = clock.now
+
+    context = {
+        "Execution": {
+            "StartTime": to_timestamp(clock.now),
+        },
+    }
+
+    data = execution_input
+    state_name = definition["StartAt"]
+    states = definition["States"]
+
+    while True:
+        if result.transitions >= max_transitions:
+            raise StatesError("States.Runtime", "Exceeded %d transitions" % max_transitions)
+
+        state = states[state_name]
+        result.transitions += 1
+        result.visited.append(state_name)
+        yield transition_seconds
+
+        state_type = state["Type"]
+        next_name = state.get("Next")
+
+        try:
+            if state_type == "Pass":
+                value = state["Result"] if "Result" in state else data
+                data = set_path(data, state.get("ResultPath", "$"), value)
+
+            elif state_type == "Wait":
+                if "SecondsPath" in state:
+                    yield get_path(data, state["SecondsPath"])
+                else:
+                    yield state.get("Seconds", 0)
+
+            elif state_type == "Choice":
+                next_name = state.get("Default")
+                for rule in state["Choices"]:
+                    if evaluate_choice_rule(rule, data):
+                        next_name = rule["Next"]
+                        break
+                if next_name is None:
+                    raise StatesError("States.NoChoiceMatched")
+
+            elif state_type == "Task":
+                data = yield from iter_task(state, data, context, invoke, clock, result)
+
+            elif state_type == "Succeed":
+                next_name = None
+
+            elif state_type == "Fail":
+                raise StatesError(state.get("Error", "States.Fail"), state.get("Cause"))
+
+            else:
+                raise StatesError("States.Runtime", "Unsupported state type: %s" % state_type)
+
+        except StatesError as err:
+            catcher = next(
+                (c for c in state.get("Catch", []) if matches_error(c["ErrorEquals"], err.error)),
+                None,
+            )
+
+            if catcher is None:
+                result.status = "FAILED"
+                result.error = err.to_error_info()
+                result.stop_time = clock.now
+                return result
+
+            data = set_path(data, catcher.get("ResultPath", "$"), err.to_error_info())
+            next_name = catcher["Next"]
+
+        if state.get("End") or next_name is None:
+            result.status = "SUCCEEDED"
+            result.output = data
+            result.stop_time = clock.now
+            return result
+
+        state_name = next_name
+
+
+def iter_task(state, data, context, invoke, clock, result):
+    resource = state["Resource"]
+    task_context = dict(context, Task = {"Token": "token-%d" % result.transitions})
+
+    if "Parameters" in state:
+        payload = apply_parameters(state["Parameters"], data, task_context)
+    else:
+        payload = data
+
+    attempts = {}
+
+    while True:
+        try:
+            result.task_invocations += 1
+            output, seconds = invoke(resource, payload, task_context)
+            yield seconds
+
+            if resource.endswith(".waitForTaskToken"):
+                yield get_path(data, state["TimeoutSecondsPath"]) - seconds
+                raise StatesError("States.Timeout")
+
+            break
+
+        except StatesError as err:
+            if err.error == "States.Timeout":
+                raise
+
+            retrier = next(
+                (r for r in state.get("Retry", []) if matches_error(r["ErrorEquals"], err.error)),
+                None,
+            )
+
+            if retrier is None:
+                raise
+
+            key = id(retrier)
+            attempts[key] = attempts.get(key, 0) + 1
+            if attempts[key] > retrier.get("MaxAttempts", 3):
+                raise
+
+            yield (
+                retrier.get("IntervalSeconds", 1)
+                * retrier.get("BackoffRate", 2.0) ** (attempts[key] - 1)
+            )
+
+    return set_path(data, state.get("ResultPath", "$"), output)
+
+
+# Run one execution of a state machine definition to completion on its own.
+def run_execution(definition, execution_input, invoke, clock, transition_seconds = 0.0, max_transitions = 25000):
+    execution = iter_execution(definition, execution_input, invoke, clock, transition_seconds, max_transitions)
+
+    while True:
+        try:
+            clock.advance(next(execution))
+        except StopIteration as done:
+            return done.value
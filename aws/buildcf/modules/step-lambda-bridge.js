@@ -0,0 +1,238 @@
+'use strict';
+
+// Runs the step lambda's handler for the local state machine tools (see load_test.py),
+// and the log archive lambda's handler for the logs that ended builds queue.
+//
+// Messages are JSON, one per line. The tool sends "invoke" messages on stdin (with
+// "handler" set to "archiveLogs" for the log archive lambda) and this process
+// replies with a "done" or "failed" message on stdout. While a handler
+// runs, calls to the "aws" and "github" utility modules are sent to the tool as
+// "call" messages, which the tool answers with a "result" or "error" message.
+// Every message from the tool includes the virtual time ("now"), which is used
+// for Date so the handler sees the same clock as the tool.
+//
+// Handler logs are written to stderr, since stdout carries the messages.
+
+const path = require('path');
+const readline = require('readline');
+
+const SRC_DIR = path.resolve(__dirname, '../../../src');
+
+const RealDate = Date;
+let virtualNow = RealDate.now();
+
+global.Date = class extends RealDate {
+    constructor(...args) {
+        if (args.length) {
+            super(...args);
+        }
+        else {
+            super(virtualNow);
+        }
+    }
+
+    static now() {
+        return virtualNow;
+    }
+};
+
+const protocolOut = process.stdout.write.bind(process.stdout);
+const logOut = (...args) => process.stderr.write(`${args.join(' ')}\n`);
+console.log = logOut;
+console.info = logOut;
+console.warn = logOut;
+console.error = logOut;
+
+const aws = require(path.join(SRC_DIR, 'lambda/util/aws'));
+const github = require(path.join(SRC_DIR, 'lambda/util/github'));
+const schema = require(path.join(SRC_DIR, 'common/schema'));
+const util = require(path.join(SRC_DIR, 'common/util'));
+const CIApp = require(path.join(SRC_DIR, 'lambda/CIApp'));
+const handlers = {
+    step: require(path.join(SRC_DIR, 'lambda/execution/index')).handler,
+    archiveLogs: require(path.join(SRC_DIR, 'lambda/execution/archiveLogs')).handler,
+};
+
+const ciApp = CIApp.create(process.env);
+
+const pendingCalls = new Map();
+let nextCallId = 1;
+
+function send(message) {
+    protocolOut(`${JSON.stringify(message, jsonReplacer())}\n`);
+}
+
+// Replace values that cannot be sent as JSON, such as streams.
+function jsonReplacer() {
+    const seen = new WeakSet();
+    return (key, value) => {
+        if (Buffer.isBuffer(value)) {
+            return value.toString();
+        }
+        if (value && typeof value === 'object') {
+            if (seen.has(value)) {
+                return '[Circular]';
+            }
+            seen.add(value);
+
+            const proto = Object.getPrototypeOf(value);
+            if (proto !== Object.prototype && proto !== Array.prototype && proto !== null) {
+                return `[${value.constructor ? value.constructor.name : 'Object'}]`;
+            }
+        }
+        return value;
+    };
+}
+
+function callTool(moduleName, method, args) {
+    return new Promise((resolve, reject) => {
+        const id = nextCallId++;
+        pendingCalls.set(id, { resolve, reject });
+        send({ type: 'call', id, module: moduleName, method, args });
+    });
+}
+
+// Send the calls to the stand-in methods to the tool, and leave the others (e.g. aws.parseArn) as is.
+function proxyMethods(moduleName, target, methods) {
+    for (const method of methods) {
+        if (typeof target[method] !== 'function') {
+            throw new Error(`${moduleName}.${method} is not a function`);
+        }
+        target[method] = (...args) => callTool(moduleName, method, args);
+    }
+}
+
+// Create the state for a new execution like startExecution does,
+// with the source already uploaded for each build.
+function createState({ repoId, executionId, commitSHA, traceId, waitSeconds, debounceSeconds, builds: ymlBuilds, buildDefaults }) {
+    const [owner, repo] = repoId.split('/');
+    const builds = {};
+
+    for (const [buildKey, ymlBuild] of Object.entries(ymlBuilds)) {
+        const buildParams = schema.validateBuildParams({
+            ...ciApp.globalBuildDefaults,
+            ...buildDefaults,
+            ...ymlBuild,
+        });
+
+        builds[buildKey] = {
+            buildKey,
+            status: null,
+            codeBuild: null,
+            slotScopeIds: null,
+            resultKey: null,
+            reusedResult: null,
+            waitingForDeps: [...new Set(buildParams.dependsOn)],
+            buildParams,
+        };
+    }
+
+    const graph = schema.compileBuildGraph(
+        Object.entries(builds).reduce((ret, [buildKey, buildState]) => {
+            ret[buildKey] = buildState.buildParams;
+            return ret;
+        }, {}),
+    );
+
+    const sourcesUploaded = [...new Set(Object.values(builds).map(({ buildParams }) => {
+        const sourceS3KeyPrefix = buildParams.sourceS3KeyPrefix
+            .replace('{GitHubDomain}', ciApp.githubHost)
+            .replace('{GitHubUser}', owner)
+            .replace('{GitHubRepo}', repo);
+
+        return `${buildParams.sourceS3Bucket}/${sourceS3KeyPrefix}source_${commitSHA}.zip`;
+    }))];
+
+    return {
+        lockId: util.buildLockId(owner, repo, commitSHA),
+        state: {
+            isRunning: true,
+            stopRequested: false,
+            stopSupersededBy: null,
+            runTask: 'RunMain',
+            waitSeconds,
+            debounceSeconds,
+            errorInfo: null,
+            repoId,
+            installationId: null,
+            executionId,
+            traceId,
+            checksName: null,
+            checksRunId: null,
+            encryptedOAuthToken: 'encrypted-token',
+            oAuthTokenExpiration: null,
+            sourcesUploaded,
+            builds,
+            graph,
+            readyBuildKeys: Object.values(builds)
+                .filter((buildState) => !buildState.waitingForDeps.length)
+                .map((buildState) => buildState.buildKey),
+            commitSHA,
+            isDefaultBranch: true,
+            owner,
+            repo,
+        },
+    };
+}
+
+function invoke(handler, event, context) {
+    return new Promise((resolve) => {
+        handler(event, context, (err, result) => {
+            if (err) {
+                send({
+                    type: 'failed',
+                    errorType: err.name || 'Error',
+                    errorMessage: err.message,
+                });
+            }
+            else {
+                send({ type: 'done', result });
+            }
+            resolve();
+        });
+    });
+}
+
+const lines = readline.createInterface({ input: process.stdin });
+
+lines.on('line', (line) => {
+    const message = JSON.parse(line);
+    if (message.now != null) {
+        virtualNow = message.now;
+    }
+
+    if (message.type === 'init') {
+        proxyMethods('aws', aws, message.aws);
+        proxyMethods('github', github, message.github);
+        send({ type: 'done', result: null });
+    }
+    else if (message.type === 'createState') {
+        try {
+            send({ type: 'done', result: createState(message.params) });
+        }
+        catch (err) {
+            send({ type: 'failed', errorType: err.name, errorMessage: err.message });
+        }
+    }
+    else if (message.type === 'invoke') {
+        invoke(handlers[message.handler || 'step'], message.event, message.context);
+    }
+    else if (message.type === 'result' || message.type === 'error') {
+        const { resolve, reject } = pendingCalls.get(message.id);
+        pendingCalls.delete(message.id);
+
+        if (message.type === 'result') {
+            resolve(message.result);
+        }
+        else {
+            const err = new Error(message.error.message);
+            err.name = message.error.name;
+            err.code = message.error.code;
+            reject(err);
+        }
+    }
+});
+
+lines.on('close', () => {
+    process.exit(0);
+});
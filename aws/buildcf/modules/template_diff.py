@@ -0,0 +1,161 @@
+from cfn_tools import load_yaml
+
+# Semantic comparison of CloudFormation templates, used by run.py to only rewrite
+# templates that have changed.
+#
+# Both templates are loaded from YAML, so short form intrinsic functions (e.g. !Sub)
+# compare equal to their long form, and key order and formatting are ignored.
+
+# Sections whose entries are compared by logical ID. Other sections
+# (e.g. Description) are compared as a whole.
+KEYED_SECTIONS = [
+    "Parameters",
+    "Mappings",
+    "Conditions",
+    "Resources",
+    "Outputs",
+]
+
+# Limit on the changed paths listed for a changed entry.
+MAX_CHANGED_PATHS = 10
+
+
+def load_template(text):
+    return load_yaml(text)
+
+
+def to_plain(value):
+    if isinstance(value, dict):
+        return dict((k, to_plain(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [to_plain(v) for v in value]
+    return value
+
+
+# List the paths (e.g. "Properties.Environment.Variables.FOO") at which two values differ.
+def changed_paths(old, new, path = ""):
+    if old == new:
+        return []
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        ret = []
+        for key in list(old) + [k for k in new if k not in old]:
+            ret.extend(changed_paths(
+                old.get(key),
+                new.get(key),
+                "%s.%s" % (path, key) if path else str(key),
+            ))
+        return ret
+
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        ret = []
+        for i, (old_item, new_item) in enumerate(zip(old, new)):
+            ret.extend(changed_paths(old_item, new_item, "%s[%d]" % (path, i)))
+        return ret
+
+    return [path]
+
+
+def entry_type(section, entry):
+    if isinstance(entry, dict) and section in ("Resources", "Parameters"):
+        return entry.get("Type")
+    return None
+
+
+# Compare two loaded templates, returning a list of the changes by section and logical ID.
+#
+# Each change is a dict with "section", "change" ("added", "removed" or "changed"),
+# and for entries of keyed sections, "id", "type" and "paths" (the paths that changed).
+def diff_templates(old, new):
+    old = to_plain(old or {})
+    new = to_plain(new or {})
+
+    changes = []
+    for section in list(old) + [k for k in new if k not in old]:
+        old_section = old.get(section)
+        new_section = new.get(section)
+
+        if old_section == new_section:
+            continue
+
+        if section not in KEYED_SECTIONS \
+                or not isinstance(old_section or {}, dict) \
+                or not isinstance(new_section or {}, dict):
+            changes.append({
+                "section": section,
+                "change": "added" if old_section is None else "removed" if new_section is None else "changed",
+            })
+            continue
+
+        old_section = old_section or {}
+        new_section = new_section or {}
+
+        for logical_id in list(old_section) + [k for k in new_section if k not in old_section]:
+            old_entry = old_section.get(logical_id)
+            new_entry = new_section.get(logical_id)
+
+            if logical_id not in new_section:
+                changes.append({
+                    "section": section,
+                    "change": "removed",
+                    "id": logical_id,
+                    "type": entry_type(section, old_entry),
+                    "paths": [],
+                })
+            elif logical_id not in old_section:
+                changes.append({
+                    "section": section,
+                    "change": "added",
+                    "id": logical_id,
+                    "type": entry_type(section, new_entry),
+                    "paths": [],
+                })
+            elif old_entry != new_entry:
+                changes.append({
+                    "section": section,
+                    "change": "changed",
+                    "id": logical_id,
+                    "type": entry_type(section, new_entry),
+                    "paths": changed_paths(old_entry, new_entry),
+                })
+
+    return changes
+
+
+CHANGE_SYMBOLS = {
+    "added": "+",
+    "removed": "-",
+    "changed": "~",
+}
+
+
+# Format changes from diff_templates() as lines, grouped by section.
+def format_diff(changes, indent = "  "):
+    lines = []
+    section = None
+
+    for change in changes:
+        symbol = CHANGE_SYMBOLS[change["change"]]
+
+        if "id" not in change:
+            section = None
+            lines.append("%s%s %s" % (indent, symbol, change["section"]))
+            continue
+
+        if change["section"] != section:
+            section = change["section"]
+            lines.append("%s%s:" % (indent, section))
+
+        line = "%s%s%s %s" % (indent, indent, symbol, change["id"])
+        if change["type"]:
+            line += " (%s)" % change["type"]
+
+        paths = change["paths"]
+        if paths:
+            line += ": %s" % ", ".join(paths[:MAX_CHANGED_PATHS])
+            if len(paths) > MAX_CHANGED_PATHS:
+                line += ", and %d more" % (len(paths) - MAX_CHANGED_PATHS)
+
+        lines.append(line)
+
+    return lines
@@ -0,0 +1,570 @@
+import io
+import re
+
+from yaml.nodes import ScalarNode
+from yaml.resolver import Resolver
+
+# Writes a troposphere Template as YAML in one pass over its to_dict() output.
+#
+# The output is byte-identical to cfn_flip.to_yaml(template.to_json(sort_keys = False), True),
+# which is how the templates were written before, without serializing the template
+# to JSON and parsing it again. That means short-form intrinsic functions (e.g. !Ref,
+# !Sub and !If), Fn::Join converted to Fn::Sub by cfn_clean, and the same scalar styles
+# and line wrapping as PyYAML's emitter (with cfn_flip's dumper settings), whose rules
+# are followed here for the block styles that CloudFormation templates use.
+
+BEST_WIDTH = 80
+BEST_INDENT = 2
+
+TAG_PREFIX = "tag:yaml.org,2002:"
+TAG_STR = "tag:yaml.org,2002:str"
+TAG_INT = "tag:yaml.org,2002:int"
+TAG_FLOAT = "tag:yaml.org,2002:float"
+TAG_BOOL = "tag:yaml.org,2002:bool"
+TAG_NULL = "tag:yaml.org,2002:null"
+
+# Single-key mappings that are written as short-form tags, except for LongFormDict.
+SHORT_FORM_KEYS = ["Ref", "Condition"]
+FN_PREFIX = "Fn::"
+
+BREAKS = "\n\x85\u2028\u2029"
+WHITESPACE = "\0 \t\r\n\x85\u2028\u2029"
+
+RE_BREAK = re.compile("[%s]" % BREAKS)
+RE_BREAK_SPACE = re.compile("[%s] " % BREAKS)
+RE_SPACE_BREAK = re.compile(" [%s]" % BREAKS)
+RE_BLOCK_INDICATOR = re.compile(":(?:[%s]|\\Z)|[%s]#" % (WHITESPACE, WHITESPACE))
+RE_SPECIAL_CHARACTER = re.compile("[^\n\x20-\x7E\x85\xA0-\uD7FF\uE000-\uFFFD\U00010000-\U0010FFFE]|\uFEFF")
+
+ESCAPE_REPLACEMENTS = {
+    "\0": "0",
+    "\x07": "a",
+    "\x08": "b",
+    "\x09": "t",
+    "\x0A": "n",
+    "\x0B": "v",
+    "\x0C": "f",
+    "\x0D": "r",
+    "\x1B": "e",
+    "\"": "\"",
+    "\\": "\\",
+    "\x85": "N",
+    "\xA0": "_",
+    "\u2028": "L",
+    "\u2029": "P",
+}
+
+resolver = Resolver()
+
+
+class ScalarAnalysis(object):
+
+    def __init__(self, scalar, empty, multiline, allow_block_plain, allow_single_quoted, allow_block):
+        self.scalar = scalar
+        self.empty = empty
+        self.multiline = multiline
+        self.allow_block_plain = allow_block_plain
+        self.allow_single_quoted = allow_single_quoted
+        self.allow_block = allow_block
+
+
+# The same as PyYAML's Emitter.analyze_scalar() outside of flow collections.
+def analyze_scalar(scalar):
+    if not scalar:
+        return ScalarAnalysis(scalar, True, False, True, True, False)
+
+    first = scalar[0]
+    last = scalar[-1]
+    followed_by_whitespace = len(scalar) == 1 or scalar[1] in WHITESPACE
+
+    block_indicators = (
+        scalar.startswith("---")
+        or scalar.startswith("...")
+        or first in "#,[]{}&*!|>'\"%@`"
+        or (first in "?:-" and followed_by_whitespace)
+        or RE_BLOCK_INDICATOR.search(scalar) is not None
+    )
+
+    line_breaks = RE_BREAK.search(scalar) is not None
+    special_characters = RE_SPECIAL_CHARACTER.search(scalar) is not None
+    break_space = line_breaks and RE_BREAK_SPACE.search(scalar) is not None
+    space_break = line_breaks and RE_SPACE_BREAK.search(scalar) is not None
+    edge_whitespace = first == " " or last == " " or first in BREAKS or last in BREAKS
+
+    return ScalarAnalysis(
+        scalar,
+        False,
+        line_breaks,
+        not (edge_whitespace or break_space or space_break or special_characters or line_breaks or block_indicators),
+        not (break_space or space_break or special_characters),
+        not (last == " " or space_break or special_characters),
+    )
+
+
+def represent_float(value):
+    if value != value:
+        return ".nan"
+    if value == float("inf"):
+        return ".inf"
+    if value == -float("inf"):
+        return "-.inf"
+
+    text = repr(value).lower()
+    if "." not in text and "e" in text:
+        text = text.replace("e", ".0e", 1)
+    return text
+
+
+# Get the tag, value and requested style of a scalar, like cfn_flip's dumper represents it.
+def represent_scalar(value):
+    if isinstance(value, str):
+        if "\n" in value:
+            return TAG_STR, value, "|"
+        if "\r" in value:
+            return TAG_STR, value, "\""
+        return TAG_STR, value, None
+
+    if value is None:
+        return TAG_NULL, "null", None
+
+    if isinstance(value, bool):
+        return TAG_BOOL, "true" if value else "false", None
+
+    if isinstance(value, int):
+        return TAG_INT, str(value), None
+
+    if isinstance(value, float):
+        return TAG_FLOAT, represent_float(value), None
+
+    raise TypeError("Cannot write %r to a CloudFormation template" % (value,))
+
+
+def short_form(mapping):
+    if len(mapping) != 1:
+        return None
+
+    key = next(iter(mapping))
+    if key in SHORT_FORM_KEYS:
+        return key
+    if key.startswith(FN_PREFIX):
+        return key[len(FN_PREFIX):]
+    return None
+
+
+# A mapping that is written in long form, which clean() uses for an Fn::Join it
+# can't convert, since cfn_flip writes that as a plain dict rather than an ODict.
+class LongFormDict(dict):
+    pass
+
+
+# Compare values like cfn_flip's ODicts do, where the order of keys matters.
+def same_value(a, b):
+    if isinstance(a, dict) and isinstance(b, dict):
+        return list(a) == list(b) and all(same_value(a[key], b[key]) for key in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same_value(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+# The same as cfn_clean.clean(), which replaces Fn::Join with Fn::Sub where it can.
+def clean(source):
+    if isinstance(source, dict):
+        for key, value in source.items():
+            if key == "Fn::Join":
+                return convert_join(value)
+            else:
+                source[key] = clean(value)
+
+    elif isinstance(source, list):
+        return [clean(item) for item in source]
+
+    return source
+
+
+def convert_join(value):
+    if not isinstance(value, list) or len(value) != 2:
+        return value
+
+    sep, parts = value[0], value[1]
+
+    if isinstance(parts, str):
+        return parts
+
+    if not isinstance(parts, list):
+        return LongFormDict({"Fn::Join": value})
+
+    plain_string = True
+    args = {}
+    new_parts = []
+
+    for part in parts:
+        part = clean(part)
+
+        if isinstance(part, dict):
+            plain_string = False
+
+            if "Ref" in part:
+                new_parts.append("${{{}}}".format(part["Ref"]))
+            elif "Fn::GetAtt" in part:
+                new_parts.append("${{{}}}".format(".".join(part["Fn::GetAtt"])))
+            else:
+                for key, val in args.items():
+                    # Keep the Fn::Join if a condition can evaluate to AWS::NoValue.
+                    if isinstance(val, dict) and "Fn::If" in val and "AWS::NoValue" in str(val["Fn::If"]):
+                        return LongFormDict({"Fn::Join": value})
+
+                    if same_value(val, part):
+                        param_name = key
+                        break
+                else:
+                    param_name = "Param{}".format(len(args) + 1)
+                    args[param_name] = part
+
+                new_parts.append("${{{}}}".format(param_name))
+
+        elif isinstance(part, str):
+            new_parts.append(part.replace("${", "${!"))
+
+        else:
+            return LongFormDict({"Fn::Join": value})
+
+    source = sep.join(new_parts)
+
+    if plain_string:
+        return source
+
+    if args:
+        return {"Fn::Sub": [source, args]}
+
+    return {"Fn::Sub": source}
+
+
+class TemplateYamlWriter(object):
+
+    def __init__(self, stream):
+        self.write = stream.write
+        self.indent = None
+        self.indents = []
+        self.column = 0
+        self.whitespace = True
+        self.indention = True
+        self.open_ended = False
+
+    def write_document(self, data):
+        self.write_node(data, root = True)
+
+        self.write_indent()
+        if self.open_ended:
+            self.write_indicator("...", True)
+            self.write_indent()
+
+    def increase_indent(self, flow = False):
+        self.indents.append(self.indent)
+        if self.indent is None:
+            self.indent = BEST_INDENT if flow else 0
+        else:
+            self.indent += BEST_INDENT
+
+    def write_node(self, value, root = False, simple_key = False):
+        tag = None
+
+        if isinstance(value, dict) and not isinstance(value, LongFormDict):
+            fn_name = short_form(value)
+            if fn_name is not None:
+                tag = "!" + fn_name
+                value = next(iter(value.values()))
+                if fn_name == "GetAtt" and isinstance(value, list):
+                    value = ".".join(value)
+
+        if isinstance(value, dict):
+            self.write_tag(tag)
+            if not value:
+                self.write_empty_collection("{", "}")
+            else:
+                self.write_block_mapping(value)
+
+        elif isinstance(value, (list, tuple)):
+            self.write_tag(tag)
+            if not value:
+                self.write_empty_collection("[", "]")
+            else:
+                self.write_block_sequence(value)
+
+        elif tag is not None:
+            if not isinstance(value, str):
+                raise TypeError("Cannot write %r as the value of %s" % (value, tag))
+            style = "|" if "\n" in value else "\"" if "\r" in value else None
+            self.write_scalar(tag, value, style, (False, False), root, simple_key)
+
+        else:
+            scalar_tag, text, style = represent_scalar(value)
+            implicit = (
+                scalar_tag == resolver.resolve(ScalarNode, text, (True, False)),
+                scalar_tag == TAG_STR,
+            )
+            self.write_scalar(scalar_tag, text, style, implicit, root, simple_key)
+
+    def write_tag(self, tag):
+        if tag is not None:
+            self.write_indicator(tag, True)
+
+    def write_empty_collection(self, start, end):
+        self.write_indicator(start, True, whitespace = True)
+        self.write_indicator(end, False)
+
+    def write_block_sequence(self, items):
+        self.increase_indent()
+        for item in items:
+            self.write_indent()
+            self.write_indicator("-", True, indention = True)
+            self.write_node(item)
+        self.indent = self.indents.pop()
+
+    def write_block_mapping(self, mapping):
+        self.increase_indent()
+        for key, value in mapping.items():
+            if not isinstance(key, str):
+                raise TypeError("Cannot write %r as a key" % (key,))
+
+            self.write_indent()
+            if self.check_simple_key(key):
+                self.write_node(key, simple_key = True)
+                self.write_indicator(":", False)
+            else:
+                self.write_indicator("?", True, indention = True)
+                self.write_node(key)
+                self.write_indent()
+                self.write_indicator(":", True, indention = True)
+            self.write_node(value)
+        self.indent = self.indents.pop()
+
+    # Keys are written after "?" if they are long or multi-line. The length
+    # includes the "!!str" tag, which PyYAML counts even though it isn't written.
+    def check_simple_key(self, key):
+        analysis = analyze_scalar(key)
+        return len("!!str") + len(key) < 128 and not analysis.empty and not analysis.multiline
+
+    def write_scalar(self, tag, text, requested_style, implicit, root, simple_key):
+        analysis = analyze_scalar(text)
+        style = self.choose_scalar_style(analysis, requested_style, implicit, simple_key)
+
+        if not ((style == "" and implicit[0]) or (style != "" and implicit[1])):
+            self.write_indicator(tag.replace(TAG_PREFIX, "!!", 1), True)
+
+        self.increase_indent(flow = True)
+        split = not simple_key
+        if style == "\"":
+            self.write_double_quoted(text, split)
+        elif style == "'":
+            self.write_single_quoted(text, split)
+        elif style == "|":
+            self.write_literal(text)
+        else:
+            self.write_plain(text, split, root)
+        self.indent = self.indents.pop()
+
+    def choose_scalar_style(self, analysis, style, implicit, simple_key):
+        if style == "\"":
+            return "\""
+        if not style and implicit[0]:
+            if not (simple_key and (analysis.empty or analysis.multiline)) and analysis.allow_block_plain:
+                return ""
+        if style == "|":
+            if not simple_key and analysis.allow_block:
+                return style
+        if not style:
+            if analysis.allow_single_quoted and not (simple_key and analysis.multiline):
+                return "'"
+        return "\""
+
+    def write_text(self, data):
+        self.column += len(data)
+        self.write(data)
+
+    def write_indicator(self, indicator, need_whitespace, whitespace = False, indention = False):
+        if self.whitespace or not need_whitespace:
+            data = indicator
+        else:
+            data = " " + indicator
+        self.whitespace = whitespace
+        self.indention = self.indention and indention
+        self.open_ended = False
+        self.write_text(data)
+
+    def write_indent(self):
+        indent = self.indent or 0
+        if not self.indention or self.column > indent or (self.column == indent and not self.whitespace):
+            self.write_line_break()
+        if self.column < indent:
+            self.whitespace = True
+            self.write_text(" " * (indent - self.column))
+
+    def write_line_break(self, data = "\n"):
+        self.whitespace = True
+        self.indention = True
+        self.column = 0
+        self.write(data)
+
+    def write_breaks(self, text):
+        for br in text:
+            self.write_line_break(br)
+
+    # The scalar writers below follow PyYAML's Emitter, with a fast path for
+    # scalars that fit on the current line.
+
+    def write_plain(self, text, split, root):
+        if root:
+            self.open_ended = True
+        if not text:
+            return
+        if not self.whitespace:
+            self.write_text(" ")
+        self.whitespace = False
+        self.indention = False
+
+        if self.column + len(text) <= BEST_WIDTH or not split or " " not in text:
+            self.write_text(text)
+            return
+
+        spaces = False
+        start = end = 0
+        while end <= len(text):
+            ch = text[end] if end < len(text) else None
+            if spaces:
+                if ch != " ":
+                    if start + 1 == end and self.column > BEST_WIDTH:
+                        self.write_indent()
+                        self.whitespace = False
+                        self.indention = False
+                    else:
+                        self.write_text(text[start:end])
+                    start = end
+            elif ch is None or ch == " ":
+                self.write_text(text[start:end])
+                start = end
+            if ch is not None:
+                spaces = ch == " "
+            end += 1
+
+    def write_single_quoted(self, text, split):
+        self.write_indicator("'", True)
+
+        quoted = text.replace("'", "''")
+        if (self.column + len(quoted) <= BEST_WIDTH or not split or " " not in text) and RE_BREAK.search(text) is None:
+            self.write_text(quoted)
+            self.write_indicator("'", False)
+            return
+
+        spaces = False
+        breaks = False
+        start = end = 0
+        while end <= len(text):
+            ch = text[end] if end < len(text) else None
+            if spaces:
+                if ch is None or ch != " ":
+                    if start + 1 == end and self.column > BEST_WIDTH and split and start != 0 and end != len(text):
+                        self.write_indent()
+                    else:
+                        self.write_text(text[start:end])
+                    start = end
+            elif breaks:
+                if ch is None or ch not in BREAKS:
+                    if text[start] == "\n":
+                        self.write_line_break()
+                    self.write_breaks(text[start:end])
+                    self.write_indent()
+                    start = end
+            else:
+                if ch is None or ch in " '" or ch in BREAKS:
+                    if start < end:
+                        self.write_text(text[start:end])
+                        start = end
+            if ch == "'":
+                self.write_text("''")
+                start = end + 1
+            if ch is not None:
+                spaces = ch == " "
+                breaks = ch in BREAKS
+            end += 1
+
+        self.write_indicator("'", False)
+
+    def write_double_quoted(self, text, split):
+        self.write_indicator("\"", True)
+        start = end = 0
+        while end <= len(text):
+            ch = text[end] if end < len(text) else None
+            if ch is None or ch in "\"\\\x85\u2028\u2029\uFEFF" \
+                    or not ("\x20" <= ch <= "\x7E" or "\xA0" <= ch <= "\uD7FF" or "\uE000" <= ch <= "\uFFFD"):
+                if start < end:
+                    self.write_text(text[start:end])
+                    start = end
+                if ch is not None:
+                    if ch in ESCAPE_REPLACEMENTS:
+                        data = "\\" + ESCAPE_REPLACEMENTS[ch]
+                    elif ch <= "\xFF":
+                        data = "\\x%02X" % ord(ch)
+                    elif ch <= "\uFFFF":
+                        data = "\\u%04X" % ord(ch)
+                    else:
+                        data = "\\U%08X" % ord(ch)
+                    self.write_text(data)
+                    start = end + 1
+            if 0 < end < len(text) - 1 and (ch == " " or start >= end) \
+                    and self.column + (end - start) > BEST_WIDTH and split:
+                data = text[start:end] + "\\"
+                if start < end:
+                    start = end
+                self.write_text(data)
+                self.write_indent()
+                self.whitespace = False
+                self.indention = False
+                if text[start] == " ":
+                    self.write_text("\\")
+            end += 1
+        self.write_indicator("\"", False)
+
+    def write_literal(self, text):
+        hints = ""
+        if text[0] in " " + BREAKS:
+            hints += str(BEST_INDENT)
+        if text[-1] not in BREAKS:
+            hints += "-"
+        elif len(text) == 1 or text[-2] in BREAKS:
+            hints += "+"
+
+        self.write_indicator("|" + hints, True)
+        if hints[-1:] == "+":
+            self.open_ended = True
+        self.write_line_break()
+
+        breaks = True
+        start = end = 0
+        while end <= len(text):
+            ch = text[end] if end < len(text) else None
+            if breaks:
+                if ch is None or ch not in BREAKS:
+                    self.write_breaks(text[start:end])
+                    if ch is not None:
+                        self.write_indent()
+                    start = end
+            else:
+                if ch is None or ch in BREAKS:
+                    self.write(text[start:end])
+                    if ch is None:
+                        self.write_line_break()
+                    start = end
+            if ch is not None:
+                breaks = ch in BREAKS
+            end += 1
+
+
+# Write a template as YAML to a stream (e.g. an open file).
+def write_template_yaml(template, stream):
+    TemplateYamlWriter(stream).write_document(clean(template.to_dict()))
+
+
+def template_to_yaml(template):
+    stream = io.StringIO()
+    write_template_yaml(template, stream)
+    return stream.getvalue()
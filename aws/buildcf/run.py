@@ -1,5 +1,5 @@
-import cfn_flip
 import argparse
+import json
 import os
 import sys
 sys.path.insert(0, "./")
@@ -7,6 +7,8 @@ sys.path.insert(0, "./")
 from modules.cf_tables import create_template as create_cf_tables
 from modules.cf_orchestrator import create_template as create_cf_orchestrator
 from modules.cf_individual import create_template as create_cf_individual
+from modules.template_yaml import write_template_yaml, template_to_yaml
+from modules.template_diff import load_template, diff_templates, format_diff
 
 parser = argparse.ArgumentParser(
     description='Create the CloudFormation templates for CBuildCI',
@@ -18,8 +20,36 @@ parser.add_argument(
     help='The path to output the CloudFormation templates',
 )
 
+parser.add_argument(
+    '--cfn-flip',
+    action='store_true',
+    help='Convert the templates to YAML with cfn_flip, rather than writing the YAML directly',
+)
+
+parser.add_argument(
+    '--incremental',
+    action='store_true',
+    help='Only rewrite templates that differ semantically from the existing files, and print what changed',
+)
+
+parser.add_argument(
+    '--check',
+    action='store_true',
+    help='Compare the templates with the existing files without writing them, and exit with an error if any differ',
+)
+
+parser.add_argument(
+    '--report',
+    type=str,
+    help='Write a JSON report of which templates changed (with --incremental or --check)',
+)
+
 args = parser.parse_args()
 
+if args.report and not (args.incremental or args.check):
+    sys.stderr.write("--report requires --incremental or --check")
+    exit(1)
+
 output_dir = os.path.normpath(os.path.join(
     os.getcwd(),
     args.outputdir,
@@ -44,38 +74,83 @@ individual_out = os.path.normpath(os.path.join(
     "individual-codebuild.yaml",
 ))
 
-print("Building Tables CloudFormation template...")
-t_tables = create_cf_tables()
-
-t_tables_yaml = cfn_flip.to_yaml(
-    t_tables.to_json(sort_keys = False),
-    True,
-)
-
-print("Building Orchestrator CloudFormation template...")
-t_orchestrator = create_cf_orchestrator()
-
-t_orchestrator_yaml = cfn_flip.to_yaml(
-    t_orchestrator.to_json(sort_keys = False),
-    True,
-)
 
-print("Building Individual CloudFormation template...")
-t_individual = create_cf_individual()
-
-t_individual_yaml = cfn_flip.to_yaml(
-    t_individual.to_json(sort_keys = False),
-    True,
-)
-
-with open(tables_out, "w") as stream:
-    stream.write(t_tables_yaml)
-    stream.close()
-
-with open(orchestrator_out, "w") as stream:
-    stream.write(t_orchestrator_yaml)
-    stream.close()
-
-with open(individual_out, "w") as stream:
-    stream.write(t_individual_yaml)
-    stream.close()
+def to_yaml(template):
+    if args.cfn_flip:
+        # Only needed for --cfn-flip, so the default path does not depend on it.
+        import cfn_flip
+        return cfn_flip.to_yaml(
+            template.to_json(sort_keys = False),
+            True,
+        )
+    return template_to_yaml(template)
+
+
+def write_template(template, out_path):
+    with open(out_path, "w") as stream:
+        if args.cfn_flip:
+            stream.write(to_yaml(template))
+        else:
+            write_template_yaml(template, stream)
+        stream.close()
+
+
+# Compare a template with the existing file, and write it only if it has changed.
+# Formatting-only differences do not count as changes, so those files are left as is.
+def update_template(template, out_path):
+    name = os.path.basename(out_path)
+    template_yaml = to_yaml(template)
+
+    if os.path.isfile(out_path):
+        with open(out_path, "r") as stream:
+            existing = load_template(stream.read())
+            stream.close()
+        changes = diff_templates(existing, load_template(template_yaml))
+        status = "changed" if changes else "unchanged"
+    else:
+        changes = []
+        status = "added"
+
+    print("%s: %s" % (name, status))
+    for line in format_diff(changes):
+        print(line)
+
+    if status != "unchanged" and not args.check:
+        with open(out_path, "w") as stream:
+            stream.write(template_yaml)
+            stream.close()
+
+    return {
+        "name": name,
+        "path": out_path,
+        "status": status,
+        "changes": changes,
+    }
+
+
+templates = [
+    ("Tables", create_cf_tables, tables_out),
+    ("Orchestrator", create_cf_orchestrator, orchestrator_out),
+    ("Individual", create_cf_individual, individual_out),
+]
+
+if not (args.incremental or args.check):
+    for label, create_template, out_path in templates:
+        print("Building %s CloudFormation template..." % label)
+        write_template(create_template(), out_path)
+    exit(0)
+
+results = []
+for label, create_template, out_path in templates:
+    results.append(update_template(create_template(), out_path))
+
+if args.report:
+    with open(args.report, "w") as stream:
+        json.dump({"templates": results}, stream, indent = 2)
+        stream.write("\n")
+        stream.close()
+
+if args.check and any(result["status"] != "unchanged" for result in results):
+    print("")
+    print("Templates differ from %s, run without --check to update them" % output_dir)
+    exit(1)
@@ -0,0 +1,264 @@
+'use strict';
+
+// Builds a separate zip file for each lambda function, containing only the files
+// its handler requires, rather than one zip of the whole project.
+//
+// Files are found by following the require() calls of each handler (including
+// lazy ones inside functions) through the project and node_modules. Only calls with
+// a string literal can be followed, so dependencies that make other require() calls
+// are reported, to check that nothing is missing. The aws-sdk is left out, since
+// the Lambda runtime provides it.
+//
+// Upload each zip to S3 and set its key as the orchestrator stack's
+// WebhookLambdaZipS3Key, QueueLambdaZipS3Key, ApiLambdaZipS3Key,
+// StepLambdaZipS3Key and LogArchiveLambdaZipS3Key parameters.
+//
+// Usage:
+//   npm run bundle -- [options]
+//
+// Options:
+//   --out dist     Directory to write the zip files to.
+//   --measure      Also measure the time to load each handler, as in a cold start.
+//   --runs 5       Runs of each handler when measuring, of which the median is reported.
+
+const fs = require('fs');
+const path = require('path');
+const childProcess = require('child_process');
+const archiver = require('archiver');
+
+const ROOT_DIR = path.resolve(__dirname, '..');
+
+const HANDLERS = [
+    { name: 'webhook-lambda', entry: 'src/lambda/webhook/index.js' },
+    { name: 'queue-lambda', entry: 'src/lambda/webhook/queue.js' },
+    { name: 'api-lambda', entry: 'src/lambda/api/index.js' },
+    { name: 'step-lambda', entry: 'src/lambda/execution/index.js' },
+    { name: 'log-archive-lambda', entry: 'src/lambda/execution/archiveLogs.js' },
+];
+
+// Modules provided by the Lambda runtime.
+const EXTERNAL_MODULES = ['aws-sdk'];
+
+// Environment needed to load the handlers when measuring them.
+const MEASURE_ENV = {
+    GH_URL: 'https://github.com',
+};
+
+const REQUIRE_LITERAL_REGEX = /\brequire\(\s*(?:'([^']+)'|"([^"]+)")\s*\)/g;
+const REQUIRE_ANY_REGEX = /\brequire\(/g;
+
+const DEFAULT_OPTIONS = {
+    out: 'dist',
+    measure: false,
+    runs: '5',
+};
+
+function parseArgs(argv) {
+    const options = { ...DEFAULT_OPTIONS };
+
+    for (let i = 0; i < argv.length; i++) {
+        if (argv[i] === '--measure') {
+            options.measure = true;
+        }
+        else if ((argv[i] === '--out' || argv[i] === '--runs') && i + 1 < argv.length) {
+            options[argv[i].substr(2)] = argv[++i];
+        }
+        else {
+            throw new Error(`Invalid argument: ${argv[i]}`);
+        }
+    }
+
+    return {
+        out: path.resolve(options.out),
+        measure: options.measure,
+        runs: Number(options.runs),
+    };
+}
+
+function isExternal(request) {
+    return EXTERNAL_MODULES.some((name) => request === name || request.startsWith(`${name}/`));
+}
+
+// Find the package.json of the package that a file in node_modules belongs to.
+function findPackageJson(fileName) {
+    let dir = path.dirname(fileName);
+
+    while (dir !== path.dirname(dir)) {
+        const parentName = path.basename(path.dirname(dir));
+
+        // Stop at node_modules/<name> or node_modules/@<scope>/<name>.
+        if (parentName === 'node_modules'
+            || parentName.startsWith('@') && path.basename(path.dirname(path.dirname(dir))) === 'node_modules') {
+            break;
+        }
+
+        dir = path.dirname(dir);
+    }
+
+    const packageJson = path.join(dir, 'package.json');
+    return fs.existsSync(packageJson) ? packageJson : null;
+}
+
+/**
+ * Find the files needed to run a handler, by following its require() calls.
+ *
+ * @param {string} entry Path of the handler, relative to the project.
+ * @returns {{ files: string[], unresolved: string[], dynamicRequires: string[] }}
+ */
+function traceHandler(entry) {
+    const files = new Set();
+    const unresolved = new Set();
+    const dynamicRequires = new Set();
+    const pending = [path.join(ROOT_DIR, entry)];
+
+    while (pending.length) {
+        const fileName = pending.pop();
+
+        if (files.has(fileName)) {
+            continue;
+        }
+
+        files.add(fileName);
+
+        const isDependency = fileName.includes(`${path.sep}node_modules${path.sep}`);
+
+        if (isDependency) {
+            const packageJson = findPackageJson(fileName);
+            if (packageJson) {
+                files.add(packageJson);
+            }
+        }
+
+        if (path.extname(fileName) !== '.js') {
+            continue;
+        }
+
+        const source = fs.readFileSync(fileName, 'utf8');
+        let literalCount = 0;
+        let match;
+
+        REQUIRE_LITERAL_REGEX.lastIndex = 0;
+        while (match = REQUIRE_LITERAL_REGEX.exec(source)) {
+            const request = match[1] || match[2];
+            literalCount++;
+
+            if (isExternal(request)) {
+                continue;
+            }
+
+            let resolved;
+            try {
+                resolved = require.resolve(request, { paths: [path.dirname(fileName)] });
+            }
+            catch (err) {
+                // Usually an optional dependency, loaded in a try/catch.
+                unresolved.add(`${request} (from ${path.relative(ROOT_DIR, fileName)})`);
+                continue;
+            }
+
+            // Built-in modules resolve to their own name.
+            if (path.isAbsolute(resolved)) {
+                pending.push(resolved);
+            }
+        }
+
+        // The project's own require() calls without a literal only load the aws-sdk.
+        if (isDependency && (source.match(REQUIRE_ANY_REGEX) || []).length > literalCount) {
+            dynamicRequires.add(path.relative(ROOT_DIR, fileName));
+        }
+    }
+
+    return {
+        files: [...files].sort(),
+        unresolved: [...unresolved].sort(),
+        dynamicRequires: [...dynamicRequires].sort(),
+    };
+}
+
+function writeZip(files, zipFileName) {
+    return new Promise((resolve, reject) => {
+        const output = fs.createWriteStream(zipFileName);
+        const archive = archiver('zip', {
+            zlib: { level: 9 },
+        });
+
+        output.on('close', () => resolve(archive.pointer()));
+        archive.on('warning', reject);
+        archive.on('error', reject);
+        archive.pipe(output);
+
+        for (const fileName of files) {
+            archive.file(fileName, {
+                name: path.relative(ROOT_DIR, fileName).split(path.sep).join('/'),
+            });
+        }
+
+        archive.finalize();
+    });
+}
+
+/**
+ * Measure the time to load a handler in a new process, which is the init
+ * phase of a cold start (apart from the runtime itself).
+ *
+ * @param {string} entry
+ * @param {number} runs
+ * @returns {number} Median milliseconds.
+ */
+function measureHandler(entry, runs) {
+    const script = [
+        'const start = process.hrtime();',
+        `require(${JSON.stringify(path.join(ROOT_DIR, entry))});`,
+        'const elapsed = process.hrtime(start);',
+        'console.log(elapsed[0] * 1e3 + elapsed[1] / 1e6);',
+    ].join('\n');
+
+    const timings = [];
+    for (let i = 0; i < runs; i++) {
+        const stdout = childProcess.execFileSync(process.execPath, ['-e', script], {
+            cwd: ROOT_DIR,
+            env: { ...process.env, ...MEASURE_ENV },
+            encoding: 'utf8',
+        });
+
+        timings.push(Number(stdout.trim().split('\n').pop()));
+    }
+
+    timings.sort((a, b) => a - b);
+    return timings[Math.floor(timings.length / 2)];
+}
+
+async function main() {
+    const options = parseArgs(process.argv.slice(2));
+
+    if (!fs.existsSync(options.out)) {
+        fs.mkdirSync(options.out);
+    }
+
+    for (const handler of HANDLERS) {
+        const { files, unresolved, dynamicRequires } = traceHandler(handler.entry);
+        const zipFileName = path.join(options.out, `${handler.name}.zip`);
+        const zipBytes = await writeZip(files, zipFileName);
+
+        let line = `${handler.name}: ${files.length} files, ${(zipBytes / 1024).toFixed(1)} KB`;
+        if (options.measure) {
+            line += `, loads in ${measureHandler(handler.entry, options.runs).toFixed(1)} ms`;
+        }
+
+        console.log(`${line} -> ${path.relative(process.cwd(), zipFileName)}`);
+
+        for (const request of unresolved) {
+            console.log(`  Not found: ${request}`);
+        }
+
+        for (const fileName of dynamicRequires) {
+            console.log(`  Has require() calls that were not followed: ${fileName}`);
+        }
+    }
+}
+
+main()
+    .catch((err) => {
+        console.error(err.stack);
+        process.exitCode = 1;
+    });
@@ -8,6 +8,8 @@ describe('cache', () => {
         expect(Object.keys(cacheUtil).sort()).toEqual([
             'INSTALLATION_TOKEN_CACHE',
             'INSTALLATION_TOKEN_CACHE_LAST_PRUNE',
+            'ACCESS_KEY_CACHE',
+            'ACCESS_KEY_CACHE_LAST_PRUNE',
             'getCachedValue',
             'pruneCache',
         ].sort());
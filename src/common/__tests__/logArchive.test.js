@@ -0,0 +1,139 @@
+'use strict';
+
+const zlib = require('zlib');
+const logArchive = require('../../../src/common/logArchive');
+
+function createEvents(count) {
+    const events = [];
+    for (let i = 0; i < count; i++) {
+        events.push({
+            timestamp: 1546300800000 + i,
+            message: `line ${i}\n`,
+            ingestionTime: 1546300801000 + i,
+        });
+    }
+    return events;
+}
+
+describe('logArchive', () => {
+
+    it('should have expected exports', () => {
+        expect(Object.keys(logArchive).sort()).toEqual([
+            'LOG_ARCHIVE_VERSION',
+            'LOG_ARCHIVE_CHUNK_EVENTS',
+            'LOG_ARCHIVE_SETTLE_SECONDS',
+            'buildLogArchive',
+            'getLogArchiveRange',
+            'readLogArchiveRange',
+            'getLogArchivePage',
+        ].sort());
+    });
+
+    describe('buildLogArchive', () => {
+        it('should compress events in chunks that together are a gzip file', () => {
+            const events = createEvents(25);
+            const { data, index } = logArchive.buildLogArchive(events, { chunkEvents: 10 });
+
+            expect(index).toEqual({
+                version: logArchive.LOG_ARCHIVE_VERSION,
+                eventCount: 25,
+                byteLength: data.length,
+                chunks: [
+                    { start: 0, count: 10, offset: 0, length: index.chunks[0].length },
+                    { start: 10, count: 10, offset: index.chunks[0].length, length: index.chunks[1].length },
+                    { start: 20, count: 5, offset: index.chunks[0].length + index.chunks[1].length, length: index.chunks[2].length },
+                ],
+            });
+
+            expect(zlib.gunzipSync(data).toString('utf8')).toBe(
+                events.map((event) => `${JSON.stringify(event)}\n`).join(''),
+            );
+        });
+
+        it('should build an empty archive for no events', () => {
+            const { data, index } = logArchive.buildLogArchive([]);
+
+            expect(data.length).toBe(0);
+            expect(index.eventCount).toBe(0);
+            expect(index.chunks).toEqual([]);
+        });
+    });
+
+    describe('getLogArchiveRange and readLogArchiveRange', () => {
+        it('should read a range of events from only the chunks that contain it', () => {
+            const events = createEvents(25);
+            const { data, index } = logArchive.buildLogArchive(events, { chunkEvents: 10 });
+
+            const range = logArchive.getLogArchiveRange(index, 8, 5);
+            expect(range.chunks).toEqual(index.chunks.slice(0, 2));
+            expect(range.byteStart).toBe(0);
+            expect(range.byteEnd).toBe(index.chunks[1].offset + index.chunks[1].length - 1);
+
+            expect(logArchive.readLogArchiveRange(
+                range,
+                data.slice(range.byteStart, range.byteEnd + 1),
+                8,
+                5,
+            )).toEqual(events.slice(8, 13));
+        });
+
+        it('should read the last events', () => {
+            const events = createEvents(25);
+            const { data, index } = logArchive.buildLogArchive(events, { chunkEvents: 10 });
+
+            const range = logArchive.getLogArchiveRange(index, 22, 100);
+            expect(range.chunks).toEqual(index.chunks.slice(2));
+
+            expect(logArchive.readLogArchiveRange(
+                range,
+                data.slice(range.byteStart, range.byteEnd + 1),
+                22,
+                100,
+            )).toEqual(events.slice(22));
+        });
+
+        it('should return null for ranges without events', () => {
+            const { index } = logArchive.buildLogArchive(createEvents(25), { chunkEvents: 10 });
+
+            expect(logArchive.getLogArchiveRange(index, 25, 10)).toBe(null);
+            expect(logArchive.getLogArchiveRange(index, 0, 0)).toBe(null);
+        });
+    });
+
+    describe('getLogArchivePage', () => {
+        it('should get the last events without a token', () => {
+            expect(logArchive.getLogArchivePage(25, undefined, 10)).toEqual({
+                start: 15,
+                end: 25,
+                nextForwardToken: 'archive/f/25',
+                nextBackwardToken: 'archive/b/15',
+            });
+        });
+
+        it('should page forward and backward', () => {
+            expect(logArchive.getLogArchivePage(25, 'archive/f/20', 10)).toEqual({
+                start: 20,
+                end: 25,
+                nextForwardToken: 'archive/f/25',
+                nextBackwardToken: 'archive/b/20',
+            });
+
+            expect(logArchive.getLogArchivePage(25, 'archive/b/15', 10)).toEqual({
+                start: 5,
+                end: 15,
+                nextForwardToken: 'archive/f/15',
+                nextBackwardToken: 'archive/b/5',
+            });
+        });
+
+        it('should return the same token at either end', () => {
+            expect(logArchive.getLogArchivePage(25, 'archive/f/25', 10).nextForwardToken).toBe('archive/f/25');
+            expect(logArchive.getLogArchivePage(25, 'archive/b/0', 10).nextBackwardToken).toBe('archive/b/0');
+        });
+
+        it('should return null for other tokens', () => {
+            expect(logArchive.getLogArchivePage(25, 'f/36337425375520390863812470812768468049', 10)).toBe(null);
+            expect(logArchive.getLogArchivePage(25, 'archive/x/1', 10)).toBe(null);
+        });
+    });
+});
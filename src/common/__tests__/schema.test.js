@@ -10,6 +10,7 @@ describe('schema', () => {
             'validateBuildsYml',
             'validateBuildParams',
             'checkBuildDependencies',
+            'compileBuildGraph',
         ].sort());
     });
 
@@ -207,6 +208,8 @@ describe('schema', () => {
                 version: 1,
                 checksName: 'CBuildCI',
                 defaults: {},
+                supersede: false,
+                debounceSeconds: 0,
                 builds: {
                     foobar: {},
                 },
@@ -264,6 +267,66 @@ describe('schema', () => {
                 },
             })).not.toThrowError();
         });
+
+        it('should throw error if "supersede" is invalid', () => {
+            expect(() => schema.validateBuildsYml({
+                version: 1,
+                supersede: 'foobar',
+                builds: {
+                    foobar: {},
+                },
+            })).toThrowError('supersede must be a boolean');
+
+            expect(() => schema.validateBuildsYml({
+                version: 1,
+                supersede: true,
+                builds: {
+                    foobar: {},
+                },
+            })).not.toThrowError();
+        });
+
+        it('should throw error if "debounceSeconds" is invalid', () => {
+            expect(() => schema.validateBuildsYml({
+                version: 1,
+                debounceSeconds: 'foobar',
+                builds: {
+                    foobar: {},
+                },
+            })).toThrowError('debounceSeconds must be a number');
+
+            expect(() => schema.validateBuildsYml({
+                version: 1,
+                debounceSeconds: -1,
+                builds: {
+                    foobar: {},
+                },
+            })).toThrowError('debounceSeconds must not be less than 0');
+
+            expect(() => schema.validateBuildsYml({
+                version: 1,
+                debounceSeconds: 301,
+                builds: {
+                    foobar: {},
+                },
+            })).toThrowError('debounceSeconds must not be greater than 300');
+
+            expect(() => schema.validateBuildsYml({
+                version: 1,
+                debounceSeconds: 1.5,
+                builds: {
+                    foobar: {},
+                },
+            })).toThrowError('debounceSeconds must be an integer');
+
+            expect(() => schema.validateBuildsYml({
+                version: 1,
+                debounceSeconds: 30,
+                builds: {
+                    foobar: {},
+                },
+            })).not.toThrowError();
+        });
     });
 
     describe('validateBuildParams', () => {
@@ -347,6 +410,7 @@ describe('schema', () => {
                 privilegedMode: false,
                 timeoutInMinutes: 5,
                 stopIfNotBranchHead: false,
+                reuseResult: false,
                 dependsOn: [],
                 environmentVariables: [],
                 // branches: undefined,
@@ -578,6 +642,29 @@ describe('schema', () => {
             })).not.toThrowError();
         });
 
+        it('should throw error if "reuseResult" is invalid', () => {
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                reuseResult: null,
+            })).toThrowError('reuseResult must be a boolean');
+
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                reuseResult: 'foobar',
+            })).toThrowError('reuseResult must be a boolean');
+
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                reuseResult: true,
+            })).not.toThrowError();
+        });
+
         it('should throw error if "dependsOn" is invalid', () => {
             expect(() => schema.validateBuildParams({
                 codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
@@ -787,6 +874,87 @@ describe('schema', () => {
             })).not.toThrowError();
         });
 
+        it('should throw error if "paths" is invalid', () => {
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                paths: null,
+            })).toThrowError('paths must be an array');
+
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                paths: 'src/*',
+            })).toThrowError('paths must be an array');
+
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                paths: [],
+            })).toThrowError('paths must not have a length less than 1');
+
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                paths: [''],
+            })).toThrowError('paths.0 must have a value');
+
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                paths: ['/+/'],
+            })).toThrowError('paths.0 is an invalid pattern');
+
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                paths: ['src/*', '/^lib\\//'],
+            })).not.toThrowError();
+        });
+
+        it('should throw error if "pathsIgnore" is invalid', () => {
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                pathsIgnore: null,
+            })).toThrowError('pathsIgnore must be an array');
+
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                pathsIgnore: 'docs/*',
+            })).toThrowError('pathsIgnore must be an array');
+
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                pathsIgnore: ['/+/'],
+            })).toThrowError('pathsIgnore.0 is an invalid pattern');
+
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                pathsIgnore: [],
+            })).not.toThrowError();
+
+            expect(() => schema.validateBuildParams({
+                codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
+                image: 'foobar',
+                sourceS3Bucket: 'foosource',
+                pathsIgnore: ['docs/*'],
+            })).not.toThrowError();
+        });
+
         it('should throw error if "branches" is invalid', () => {
             expect(() => schema.validateBuildParams({
                 codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/foobar',
@@ -1279,4 +1447,83 @@ describe('schema', () => {
             )).toThrowError('Builds "first" and "third" have a circular dependency');
         });
     });
+
+    describe('compileBuildGraph', () => {
+        const builds = {
+            lint: {
+                dependsOn: [],
+            },
+            compile: {
+                dependsOn: [],
+            },
+            test: {
+                dependsOn: ['compile'],
+            },
+            deploy: {
+                dependsOn: ['lint', 'test'],
+            },
+        };
+
+        it('should throw error if there are cyclic dependencies', () => {
+            expect(() => schema.compileBuildGraph({
+                first: {
+                    dependsOn: ['first'],
+                },
+            })).toThrowError('Build "first" cannot have a dependency to itself');
+        });
+
+        it('should build levels and dependents', () => {
+            const graph = schema.compileBuildGraph(builds);
+
+            expect(graph.levels).toEqual([
+                ['compile', 'lint'],
+                ['test'],
+                ['deploy'],
+            ]);
+
+            expect(graph.dependents).toEqual({
+                lint: ['deploy'],
+                compile: ['test'],
+                test: ['deploy'],
+                deploy: [],
+            });
+        });
+
+        it('should weight the critical path by duration', () => {
+            expect(schema.compileBuildGraph(builds).criticalPath).toEqual({
+                lint: 2,
+                compile: 3,
+                test: 2,
+                deploy: 1,
+            });
+
+            const graph = schema.compileBuildGraph(builds, {
+                lint: 600,
+                compile: 60,
+                test: 120,
+                deploy: 30,
+            });
+
+            expect(graph.criticalPath).toEqual({
+                lint: 630,
+                compile: 210,
+                test: 150,
+                deploy: 30,
+            });
+
+            expect(graph.levels[0]).toEqual(['lint', 'compile']);
+        });
+
+        it('should use the average duration for builds without one', () => {
+            expect(schema.compileBuildGraph(builds, {
+                compile: 100,
+                test: 300,
+            }).criticalPath).toEqual({
+                lint: 400,
+                compile: 600,
+                test: 500,
+                deploy: 200,
+            });
+        });
+    });
 });
@@ -13,14 +13,23 @@ describe('util', () => {
             'parseRepoId',
             'isValidRepoId',
             'buildExecutionId',
+            'buildLatestExecutionPointerId',
             'parseExecutionId',
             'parseLongExecutionId',
             'isValidExecutionId',
             'buildLockId',
+            'buildSupersedeId',
             'hasSpecialLabel',
             'escapeRegExp',
             'convertToRegex',
+            'isAffectedByChangedFiles',
+            'filterFilesByPaths',
+            'buildResultKey',
+            'buildETag',
+            'encodeCursor',
+            'decodeCursor',
             'cacheAsyncResult',
+            'delay',
             'toEpochTime',
             'toISODateString',
         ].sort());
@@ -121,6 +130,18 @@ describe('util', () => {
         });
     });
 
+    describe('buildLatestExecutionPointerId', () => {
+        it('should build IDs that are not valid execution IDs', () => {
+            expect(util.buildLatestExecutionPointerId()).toBe('latest');
+            expect(util.buildLatestExecutionPointerId('ABCF627A1D310E50725D3A7FA6A7BACC65A3CC89'))
+                .toBe('latest/abcf627a1d310e50725d3a7fa6a7bacc65a3cc89');
+
+            expect(util.isValidExecutionId(util.buildLatestExecutionPointerId())).toBe(false);
+            expect(util.isValidExecutionId(util.buildLatestExecutionPointerId('abcf627a1d310e50725d3a7fa6a7bacc65a3cc89')))
+                .toBe(false);
+        });
+    });
+
     describe('parseExecutionId', () => {
         it('should produce the expected values', () => {
             expect(util.parseExecutionId('ABCF627a1d310e50725d3a7fa6a7bacc65a3cc89/0005'))
@@ -199,6 +220,12 @@ describe('util', () => {
         });
     });
 
+    describe('buildSupersedeId', () => {
+        it('should produce the expected id', () => {
+            expect(util.buildSupersedeId('USER', 'rePO', 15)).toBe('supersede:user/repo/pr/15');
+        });
+    });
+
     describe('hasSpecialLabel', () => {
         it('should return true if contains label', () => {
             expect(util.hasSpecialLabel(['foobar'], 'foobar')).toBe(true);
@@ -262,6 +289,123 @@ describe('util', () => {
         });
     });
 
+    describe('isAffectedByChangedFiles', () => {
+        const changedFiles = [
+            'docs/index.md',
+            'src/app/index.js',
+        ];
+
+        it('should match any file if no patterns are set', () => {
+            expect(util.isAffectedByChangedFiles(changedFiles)).toBe(true);
+            expect(util.isAffectedByChangedFiles([])).toBe(false);
+        });
+
+        it('should match files by "paths"', () => {
+            expect(util.isAffectedByChangedFiles(changedFiles, ['src/*'])).toBe(true);
+            expect(util.isAffectedByChangedFiles(changedFiles, ['lib/*', 'docs/*'])).toBe(true);
+            expect(util.isAffectedByChangedFiles(changedFiles, ['lib/*'])).toBe(false);
+            expect(util.isAffectedByChangedFiles(changedFiles, ['/^src\\/.+\\.js$/'])).toBe(true);
+        });
+
+        it('should not match files by "pathsIgnore"', () => {
+            expect(util.isAffectedByChangedFiles(changedFiles, null, ['docs/*'])).toBe(true);
+            expect(util.isAffectedByChangedFiles(changedFiles, null, ['docs/*', '*.js'])).toBe(false);
+            expect(util.isAffectedByChangedFiles(changedFiles, ['src/*'], ['src/app/*'])).toBe(false);
+            expect(util.isAffectedByChangedFiles(changedFiles, ['src/*', 'docs/*'], ['src/app/*'])).toBe(true);
+        });
+    });
+
+    describe('filterFilesByPaths', () => {
+        const files = [
+            'docs/index.md',
+            'src/app/index.js',
+            'src/lib/index.js',
+        ];
+
+        it('should return files matched by "paths" and not "pathsIgnore"', () => {
+            expect(util.filterFilesByPaths(files)).toEqual(files);
+            expect(util.filterFilesByPaths(files, ['src/*'])).toEqual(['src/app/index.js', 'src/lib/index.js']);
+            expect(util.filterFilesByPaths(files, ['src/*'], ['src/app/*'])).toEqual(['src/lib/index.js']);
+            expect(util.filterFilesByPaths(files, null, ['*.js'])).toEqual(['docs/index.md']);
+        });
+    });
+
+    describe('buildETag', () => {
+        it('should return the same quoted ETag for the same parts', () => {
+            const etag = util.buildETag(['foo/bar', 'abc/1', 5, '2019-01-01T00:00:00.000Z']);
+
+            expect(etag).toMatch(/^"[0-9a-f]{40}"$/);
+            expect(util.buildETag(['foo/bar', 'abc/1', 5, '2019-01-01T00:00:00.000Z'])).toBe(etag);
+        });
+
+        it('should return a different ETag if a part changes', () => {
+            const etag = util.buildETag(['foo/bar', 'abc/1', 5, '2019-01-01T00:00:00.000Z', null]);
+
+            expect(util.buildETag(['foo/bar', 'abc/1', 6, '2019-01-01T00:00:00.000Z', null])).not.toBe(etag);
+            expect(util.buildETag(['foo/bar', 'abc/1', 5, '2019-01-01T00:00:01.000Z', null])).not.toBe(etag);
+            expect(util.buildETag(['foo/bar', 'abc/1', 5, '2019-01-01T00:00:00.000Z', 'key'])).not.toBe(etag);
+            expect(util.buildETag(['foo/bar', 'abc/15', '', '2019-01-01T00:00:00.000Z', null])).not.toBe(etag);
+        });
+    });
+
+    describe('buildResultKey', () => {
+        const buildParams = {
+            commitStatus: 'CI - Foo',
+            image: 'aws/codebuild/standard:2.0',
+            computeType: 'BUILD_GENERAL1_SMALL',
+            dependsOn: ['bar'],
+            environmentVariables: [{ name: 'FOO', value: 'bar' }],
+        };
+
+        it('should return the same key for the same inputs', () => {
+            const key = util.buildResultKey('foo/bar', 'abc', buildParams, { bar: '123', baz: '456' });
+
+            expect(key).toMatch(/^[0-9a-f]{64}$/);
+            expect(util.buildResultKey('Foo/Bar', 'abc', {
+                environmentVariables: [{ name: 'FOO', value: 'bar' }],
+                computeType: 'BUILD_GENERAL1_SMALL',
+                image: 'aws/codebuild/standard:2.0',
+            }, { baz: '456', bar: '123' })).toBe(key);
+        });
+
+        it('should return a different key if an input changes', () => {
+            const key = util.buildResultKey('foo/bar', 'abc', buildParams, { bar: '123' });
+
+            expect(util.buildResultKey('foo/baz', 'abc', buildParams, { bar: '123' })).not.toBe(key);
+            expect(util.buildResultKey('foo/bar', 'abd', buildParams, { bar: '123' })).not.toBe(key);
+            expect(util.buildResultKey('foo/bar', 'abc', buildParams, { bar: '124' })).not.toBe(key);
+            expect(util.buildResultKey('foo/bar', 'abc', {
+                ...buildParams,
+                image: 'aws/codebuild/standard:3.0',
+            }, { bar: '123' })).not.toBe(key);
+            expect(util.buildResultKey('foo/bar', 'abc', {
+                ...buildParams,
+                environmentVariables: [{ name: 'FOO', value: 'baz' }],
+            }, { bar: '123' })).not.toBe(key);
+        });
+    });
+
+    describe('encodeCursor and decodeCursor', () => {
+        it('should decode a cursor signed with any of the keys', () => {
+            const value = { repoId: 'foo/bar', createTime: '2019-01-01T00:00:00.000Z' };
+            const cursor = util.encodeCursor(value, 'key2');
+
+            expect(cursor).toMatch(/^[\w-]+\.[\w-]+$/);
+            expect(util.decodeCursor(cursor, ['key1', 'key2'])).toEqual(value);
+        });
+
+        it('should return null for cursors that are invalid or signed with another key', () => {
+            const cursor = util.encodeCursor({ repoId: 'foo/bar' }, 'key1');
+            const otherPayload = util.encodeCursor({ repoId: 'foo/other' }, 'key1').split('.')[0];
+
+            expect(util.decodeCursor(cursor, ['key2'])).toBe(null);
+            expect(util.decodeCursor(`${otherPayload}.${cursor.split('.')[1]}`, ['key1'])).toBe(null);
+            expect(util.decodeCursor(`${cursor}.foo`, ['key1'])).toBe(null);
+            expect(util.decodeCursor('', ['key1'])).toBe(null);
+            expect(util.decodeCursor(null, ['key1'])).toBe(null);
+        });
+    });
+
     describe('cacheAsyncResult', () => {
         it('should return a function that is a promise', async () => {
             let executions = 0;
@@ -344,6 +488,14 @@ describe('util', () => {
         });
     });
 
+    describe('delay', () => {
+        it('should resolve after the delay', async () => {
+            const start = Date.now();
+            expect(await util.delay(20)).toBe(undefined);
+            expect(Date.now() - start).toBeGreaterThanOrEqual(15);
+        });
+    });
+
     describe('toEpochTime', () => {
         it('should return epoch time for parsable dates', () => {
             expect(util.toEpochTime(new Date(1536668197845)))
@@ -2,6 +2,8 @@
 
 exports.INSTALLATION_TOKEN_CACHE = Symbol('INSTALLATION_TOKEN_CACHE');
 exports.INSTALLATION_TOKEN_CACHE_LAST_PRUNE = Symbol('INSTALLATION_TOKEN_CACHE_LAST_PRUNE');
+exports.ACCESS_KEY_CACHE = Symbol('ACCESS_KEY_CACHE');
+exports.ACCESS_KEY_CACHE_LAST_PRUNE = Symbol('ACCESS_KEY_CACHE_LAST_PRUNE');
 
 /**
  * Cache a value by key.
@@ -0,0 +1,171 @@
+'use strict';
+
+const zlib = require('zlib');
+
+// Build logs are archived as newline delimited JSON events, compressed in chunks
+// that are each a separate gzip member. Concatenated, they are still a valid gzip file,
+// and the index of the chunks allows a range of events to be read without reading
+// the whole file.
+
+/**
+ * @typedef {object} LogArchiveIndex
+ * @property {number} version
+ * @property {number} eventCount
+ * @property {number} byteLength
+ * @property {Array<{ start: number, count: number, offset: number, length: number }>} chunks
+ */
+
+exports.LOG_ARCHIVE_VERSION = 1;
+
+// Events per chunk, which is also about the smallest read from an archive.
+exports.LOG_ARCHIVE_CHUNK_EVENTS = 500;
+
+// Seconds to wait after a build ends before archiving its logs, since CloudWatch Logs
+// can still be ingesting its last events. Logs are archived again later if events
+// were ingested within this time of reading them.
+exports.LOG_ARCHIVE_SETTLE_SECONDS = 60;
+
+/**
+ * Build a log archive and its index from log events.
+ *
+ * @param {Array<{ timestamp: number, message: string, ingestionTime: number }>} events
+ * @param {object} [options]
+ * @param {number} [options.chunkEvents]
+ * @returns {{ data: Buffer, index: LogArchiveIndex }}
+ */
+exports.buildLogArchive = function buildLogArchive(
+    events,
+    { chunkEvents = exports.LOG_ARCHIVE_CHUNK_EVENTS } = {},
+) {
+    const buffers = [];
+    const chunks = [];
+    let offset = 0;
+
+    for (let start = 0; start < events.length; start += chunkEvents) {
+        const chunkLines = events.slice(start, start + chunkEvents)
+            .map((event) => `${JSON.stringify(event)}\n`);
+
+        const buffer = zlib.gzipSync(chunkLines.join(''));
+
+        buffers.push(buffer);
+        chunks.push({
+            start,
+            count: chunkLines.length,
+            offset,
+            length: buffer.length,
+        });
+
+        offset += buffer.length;
+    }
+
+    return {
+        data: Buffer.concat(buffers),
+        index: {
+            version: exports.LOG_ARCHIVE_VERSION,
+            eventCount: events.length,
+            byteLength: offset,
+            chunks,
+        },
+    };
+};
+
+/**
+ * Find the chunks of a log archive that contain a range of events.
+ *
+ * @param {LogArchiveIndex} index
+ * @param {number} start - Index of the first event.
+ * @param {number} limit - Maximum number of events.
+ * @returns {{ chunks: Array<object>, byteStart: number, byteEnd: number }|null} The chunks and their inclusive byte range, or null if there are no events in the range.
+ */
+exports.getLogArchiveRange = function getLogArchiveRange(index, start, limit) {
+    const chunks = index.chunks.filter((chunk) => (
+        chunk.start < start + limit
+        && chunk.start + chunk.count > start
+    ));
+
+    if (!chunks.length || limit <= 0) {
+        return null;
+    }
+
+    const lastChunk = chunks[chunks.length - 1];
+
+    return {
+        chunks,
+        byteStart: chunks[0].offset,
+        byteEnd: lastChunk.offset + lastChunk.length - 1,
+    };
+};
+
+/**
+ * Read a range of events from the chunks found by getLogArchiveRange.
+ *
+ * @param {{ chunks: Array<object>, byteStart: number }} range
+ * @param {Buffer} data - The bytes of the range, from byteStart to byteEnd.
+ * @param {number} start - Index of the first event.
+ * @param {number} limit - Maximum number of events.
+ * @returns {Array<object>}
+ */
+exports.readLogArchiveRange = function readLogArchiveRange(range, data, start, limit) {
+    const events = [];
+
+    for (const chunk of range.chunks) {
+        const chunkOffset = chunk.offset - range.byteStart;
+        const lines = zlib.gunzipSync(data.slice(chunkOffset, chunkOffset + chunk.length))
+            .toString('utf8')
+            .split('\n');
+
+        for (let i = 0; i < chunk.count; i++) {
+            const eventIndex = chunk.start + i;
+            if (eventIndex >= start && eventIndex < start + limit) {
+                events.push(JSON.parse(lines[i]));
+            }
+        }
+    }
+
+    return events;
+};
+
+/**
+ * Get a page of events of a log archive, for a page token like the ones CloudWatch Logs
+ * GetLogEvents returns, so archived logs can be paged through like the logs in CloudWatch.
+ *
+ * Without a token, the page is the last events, as with GetLogEvents when not starting from the head.
+ *
+ * @param {number} eventCount - Number of events in the archive.
+ * @param {string|undefined} nextToken - A token returned by this function.
+ * @param {number} limit - Maximum number of events.
+ * @returns {{ start: number, end: number, nextForwardToken: string, nextBackwardToken: string }|null} The range of the events (with an exclusive end), or null if the token is not for an archive.
+ */
+exports.getLogArchivePage = function getLogArchivePage(eventCount, nextToken, limit) {
+    let start;
+    let end;
+
+    if (nextToken === undefined) {
+        end = eventCount;
+        start = Math.max(0, end - limit);
+    }
+    else {
+        const match = typeof nextToken === 'string' && nextToken.match(/^archive\/([fb])\/(\d+)$/);
+        if (!match) {
+            return null;
+        }
+
+        const position = Math.min(eventCount, parseInt(match[2]));
+
+        if (match[1] === 'f') {
+            start = position;
+            end = Math.min(eventCount, start + limit);
+        }
+        else {
+            end = position;
+            start = Math.max(0, end - limit);
+        }
+    }
+
+    return {
+        start,
+        end,
+        nextForwardToken: `archive/f/${end}`,
+        nextBackwardToken: `archive/b/${start}`,
+    };
+};
@@ -94,6 +94,14 @@ exports.validateBuildsYml = v.top(
             isOptional({ defaultTo: () => ({}) }),
             isObject(),
         ),
+        supersede: v(
+            isOptional({ defaultTo: false }),
+            isBoolean(),
+        ),
+        debounceSeconds: v(
+            isOptional({ defaultTo: 0 }),
+            isNumber({ min: 0, max: 300, onlyInteger: true }),
+        ),
         builds: v(
             isRequired(),
             isObject({ minProps: 1 }),
@@ -112,9 +120,12 @@ exports.validateBuildsYml = v.top(
  * @property {boolean} privilegedMode
  * @property {number} timeoutInMinutes
  * @property {boolean} stopIfNotBranchHead
+ * @property {boolean} reuseResult
  * @property {string[]} dependsOn
  * @property {object[]} environmentVariables
  * @property {string[]} branches
+ * @property {string[]} paths
+ * @property {string[]} pathsIgnore
  * @property {string} sourceS3Bucket
  * @property {string} sourceS3KeyPrefix
  * @property {boolean} noArtifacts
@@ -172,6 +183,10 @@ exports.validateBuildParams = v.top(
             isOptional({ defaultTo: false }),
             isBoolean(),
         ),
+        reuseResult: v(
+            isOptional({ defaultTo: false }),
+            isBoolean(),
+        ),
         dependsOn: v(
             isOptional({ defaultTo: () => [] }),
             isArray(),
@@ -218,6 +233,34 @@ exports.validateBuildParams = v.top(
                 },
             ),
         ),
+        paths: v(
+            isOptional(),
+            isArray({ min: 1 }),
+            mapArray(
+                isRequired(),
+                isString(),
+                (value) => {
+                    if (!util.convertToRegex(value)) {
+                        throw new VError('{} is an invalid pattern');
+                    }
+                    return true;
+                },
+            ),
+        ),
+        pathsIgnore: v(
+            isOptional(),
+            isArray(),
+            mapArray(
+                isRequired(),
+                isString(),
+                (value) => {
+                    if (!util.convertToRegex(value)) {
+                        throw new VError('{} is an invalid pattern');
+                    }
+                    return true;
+                },
+            ),
+        ),
         sourceS3Bucket: v(
             isRequired(),
             isString(),
@@ -312,3 +355,83 @@ exports.checkBuildDependencies = function checkBuildDependencies(builds) {
 
     // return nodes;
 };
+
+/**
+ * Check builds for circular dependencies, and compile their dependency graph.
+ *
+ * The critical path of a build is its own weight plus the longest chain of
+ * weights of builds that depend on it, where a build's weight is its duration
+ * from `durations` (or the average of the known durations if missing).
+ *
+ * @param {object} builds
+ * @param {object} [durations] - Historical build durations in seconds, keyed by build key.
+ * @returns {{ levels: string[][], dependents: object, criticalPath: object }}
+ */
+exports.compileBuildGraph = function compileBuildGraph(builds, durations = {}) {
+    exports.checkBuildDependencies(builds);
+
+    const buildKeys = Object.keys(builds);
+
+    // Build the reverse of "dependsOn".
+    const dependents = {};
+    for (const buildKey of buildKeys) {
+        dependents[buildKey] = [];
+    }
+    for (const buildKey of buildKeys) {
+        for (const depBuildKey of builds[buildKey].dependsOn) {
+            if (!dependents[depBuildKey].includes(buildKey)) {
+                dependents[depBuildKey].push(buildKey);
+            }
+        }
+    }
+
+    const knownDurations = buildKeys
+        .map((buildKey) => durations[buildKey])
+        .filter((duration) => typeof duration === 'number' && duration > 0);
+
+    const defaultWeight = knownDurations.length
+        ? knownDurations.reduce((sum, duration) => sum + duration, 0) / knownDurations.length
+        : 1;
+
+    const levelOf = {};
+    const getLevel = (buildKey) => {
+        if (levelOf[buildKey] == null) {
+            levelOf[buildKey] = builds[buildKey].dependsOn
+                .reduce((max, depBuildKey) => Math.max(max, getLevel(depBuildKey) + 1), 0);
+        }
+        return levelOf[buildKey];
+    };
+
+    const criticalPath = {};
+    const getCriticalPath = (buildKey) => {
+        if (criticalPath[buildKey] == null) {
+            const weight = typeof durations[buildKey] === 'number' && durations[buildKey] > 0
+                ? durations[buildKey]
+                : defaultWeight;
+
+            criticalPath[buildKey] = Math.round(
+                weight + dependents[buildKey]
+                    .reduce((max, depBuildKey) => Math.max(max, getCriticalPath(depBuildKey)), 0)
+            );
+        }
+        return criticalPath[buildKey];
+    };
+
+    const levels = [];
+    for (const buildKey of buildKeys) {
+        const level = getLevel(buildKey);
+        getCriticalPath(buildKey);
+        (levels[level] || (levels[level] = [])).push(buildKey);
+    }
+
+    // Order each level so the longest remaining chain is first.
+    for (const level of levels) {
+        level.sort((a, b) => criticalPath[b] - criticalPath[a]);
+    }
+
+    return {
+        levels,
+        dependents,
+        criticalPath,
+    };
+};
@@ -1,5 +1,7 @@
 'use strict';
 
+const crypto = require('crypto');
+
 /**
  * Validate a GitHub user or organization name.
  *
@@ -92,6 +94,20 @@ exports.buildExecutionId = function buildExecutionId(commit, executionNum) {
     return `${commit}/${String(executionNum).padStart(4, '0')}`.toLowerCase();
 };
 
+/**
+ * Build the ID of the item that points to the latest execution of a repo,
+ * or of a commit if one is specified. These items are in the executions table,
+ * but their IDs are not valid execution IDs.
+ *
+ * @param {string|null} [commit]
+ * @returns {string}
+ */
+exports.buildLatestExecutionPointerId = function buildLatestExecutionPointerId(commit = null) {
+    return commit
+        ? `latest/${commit}`.toLowerCase()
+        : 'latest';
+};
+
 /**
  * Split an execution ID into its parts, or null if it is invalid.
  *
@@ -178,6 +194,18 @@ exports.buildLockId = function buildLockId(owner, repo, commit) {
     return `${owner}/${repo}/${commit}`.toLowerCase();
 };
 
+/**
+ * Build the id used to track the latest execution for a pull request.
+ *
+ * @param {string} owner
+ * @param {string} repo
+ * @param {number} pullRequestNumber
+ * @returns {string}
+ */
+exports.buildSupersedeId = function buildSupersedeId(owner, repo, pullRequestNumber) {
+    return `supersede:${owner}/${repo}/pr/${pullRequestNumber}`.toLowerCase();
+};
+
 /**
  * TODO: Is this still needed?
  *
@@ -223,6 +251,152 @@ exports.convertToRegex = function convertToRegex(val) {
     }
 };
 
+/**
+ * Check if any changed files are matched by "paths" patterns and not by "pathsIgnore" patterns.
+ *
+ * If "paths" is not set, then any changed file not matched by "pathsIgnore" is a match.
+ *
+ * @param {string[]} changedFiles
+ * @param {string[]} [paths]
+ * @param {string[]} [pathsIgnore]
+ * @returns {boolean}
+ */
+exports.isAffectedByChangedFiles = function isAffectedByChangedFiles(changedFiles, paths, pathsIgnore) {
+    return changedFiles.some(createPathsMatcher(paths, pathsIgnore));
+};
+
+/**
+ * Get the files that are matched by "paths" patterns and not by "pathsIgnore" patterns.
+ *
+ * @param {string[]} files
+ * @param {string[]} [paths]
+ * @param {string[]} [pathsIgnore]
+ * @returns {string[]}
+ */
+exports.filterFilesByPaths = function filterFilesByPaths(files, paths, pathsIgnore) {
+    return files.filter(createPathsMatcher(paths, pathsIgnore));
+};
+
+function createPathsMatcher(paths, pathsIgnore) {
+    const pathsRegex = paths && paths.map(exports.convertToRegex);
+    const pathsIgnoreRegex = (pathsIgnore || []).map(exports.convertToRegex);
+
+    return (file) => {
+        if (pathsIgnoreRegex.some((re) => re.test(file))) {
+            return false;
+        }
+
+        return !pathsRegex || pathsRegex.some((re) => re.test(file));
+    };
+}
+
+/**
+ * Build the key that identifies the inputs of a build, so results can be reused for identical builds.
+ *
+ * Build params that only affect reporting or whether the build runs are not included.
+ *
+ * @param {string} repoId
+ * @param {string} inputId - The git tree SHA, or a hash of the files the build's "paths" match.
+ * @param {BuildParams} buildParams
+ * @param {object} depResultKeys - The result keys of the build's dependencies, keyed by build key.
+ * @returns {string}
+ */
+exports.buildResultKey = function buildResultKey(repoId, inputId, buildParams, depResultKeys) {
+    const params = Object.keys(buildParams)
+        .filter((key) => !RESULT_KEY_IGNORED_PARAMS.includes(key))
+        .sort()
+        .map((key) => [key, buildParams[key]]);
+
+    const deps = Object.keys(depResultKeys)
+        .sort()
+        .map((key) => [key, depResultKeys[key]]);
+
+    return crypto.createHash('sha256')
+        .update(JSON.stringify([repoId.toLowerCase(), inputId, params, deps]))
+        .digest('hex');
+};
+
+const RESULT_KEY_IGNORED_PARAMS = [
+    'commitStatus',
+    'stopIfNotBranchHead',
+    'dependsOn',
+    'branches',
+    'paths',
+    'pathsIgnore',
+    'reuseResult',
+];
+
+/**
+ * Build a strong HTTP ETag from the values that identify a version of a response.
+ *
+ * @param {Array<*>} parts - JSON serializable values, such as an item's update counter and time.
+ * @returns {string} The quoted ETag.
+ */
+exports.buildETag = function buildETag(parts) {
+    return `"${crypto.createHash('sha1').update(JSON.stringify(parts)).digest('hex')}"`;
+};
+
+/**
+ * Encode a value as an opaque cursor, such as for pagination, which is signed so
+ * it cannot be changed by clients.
+ *
+ * @param {*} value - A JSON serializable value.
+ * @param {string} key - The secret to sign the cursor with.
+ * @returns {string}
+ */
+exports.encodeCursor = function encodeCursor(value, key) {
+    const payload = toBase64Url(Buffer.from(JSON.stringify(value), 'utf8'));
+    return `${payload}.${signCursorPayload(payload, key)}`;
+};
+
+/**
+ * Decode a cursor from encodeCursor, or return null if it is invalid or its signature does not match.
+ *
+ * @param {string} cursor
+ * @param {string[]} keys - The secrets it may have been signed with, to allow them to be rotated.
+ * @returns {*}
+ */
+exports.decodeCursor = function decodeCursor(cursor, keys) {
+    if (typeof cursor !== 'string') {
+        return null;
+    }
+
+    const [payload, signature, ...extra] = cursor.split('.');
+
+    if (!payload || !signature || extra.length) {
+        return null;
+    }
+
+    const signatureBuffer = Buffer.from(signature, 'utf8');
+    const isSigned = keys.some((key) => {
+        const expected = Buffer.from(signCursorPayload(payload, key), 'utf8');
+        return expected.length === signatureBuffer.length
+            && crypto.timingSafeEqual(expected, signatureBuffer);
+    });
+
+    if (!isSigned) {
+        return null;
+    }
+
+    try {
+        return JSON.parse(Buffer.from(payload.replace(/-/g, '+').replace(/_/g, '/'), 'base64').toString('utf8'));
+    }
+    catch (err) {
+        return null;
+    }
+};
+
+function signCursorPayload(payload, key) {
+    return toBase64Url(crypto.createHmac('sha256', key).update(payload).digest());
+}
+
+function toBase64Url(buffer) {
+    return buffer.toString('base64')
+        .replace(/\+/g, '-')
+        .replace(/\//g, '_')
+        .replace(/=+$/, '');
+}
+
 /**
  * Wrap an async function so its result is cached.
  *
@@ -263,6 +437,16 @@ exports.cacheAsyncResult = function cacheAsyncResult(fn, { getKey = null, expira
     };
 };
 
+/**
+ * Wait for a number of milliseconds.
+ *
+ * @param {number} ms
+ * @returns {Promise<void>}
+ */
+exports.delay = function delay(ms) {
+    return new Promise((resolve) => setTimeout(resolve, ms));
+};
+
 exports.toEpochTime = function toEpochTime(dt) {
     if (!dt && dt !== 0) {
         return null;
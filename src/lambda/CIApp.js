@@ -12,7 +12,16 @@ class CIApp {
         tableLocksName,
         tableSessionsName,
         tableExecutionsName,
+        tableWebhookDeliveriesName,
+        webhookDeliveryDedupeSeconds,
+        webhookEventDedupeSeconds,
+        tableBuildSlotsName,
+        buildConcurrencyLimits,
+        tableBuildResultsName,
         stateMachineArn,
+        stateMachineMode,
+        webhookQueueUrl,
+        logArchiveQueueUrl,
         secretsKMSArn,
         githubUrl,
         githubApiUrl,
@@ -35,7 +44,16 @@ class CIApp {
         this.tableLocksName = tableLocksName;
         this.tableSessionsName = tableSessionsName;
         this.tableExecutionsName = tableExecutionsName;
+        this.tableWebhookDeliveriesName = tableWebhookDeliveriesName;
+        this.webhookDeliveryDedupeSeconds = webhookDeliveryDedupeSeconds;
+        this.webhookEventDedupeSeconds = webhookEventDedupeSeconds;
+        this.tableBuildSlotsName = tableBuildSlotsName;
+        this.buildConcurrencyLimits = buildConcurrencyLimits;
+        this.tableBuildResultsName = tableBuildResultsName;
         this.stateMachineArn = stateMachineArn;
+        this.stateMachineMode = stateMachineMode;
+        this.webhookQueueUrl = webhookQueueUrl;
+        this.logArchiveQueueUrl = logArchiveQueueUrl;
         this.secretsKMSArn = secretsKMSArn;
         this.githubUrl = githubUrl;
         this.githubHost = url.parse(githubUrl).host;
@@ -127,7 +145,21 @@ CIApp.create = (env) => {
         tableLocksName: env.TABLE_LOCKS_NAME,
         tableSessionsName: env.TABLE_SESSIONS_NAME,
         tableExecutionsName: env.TABLE_EXECUTIONS_NAME,
+        tableWebhookDeliveriesName: env.TABLE_WEBHOOK_DELIVERIES_NAME || null,
+        webhookDeliveryDedupeSeconds: parseInt(env.WEBHOOK_DELIVERY_DEDUPE_SECONDS || 86400),
+        webhookEventDedupeSeconds: parseInt(env.WEBHOOK_EVENT_DEDUPE_SECONDS || 60),
+        tableBuildSlotsName: env.TABLE_BUILD_SLOTS_NAME || null,
+        buildConcurrencyLimits: {
+            account: parseInt(env.BUILD_ACCOUNT_CONCURRENCY_LIMIT || 0),
+            project: parseInt(env.BUILD_PROJECT_CONCURRENCY_LIMIT || 0),
+            repo: parseInt(env.BUILD_REPO_CONCURRENCY_LIMIT || 0),
+            priorityReserve: parseInt(env.BUILD_PRIORITY_RESERVE || 0),
+        },
+        tableBuildResultsName: env.TABLE_BUILD_RESULTS_NAME || null,
         stateMachineArn: env.STATE_MACHINE_ARN,
+        stateMachineMode: env.STATE_MACHINE_MODE || 'standard',
+        webhookQueueUrl: env.WEBHOOK_QUEUE_URL || null,
+        logArchiveQueueUrl: env.LOG_ARCHIVE_QUEUE_URL || null,
         secretsKMSArn: env.SECRETS_KMS_ARN,
 
         githubUrl: env.GH_URL.replace(/\/$/, ''),
@@ -0,0 +1,164 @@
+'use strict';
+
+const koaRouter = require('koa-router');
+const util = require('../../../common/util');
+const aws = require('../../util/aws');
+const { getExecutionSummaryJSON } = require('../../util/execution');
+const {
+    getPageLimit,
+    decodePageCursor,
+    encodePageCursor,
+    getAccessibleRepo,
+} = require('./util');
+
+// Most repos and commits that can be looked up in one request,
+// since access to each repo is checked with GitHub.
+const MAX_LOOKUPS = 25;
+
+/**
+ * Parse the "repo" (owner/repo) and "commit" (owner/repo/commit) query params,
+ * which may each be repeated.
+ *
+ * @param {object} ctx
+ * @returns {Array<{ owner: string, repo: string, commit: string|null }>}
+ */
+function parseLookups(ctx) {
+    const toArray = (value) => (value == null ? [] : [].concat(value));
+
+    const lookups = toArray(ctx.query.repo)
+        .map((value) => [value, value.split('/').concat(null)])
+        .concat(toArray(ctx.query.commit).map((value) => [value, value.split('/')]))
+        .map(([value, [owner, repo, commit, ...extra]]) => {
+            if (!util.isValidGitHubUser(owner)
+                || !util.isValidGitHubRepo(repo)
+                || commit !== null && !util.isValidSha(commit)
+                || extra.length) {
+                ctx.throw(400, `Invalid repo or commit: ${JSON.stringify(value)}`);
+            }
+
+            return {
+                owner,
+                repo,
+                commit: commit && commit.toLowerCase(),
+            };
+        });
+
+    if (!lookups.length) {
+        ctx.throw(400, 'Missing "repo" or "commit" query params');
+    }
+
+    if (lookups.length > MAX_LOOKUPS) {
+        ctx.throw(400, `Too many repos and commits (max ${MAX_LOOKUPS})`);
+    }
+
+    return lookups;
+}
+
+/**
+ * Check access to each repo once, in parallel.
+ *
+ * @param {object} ctx
+ * @param {string[]} repoIds
+ * @returns {Promise<Map<string, object|null>>} The GitHub repo by repo ID, or null if the user cannot access it.
+ */
+async function getAccessibleRepos(ctx, repoIds) {
+    const token = (await aws.decryptString(ctx.session.encryptedGithubAuthToken)).toString('utf8');
+
+    return new Map(await Promise.all([...new Set(repoIds)].map(async (repoId) => {
+        const { owner, repo } = util.parseRepoId(repoId);
+        return [repoId, await getAccessibleRepo(ctx, token, owner, repo)];
+    })));
+}
+
+/**
+ * Check that an execution is for a repo, and not an earlier repo
+ * that was deleted and then recreated with the same name.
+ *
+ * @param {object} execution
+ * @param {object} githubRepo
+ * @returns {boolean}
+ */
+function isExecutionForRepo(execution, githubRepo) {
+    return !!(execution.meta && execution.meta.githubRepo
+        && execution.meta.githubRepo.id === githubRepo.id);
+}
+
+module.exports = koaRouter()
+
+    // Get the latest execution of many repos and commits, such as for a dashboard.
+    // Repos and commits the user cannot access have a null execution, like ones without executions.
+    .get('/latest-executions', async (ctx) => {
+        const lookups = parseLookups(ctx);
+        const accessibleRepos = await getAccessibleRepos(
+            ctx,
+            lookups.map(({ owner, repo }) => util.buildRepoId(owner, repo)),
+        );
+
+        const accessibleLookups = lookups
+            .map(({ owner, repo, commit }) => ({
+                repoId: util.buildRepoId(owner, repo),
+                commit,
+            }))
+            .filter(({ repoId }) => accessibleRepos.get(repoId));
+
+        const executions = await aws.getLatestExecutions(
+            ctx.ciApp.tableExecutionsName,
+            accessibleLookups,
+        );
+
+        const executionsByLookup = new Map(accessibleLookups.map(({ repoId, commit }, i) => [
+            `${repoId}/${commit || ''}`,
+            executions[i],
+        ]));
+
+        ctx.set('Cache-Control', 'no-cache');
+
+        ctx.body = {
+            results: lookups.map(({ owner, repo, commit }) => {
+                const repoId = util.buildRepoId(owner, repo);
+                const githubRepo = accessibleRepos.get(repoId);
+                const execution = executionsByLookup.get(`${repoId}/${commit || ''}`) || null;
+
+                return {
+                    owner,
+                    repo,
+                    commit,
+                    execution: execution && isExecutionForRepo(execution, githubRepo)
+                        ? getExecutionSummaryJSON(execution)
+                        : null,
+                };
+            }),
+        };
+    })
+
+    // List the executions that are queued or in progress across all repos, oldest first,
+    // such as for an operational dashboard. Only executions of repos the user can access
+    // are included, so a page may have fewer executions than the limit.
+    .get('/active-executions', async (ctx) => {
+        const cursorScope = 'active';
+
+        const results = await aws.getActiveExecutions(
+            ctx.ciApp.tableExecutionsName,
+            {
+                limit: getPageLimit(ctx, 50),
+                exclusiveStartKey: decodePageCursor(ctx, cursorScope),
+            },
+        );
+
+        const accessibleRepos = await getAccessibleRepos(
+            ctx,
+            results.items.map((execution) => execution.repoId),
+        );
+
+        ctx.set('Cache-Control', 'no-cache');
+
+        ctx.body = {
+            executions: results.items
+                .filter((execution) => {
+                    const githubRepo = accessibleRepos.get(execution.repoId);
+                    return githubRepo && isExecutionForRepo(execution, githubRepo);
+                })
+                .map(getExecutionSummaryJSON),
+            nextCursor: encodePageCursor(ctx, cursorScope, results.lastEvaluatedKey),
+        };
+    });
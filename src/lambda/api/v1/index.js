@@ -17,11 +17,15 @@ module.exports = koaRouter()
                 githubNoBuildLabels: ctx.ciApp.githubNoBuildLabels,
             },
             endpoints: {
-                searchByRepoUrl: `${ctx.ciApp.baseUrl}/api/v1/repo/{owner}/{repo}`,
-                searchByCommitUrl: `${ctx.ciApp.baseUrl}/api/v1/repo/{owner}/{repo}/commit/{commit}`,
+                searchByRepoUrl: `${ctx.ciApp.baseUrl}/api/v1/repo/{owner}/{repo}?limit={limit}&cursor={cursor}`,
+                searchByCommitUrl: `${ctx.ciApp.baseUrl}/api/v1/repo/{owner}/{repo}/commit/{commit}?limit={limit}&cursor={cursor}`,
+                getLatestExecutionsUrl: `${ctx.ciApp.baseUrl}/api/v1/bulk/latest-executions?repo={owner}/{repo}&commit={owner}/{repo}/{commit}`,
+                getActiveExecutionsUrl: `${ctx.ciApp.baseUrl}/api/v1/bulk/active-executions?limit={limit}&cursor={cursor}`,
                 getExecutionUrl: `${ctx.ciApp.baseUrl}/api/v1/repo/{owner}/{repo}/commit/{commit}/exec/{executionNum}`,
                 executionActionUrl: `${ctx.ciApp.baseUrl}/api/v1/repo/{owner}/{repo}/commit/{commit}/exec/{executionNum}/action/{actionRequested}`,
                 getExecutionBuildLogsUrl: `${ctx.ciApp.baseUrl}/api/v1/repo/{owner}/{repo}/commit/{commit}/exec/{executionNum}/build/{buildKey}/logs?limit={limit}&nextToken={nextToken}`,
+                getExecutionBuildLogsArchiveUrl: `${ctx.ciApp.baseUrl}/api/v1/repo/{owner}/{repo}/commit/{commit}/exec/{executionNum}/build/{buildKey}/logs/archive?start={start}&limit={limit}`,
+                tailExecutionBuildLogsUrl: `${ctx.ciApp.baseUrl}/api/v1/repo/{owner}/{repo}/commit/{commit}/exec/{executionNum}/build/{buildKey}/logs/tail?after={after}&limit={limit}&wait={wait}`,
                 authRedirectUrl: `${ctx.ciApp.baseUrl}/api/v1/auth/redirect?returnTo={url}`,
                 logoutUrl: `${ctx.ciApp.baseUrl}/api/v1/auth/logout?redirect={url}`,
             },
@@ -56,4 +60,5 @@ module.exports = koaRouter()
     // ===================================================
 
     // Routes that require a login session.
-    .use('/repo', require('./repo').routes());
+    .use('/repo', require('./repo').routes())
+    .use('/bulk', require('./bulk').routes());
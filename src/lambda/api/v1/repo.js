@@ -2,11 +2,46 @@
 
 const koaRouter = require('koa-router');
 const schema = require('../../../common/schema');
-const { INSTALLATION_TOKEN_CACHE } = require('../../../common/cache');
+const {
+    INSTALLATION_TOKEN_CACHE,
+    ACCESS_KEY_CACHE,
+    ACCESS_KEY_CACHE_LAST_PRUNE,
+    getCachedValue,
+    pruneCache,
+} = require('../../../common/cache');
 const util = require('../../../common/util');
+const logArchive = require('../../../common/logArchive');
 const aws = require('../../util/aws');
 const github = require('../../util/github');
-const { startExecution, getExecutionActions, getExecutionJSON } = require('../../util/execution');
+const { getPageLimit, decodePageCursor, encodePageCursor } = require('./util');
+const {
+    startExecution,
+    stopExecutionBuilds,
+    wakeExecution,
+    getExecutionActions,
+    getExecutionJSON,
+    getExecutionSummaryJSON,
+} = require('../../util/execution');
+
+// Completed executions (and their logs) no longer change.
+const COMPLETED_EXECUTION_MAX_AGE_SECONDS = 86400;
+
+// How long a temporary access key for an execution or its logs is valid for.
+const ACCESS_KEY_LIFETIME_MS = 300000;
+
+// Responses depend on the session, and on the access key headers (see verifyRepoAccessByKey).
+const CACHE_VARY_HEADERS = 'Cookie, X-Execution-Access-Key, X-Execution-Logs-Access-Key';
+
+// Longest a log tail request waits for new events, which is kept
+// well under the 29 second limit of API Gateway.
+const LOG_TAIL_MAX_WAIT_SECONDS = 20;
+
+// How often a waiting log tail request checks for new events. CloudWatch Logs
+// limits the calls to GetLogEvents per account, so this is not too frequent.
+const LOG_TAIL_POLL_INTERVAL_MS = 2000;
+
+// How long a waiting log tail request pauses after an empty page that is not yet the end of the logs.
+const LOG_TAIL_EMPTY_PAGE_INTERVAL_MS = 250;
 
 async function getExecution(ctx) {
     const repoId = util.buildRepoId(
@@ -33,6 +68,122 @@ async function getExecution(ctx) {
     return execution;
 }
 
+/**
+ * Set the ETag and Cache-Control headers of a GET response,
+ * and respond with a 304 if the request's If-None-Match matches the ETag.
+ *
+ * Responses depend on the session, so they are "private" and only cached by the browser,
+ * and are never cached for longer than the access key in them is valid for (see verifyRepoAccessByKey).
+ *
+ * @param {object} ctx
+ * @param {Array<*>} etagParts - Values that identify the version of the response.
+ * @param {boolean} isImmutable - Whether the response will no longer change, so it can be cached for longer.
+ * @returns {boolean} Whether a 304 response was set, in which case no body is needed.
+ */
+function respondNotModified(ctx, etagParts, isImmutable) {
+    const maxAgeSeconds = ctx.state.accessKeyExpirationTime
+        ? Math.min(
+            COMPLETED_EXECUTION_MAX_AGE_SECONDS,
+            Math.max(0, Math.floor((ctx.state.accessKeyExpirationTime - Date.now()) / 1000)),
+        )
+        : COMPLETED_EXECUTION_MAX_AGE_SECONDS;
+
+    ctx.set('ETag', util.buildETag(etagParts));
+    ctx.set('Vary', CACHE_VARY_HEADERS);
+    ctx.set('Cache-Control', isImmutable && maxAgeSeconds
+        ? `private, max-age=${maxAgeSeconds}`
+        : 'no-cache');
+
+    // Koa only checks freshness for successful responses.
+    ctx.status = 200;
+
+    if (ctx.fresh) {
+        ctx.status = 304;
+        return true;
+    }
+
+    return false;
+}
+
+/**
+ * Get a build of an execution, throwing a 404 if it does not yet have logs.
+ *
+ * @param {object} ctx
+ * @param {object} execution
+ * @returns {object} The build's state.
+ */
+function getBuildWithLogs(ctx, execution) {
+    const build = execution.state && execution.state.builds
+        && execution.state.builds[ctx.params.buildKey];
+
+    if (!build) {
+        ctx.throw(404, 'Build not found for execution');
+    }
+
+    if (!build.codeBuild) {
+        ctx.throw(404, 'Build has not yet started');
+    }
+
+    if (!build.codeBuild.logs || !build.codeBuild.logs.streamName) {
+        ctx.throw(404, 'Build does not yet have logs');
+    }
+
+    return build;
+}
+
+/**
+ * Get the index of a build's log archive, if its logs have been archived (see "logsArchive" of the build).
+ *
+ * @param {object} build
+ * @returns {Promise<LogArchiveIndex|null>}
+ */
+async function getLogArchiveIndex(build) {
+    if (!build.logsArchive) {
+        return null;
+    }
+
+    let indexResponse;
+    try {
+        indexResponse = await aws.getS3Object({
+            Bucket: build.logsArchive.bucket,
+            Key: build.logsArchive.indexKey,
+        });
+    }
+    catch (err) {
+        // Without s3:ListBucket, S3 denies access to keys that do not exist.
+        if (err.code === 'NoSuchKey' || err.code === 'AccessDenied') {
+            return null;
+        }
+        throw err;
+    }
+
+    return JSON.parse(indexResponse.Body.toString('utf8'));
+}
+
+/**
+ * Read a range of events from a build's log archive.
+ *
+ * @param {object} build
+ * @param {LogArchiveIndex} index
+ * @param {number} start - Index of the first event.
+ * @param {number} limit - Maximum number of events.
+ * @returns {Promise<object[]>}
+ */
+async function readLogArchiveEvents(build, index, start, limit) {
+    const range = logArchive.getLogArchiveRange(index, start, limit);
+    if (!range) {
+        return [];
+    }
+
+    const dataResponse = await aws.getS3Object({
+        Bucket: build.logsArchive.bucket,
+        Key: build.logsArchive.key,
+        Range: `bytes=${range.byteStart}-${range.byteEnd}`,
+    });
+
+    return logArchive.readLogArchiveRange(range, dataResponse.Body, start, limit);
+}
+
 async function verifyRepoAccess(token, ctx, githubRepoId = null) {
     const { owner, repo } = ctx.params;
 
@@ -65,6 +216,28 @@ async function verifyRepoAccess(token, ctx, githubRepoId = null) {
     return repositoryResponse.data;
 }
 
+/**
+ * Init or prune the cache of decrypted access keys, which saves decrypting
+ * the same access key each time the UI polls an execution or its logs.
+ *
+ * @param {CIApp} ciApp
+ */
+function initAccessKeyCache(ciApp) {
+    if (!ciApp[ACCESS_KEY_CACHE]) {
+        ciApp[ACCESS_KEY_CACHE] = {};
+        ciApp[ACCESS_KEY_CACHE_LAST_PRUNE] = Date.now();
+    }
+
+    // Prune expired access keys from the cache.
+    else if (ciApp[ACCESS_KEY_CACHE_LAST_PRUNE] + 300000 < Date.now()) {
+        pruneCache(
+            ciApp[ACCESS_KEY_CACHE],
+            (cached) => cached.expirationTime >= Date.now(),
+        );
+        ciApp[ACCESS_KEY_CACHE_LAST_PRUNE] = Date.now();
+    }
+}
+
 /**
  * Helper for using signed access keys to more quickly access data related to repos.
  *
@@ -81,19 +254,29 @@ async function verifyRepoAccessByKey(ctx, headerName, getGithubAuthToken, create
     // Verify the encrypted access key, if provided.
     if (accessKey) {
         try {
+            initAccessKeyCache(ctx.ciApp);
+
             // Decrypt and parse the access key.
             const {
                 sessionInternalIdentifier,
                 expirationTime,
                 accessTo,
-            } = JSON.parse((await aws.decryptString(accessKey)).toString('utf8'));
+            } = await getCachedValue(
+                ctx.ciApp[ACCESS_KEY_CACHE],
+                accessKey,
+                (cached) => cached.expirationTime >= Date.now(),
+                async () => JSON.parse((await aws.decryptString(accessKey)).toString('utf8')),
+            );
 
             // Reset the access key if isn't valid or has expired.
             if (sessionInternalIdentifier !== ctx.session.internalIdentifier
                 || expirationTime < Date.now()
-                || accessTo !== ctx.url) {
+                || accessTo !== ctx.path) {
                 accessKey = null;
             }
+            else {
+                ctx.state.accessKeyExpirationTime = expirationTime;
+            }
         }
         catch (err) {
             accessKey = null;
@@ -105,12 +288,13 @@ async function verifyRepoAccessByKey(ctx, headerName, getGithubAuthToken, create
     // This allows us to reduce the number of requests to GitHub when the UI is continually fetching execution data.
     if (!accessKey && createAccessKey) {
         await verifyRepoAccess(await getGithubAuthToken(), ctx, executionGithubRepoId);
+        ctx.state.accessKeyExpirationTime = Date.now() + ACCESS_KEY_LIFETIME_MS;
         accessKey = await aws.encryptString(
             ctx.ciApp.secretsKMSArn,
             JSON.stringify({
                 sessionInternalIdentifier: ctx.session.internalIdentifier,
-                expirationTime: Date.now() + 300000, // 5 minutes
-                accessTo: ctx.url,
+                expirationTime: ctx.state.accessKeyExpirationTime,
+                accessTo: ctx.path,
             }),
         );
     }
@@ -118,6 +302,137 @@ async function verifyRepoAccessByKey(ctx, headerName, getGithubAuthToken, create
     return accessKey;
 }
 
+/**
+ * Start a new execution for the commit of an execution.
+ *
+ * @param {object} ctx
+ * @param {string} action - "rerun" to run all builds again, or "rerun-failed"
+ *                          to only run builds that did not succeed.
+ */
+async function rerunExecution(ctx, action) {
+    const execution = await getExecution(ctx);
+
+    const repository = await verifyRepoAccess(
+        (await aws.decryptString(ctx.session.encryptedGithubAuthToken)).toString('utf8'),
+        ctx,
+        execution.meta.githubRepo.id,
+    );
+
+    if (!getExecutionActions(execution).includes(action)) {
+        ctx.throw(400, `Execution does not allow "${action}" action`);
+    }
+
+    const { owner, repo, commit } = ctx.params;
+
+    const repoId = util.buildRepoId(
+        owner,
+        repo,
+    );
+
+    ctx.logInfo(`Getting installation for ${repoId}...`);
+    let repoInstallation;
+    try {
+        repoInstallation = await github.getRepositoryInstallation(
+            ctx.ciApp.githubAppId,
+            ctx.ciApp.githubApiUrl,
+            async () => {
+                // TODO: Should cache the GitHub App private key.
+                ctx.logInfo('Getting GitHub App private key from SSM...');
+                return Buffer.from(
+                    await aws.getSSMParam(ctx.ciApp.githubAppPrivateKeyParamName),
+                    'base64',
+                );
+            },
+            owner,
+            repo,
+        );
+    }
+    catch (err) {
+        ctx.logError(`Failed to get installation for ${repoId} -- ${err.message}`);
+
+        if (err.statusCode === 404) {
+            ctx.throw(404, `No repo or repo config for ${repoId}`);
+        }
+        else {
+            ctx.throw(500, `Failed to get determine GitHub App installation for ${repoId}`);
+        }
+    }
+
+    // Load repo config.
+    ctx.logInfo(`Getting repo config for ${repoId}...`);
+
+    const fetchedConfig = await aws.getRepoConfig(
+        ctx.ciApp.tableConfigName,
+        repoId,
+    );
+
+    if (!fetchedConfig) {
+        ctx.throw(404, `No repo or repo config for ${repoId}`);
+    }
+
+    const repoConfig = schema.validateRepoConfig({
+        ...ctx.ciApp.globalRepoConfigDefaults,
+        ...fetchedConfig,
+    });
+
+    // Get the token to access GitHub.
+    ctx.logInfo(`Getting access token for installation ${repoInstallation.id}...`);
+    const {
+        token,
+        expires_at: tokenExpiration,
+    } = await github.getInstallationAccessToken(
+        ctx.ciApp.githubAppId,
+        ctx.ciApp.githubApiUrl,
+        async () => {
+            ctx.logInfo('Getting GitHub App private key from SSM...');
+            return Buffer.from(
+                await aws.getSSMParam(ctx.ciApp.githubAppPrivateKeyParamName),
+                'base64',
+            );
+        },
+        repoInstallation.id,
+        ctx.ciApp[INSTALLATION_TOKEN_CACHE],
+    );
+
+    const startResponse = await startExecution(
+        ctx.ciApp,
+        ctx.throw,
+        ctx.req.traceId,
+        token,
+        tokenExpiration,
+        repoConfig,
+        {
+            id: repository.owner.id,
+            login: repository.owner.login,
+            type: repository.owner.type,
+        },
+        {
+            id: repository.id,
+            name: repository.name,
+        },
+        {
+            type: action,
+            previous_execution_id: execution.executionId,
+            sender: {
+                id: ctx.session.githubUser.id,
+                login: ctx.session.githubUser.login,
+                type: 'User',
+            },
+        },
+        repoInstallation.id,
+        commit,
+        {
+            rerunFailedOf: action === 'rerun-failed' ? execution : null,
+        },
+    );
+
+    ctx.body = {
+        message: 'Execution Started',
+        ...util.parseRepoId(repoConfig.id),
+        ...util.parseExecutionId(startResponse.executionId),
+    };
+}
+
 module.exports = koaRouter({
     prefix: '/:owner/:repo',
 })
@@ -128,25 +443,21 @@ module.exports = koaRouter({
         );
 
         const { owner, repo } = ctx.params;
+        const repoId = util.buildRepoId(owner, repo);
+        const cursorScope = `repo:${repoId}`;
 
         const results = await aws.getExecutionsForRepo(
             ctx.ciApp.tableExecutionsName,
-            util.buildRepoId(owner, repo),
+            repoId,
             {
-                limit: typeof ctx.query.limit === 'string' && ctx.query.limit.match(/^\d+$/)
-                    ? Math.max(10, Math.min(100, parseInt(ctx.query.limit || 0) || 50))
-                    : 50,
+                limit: getPageLimit(ctx, 50),
+                exclusiveStartKey: decodePageCursor(ctx, cursorScope),
             }
         );
 
         ctx.body = {
-            executions: results.items.map((execution) => ({
-                ...util.parseRepoId(execution.repoId),
-                ...util.parseExecutionId(execution.executionId),
-
-                ...execution,
-            })),
-            lastEvaluatedKey: results.lastEvaluatedKey,
+            executions: results.items.map(getExecutionSummaryJSON),
+            nextCursor: encodePageCursor(ctx, cursorScope, results.lastEvaluatedKey),
         };
     })
 
@@ -157,25 +468,25 @@ module.exports = koaRouter({
         );
 
         const { owner, repo, commit } = ctx.params;
+        const repoId = util.buildRepoId(owner, repo);
+        const cursorScope = `commit:${repoId}/${commit.toLowerCase()}`;
 
         const {
             items,
             lastEvaluatedKey,
         } = await aws.getExecutionsForCommit(
             ctx.ciApp.tableExecutionsName,
-            util.buildRepoId(owner, repo),
+            repoId,
             commit,
+            {
+                limit: getPageLimit(ctx, 10),
+                exclusiveStartKey: decodePageCursor(ctx, cursorScope),
+            },
         );
 
         ctx.body = {
-            executions: items.map((execution) => ({
-                // Destruct the IDs into their parts.
-                ...util.parseRepoId(execution.repoId),
-                ...util.parseExecutionId(execution.executionId),
-
-                ...execution,
-            })),
-            lastEvaluatedKey,
+            executions: items.map(getExecutionSummaryJSON),
+            nextCursor: encodePageCursor(ctx, cursorScope, lastEvaluatedKey),
         };
     })
 
@@ -192,6 +503,17 @@ module.exports = koaRouter({
             execution.meta.githubRepo.id,
         );
 
+        // The response only changes when the execution is updated, or with the access key.
+        if (respondNotModified(ctx, [
+            execution.repoId,
+            execution.executionId,
+            execution.updates,
+            execution.updateTime,
+            accessKey,
+        ], execution.status === 'COMPLETED')) {
+            return;
+        }
+
         ctx.body = {
             ...getExecutionJSON(execution),
 
@@ -231,6 +553,15 @@ module.exports = koaRouter({
             },
         );
 
+        // Stop the builds now rather than waiting for the step function to poll,
+        // and then wake it so it can record the stop.
+        const failedBuildKeys = await stopExecutionBuilds(ctx.ciApp, execution);
+        if (failedBuildKeys.length) {
+            ctx.logWarn(`Failed to stop builds ${failedBuildKeys.map((v) => JSON.stringify(v)).join(',')}, which will be retried by the step function`);
+        }
+
+        await wakeExecution(ctx.ciApp, execution);
+
         ctx.body = {
             message: 'Requested Stop',
             execution: getExecutionJSON(execution),
@@ -238,126 +569,89 @@ module.exports = koaRouter({
     })
 
     .post('/commit/:commit/exec/:executionNum/action/rerun', async (ctx) => {
+        await rerunExecution(ctx, 'rerun');
+    })
+
+    .post('/commit/:commit/exec/:executionNum/action/rerun-failed', async (ctx) => {
+        await rerunExecution(ctx, 'rerun-failed');
+    })
+
+    .get('/commit/:commit/exec/:executionNum/build/:buildKey/logs', async (ctx) => {
         const execution = await getExecution(ctx);
 
-        const repository = await verifyRepoAccess(
-            (await aws.decryptString(ctx.session.encryptedGithubAuthToken)).toString('utf8'),
+        const accessKey = await verifyRepoAccessByKey(
             ctx,
+            'x-execution-logs-access-key',
+            async () => (
+                await aws.decryptString(ctx.session.encryptedGithubAuthToken)
+            ).toString('utf8'),
+            true,
             execution.meta.githubRepo.id,
         );
 
-        if (!getExecutionActions(execution).includes('rerun')) {
-            ctx.throw(400, 'Execution does not allow "rerun" action');
-        }
+        const build = getBuildWithLogs(ctx, execution);
 
-        const { owner, repo, commit } = ctx.params;
+        const nextToken = typeof ctx.query.nextToken === 'string'
+            ? ctx.query.nextToken
+            : undefined;
 
-        const repoId = util.buildRepoId(
-            owner,
-            repo,
-        );
+        const limit = typeof ctx.query.limit === 'string' && ctx.query.limit.match(/^\d+$/)
+            ? Math.max(10, Math.min(100, parseInt(ctx.query.limit || 0) || 50))
+            : 50;
 
-        ctx.logInfo(`Getting installation for ${repoId}...`);
-        let repoInstallation;
-        try {
-            repoInstallation = await github.getRepositoryInstallation(
-                ctx.ciApp.githubAppId,
-                ctx.ciApp.githubApiUrl,
-                async () => {
-                    // TODO: Should cache the GitHub App private key.
-                    ctx.logInfo('Getting GitHub App private key from SSM...');
-                    return Buffer.from(
-                        await aws.getSSMParam(ctx.ciApp.githubAppPrivateKeyParamName),
-                        'base64',
-                    );
-                },
-                owner,
-                repo,
-            );
-        }
-        catch (err) {
-            ctx.logError(`Failed to get installation for ${repoId} -- ${err.message}`);
+        // Once the logs are archived, serve them from S3 with tokens for the archive,
+        // unless continuing from a token that was returned by CloudWatch Logs.
+        const archiveIndex = await getLogArchiveIndex(build);
+        const archivePage = archiveIndex && logArchive.getLogArchivePage(archiveIndex.eventCount, nextToken, limit);
 
-            if (err.statusCode === 404) {
-                ctx.throw(404, `No repo or repo config for ${repoId}`);
+        if (archivePage) {
+            if (respondNotModified(ctx, [
+                ctx.url,
+                build.logsArchive.key,
+                accessKey,
+            ], true)) {
+                return;
             }
-            else {
-                ctx.throw(500, `Failed to get determine GitHub App installation for ${repoId}`);
-            }
-        }
-
-        // Load repo config.
-        ctx.logInfo(`Getting repo config for ${repoId}...`);
 
-        const fetchedConfig = await aws.getRepoConfig(
-            ctx.ciApp.tableConfigName,
-            repoId,
-        );
-
-        if (!fetchedConfig) {
-            ctx.throw(404, `No repo or repo config for ${repoId}`);
+            ctx.body = {
+                events: await readLogArchiveEvents(build, archiveIndex, archivePage.start, archivePage.end - archivePage.start),
+                nextForwardToken: archivePage.nextForwardToken,
+                nextBackwardToken: archivePage.nextBackwardToken,
+                accessKey,
+            };
+            return;
         }
 
-        const repoConfig = schema.validateRepoConfig({
-            ...ctx.ciApp.globalRepoConfigDefaults,
-            ...fetchedConfig,
-        });
-
-        // Get the token to access GitHub.
-        ctx.logInfo(`Getting access token for installation ${repoInstallation.id}...`);
-        const {
-            token,
-            expires_at: tokenExpiration,
-        } = await github.getInstallationAccessToken(
-            ctx.ciApp.githubAppId,
-            ctx.ciApp.githubApiUrl,
-            async () => {
-                ctx.logInfo('Getting GitHub App private key from SSM...');
-                return Buffer.from(
-                    await aws.getSSMParam(ctx.ciApp.githubAppPrivateKeyParamName),
-                    'base64',
-                );
-            },
-            repoInstallation.id,
-            ctx.ciApp[INSTALLATION_TOKEN_CACHE],
-        );
-
-        const startResponse = await startExecution(
-            ctx.ciApp,
-            ctx.throw,
-            ctx.req.traceId,
-            token,
-            tokenExpiration,
-            repoConfig,
-            {
-                id: repository.owner.id,
-                login: repository.owner.login,
-                type: repository.owner.type,
-            },
-            {
-                id: repository.id,
-                name: repository.name,
-            },
+        const logResponse = await aws.getLogEvents(
+            build.codeBuild.logs.groupName,
+            build.codeBuild.logs.streamName,
             {
-                type: 'rerun',
-                sender: {
-                    id: ctx.session.githubUser.id,
-                    login: ctx.session.githubUser.login,
-                    type: 'User',
-                },
+                nextToken,
+                limit,
             },
-            repoInstallation.id,
-            commit,
         );
 
+        // CloudWatch Logs returns the same tokens until there are new events.
+        if (respondNotModified(ctx, [
+            ctx.url,
+            logResponse.nextForwardToken,
+            logResponse.nextBackwardToken,
+            accessKey,
+        ], execution.status === 'COMPLETED')) {
+            return;
+        }
+
         ctx.body = {
-            message: 'Execution Started',
-            ...util.parseRepoId(repoConfig.id),
-            ...util.parseExecutionId(startResponse.executionId),
+            events: logResponse.events,
+            nextForwardToken: logResponse.nextForwardToken,
+            nextBackwardToken: logResponse.nextBackwardToken,
+            accessKey,
         };
     })
 
-    .get('/commit/:commit/exec/:executionNum/build/:buildKey/logs', async (ctx) => {
+    // Get a range of log events of a completed build from its archive in S3 (see "logsArchive" of
+    // the build), by the index of the first event ("start" query param) and the number of events.
+    .get('/commit/:commit/exec/:executionNum/build/:buildKey/logs/archive', async (ctx) => {
         const execution = await getExecution(ctx);
 
         const accessKey = await verifyRepoAccessByKey(
@@ -377,31 +671,115 @@ module.exports = koaRouter({
             ctx.throw(404, 'Build not found for execution');
         }
 
-        if (!build.codeBuild) {
-            ctx.throw(404, 'Build has not yet started');
+        const index = await getLogArchiveIndex(build);
+
+        if (!index) {
+            ctx.throw(404, 'Build logs have not been archived');
         }
 
-        if (!build.codeBuild.logs || !build.codeBuild.logs.streamName) {
-            ctx.throw(404, 'Build does not yet have logs');
+        const start = typeof ctx.query.start === 'string' && ctx.query.start.match(/^\d+$/)
+            ? parseInt(ctx.query.start)
+            : 0;
+
+        const limit = typeof ctx.query.limit === 'string' && ctx.query.limit.match(/^\d+$/)
+            ? Math.max(10, Math.min(1000, parseInt(ctx.query.limit) || 500))
+            : 500;
+
+        // Archives do not change once their index exists, so a 304 can be sent without reading the events.
+        if (respondNotModified(ctx, [
+            ctx.url,
+            build.logsArchive.key,
+            accessKey,
+        ], true)) {
+            return;
         }
 
-        const logResponse = await aws.getLogEvents(
-            build.codeBuild.logs.groupName,
-            build.codeBuild.logs.streamName,
-            {
-                nextToken: typeof ctx.query.nextToken === 'string'
-                    ? ctx.query.nextToken
-                    : undefined,
-                limit: typeof ctx.query.limit === 'string' && ctx.query.limit.match(/^\d+$/)
-                    ? Math.max(10, Math.min(100, parseInt(ctx.query.limit || 0) || 50))
-                    : 50,
-            },
+        const events = await readLogArchiveEvents(build, index, start, limit);
+
+        ctx.body = {
+            events,
+            start,
+            nextStart: start + events.length < index.eventCount
+                ? start + events.length
+                : null,
+            eventCount: index.eventCount,
+            accessKey,
+        };
+    })
+
+    // Get the log events after a nextForwardToken (the "after" query param), or from the
+    // start of the logs. Waits up to "wait" seconds for new events if there are none yet.
+    .get('/commit/:commit/exec/:executionNum/build/:buildKey/logs/tail', async (ctx) => {
+        const execution = await getExecution(ctx);
+
+        const accessKey = await verifyRepoAccessByKey(
+            ctx,
+            'x-execution-logs-access-key',
+            async () => (
+                await aws.decryptString(ctx.session.encryptedGithubAuthToken)
+            ).toString('utf8'),
+            true,
+            execution.meta.githubRepo.id,
         );
 
+        const build = getBuildWithLogs(ctx, execution);
+
+        // The build state is only as recent as the execution, so a build that
+        // has just finished may still be in progress here.
+        const isBuildComplete = execution.status === 'COMPLETED'
+            || build.codeBuild.buildStatus !== 'IN_PROGRESS';
+
+        const limit = typeof ctx.query.limit === 'string' && ctx.query.limit.match(/^\d+$/)
+            ? Math.max(10, Math.min(1000, parseInt(ctx.query.limit) || 1000))
+            : 1000;
+
+        const waitMs = !isBuildComplete && typeof ctx.query.wait === 'string' && ctx.query.wait.match(/^\d+$/)
+            ? Math.min(LOG_TAIL_MAX_WAIT_SECONDS, parseInt(ctx.query.wait)) * 1000
+            : 0;
+
+        const deadline = Date.now() + waitMs;
+        let nextToken = typeof ctx.query.after === 'string' && ctx.query.after
+            ? ctx.query.after
+            : undefined;
+        let logResponse;
+        let isWaiting;
+
+        do {
+            logResponse = await aws.getLogEvents(
+                build.codeBuild.logs.groupName,
+                build.codeBuild.logs.streamName,
+                {
+                    limit,
+                    startFromHead: true,
+                    nextToken,
+                },
+            );
+
+            // CloudWatch Logs can return pages without events before the end of the logs,
+            // in which case the token moves forward. At the end it returns the same token.
+            const isAtEnd = logResponse.nextForwardToken === nextToken;
+            nextToken = logResponse.nextForwardToken;
+
+            // Back off on every empty page, though less when the token is still moving forward.
+            const intervalMs = isAtEnd
+                ? LOG_TAIL_POLL_INTERVAL_MS
+                : LOG_TAIL_EMPTY_PAGE_INTERVAL_MS;
+
+            isWaiting = !logResponse.events.length
+                && Date.now() + intervalMs <= deadline;
+
+            if (isWaiting) {
+                await util.delay(intervalMs);
+            }
+        } while (isWaiting);
+
+        // Each response depends on when it was requested.
+        ctx.set('Cache-Control', 'no-store');
+
         ctx.body = {
             events: logResponse.events,
             nextForwardToken: logResponse.nextForwardToken,
-            nextBackwardToken: logResponse.nextBackwardToken,
+            isBuildComplete,
             accessKey,
         };
     });
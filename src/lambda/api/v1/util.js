@@ -0,0 +1,79 @@
+'use strict';
+
+const util = require('../../../common/util');
+const github = require('../../util/github');
+
+/**
+ * Get the "limit" query param of a list endpoint, clamped to 10 to 100.
+ *
+ * @param {object} ctx
+ * @param {number} defaultLimit
+ * @returns {number}
+ */
+exports.getPageLimit = function getPageLimit(ctx, defaultLimit) {
+    return typeof ctx.query.limit === 'string' && ctx.query.limit.match(/^\d+$/)
+        ? Math.max(10, Math.min(100, parseInt(ctx.query.limit || 0) || defaultLimit))
+        : defaultLimit;
+};
+
+/**
+ * Get the DynamoDB key to continue a list from, from the "cursor" query param.
+ *
+ * Cursors are signed with the session secrets and are only valid for the list they are from.
+ *
+ * @param {object} ctx
+ * @param {string} scope - Identifies the list, such as by its repo and commit.
+ * @returns {object|null}
+ */
+exports.decodePageCursor = function decodePageCursor(ctx, scope) {
+    if (typeof ctx.query.cursor !== 'string' || !ctx.query.cursor) {
+        return null;
+    }
+
+    const cursor = util.decodeCursor(ctx.query.cursor, ctx.app.keys);
+
+    if (!cursor || cursor.scope !== scope || !cursor.key) {
+        ctx.throw(400, 'Invalid cursor');
+    }
+
+    return cursor.key;
+};
+
+/**
+ * Create the cursor for the next page of a list, or null if it was the last page.
+ *
+ * @param {object} ctx
+ * @param {string} scope
+ * @param {object|undefined} lastEvaluatedKey
+ * @returns {string|null}
+ */
+exports.encodePageCursor = function encodePageCursor(ctx, scope, lastEvaluatedKey) {
+    return lastEvaluatedKey
+        ? util.encodeCursor({ scope, key: lastEvaluatedKey }, ctx.app.keys[0])
+        : null;
+};
+
+/**
+ * Get a repo that the user has write access to, or null if they do not.
+ *
+ * @param {object} ctx
+ * @param {string} token
+ * @param {string} owner
+ * @param {string} repo
+ * @returns {Promise<object|null>}
+ */
+exports.getAccessibleRepo = async function getAccessibleRepo(ctx, token, owner, repo) {
+    const repositoryResponse = await github.getRepository(
+        ctx.ciApp.githubApiUrl,
+        token,
+        owner,
+        repo,
+    );
+
+    if (repositoryResponse.statusCode !== 200 || !repositoryResponse.data.permissions.push) {
+        ctx.logWarn(`Repository ${util.buildRepoId(owner, repo)} not found or not writable for user "${ctx.session.githubUser.login}" (${ctx.session.githubUser.id})`);
+        return null;
+    }
+
+    return repositoryResponse.data;
+};
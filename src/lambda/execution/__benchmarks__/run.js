@@ -0,0 +1,220 @@
+'use strict';
+
+// Micro-benchmarks for the step lambda, with the AWS and GitHub calls answered by
+// stubs (see stubs.js) so only the lambda's own work is measured.
+//
+// Each scenario runs in its own process (see scenario.js), and reports per-call
+// latency, remote calls by service, approximate bytes allocated and peak RSS.
+//
+// Usage:
+//   npm run bench -- [options]
+//
+// Options:
+//   --builds 1,10,100,500   Build counts of the benchmarked executions.
+//   --iterations 20         Measured iterations of each scenario.
+//   --zip-files 2000        Files in the zipball used for prepareGitHubSource (0 to skip).
+//   --out <file>            Write the results as JSON.
+//   --baseline <file>       Compare with the results of an earlier run, and exit
+//                           with an error if any have regressed.
+//   --max-regression 0.25   How much slower (or bigger) than the baseline a result
+//                           can be before it is a regression.
+
+const fs = require('fs');
+const path = require('path');
+const childProcess = require('child_process');
+
+const SCENARIO_PATH = path.join(__dirname, 'scenario.js');
+
+// A large young generation keeps garbage collection from running during
+// a measured call, which would hide what it allocated.
+const SCENARIO_EXEC_ARGV = ['--expose-gc', '--max-semi-space-size=64'];
+
+const DEFAULT_OPTIONS = {
+    builds: '1,10,100,500',
+    iterations: '20',
+    zipFiles: '2000',
+    out: null,
+    baseline: null,
+    maxRegression: '0.25',
+};
+
+function parseArgs(argv) {
+    const options = { ...DEFAULT_OPTIONS };
+
+    for (let i = 0; i < argv.length; i++) {
+        const match = argv[i].match(/^--([a-z-]+)$/);
+        const name = match && match[1].replace(/-([a-z])/g, (m, c) => c.toUpperCase());
+
+        if (!name || !(name in DEFAULT_OPTIONS) || i + 1 >= argv.length) {
+            throw new Error(`Invalid argument: ${argv[i]}`);
+        }
+
+        options[name] = argv[++i];
+    }
+
+    return {
+        builds: options.builds.split(',').map(Number),
+        iterations: Number(options.iterations),
+        zipFiles: Number(options.zipFiles),
+        out: options.out,
+        baseline: options.baseline,
+        maxRegression: Number(options.maxRegression),
+    };
+}
+
+function runScenario(args) {
+    return new Promise((resolve, reject) => {
+        let message = null;
+
+        const child = childProcess.fork(SCENARIO_PATH, args.map(String), {
+            execArgv: SCENARIO_EXEC_ARGV,
+        });
+
+        child.on('message', (m) => {
+            message = m;
+        });
+
+        child.on('error', reject);
+
+        child.on('exit', (code) => {
+            if (message && message.results) {
+                resolve(message.results);
+            }
+            else {
+                reject(new Error(message && message.error || `Scenario ${args.join(' ')} exited with code ${code}`));
+            }
+        });
+    });
+}
+
+function resultKey(result) {
+    return result.files != null
+        ? `${result.name}:${result.files}`
+        : `${result.name}:${result.builds}`;
+}
+
+function formatBytes(bytes) {
+    return bytes >= 1024 * 1024
+        ? `${(bytes / 1024 / 1024).toFixed(1)} MB`
+        : `${(bytes / 1024).toFixed(1)} KB`;
+}
+
+function formatCalls(calls) {
+    return Object.keys(calls)
+        .sort()
+        .map((service) => `${service}=${calls[service]}`)
+        .join(' ') || '-';
+}
+
+function printResults(results) {
+    const rows = [['Benchmark', 'Size', 'Mean ms', 'p95 ms', 'Allocated', 'Peak RSS', 'Remote calls']]
+        .concat(results.map((result) => [
+            result.name,
+            result.files != null ? `${result.files} files` : `${result.builds} builds`,
+            result.latencyMs.mean.toFixed(3),
+            result.latencyMs.p95.toFixed(3),
+            formatBytes(result.allocatedBytes),
+            formatBytes(result.peakRssBytes),
+            formatCalls(result.calls),
+        ]));
+
+    const widths = rows[0].map((_, i) => Math.max(...rows.map((row) => row[i].length)));
+
+    for (const row of rows) {
+        console.log(row.map((value, i) => value.padEnd(widths[i])).join('  ').trimRight());
+    }
+}
+
+/**
+ * Compare results with a baseline run.
+ *
+ * Remote calls are deterministic, so any increase is a regression. Latency and
+ * memory vary between runs, so they regress once they exceed the baseline by
+ * more than maxRegression.
+ *
+ * @param {object[]} results
+ * @param {object[]} baselineResults
+ * @param {number} maxRegression
+ * @returns {string[]} Descriptions of the regressions.
+ */
+function findRegressions(results, baselineResults, maxRegression) {
+    const baselineByKey = baselineResults.reduce((ret, result) => {
+        ret[resultKey(result)] = result;
+        return ret;
+    }, {});
+
+    const regressions = [];
+
+    for (const result of results) {
+        const baseline = baselineByKey[resultKey(result)];
+        if (!baseline) {
+            continue;
+        }
+
+        const metrics = [
+            ['mean latency', result.latencyMs.mean, baseline.latencyMs.mean, maxRegression],
+            ['allocated bytes', result.allocatedBytes, baseline.allocatedBytes, maxRegression],
+            ['peak RSS', result.peakRssBytes, baseline.peakRssBytes, maxRegression],
+        ];
+
+        for (const service of Object.keys(result.calls)) {
+            metrics.push([`${service} calls`, result.calls[service], baseline.calls[service] || 0, 0]);
+        }
+
+        for (const [metric, value, baselineValue, allowed] of metrics) {
+            if (value > baselineValue * (1 + allowed)) {
+                regressions.push(`${resultKey(result)} ${metric}: ${baselineValue} -> ${value}`);
+            }
+        }
+    }
+
+    return regressions;
+}
+
+async function main() {
+    const options = parseArgs(process.argv.slice(2));
+    const results = [];
+
+    for (const buildCount of options.builds) {
+        results.push(...await runScenario(['poll', buildCount, options.iterations]));
+    }
+
+    if (options.zipFiles) {
+        results.push(...await runScenario(['zip', options.zipFiles, Math.min(options.iterations, 5)]));
+    }
+
+    printResults(results);
+
+    const report = {
+        node: process.version,
+        platform: `${process.platform}-${process.arch}`,
+        date: new Date().toISOString(),
+        results,
+    };
+
+    if (options.out) {
+        fs.writeFileSync(options.out, `${JSON.stringify(report, null, 2)}\n`);
+    }
+
+    if (options.baseline) {
+        const baseline = JSON.parse(fs.readFileSync(options.baseline, 'utf8'));
+        const regressions = findRegressions(results, baseline.results, options.maxRegression);
+
+        if (regressions.length) {
+            console.error(`\n${regressions.length} regression${regressions.length === 1 ? '' : 's'} compared with ${options.baseline}:`);
+            for (const regression of regressions) {
+                console.error(`  ${regression}`);
+            }
+            process.exitCode = 1;
+        }
+        else {
+            console.log(`\nNo regressions compared with ${options.baseline}`);
+        }
+    }
+}
+
+main()
+    .catch((err) => {
+        console.error(err.stack);
+        process.exitCode = 1;
+    });
@@ -0,0 +1,422 @@
+'use strict';
+
+// Runs one step lambda benchmark scenario in its own process (see run.js),
+// so its peak memory usage is not affected by other scenarios.
+//
+// Usage: node --expose-gc scenario.js <poll|zip> <builds|files> <iterations>
+//
+// The result is sent to the parent process, or written to stdout if there isn't one.
+
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const crypto = require('crypto');
+
+// Environment for the step lambda, as set by the orchestrator template.
+const LAMBDA_ENV = {
+    LOCK_TIMEOUT_SECONDS: '300',
+    MAX_SESSION_MINUTES: '30',
+    BUILDS_YML_FILE: '.cbuildci.yml',
+    BASE_URL: 'https://cbuildci.example.com',
+    TABLE_CONFIG_NAME: 'cbuildci-config',
+    TABLE_LOCKS_NAME: 'cbuildci-locks',
+    TABLE_SESSIONS_NAME: 'cbuildci-sessions',
+    TABLE_EXECUTIONS_NAME: 'cbuildci-executions',
+    STATE_MACHINE_ARN: 'arn:aws:states:us-east-1:123456789012:stateMachine:cbuildci-statemachine',
+    STATE_MACHINE_WAIT_SECONDS_DEFAULT: '30',
+    STATE_MACHINE_MODE: 'standard',
+    LOG_ARCHIVE_QUEUE_URL: 'https://sqs.us-east-1.amazonaws.com/123456789012/cbuildci-log-archive',
+    SOURCE_S3_BUCKET_DEFAULT: 'cbuildci-artifacts',
+    SOURCE_S3_KEY_PREFIX_DEFAULT: 'source/{GitHubDomain}/{GitHubUser}/{GitHubRepo}/',
+    ARTIFACT_S3_BUCKET_DEFAULT: 'cbuildci-artifacts',
+    ARTIFACT_S3_KEY_PREFIX_DEFAULT: 'artifact/{GitHubDomain}/{GitHubUser}/{GitHubRepo}/',
+    CACHE_S3_BUCKET_DEFAULT: 'cbuildci-artifacts',
+    CACHE_S3_KEY_PREFIX_DEFAULT: 'cache/{GitHubDomain}/{GitHubUser}/{GitHubRepo}/',
+    SECRETS_KMS_ARN: 'arn:aws:kms:us-east-1:123456789012:key/benchmark',
+    GH_URL: 'https://github.com',
+    GH_API_URL: 'https://api.github.com',
+    GH_APP_ID: '1',
+};
+
+for (const [name, value] of Object.entries(LAMBDA_ENV)) {
+    if (process.env[name] == null) {
+        process.env[name] = value;
+    }
+}
+
+// The handler logs every step, which would be measured along with it.
+if (!process.env.BENCH_VERBOSE) {
+    console.log = console.info = console.warn = () => {};
+}
+
+const stubs = require('./stubs');
+const schema = require('../../../common/schema');
+const CIApp = require('../../CIApp');
+const { handler, getExecutionSummary, prepareGitHubSource } = require('../index');
+
+const ciApp = CIApp.create(process.env);
+
+const OWNER = 'octocat';
+const REPO = 'hello-world';
+const COMMIT_SHA = '6dcb09b5b57875f334f61aebed695e2e4193db5e';
+const EXECUTION_ID = `${COMMIT_SHA}/0001`;
+const TRACE_ID = 'benchmark';
+
+const LAMBDA_CONTEXT = {
+    logGroupName: '/aws/lambda/cbuildci-step',
+    logStreamName: 'benchmark',
+    awsRequestId: 'benchmark',
+};
+
+let peakRss = 0;
+
+function sampleRss() {
+    peakRss = Math.max(peakRss, process.memoryUsage().rss);
+}
+
+function getPeakRss() {
+    sampleRss();
+
+    // maxRSS is in kilobytes, and includes memory used between samples.
+    return process.resourceUsage
+        ? Math.max(peakRss, process.resourceUsage().maxRSS * 1024)
+        : peakRss;
+}
+
+/**
+ * Measure an async function after a full garbage collection.
+ *
+ * The allocated bytes are the growth of the heap while it ran, which is
+ * close to what it allocated as long as no garbage collection happens
+ * meanwhile (see the --max-semi-space-size used by run.js).
+ *
+ * @param {function} fn
+ * @returns {Promise<{ ms: number, allocatedBytes: number }>}
+ */
+async function measure(fn) {
+    global.gc();
+    sampleRss();
+
+    const heapBefore = process.memoryUsage().heapUsed;
+    const start = process.hrtime();
+
+    await fn();
+
+    const [seconds, nanoseconds] = process.hrtime(start);
+    const heapAfter = process.memoryUsage().heapUsed;
+    sampleRss();
+
+    return {
+        ms: seconds * 1e3 + nanoseconds / 1e6,
+        allocatedBytes: Math.max(0, heapAfter - heapBefore),
+    };
+}
+
+function summarize(samples) {
+    const ms = samples.map((sample) => sample.ms).sort((a, b) => a - b);
+    const percentile = (p) => ms[Math.min(ms.length - 1, Math.round(p / 100 * (ms.length - 1)))];
+    const round = (value) => Math.round(value * 1000) / 1000;
+
+    return {
+        latencyMs: {
+            mean: round(ms.reduce((sum, value) => sum + value, 0) / ms.length),
+            p50: round(percentile(50)),
+            p95: round(percentile(95)),
+            min: round(ms[0]),
+            max: round(ms[ms.length - 1]),
+        },
+        allocatedBytes: Math.round(samples.reduce((sum, sample) => sum + sample.allocatedBytes, 0) / samples.length),
+    };
+}
+
+/**
+ * Create the state for a new execution like startExecution does, with the
+ * source already uploaded. The first half of the builds have no dependencies,
+ * and each of the rest depends on one of them.
+ *
+ * @param {number} buildCount
+ * @returns {object}
+ */
+function createState(buildCount) {
+    const firstWave = Math.ceil(buildCount / 2);
+    const builds = {};
+
+    for (let i = 0; i < buildCount; i++) {
+        const buildKey = `build-${String(i).padStart(3, '0')}`;
+        const buildParams = schema.validateBuildParams({
+            ...ciApp.globalBuildDefaults,
+            codeBuildProjectArn: 'arn:aws:codebuild:us-east-1:123456789012:project/cbuildci-project',
+            image: 'aws/codebuild/standard:4.0',
+            commitStatus: `CBuildCI / ${buildKey}`,
+            dependsOn: i < firstWave
+                ? []
+                : [`build-${String(i % firstWave).padStart(3, '0')}`],
+        });
+
+        builds[buildKey] = {
+            buildKey,
+            status: null,
+            codeBuild: null,
+            slotScopeIds: null,
+            resultKey: null,
+            reusedResult: null,
+            logsArchive: null,
+            waitingForDeps: buildParams.dependsOn.slice(),
+            buildParams,
+        };
+    }
+
+    const graph = schema.compileBuildGraph(
+        Object.entries(builds).reduce((ret, [buildKey, buildState]) => {
+            ret[buildKey] = buildState.buildParams;
+            return ret;
+        }, {}),
+    );
+
+    const sourceS3KeyPrefix = ciApp.globalBuildDefaults.sourceS3KeyPrefix
+        .replace('{GitHubDomain}', ciApp.githubHost)
+        .replace('{GitHubUser}', OWNER)
+        .replace('{GitHubRepo}', REPO);
+
+    return {
+        isRunning: true,
+        stopRequested: false,
+        stopSupersededBy: null,
+        runTask: 'RunMain',
+        waitSeconds: 30,
+        debounceSeconds: 0,
+        errorInfo: null,
+        repoId: `${OWNER}/${REPO}`,
+        installationId: null,
+        executionId: EXECUTION_ID,
+        traceId: TRACE_ID,
+        checksName: 'CBuildCI',
+        checksRunId: 4,
+        encryptedOAuthToken: 'encrypted-benchmark-token',
+        oAuthTokenExpiration: null,
+        sourcesUploaded: [`${ciApp.globalBuildDefaults.sourceS3Bucket}/${sourceS3KeyPrefix}source_${COMMIT_SHA}.zip`],
+        builds,
+        graph,
+        readyBuildKeys: Object.values(builds)
+            .filter((buildState) => !buildState.waitingForDeps.length)
+            .map((buildState) => buildState.buildKey),
+        commitSHA: COMMIT_SHA,
+        isDefaultBranch: true,
+        owner: OWNER,
+        repo: REPO,
+    };
+}
+
+function invoke(event) {
+    return new Promise((resolve, reject) => {
+        handler(event, LAMBDA_CONTEXT, (err, result) => {
+            if (err) {
+                reject(err);
+            }
+            else {
+                resolve(result);
+            }
+        });
+    });
+}
+
+/**
+ * Benchmark polls of the step lambda, as invoked by the state machine:
+ *
+ * - "start" starts the builds that have no dependencies.
+ * - "running" checks on the running builds, none of which have ended.
+ * - "complete" finds the running builds have ended, and starts their dependents.
+ *
+ * @param {number} buildCount
+ * @param {number} iterations
+ * @returns {Promise<object[]>}
+ */
+async function benchmarkPolls(buildCount, iterations) {
+    const polls = {
+        start: [],
+        running: [],
+        complete: [],
+    };
+    const calls = {};
+
+    const state = createState(buildCount);
+    const pointer = {
+        runTask: 'RunMain',
+        errorInfo: null,
+        repoId: state.repoId,
+        executionId: state.executionId,
+        stateVersion: 0,
+    };
+
+    // The first iteration warms up the handler and isn't included.
+    for (let i = 0; i <= iterations; i++) {
+        stubs.resetCodeBuilds();
+        stubs.putExecution({
+            repoId: state.repoId,
+            executionId: state.executionId,
+            meta: {},
+            state,
+            stateVersion: 0,
+        });
+
+        let stateVersion = 0;
+        for (const poll of Object.keys(polls)) {
+            if (poll === 'complete') {
+                stubs.endCodeBuilds('SUCCEEDED');
+            }
+
+            stubs.resetCalls();
+
+            let result;
+            const sample = await measure(async () => {
+                result = await invoke({ ...pointer, stateVersion });
+            });
+            stateVersion = result.stateVersion;
+
+            if (i > 0) {
+                polls[poll].push(sample);
+                calls[poll] = stubs.getCalls();
+            }
+        }
+    }
+
+    // Benchmark the check run summary as of the last poll, when every build has a CodeBuild status.
+    const { state: lastState } = stubs.getExecution(state.repoId, state.executionId);
+
+    const summaries = [];
+    for (let i = 0; i <= iterations; i++) {
+        const sample = await measure(async () => {
+            getExecutionSummary(lastState);
+        });
+        if (i > 0) {
+            summaries.push(sample);
+        }
+    }
+
+    return Object.keys(polls)
+        .map((poll) => ({
+            name: `executionHandler.${poll}`,
+            builds: buildCount,
+            iterations,
+            ...summarize(polls[poll]),
+            calls: calls[poll],
+        }))
+        .concat({
+            name: 'getExecutionSummary',
+            builds: buildCount,
+            iterations,
+            ...summarize(summaries),
+            calls: {},
+        });
+}
+
+/**
+ * Create a zip like a GitHub zipball, with every file in a top-level directory.
+ *
+ * @param {string} fileName
+ * @param {number} fileCount
+ * @returns {Promise<void>}
+ */
+function createZipball(fileName, fileCount) {
+    const archiver = require('archiver');
+
+    return new Promise((resolve, reject) => {
+        const zip = archiver('zip');
+        const outStream = fs.createWriteStream(fileName);
+
+        zip.on('error', reject);
+        outStream.on('error', reject);
+        outStream.on('close', resolve);
+        zip.pipe(outStream);
+
+        // Source files compress well, so most of each file is repeated text.
+        const text = Buffer.from('const value = require(\'./module\');\n'.repeat(100));
+        for (let i = 0; i < fileCount; i++) {
+            zip.append(Buffer.concat([text, crypto.randomBytes(512)]), {
+                name: `${OWNER}-${REPO}-${COMMIT_SHA.substr(0, 7)}/src/dir-${i % 50}/file-${i}.js`,
+            });
+        }
+
+        zip.finalize();
+    });
+}
+
+/**
+ * Benchmark preparing a downloaded GitHub zipball for CodeBuild.
+ *
+ * @param {number} fileCount
+ * @param {number} iterations
+ * @returns {Promise<object[]>}
+ */
+async function benchmarkZip(fileCount, iterations) {
+    const tmpDir = fs.mkdtempSync(path.join(os.tmpdir(), 'cbuildci-bench-'));
+    const inFileName = path.join(tmpDir, 'zipball.zip');
+    const outFileName = path.join(tmpDir, 'source.zip');
+
+    try {
+        await createZipball(inFileName, fileCount);
+        const zipBytes = fs.statSync(inFileName).size;
+
+        const samples = [];
+        for (let i = 0; i <= iterations; i++) {
+            const sample = await measure(() => prepareGitHubSource(inFileName, outFileName));
+            if (i > 0) {
+                samples.push(sample);
+            }
+        }
+
+        return [{
+            name: 'prepareGitHubSource',
+            files: fileCount,
+            zipBytes,
+            iterations,
+            ...summarize(samples),
+            calls: {},
+        }];
+    }
+    finally {
+        for (const fileName of fs.readdirSync(tmpDir)) {
+            fs.unlinkSync(path.join(tmpDir, fileName));
+        }
+        fs.rmdirSync(tmpDir);
+    }
+}
+
+async function main() {
+    const [scenario, size, iterations] = process.argv.slice(2);
+
+    if (typeof global.gc !== 'function') {
+        throw new Error('Run with --expose-gc');
+    }
+
+    const results = scenario === 'zip'
+        ? await benchmarkZip(Number(size), Number(iterations))
+        : await benchmarkPolls(Number(size), Number(iterations));
+
+    // Memory is measured for the whole process, so it is the same for every result.
+    const peakRssBytes = getPeakRss();
+    for (const result of results) {
+        result.peakRssBytes = peakRssBytes;
+    }
+
+    return results;
+}
+
+main()
+    .then((results) => {
+        if (process.send) {
+            process.send({ results });
+        }
+        else {
+            process.stdout.write(`${JSON.stringify(results, null, 2)}\n`);
+        }
+    })
+    .catch((err) => {
+        if (process.send) {
+            process.send({ error: err.stack });
+        }
+        else {
+            process.stderr.write(`${err.stack}\n`);
+        }
+        process.exitCode = 1;
+    });
@@ -0,0 +1,98 @@
+'use strict';
+
+// Estimates how the step lambda benchmarks (see run.js) would perform at each
+// Lambda memory size, to choose the StepLambdaMemorySize, WebhookLambdaMemorySize
+// and ApiLambdaMemorySize parameters of the orchestrator template.
+//
+// Lambda allocates CPU in proportion to memory, with one full vCPU at 1769 MB.
+// The benchmarks run on an unthrottled core, so their latency is scaled up by
+// 1769 / memory for smaller sizes. Larger sizes are not faster, since the lambda
+// is single threaded. Remote call latency is not included, as the calls are stubbed.
+//
+// Usage:
+//   npm run bench -- --out results.json
+//   npm run bench:sizing -- results.json [--memory 128,256,512,1024,1769]
+
+const fs = require('fs');
+
+const FULL_VCPU_MEMORY_MB = 1769;
+
+const DEFAULT_MEMORY_SIZES = '128,256,512,1024,1769';
+
+// Memory a Node.js lambda uses before it runs anything, beyond what the
+// benchmarks measure. Allows for the runtime itself.
+const RUNTIME_OVERHEAD_MB = 15;
+
+function parseArgs(argv) {
+    let resultsPath = null;
+    let memory = DEFAULT_MEMORY_SIZES;
+
+    for (let i = 0; i < argv.length; i++) {
+        if (argv[i] === '--memory' && i + 1 < argv.length) {
+            memory = argv[++i];
+        }
+        else if (!resultsPath && !argv[i].startsWith('--')) {
+            resultsPath = argv[i];
+        }
+        else {
+            throw new Error(`Invalid argument: ${argv[i]}`);
+        }
+    }
+
+    if (!resultsPath) {
+        throw new Error('Missing path to the results of run.js --out');
+    }
+
+    return {
+        resultsPath,
+        memorySizes: memory.split(',').map(Number),
+    };
+}
+
+/**
+ * Estimate the latency of a benchmark result at a Lambda memory size.
+ *
+ * @param {object} result
+ * @param {number} memoryMb
+ * @returns {number|null} Milliseconds, or null if the result would not fit in memory.
+ */
+function estimateLatencyMs(result, memoryMb) {
+    if (result.peakRssBytes / 1024 / 1024 + RUNTIME_OVERHEAD_MB > memoryMb) {
+        return null;
+    }
+
+    return result.latencyMs.mean * Math.max(1, FULL_VCPU_MEMORY_MB / memoryMb);
+}
+
+function main() {
+    const options = parseArgs(process.argv.slice(2));
+    const report = JSON.parse(fs.readFileSync(options.resultsPath, 'utf8'));
+
+    const rows = [['Benchmark', 'Size', 'Peak RSS'].concat(options.memorySizes.map((memoryMb) => `${memoryMb} MB`))]
+        .concat(report.results.map((result) => [
+            result.name,
+            result.files != null ? `${result.files} files` : `${result.builds} builds`,
+            `${(result.peakRssBytes / 1024 / 1024).toFixed(1)} MB`,
+        ].concat(options.memorySizes.map((memoryMb) => {
+            const latencyMs = estimateLatencyMs(result, memoryMb);
+            return latencyMs == null ? 'OOM' : `${latencyMs.toFixed(1)} ms`;
+        }))));
+
+    const widths = rows[0].map((_, i) => Math.max(...rows.map((row) => row[i].length)));
+
+    console.log(`Estimated mean latency by memory size, from ${options.resultsPath} (${report.node}, ${report.platform})\n`);
+
+    for (const row of rows) {
+        console.log(row.map((value, i) => value.padEnd(widths[i])).join('  ').trimRight());
+    }
+
+    console.log(`\n"OOM" marks sizes below the peak RSS plus ${RUNTIME_OVERHEAD_MB} MB for the runtime.`);
+}
+
+try {
+    main();
+}
+catch (err) {
+    console.error(err.stack);
+    process.exitCode = 1;
+}
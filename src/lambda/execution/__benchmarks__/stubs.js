@@ -0,0 +1,177 @@
+'use strict';
+
+const fs = require('fs');
+const path = require('path');
+const aws = require('../../util/aws');
+const github = require('../../util/github');
+
+// Stand-ins for the "aws" and "github" utility modules used by the step lambda,
+// which answer from recorded responses (see ./fixtures) instead of calling the services.
+//
+// Every call is counted by service, so the benchmarks can report how many remote
+// calls a poll makes. Methods that do not make remote calls (e.g. aws.parseArn)
+// are left as is.
+
+const FIXTURES_DIR = path.join(__dirname, 'fixtures');
+
+const codeBuildFixture = loadFixture('codebuild-build.json');
+const commitStatusFixture = loadFixture('github-commit-status.json');
+const checkRunFixture = loadFixture('github-check-run.json');
+
+const calls = {};
+const executions = {};
+const codeBuilds = {};
+let nextBuildNum = 1;
+
+function loadFixture(fileName) {
+    return JSON.parse(fs.readFileSync(path.join(FIXTURES_DIR, fileName), 'utf8'));
+}
+
+function copy(value) {
+    return value === undefined ? value : JSON.parse(JSON.stringify(value));
+}
+
+const awsMethods = {
+    batchGetCodeBuilds: ['codebuild', async (ids) => ({
+        builds: ids
+            .map((id) => codeBuilds[id])
+            .filter(Boolean)
+            .map(copy),
+    })],
+
+    startCodeBuild: ['codebuild', async (params) => {
+        const id = `${params.projectName}:bench-${nextBuildNum++}`;
+        codeBuilds[id] = {
+            ...copy(codeBuildFixture),
+            id,
+            arn: `arn:aws:codebuild:us-east-1:123456789012:build/${id}`,
+            currentPhase: 'SUBMITTED',
+            buildStatus: 'IN_PROGRESS',
+            buildComplete: false,
+            endTime: null,
+            phases: codeBuildFixture.phases.slice(0, 1),
+        };
+        return { build: copy(codeBuilds[id]) };
+    }],
+
+    stopCodeBuild: ['codebuild', async (id) => ({
+        build: copy(codeBuilds[id]),
+    })],
+
+    getExecution: ['dynamodb', async (tableName, repoId, executionId) => {
+        return copy(executions[`${repoId}/${executionId}`] || null);
+    }],
+
+    updateExecution: ['dynamodb', async (tableName, repoId, executionId, updates) => {
+        const key = `${repoId}/${executionId}`;
+        const execution = executions[key];
+        const { expectedStateVersion, ...rest } = updates;
+
+        if (expectedStateVersion != null && execution.stateVersion !== expectedStateVersion) {
+            const err = new Error('The conditional request failed');
+            err.name = err.code = 'ConditionalCheckFailedException';
+            throw err;
+        }
+
+        executions[key] = {
+            ...execution,
+            ...copy(rest),
+            meta: {
+                ...execution.meta,
+                ...copy(rest.meta),
+            },
+            stateVersion: rest.state ? (execution.stateVersion || 0) + 1 : execution.stateVersion,
+        };
+
+        return copy(executions[key]);
+    }],
+
+    updateLock: ['dynamodb', async () => true],
+    releaseLock: ['dynamodb', async () => true],
+    getBuildResult: ['dynamodb', async () => null],
+    putBuildResult: ['dynamodb', async () => undefined],
+    getBuildSlots: ['dynamodb', async () => null],
+    acquireBuildSlot: ['dynamodb', async () => true],
+    renewBuildSlots: ['dynamodb', async () => undefined],
+    releaseBuildSlots: ['dynamodb', async () => undefined],
+
+    decryptString: ['kms', async () => 'benchmark-token'],
+    encryptString: ['kms', async () => 'encrypted-benchmark-token'],
+    getSSMParam: ['ssm', async () => ''],
+
+    putS3Object: ['s3', async () => ({})],
+
+    // Ended builds queue their logs to be archived.
+    sendSQSMessage: ['sqs', async () => ({
+        messageId: 'benchmark-message',
+    })],
+
+    startStepFunctionExecution: ['states', async () => ({
+        executionArn: 'arn:aws:states:us-east-1:123456789012:execution:cbuildci-statemachine:bench',
+    })],
+};
+
+const githubMethods = {
+    pushCommitStatus: ['github', async () => copy(commitStatusFixture)],
+    updateCheckRun: ['github', async () => copy(checkRunFixture)],
+    getInstallationAccessToken: ['github', async () => ({
+        token: 'benchmark-token',
+        expires_at: '2099-01-01T00:00:00Z',
+    })],
+    // Benchmarked executions start with their source uploaded, so nothing is downloaded.
+    downloadArchive: ['github', async () => {
+        throw new Error('github.downloadArchive is not stubbed');
+    }],
+};
+
+function install(target, methods) {
+    for (const [method, [service, fn]] of Object.entries(methods)) {
+        if (typeof target[method] !== 'function') {
+            throw new Error(`${method} is not a function`);
+        }
+
+        target[method] = (...args) => {
+            calls[service] = (calls[service] || 0) + 1;
+            return fn(...args);
+        };
+    }
+}
+
+install(aws, awsMethods);
+install(github, githubMethods);
+
+exports.resetCalls = function resetCalls() {
+    for (const service of Object.keys(calls)) {
+        delete calls[service];
+    }
+};
+
+exports.getCalls = function getCalls() {
+    return { ...calls };
+};
+
+exports.putExecution = function putExecution(execution) {
+    executions[`${execution.repoId}/${execution.executionId}`] = copy(execution);
+};
+
+exports.getExecution = function getExecution(repoId, executionId) {
+    return copy(executions[`${repoId}/${executionId}`]);
+};
+
+// Set the status of all CodeBuild builds, as if they had ended.
+exports.endCodeBuilds = function endCodeBuilds(buildStatus) {
+    for (const [id, build] of Object.entries(codeBuilds)) {
+        codeBuilds[id] = {
+            ...copy(codeBuildFixture),
+            id,
+            arn: build.arn,
+            buildStatus,
+        };
+    }
+};
+
+exports.resetCodeBuilds = function resetCodeBuilds() {
+    for (const id of Object.keys(codeBuilds)) {
+        delete codeBuilds[id];
+    }
+};
@@ -0,0 +1,108 @@
+'use strict';
+
+const CIApp = require('../CIApp');
+const aws = require('../util/aws');
+const { buildLogArchive, LOG_ARCHIVE_SETTLE_SECONDS } = require('../../common/logArchive');
+
+// CIApp contains logging and config.
+const ciApp = CIApp.create(process.env);
+
+// Builds with more log events than this are not archived, and their logs are
+// only read from CloudWatch Logs, to limit the memory used to archive them.
+const LOG_ARCHIVE_MAX_EVENTS = 100000;
+
+exports.handler = (event, context, cb) => {
+    archiveLogsHandler(event.Records || [], ciApp)
+        .then((result) => cb(null, result))
+        .catch((err) => cb(err));
+};
+
+/**
+ * Archive the logs of ended builds, which were queued by the step lambda (see "queueLogArchive").
+ *
+ * The messages are delayed until the logs have settled. Any failure (e.g. GetLogEvents being
+ * throttled, or events still being ingested) leaves the message on the queue to be retried,
+ * and eventually moved to the dead-letter queue.
+ *
+ * @param {object[]} records
+ * @param {CIApp} ciApp
+ * @returns {Promise<object>}
+ */
+async function archiveLogsHandler(records, ciApp) {
+    let archived = 0;
+
+    for (const record of records) {
+        if (await archiveLogs(JSON.parse(record.body), ciApp)) {
+            archived++;
+        }
+    }
+
+    return {
+        processed: records.length,
+        archived,
+    };
+}
+
+/**
+ * Copy the logs of an ended build from CloudWatch Logs to S3, where the API reads them
+ * without the low rate limits of CloudWatch Logs. The index is written last, since the
+ * archive is only read once it exists.
+ *
+ * @param {{ executionId: string, buildKey: string, logs: { groupName: string, streamName: string }, logsArchive: { bucket: string, key: string, indexKey: string } }} message
+ * @param {CIApp} ciApp
+ * @returns {Promise<boolean>} Whether the logs were archived.
+ */
+async function archiveLogs({ executionId, buildKey, logs, logsArchive }, ciApp) {
+    const events = [];
+    let nextToken;
+    let isAtEnd;
+
+    // Read forward until the token no longer changes, which is the end of the logs.
+    do {
+        const logResponse = await aws.getLogEvents(
+            logs.groupName,
+            logs.streamName,
+            {
+                startFromHead: true,
+                nextToken,
+            },
+        );
+
+        for (const event of logResponse.events) {
+            events.push(event);
+        }
+
+        if (events.length > LOG_ARCHIVE_MAX_EVENTS) {
+            ciApp.logInfo(`Not archiving logs for "${buildKey}" of "${executionId}", since it has over ${LOG_ARCHIVE_MAX_EVENTS} log events`);
+            return false;
+        }
+
+        isAtEnd = logResponse.nextForwardToken === nextToken;
+        nextToken = logResponse.nextForwardToken;
+    } while (!isAtEnd);
+
+    const lastIngestionTime = events.reduce((ret, event) => Math.max(ret, event.ingestionTime || 0), 0);
+    if (lastIngestionTime > Date.now() - LOG_ARCHIVE_SETTLE_SECONDS * 1000) {
+        throw new Error(`Log events for "${buildKey}" of "${executionId}" are still being ingested`);
+    }
+
+    const { data, index } = buildLogArchive(events);
+
+    await aws.putS3Object({
+        Bucket: logsArchive.bucket,
+        Key: logsArchive.key,
+        Body: data,
+        ContentType: 'application/x-ndjson',
+        ContentEncoding: 'gzip',
+    });
+
+    await aws.putS3Object({
+        Bucket: logsArchive.bucket,
+        Key: logsArchive.indexKey,
+        Body: JSON.stringify(index),
+        ContentType: 'application/json',
+    });
+
+    ciApp.logInfo(`Archived ${index.eventCount} log events for "${buildKey}" of "${executionId}" (${data.length} bytes)`);
+    return true;
+}
@@ -2,14 +2,20 @@
 
 const path = require('path');
 const fs = require('fs');
-const yauzl = require('yauzl');
-const archiver = require('archiver');
 const crypto = require('crypto');
 const util = require('../../common/util');
+const schema = require('../../common/schema');
 const CIApp = require('../CIApp');
 const aws = require('../util/aws');
 const github = require('../util/github');
-const { getExecutionActions } = require('../util/execution');
+const scheduler = require('../util/scheduler');
+const {
+    getExecutionActions,
+    stopExecutionBuilds,
+    EXPRESS_MAX_DURATION_SECONDS,
+    EXPRESS_HANDOFF_MARGIN_SECONDS,
+} = require('../util/execution');
+const { LOG_ARCHIVE_SETTLE_SECONDS } = require('../../common/logArchive');
 
 const ciApp = CIApp.create(process.env);
 
@@ -25,6 +31,7 @@ const STATUS_FAULT = 'FAULT';
 const STATUS_STOPPED = 'STOPPED';
 const STATUS_TIMED_OUT = 'TIMED_OUT';
 const STATUS_SKIPPED = 'SKIPPED';
+const STATUS_QUEUED = 'QUEUED';
 
 const statusToText = {
     [STATUS_IN_PROGRESS]: 'In Progress',
@@ -39,6 +46,7 @@ const statusToText = {
     [STATUS_STOPPED]: 'Stopped',
     [STATUS_TIMED_OUT]: 'Timed Out',
     [STATUS_SKIPPED]: 'Skipped',
+    [STATUS_QUEUED]: 'Queued',
 };
 
 const statusToEmoji = {
@@ -54,12 +62,33 @@ const statusToEmoji = {
     [STATUS_STOPPED]: ':no_entry_sign:',
     [STATUS_TIMED_OUT]: ':alarm_clock:',
     [STATUS_SKIPPED]: ':white_circle:',
+    [STATUS_QUEUED]: ':hourglass:',
 };
 
 exports.handler = (event, context, cb) => {
     const traceId = `lambda:${context.logGroupName}:${context.logStreamName}:${context.awsRequestId}`;
 
-    executionHandler(event, ciApp, traceId)
+    if (event && event.runTask === 'RunWait') {
+        waitHandler(event, ciApp)
+            .then((result) => cb(null, result))
+            .catch((err) => cb(err));
+        return;
+    }
+
+    if (event && event.runTask === 'RunBuild') {
+        buildHandler(event, ciApp, traceId)
+            .then((result) => cb(null, result))
+            .catch((err) => cb(err));
+        return;
+    }
+
+    const handler = event && event.fanout
+        ? fanoutEndHandler
+        : event && typeof event.stateVersion === 'number'
+            ? stateRefHandler
+            : executionHandler;
+
+    handler(event, ciApp, traceId)
         .then((result) => {
             if (!result) {
                 throw new Error('Missing state');
@@ -74,19 +103,451 @@ exports.handler = (event, context, cb) => {
         .catch((err) => cb(err));
 };
 
+/**
+ * Store the task token for the step function's "Wait" state,
+ * so it can be woken early (e.g. by a stop request).
+ *
+ * @param {{ taskToken: string, repoId: string, executionId: string }} input
+ * @param {CIApp} ciApp
+ * @returns {object}
+ */
+async function waitHandler(input, ciApp) {
+    await aws.updateExecution(
+        ciApp.tableExecutionsName,
+        input.repoId,
+        input.executionId,
+        {
+            waitTaskToken: input.taskToken,
+        },
+    );
+
+    return {};
+}
+
+/**
+ * Start or check one build of an execution run by the "fanout" state machine,
+ * where each build has its own child workflow.
+ *
+ * The state is read from the execution record, and only the build's own state
+ * is written back so builds in the same level can be handled concurrently.
+ *
+ * @param {{ repoId: string, executionId: string, buildKey: string, waitSeconds: number }} input
+ * @param {CIApp} ciApp
+ * @param {string} traceId
+ * @returns {object}
+ */
+async function buildHandler(input, ciApp, traceId) {
+    const execution = await aws.getExecution(
+        ciApp.tableExecutionsName,
+        input.repoId,
+        input.executionId,
+    );
+
+    if (!execution || !execution.state) {
+        throw new Error(`Execution not found: ${JSON.stringify(input.executionId)}`);
+    }
+
+    const state = execution.state;
+    const buildState = state.builds[input.buildKey];
+
+    if (!buildState) {
+        throw new Error(`Build not found: ${JSON.stringify(input.buildKey)}`);
+    }
+
+    const {
+        getAccessToken,
+        reuseBuildResult,
+        recordBuildResult,
+        queueLogArchive,
+        queueBuild,
+        startBuild,
+        pushCommitStatus,
+    } = createBuildActions(state, traceId);
+
+    const prevStatus = buildState.status;
+    const prevSourcesUploaded = state.sourcesUploaded.length;
+    const prevEncryptedOAuthToken = state.encryptedOAuthToken;
+
+    // Update lock to avoid timeout.
+    await aws.updateLock(
+        ciApp.tableLocksName,
+        util.buildLockId(
+            state.owner,
+            state.repo,
+            state.commitSHA,
+        ),
+        state.traceId,
+    );
+
+    if (buildState.status === STATUS_IN_PROGRESS) {
+        const batchGetResult = await aws.batchGetCodeBuilds([
+            aws.parseArn(buildState.codeBuild.arn).buildId,
+        ]);
+
+        const codeBuildStatus = batchGetResult.builds
+            .find(({ arn }) => arn === buildState.codeBuild.arn);
+
+        if (codeBuildStatus) {
+            buildState.codeBuild = codeBuildStatus;
+            buildState.status = codeBuildStatus.buildStatus;
+        }
+        else {
+            buildState.status = STATUS_BUILD_NOTFOUND;
+        }
+
+        if (buildState.status !== STATUS_IN_PROGRESS) {
+            await scheduler.releaseBuildSlot(ciApp, state, buildState);
+            await recordBuildResult(buildState);
+            await queueLogArchive(buildState);
+            await pushCommitStatus(buildState);
+        }
+        else if (execution.meta.stop) {
+            ciApp.logInfo(`Stopping build "${buildState.buildKey}"...`);
+            try {
+                await aws.stopCodeBuild(
+                    aws.parseArn(buildState.codeBuild.arn).buildId,
+                );
+
+                // The build no longer counts towards the concurrency limits once it is stopping.
+                await scheduler.releaseBuildSlot(ciApp, state, buildState);
+            }
+            catch (err) {
+                ciApp.logError(`Failed to stop build "${buildState.buildKey}": ${err.stack}`);
+                await scheduler.renewBuildSlots(ciApp, state, [buildState]);
+            }
+        }
+        else {
+            await scheduler.renewBuildSlots(ciApp, state, [buildState]);
+        }
+    }
+    else if (!buildState.status || buildState.status === STATUS_QUEUED) {
+        const depBuildKeys = [...new Set(buildState.buildParams.dependsOn)];
+
+        if (execution.meta.stop) {
+            ciApp.logInfo(`Not starting build "${buildState.buildKey}" since a stop was requested`);
+        }
+
+        // Dependencies are all in earlier levels, so they have ended.
+        else if (depBuildKeys.some((depBuildKey) => state.builds[depBuildKey].status !== STATUS_SUCCEEDED
+            && state.builds[depBuildKey].status !== STATUS_SKIPPED)) {
+            buildState.status = STATUS_DEPENDENCY_FAILED;
+            await pushCommitStatus(buildState);
+        }
+        else if (ciApp.tableBuildResultsName && await reuseBuildResult(buildState)) {
+            ciApp.logInfo(`Reused result for build "${buildState.buildKey}"`);
+        }
+
+        // Keep the build queued if a concurrency limit has been reached.
+        else if (!await scheduler.acquireBuildSlot(ciApp, state, buildState)) {
+            await queueBuild(buildState);
+        }
+        else {
+            ciApp.logInfo(`Starting build "${buildState.buildKey}"...`);
+
+            try {
+                await startBuild(buildState);
+            }
+            catch (err) {
+                await scheduler.releaseBuildSlot(ciApp, state, buildState);
+
+                // Keep the build queued if CodeBuild's concurrent build limit has been reached.
+                if (err.code === 'AccountLimitExceededException') {
+                    ciApp.logInfo(`Build "${buildState.buildKey}" queued since the CodeBuild build limit has been reached: ${err.message}`);
+                    await queueBuild(buildState);
+                }
+                else {
+                    ciApp.logError(`Failed to start build "${buildState.buildKey}": [${err.name}] ${err.message}`);
+
+                    // Push a failed status for the build.
+                    buildState.status = STATUS_START_CODEBUILD_FAILED;
+                    await pushCommitStatus(buildState);
+                }
+            }
+        }
+    }
+
+    const stateProps = {};
+    if (state.sourcesUploaded.length !== prevSourcesUploaded) {
+        stateProps.sourcesUploaded = state.sourcesUploaded;
+    }
+    if (state.encryptedOAuthToken !== prevEncryptedOAuthToken) {
+        stateProps.encryptedOAuthToken = state.encryptedOAuthToken;
+        stateProps.oAuthTokenExpiration = state.oAuthTokenExpiration;
+    }
+
+    ciApp.logInfo(`Updating build "${buildState.buildKey}" in execution table item...`);
+    const updatedExecution = await aws.updateExecution(
+        ciApp.tableExecutionsName,
+        state.repoId,
+        state.executionId,
+        {
+            stateProps: Object.keys(stateProps).length ? stateProps : null,
+            builds: {
+                [buildState.buildKey]: buildState,
+            },
+        },
+    );
+
+    // Only update the check run when the build's status changes, since builds are checked separately.
+    if (state.checksRunId && buildState.status !== prevStatus) {
+        const installationAccessToken = await getAccessToken();
+
+        ciApp.logInfo(`Updating check run "${state.checksName}"...`);
+        const response = await github.updateCheckRun(
+            ciApp.githubApiUrl,
+            installationAccessToken,
+            state.owner,
+            state.repo,
+            state.checksRunId,
+            state.checksName,
+            {
+                status: 'in_progress',
+                actions: getExecutionActions(updatedExecution, true),
+                output: {
+                    title: updatedExecution.meta.stop ? 'Stopping...' : 'Running builds...',
+                    summary: getExecutionSummary(updatedExecution.state),
+                },
+            },
+        );
+
+        if (response.statusCode !== 200 && response.statusCode !== 201) {
+            ciApp.logError(`Failed to create check run:\n[${response.statusCode}] ${JSON.stringify(response.data, null, 2)}`);
+        }
+    }
+
+    return {
+        repoId: input.repoId,
+        executionId: input.executionId,
+        buildKey: input.buildKey,
+        waitSeconds: input.waitSeconds,
+        isRunning: buildState.status === STATUS_IN_PROGRESS
+            || buildState.status === STATUS_QUEUED && !execution.meta.stop,
+        status: buildState.status,
+    };
+}
+
+/**
+ * End an execution run by the "fanout" state machine, using the state from the execution record.
+ *
+ * @param {{ runTask: string, repoId: string, executionId: string, errorInfo: object|null }} input
+ * @param {CIApp} ciApp
+ * @param {string} traceId
+ * @returns {object} A summary of the execution's builds.
+ */
+async function fanoutEndHandler(input, ciApp, traceId) {
+    const execution = await aws.getExecution(
+        ciApp.tableExecutionsName,
+        input.repoId,
+        input.executionId,
+    );
+
+    if (!execution || !execution.state) {
+        throw new Error(`Execution not found: ${JSON.stringify(input.executionId)}`);
+    }
+
+    const state = await executionHandler(
+        {
+            ...execution.state,
+            runTask: input.runTask,
+            errorInfo: input.errorInfo,
+            isRunning: false,
+            stopRequested: Boolean(execution.meta.stop),
+            stopSupersededBy: execution.meta.stop && execution.meta.stop.supersededBy || null,
+        },
+        ciApp,
+        traceId,
+    );
+
+    return {
+        isRunning: false,
+        repoId: state.repoId,
+        executionId: state.executionId,
+        builds: Object.values(state.builds).reduce((ret, buildState) => {
+            ret[buildState.buildKey] = buildState.status;
+            return ret;
+        }, {}),
+    };
+}
+
+/**
+ * Run a task for a state machine that passes the state by reference,
+ * loading the state from the execution record and saving it back.
+ *
+ * Only a pointer to the state is returned, so the size of the step function's
+ * input and output does not grow with the number of builds.
+ *
+ * @param {{ runTask: string, repoId: string, executionId: string, stateVersion: number, errorInfo: object|null, workflowStartTime?: string }} input
+ * @param {CIApp} ciApp
+ * @param {string} traceId
+ * @returns {object}
+ */
+async function stateRefHandler(input, ciApp, traceId) {
+    const execution = await aws.getExecution(
+        ciApp.tableExecutionsName,
+        input.repoId,
+        input.executionId,
+    );
+
+    if (!execution || !execution.state) {
+        throw new Error(`Execution not found: ${JSON.stringify(input.executionId)}`);
+    }
+
+    // The saved state can be ahead of the pointer if an invocation saved it and then failed.
+    if (execution.stateVersion !== input.stateVersion) {
+        ciApp.logWarn(`Execution state is at version ${execution.stateVersion} rather than ${input.stateVersion}`);
+    }
+
+    const stateRef = {
+        version: execution.stateVersion,
+        savedJSON: null,
+    };
+
+    const state = await executionHandler(
+        {
+            ...execution.state,
+            runTask: input.runTask,
+            errorInfo: input.errorInfo,
+        },
+        ciApp,
+        traceId,
+        stateRef,
+    );
+
+    // Save any changes made after the state was last saved (e.g. a stop request).
+    if (JSON.stringify(state) !== stateRef.savedJSON) {
+        await saveState(state, stateRef);
+    }
+
+    const pointer = {
+        runTask: state.runTask,
+        repoId: state.repoId,
+        executionId: state.executionId,
+        stateVersion: stateRef.version,
+        isRunning: state.isRunning,
+        handedOff: false,
+        waitSeconds: state.waitSeconds,
+        debounceSeconds: state.debounceSeconds,
+        errorInfo: null,
+    };
+
+    if (ciApp.stateMachineMode === 'express'
+        && state.isRunning
+        && isExpressHandoffDue(input.workflowStartTime, state.waitSeconds)) {
+        return await handOffExpressWorkflow(pointer, ciApp);
+    }
+
+    return pointer;
+}
+
+/**
+ * Check if an "express" state machine execution must hand off to a new execution
+ * before it would reach the express workflow duration limit during the next wait.
+ *
+ * @param {string} [workflowStartTime]
+ * @param {number} waitSeconds
+ * @returns {boolean}
+ */
+function isExpressHandoffDue(workflowStartTime, waitSeconds) {
+    if (!workflowStartTime) {
+        return false;
+    }
+
+    const elapsedSeconds = (Date.now() - new Date(workflowStartTime).getTime()) / 1000;
+    return elapsedSeconds + waitSeconds + EXPRESS_HANDOFF_MARGIN_SECONDS >= EXPRESS_MAX_DURATION_SECONDS;
+}
+
+/**
+ * Continue an execution in a new "express" state machine execution,
+ * which starts by waiting for the poll interval.
+ *
+ * @param {object} pointer
+ * @param {CIApp} ciApp
+ * @returns {object} The pointer for the current execution, which ends without running "RunEnd".
+ */
+async function handOffExpressWorkflow(pointer, ciApp) {
+    const execResult = await aws.startStepFunctionExecution({
+        stateMachineArn: ciApp.stateMachineArn,
+        input: JSON.stringify({
+            ...pointer,
+            debounceSeconds: pointer.waitSeconds,
+        }),
+    });
+
+    ciApp.logInfo(`Handed off to state machine execution ARN:${execResult.executionArn}`);
+
+    await aws.updateExecution(
+        ciApp.tableExecutionsName,
+        pointer.repoId,
+        pointer.executionId,
+        {
+            meta: {
+                executionArn: execResult.executionArn,
+            },
+        },
+    );
+
+    return {
+        ...pointer,
+        isRunning: false,
+        handedOff: true,
+    };
+}
+
+/**
+ * Save the state to the execution record.
+ *
+ * If the state is passed by reference, it is only saved if no other
+ * invocation has saved it since it was loaded.
+ *
+ * @param {StateInput} state
+ * @param {{ version: number, savedJSON: string|null }|null} stateRef
+ * @param {object} [updates]
+ * @returns {Promise<object>} The updated execution.
+ */
+async function saveState(state, stateRef, updates = {}) {
+    ciApp.logInfo('Updating execution table item...');
+    const execution = await aws.updateExecution(
+        ciApp.tableExecutionsName,
+        state.repoId,
+        state.executionId,
+        {
+            ...updates,
+            state,
+            expectedStateVersion: stateRef ? stateRef.version : null,
+        },
+    );
+
+    if (stateRef) {
+        stateRef.version = execution.stateVersion;
+        stateRef.savedJSON = JSON.stringify(state);
+    }
+
+    return execution;
+}
+
 /**
  * @param {StateInput} state
  * @param {CIApp} ciApp
  * @param {string} traceId
+ * @param {{ version: number, savedJSON: string|null }|null} [stateRef] - Set if the state is passed by reference.
  * @returns {StateInput}
  */
-async function executionHandler(state, ciApp, traceId) {
-    let installationAccessToken = null;
-
+async function executionHandler(state, ciApp, traceId, stateRef = null) {
     if (!state) {
         throw new Error('Missing state');
     }
 
+    const {
+        getAccessToken,
+        resolveDependents,
+        reuseBuildResult,
+        recordBuildResult,
+        queueLogArchive,
+        queueBuild,
+        startBuild,
+        pushCommitStatus,
+    } = createBuildActions(state, traceId);
+
     if (state.runTask === 'RunError' || state.runTask === 'RunEnd') {
         let title;
         let conclusion;
@@ -102,7 +563,9 @@ async function executionHandler(state, ciApp, traceId) {
             ciApp.logInfo('Execution completed');
 
             if (state.stopRequested) {
-                title = 'Stopped by User';
+                title = state.stopSupersededBy
+                    ? 'Superseded by a newer commit'
+                    : 'Stopped by User';
                 conclusion = 'STOPPED';
                 checkRunConclusion = 'cancelled';
             }
@@ -141,20 +604,17 @@ async function executionHandler(state, ciApp, traceId) {
             }
         }
 
-        ciApp.logInfo('Updating execution table item...');
-        const execution = await aws.updateExecution(
-            ciApp.tableExecutionsName,
-            state.repoId,
-            state.executionId,
+        const execution = await saveState(
+            state,
+            stateRef,
             {
                 status: 'COMPLETED',
                 conclusion,
-                state,
             },
         );
 
         if (state.checksRunId) {
-            installationAccessToken = installationAccessToken || await getToken(state);
+            const installationAccessToken = await getAccessToken();
 
             ciApp.logInfo(`Updating check run "${state.checksName}"...`);
             const response = await github.updateCheckRun(
@@ -181,6 +641,9 @@ async function executionHandler(state, ciApp, traceId) {
             }
         }
 
+        // Release any build slots that are still held (e.g. if the execution errored).
+        await scheduler.releaseAllBuildSlots(ciApp, state);
+
         ciApp.logInfo('Releasing lock...');
         try {
             // Release the lock.
@@ -228,6 +691,7 @@ async function executionHandler(state, ciApp, traceId) {
         }, {});
 
     // Check status of running builds.
+    const endedBuildKeys = [];
     const runningBuildArns = Object.keys(buildArnToStateMap);
     if (runningBuildArns.length) {
         // Get the current status of the CodeBuild builds.
@@ -252,7 +716,7 @@ async function executionHandler(state, ciApp, traceId) {
         }
 
         // Mark any builds that were not found as failed.
-        if (missingBuildArns.length) {
+        if (missingBuildArns.size) {
             for (const buildArn of missingBuildArns) {
                 const buildState = buildArnToStateMap[buildArn];
                 buildState.status = STATUS_BUILD_NOTFOUND;
@@ -260,71 +724,117 @@ async function executionHandler(state, ciApp, traceId) {
             }
         }
 
-        // Push status updates to GitHub.
+        // Renew the build slots of builds that are still running.
+        await scheduler.renewBuildSlots(
+            ciApp,
+            state,
+            Object.values(buildArnToStateMap)
+                .filter((buildState) => buildState.status === STATUS_IN_PROGRESS),
+        );
+
+        // Free the build slots of ended builds and push status updates to GitHub.
         if (endedBuilds.length) {
             for (const buildState of endedBuilds) {
+                await scheduler.releaseBuildSlot(ciApp, state, buildState);
+                await recordBuildResult(buildState);
+                await queueLogArchive(buildState);
                 await pushCommitStatus(buildState);
+                endedBuildKeys.push(buildState.buildKey);
             }
         }
     }
 
-    // Start builds.
-    for (const [buildKey, buildState] of Object.entries(state.builds)) {
-        if (state.stopRequested) {
-            break;
+    // Check for a stop request before starting the first builds, since
+    // the execution may have been superseded while debouncing.
+    if (!state.stopRequested && Object.values(state.builds)
+        .every((buildState) => !buildState.status || buildState.status === STATUS_SKIPPED || buildState.reusedResult)) {
+        const pendingExecution = await aws.getExecution(
+            ciApp.tableExecutionsName,
+            state.repoId,
+            state.executionId,
+        );
+
+        if (pendingExecution && pendingExecution.meta.stop) {
+            ciApp.logInfo('Execution stop requested before builds started');
+            state.stopRequested = true;
+            state.stopSupersededBy = pendingExecution.meta.stop.supersededBy || null;
         }
+    }
 
-        // Check builds that have yet to start.
-        if (!buildState.status || buildState.status === STATUS_WAITING_FOR_DEPENDENCY) {
-            let canRun = true;
-            let failedDeps = false;
-            buildState.waitingForDeps = [];
+    // Executions started before the dependency graph was persisted won't have one.
+    if (!state.graph) {
+        endedBuildKeys.push(...initBuildGraph(state));
+    }
 
-            // Check any dependencies of the build.
-            for (const depBuildKey of buildState.buildParams.dependsOn) {
-                const depBuildState = state.builds[depBuildKey];
+    // Update the dependents of builds that just ended.
+    await resolveDependents(endedBuildKeys);
 
-                // Don't start if a dependency hasn't completed yet.
-                if (!depBuildState.status
-                    || depBuildState.status === STATUS_IN_PROGRESS
-                    || depBuildState.status === STATUS_WAITING_FOR_DEPENDENCY) {
-                    canRun = false;
-                    buildState.waitingForDeps.push(depBuildKey);
-                }
+    // Mark builds that are waiting on dependencies and push their status.
+    for (const buildState of Object.values(state.builds)) {
+        if (!buildState.status && buildState.waitingForDeps.length) {
+            ciApp.logInfo(`Build "${buildState.buildKey}" waiting on deps: ${buildState.waitingForDeps.map((v) => JSON.stringify(v)).join(',')}`);
+            buildState.status = STATUS_WAITING_FOR_DEPENDENCY;
+            await pushCommitStatus(buildState);
+        }
+    }
 
-                // Fail if dependency failed.
-                else if (depBuildState.status !== STATUS_SUCCEEDED) {
-                    canRun = false;
-                    failedDeps = true;
+    // Reuse the results of identical builds that have already succeeded,
+    // which may make their dependents ready too.
+    if (ciApp.tableBuildResultsName) {
+        let reusedBuildKeys;
+        do {
+            reusedBuildKeys = [];
+            for (const buildKey of state.readyBuildKeys) {
+                if (!state.stopRequested && await reuseBuildResult(state.builds[buildKey])) {
+                    reusedBuildKeys.push(buildKey);
                 }
             }
 
-            if (failedDeps) {
-                buildState.status = STATUS_DEPENDENCY_FAILED;
-                await pushCommitStatus(buildState);
-            }
-            else if (canRun) {
-                ciApp.logInfo(`Starting build "${buildKey}"...`);
+            state.readyBuildKeys = state.readyBuildKeys.filter((key) => !reusedBuildKeys.includes(key));
+            await resolveDependents(reusedBuildKeys);
+        } while (reusedBuildKeys.length);
+    }
 
-                try {
-                    await startBuild(buildState);
-                }
-                catch (err) {
-                    ciApp.logError(`Failed to start build "${buildKey}": [${err.name}] ${err.message}`);
+    // Start builds that are ready, with the longest remaining chain of builds first.
+    const readyBuildKeys = state.readyBuildKeys
+        .slice()
+        .sort((a, b) => (state.graph.criticalPath[b] || 0) - (state.graph.criticalPath[a] || 0));
 
-                    // Push a failed status for the build.
-                    buildState.status = STATUS_START_CODEBUILD_FAILED;
-                    await pushCommitStatus(buildState);
-                }
+    for (const buildKey of readyBuildKeys) {
+        if (state.stopRequested) {
+            break;
+        }
+
+        const buildState = state.builds[buildKey];
+
+        // Keep the build queued if a concurrency limit has been reached.
+        if (!await scheduler.acquireBuildSlot(ciApp, state, buildState)) {
+            await queueBuild(buildState);
+            continue;
+        }
+
+        ciApp.logInfo(`Starting build "${buildKey}"...`);
+        state.readyBuildKeys = state.readyBuildKeys.filter((key) => key !== buildKey);
+
+        try {
+            await startBuild(buildState);
+        }
+        catch (err) {
+            await scheduler.releaseBuildSlot(ciApp, state, buildState);
+
+            // Keep the build queued if CodeBuild's concurrent build limit has been reached.
+            if (err.code === 'AccountLimitExceededException') {
+                ciApp.logInfo(`Build "${buildKey}" queued since the CodeBuild build limit has been reached: ${err.message}`);
+                state.readyBuildKeys.push(buildKey);
+                await queueBuild(buildState);
             }
             else {
-                ciApp.logInfo(`Build "${buildKey}" waiting on deps: ${buildState.waitingForDeps.map((v) => JSON.stringify(v)).join(',')}`);
+                ciApp.logError(`Failed to start build "${buildKey}": [${err.name}] ${err.message}`);
 
-                // Mark the build as waiting on deps and push its status.
-                if (!buildState.status) {
-                    buildState.status = STATUS_WAITING_FOR_DEPENDENCY;
-                    await pushCommitStatus(buildState);
-                }
+                // Push a failed status for the build.
+                buildState.status = STATUS_START_CODEBUILD_FAILED;
+                await pushCommitStatus(buildState);
+                await resolveDependents([buildKey]);
             }
         }
     }
@@ -332,20 +842,16 @@ async function executionHandler(state, ciApp, traceId) {
     // Keep running if there are builds that have yet to complete.
     // TODO: Handling skipped builds?
     state.isRunning = Object.values(state.builds)
-        .some((buildState) => !state.stopRequested && !buildState.status || buildState.status === STATUS_IN_PROGRESS);
+        .some((buildState) => !state.stopRequested && (!buildState.status || buildState.status === STATUS_QUEUED)
+            || buildState.status === STATUS_IN_PROGRESS);
 
     if (!state.isRunning) {
         ciApp.logInfo('All builds for execution complete');
     }
 
-    ciApp.logInfo('Updating execution table item...');
-    const execution = await aws.updateExecution(
-        ciApp.tableExecutionsName,
-        state.repoId,
-        state.executionId,
-        {
-            state,
-        },
+    const execution = await saveState(
+        state,
+        stateRef,
     );
 
     // Stop builds if the API has requested this execution to stop.
@@ -354,24 +860,20 @@ async function executionHandler(state, ciApp, traceId) {
 
         // state.isRunning = false;
         state.stopRequested = true;
+        state.stopSupersededBy = execution.meta.stop.supersededBy || null;
 
-        for (const [buildKey, buildState] of Object.entries(state.builds)) {
-            if (buildState.codeBuild && buildState.codeBuild.buildStatus === STATUS_IN_PROGRESS) {
-                try {
-                    ciApp.logInfo(`Stopping build "${buildKey}"...`);
-                    await aws.stopCodeBuild(
-                        aws.parseArn(buildState.codeBuild.arn).buildId,
-                    );
-                }
-                catch (err) {
-                    ciApp.logError(`Failed to stop build "${buildKey}" for execution "${state.executionId}": ${err.stack}`);
-                }
+        const failedBuildKeys = await stopExecutionBuilds(ciApp, execution);
+
+        // Builds no longer count towards the concurrency limits once they are stopping.
+        for (const buildState of Object.values(state.builds)) {
+            if (buildState.status === STATUS_IN_PROGRESS && !failedBuildKeys.includes(buildState.buildKey)) {
+                await scheduler.releaseBuildSlot(ciApp, state, buildState);
             }
         }
     }
 
     if (state.checksRunId) {
-        installationAccessToken = installationAccessToken || await getToken(state);
+        const installationAccessToken = await getAccessToken();
 
         ciApp.logInfo(`Updating check run "${state.checksName}"...`);
         const response = await github.updateCheckRun(
@@ -397,6 +899,194 @@ async function executionHandler(state, ciApp, traceId) {
     }
 
     return state;
+}
+
+/**
+ * Create the helpers that act on the builds of an execution's state.
+ *
+ * The GitHub access token is only fetched once it is needed, and is then shared by the helpers.
+ *
+ * @param {StateInput} state
+ * @param {string} traceId
+ * @returns {object}
+ */
+function createBuildActions(state, traceId) {
+    let installationAccessToken = null;
+
+    return {
+        getAccessToken,
+        resolveDependents,
+        reuseBuildResult,
+        recordBuildResult,
+        queueLogArchive,
+        queueBuild,
+        startBuild,
+        pushCommitStatus,
+    };
+
+    async function getAccessToken() {
+        installationAccessToken = installationAccessToken || await getToken(state);
+        return installationAccessToken;
+    }
+
+    /**
+     * Remove ended builds from the dependencies their dependents are waiting for,
+     * marking dependents as ready or, if a dependency did not succeed, as failed.
+     *
+     * @param {string[]} buildKeys
+     */
+    async function resolveDependents(buildKeys) {
+        const pending = buildKeys.slice();
+
+        while (pending.length) {
+            const depBuildKey = pending.shift();
+            const depBuildState = state.builds[depBuildKey];
+
+            for (const buildKey of state.graph.dependents[depBuildKey] || []) {
+                const buildState = state.builds[buildKey];
+
+                if (buildState.status && buildState.status !== STATUS_WAITING_FOR_DEPENDENCY) {
+                    continue;
+                }
+
+                buildState.waitingForDeps = buildState.waitingForDeps.filter((key) => key !== depBuildKey);
+
+                // Fail if dependency failed, and then fail its dependents too.
+                if (depBuildState.status !== STATUS_SUCCEEDED) {
+                    buildState.status = STATUS_DEPENDENCY_FAILED;
+                    buildState.waitingForDeps = [];
+                    await pushCommitStatus(buildState);
+                    pending.push(buildKey);
+                }
+                else if (!buildState.waitingForDeps.length) {
+                    state.readyBuildKeys.push(buildKey);
+                }
+            }
+        }
+    }
+
+    /**
+     * Mark a build as succeeded if an identical build has already succeeded.
+     *
+     * @param {BuildState} buildState
+     * @returns {Promise<boolean>} True if the result was reused.
+     */
+    async function reuseBuildResult(buildState) {
+        if (!buildState.buildParams.reuseResult || !buildState.resultKey) {
+            return false;
+        }
+
+        let result;
+        try {
+            result = await aws.getBuildResult(
+                ciApp.tableBuildResultsName,
+                buildState.resultKey,
+            );
+        }
+        catch (err) {
+            ciApp.logError(`Failed to get build result for "${buildState.buildKey}": ${err.message}`);
+            return false;
+        }
+
+        if (!result) {
+            return false;
+        }
+
+        ciApp.logInfo(`Reusing result of build "${result.buildKey}" from "${result.executionId}" for "${buildState.buildKey}"`);
+        buildState.status = STATUS_SUCCEEDED;
+        buildState.waitingForDeps = [];
+        buildState.reusedResult = {
+            repoId: result.repoId,
+            executionId: result.executionId,
+            buildKey: result.buildKey,
+            codeBuildArn: result.codeBuildArn,
+            artifactsLocation: result.artifactsLocation,
+        };
+
+        await pushCommitStatus(buildState);
+        return true;
+    }
+
+    /**
+     * Record the result of a successful build so identical builds can reuse it.
+     *
+     * @param {BuildState} buildState
+     */
+    async function recordBuildResult(buildState) {
+        if (!ciApp.tableBuildResultsName
+            || !buildState.buildParams.reuseResult
+            || !buildState.resultKey
+            || buildState.status !== STATUS_SUCCEEDED) {
+            return;
+        }
+
+        try {
+            await aws.putBuildResult(
+                ciApp.tableBuildResultsName,
+                buildState.resultKey,
+                {
+                    repoId: state.repoId,
+                    executionId: state.executionId,
+                    buildKey: buildState.buildKey,
+                    codeBuildArn: buildState.codeBuild.arn,
+                    artifactsLocation: buildState.codeBuild.artifacts && buildState.codeBuild.artifacts.location || null,
+                },
+            );
+        }
+        catch (err) {
+            ciApp.logError(`Failed to record build result for "${buildState.buildKey}": ${err.message}`);
+        }
+    }
+
+    // Queue the logs of an ended build to be archived to S3 under its artifact prefix,
+    // once they have settled (see archiveLogs.js). The archive can be read once its index exists.
+    async function queueLogArchive(buildState) {
+        const logs = buildState.codeBuild && buildState.codeBuild.logs;
+        if (!ciApp.logArchiveQueueUrl || buildState.buildParams.noArtifacts || !logs || !logs.streamName) {
+            return;
+        }
+
+        const artifactS3KeyPrefix = buildState.buildParams.artifactS3KeyPrefix
+            .replace('{GitHubDomain}', ciApp.githubHost)
+            .replace('{GitHubUser}', state.owner)
+            .replace('{GitHubRepo}', state.repo);
+
+        const keyPrefix = `${artifactS3KeyPrefix}logs/${aws.parseArn(buildState.codeBuild.arn).buildId}/`;
+        const logsArchive = {
+            bucket: buildState.buildParams.artifactS3Bucket,
+            key: `${keyPrefix}events.ndjson.gz`,
+            indexKey: `${keyPrefix}index.json`,
+        };
+
+        try {
+            await aws.sendSQSMessage({
+                QueueUrl: ciApp.logArchiveQueueUrl,
+                DelaySeconds: LOG_ARCHIVE_SETTLE_SECONDS,
+                MessageBody: JSON.stringify({
+                    repoId: state.repoId,
+                    executionId: state.executionId,
+                    buildKey: buildState.buildKey,
+                    logs: {
+                        groupName: logs.groupName,
+                        streamName: logs.streamName,
+                    },
+                    logsArchive,
+                }),
+            });
+
+            buildState.logsArchive = logsArchive;
+        }
+        catch (err) {
+            ciApp.logError(`Failed to queue log archive for "${buildState.buildKey}": ${err.message}`);
+        }
+    }
+
+    async function queueBuild(buildState) {
+        if (buildState.status !== STATUS_QUEUED) {
+            buildState.status = STATUS_QUEUED;
+            await pushCommitStatus(buildState);
+        }
+    }
 
     async function startBuild(buildState) {
         buildState.status = STATUS_STARTING;
@@ -543,11 +1233,12 @@ async function executionHandler(state, ciApp, traceId) {
         let commitState = 'failure';
         if (!buildState.status
             || buildState.status === STATUS_WAITING_FOR_DEPENDENCY
+            || buildState.status === STATUS_QUEUED
             || buildState.status === STATUS_STARTING
             || buildState.status === STATUS_IN_PROGRESS) {
             commitState = 'pending';
         }
-        else if (buildState.status === STATUS_SUCCEEDED) {
+        else if (buildState.status === STATUS_SUCCEEDED || buildState.status === STATUS_SKIPPED) {
             commitState = 'success';
         }
 
@@ -558,6 +1249,9 @@ async function executionHandler(state, ciApp, traceId) {
         else if (buildState.status === STATUS_DEPENDENCY_FAILED) {
             description = 'Dependency failed';
         }
+        else if (buildState.status === STATUS_QUEUED) {
+            description = 'Queued...';
+        }
         else if (buildState.status === STATUS_STARTING) {
             description = 'Starting...';
         }
@@ -565,7 +1259,12 @@ async function executionHandler(state, ciApp, traceId) {
             description = 'Running...';
         }
         else if (buildState.status === STATUS_SUCCEEDED) {
-            description = 'Successful';
+            description = buildState.reusedResult
+                ? 'Successful (reused result)'
+                : 'Successful';
+        }
+        else if (buildState.status === STATUS_SKIPPED) {
+            description = 'Skipped';
         }
         else if (buildState.status === STATUS_FAILED) {
             description = 'Failed';
@@ -591,6 +1290,47 @@ async function executionHandler(state, ciApp, traceId) {
     }
 }
 
+/**
+ * Compile the dependency graph for a state that does not have one,
+ * and work out which builds are waiting or ready from their statuses.
+ *
+ * @param {StateInput} state
+ * @returns {string[]} The keys of builds that have ended without succeeding,
+ *                     whose dependents still need to be resolved.
+ */
+function initBuildGraph(state) {
+    state.graph = schema.compileBuildGraph(
+        Object.entries(state.builds).reduce((ret, [buildKey, buildState]) => {
+            ret[buildKey] = buildState.buildParams;
+            return ret;
+        }, {}),
+    );
+
+    state.readyBuildKeys = [];
+    const failedBuildKeys = [];
+
+    for (const buildState of Object.values(state.builds)) {
+        if (buildState.status && buildState.status !== STATUS_WAITING_FOR_DEPENDENCY && buildState.status !== STATUS_QUEUED) {
+            if (buildState.status !== STATUS_SUCCEEDED
+                && buildState.status !== STATUS_SKIPPED
+                && buildState.status !== STATUS_IN_PROGRESS) {
+                failedBuildKeys.push(buildState.buildKey);
+            }
+            continue;
+        }
+
+        buildState.waitingForDeps = [...new Set(buildState.buildParams.dependsOn)]
+            .filter((depBuildKey) => state.builds[depBuildKey].status !== STATUS_SUCCEEDED
+                && state.builds[depBuildKey].status !== STATUS_SKIPPED);
+
+        if (!buildState.waitingForDeps.length) {
+            state.readyBuildKeys.push(buildState.buildKey);
+        }
+    }
+
+    return failedBuildKeys;
+}
+
 function getExecutionSummary(state) {
     const buildsTable = [
         '| Build | Status | Phase | Duration |',
@@ -609,11 +1349,13 @@ function getExecutionSummary(state) {
                         return 0;
                     }
                 })
-                .map(({ buildKey, status, codeBuild }) => {
+                .map(({ buildKey, status, codeBuild, reusedResult }) => {
                     const icon = statusToEmoji[status] || '';
                     const { commit, executionNum } = util.parseExecutionId(state.executionId);
                     const link = `${ciApp.baseUrl}/app/repo/${state.repoId}/commit/${commit}/exec/${executionNum}/build/${buildKey}`;
-                    const currentPhase = codeBuild && codeBuild.currentPhase;
+                    const currentPhase = codeBuild
+                        ? codeBuild.currentPhase
+                        : reusedResult && 'Reused Result';
                     const duration = codeBuild && codeBuild.startTime && codeBuild.endTime
                         ? `${Math.round((util.toEpochTime(codeBuild.endTime) - util.toEpochTime(codeBuild.startTime)) / 1000)}s`
                         : '-';
@@ -633,6 +1375,10 @@ function getExecutionSummary(state) {
 }
 
 async function prepareGitHubSource(inFileName, outFileName) {
+    // Only loaded when source is uploaded, rather than on every poll.
+    const yauzl = require('yauzl');
+    const archiver = require('archiver');
+
     return new Promise((resolve, reject) => {
         const catchAndReject = (fn) => {
             return function catchAndReject(...args) {
@@ -765,3 +1511,7 @@ async function getToken(state) {
         return await aws.decryptString(state.encryptedOAuthToken);
     }
 }
+
+// Exported for the step lambda benchmarks (see __benchmarks__).
+exports.getExecutionSummary = getExecutionSummary;
+exports.prepareGitHubSource = prepareGitHubSource;
@@ -0,0 +1,294 @@
+'use strict';
+
+// A DynamoDB table in memory, behind a stand-in for the DocumentClient.
+const mockTable = new Map();
+const mockCalls = [];
+
+jest.mock('aws-sdk/clients/dynamodb', () => {
+    function request(fn) {
+        return {
+            promise: async () => fn(),
+        };
+    }
+
+    function resolvePath(path, names) {
+        return path.split('.').map((part) => names && names[part] || part);
+    }
+
+    function getPath(item, path, names) {
+        return resolvePath(path, names).reduce((ret, key) => (ret == null ? undefined : ret[key]), item);
+    }
+
+    // Only the expressions used by the functions under test are supported.
+    function isConditionMet(item, condition, names, values) {
+        if (!condition) {
+            return true;
+        }
+
+        return condition.split(' AND ').every((term) => term.replace(/^\((.*)\)$/, '$1').split(' OR ').some((atom) => {
+            let match;
+            if ((match = atom.match(/^attribute_(not_)?exists\((\S+)\)$/))) {
+                return (getPath(item, match[2], names) === undefined) === Boolean(match[1]);
+            }
+            if ((match = atom.match(/^size\((\S+)\) < (:\w+)$/))) {
+                return Object.keys(getPath(item, match[1], names) || {}).length < values[match[2]];
+            }
+            if ((match = atom.match(/^(\S+) < (:\w+)$/))) {
+                return getPath(item, match[1], names) < values[match[2]];
+            }
+            throw new Error(`Unsupported condition: ${atom}`);
+        }));
+    }
+
+    function applyUpdate(item, expression, names, values) {
+        const updated = JSON.parse(JSON.stringify(item));
+
+        for (const [, action, clause] of expression.matchAll(/(SET|REMOVE) (.*?)(?= SET | REMOVE |$)/g)) {
+            for (const part of clause.split(', ')) {
+                const [path, value] = part.split(' = ');
+                const keys = resolvePath(path, names);
+                const parent = keys.slice(0, -1).reduce((ret, key) => ret[key], updated);
+
+                if (action === 'SET') {
+                    parent[keys[keys.length - 1]] = JSON.parse(JSON.stringify(values[value]));
+                }
+                else {
+                    delete parent[keys[keys.length - 1]];
+                }
+            }
+        }
+
+        return updated;
+    }
+
+    function conditionalCheckFailed() {
+        const err = new Error('The conditional request failed');
+        err.code = 'ConditionalCheckFailedException';
+        return err;
+    }
+
+    class DocumentClient {
+        get(params) {
+            mockCalls.push(['get', params]);
+            return request(() => ({
+                Item: mockTable.get(params.Key.id),
+            }));
+        }
+
+        update(params) {
+            mockCalls.push(['update', params]);
+            return request(() => {
+                const item = mockTable.get(params.Key.id);
+                if (!isConditionMet(item, params.ConditionExpression, params.ExpressionAttributeNames, params.ExpressionAttributeValues)) {
+                    throw conditionalCheckFailed();
+                }
+
+                mockTable.set(params.Key.id, applyUpdate(item || params.Key, params.UpdateExpression, params.ExpressionAttributeNames, params.ExpressionAttributeValues));
+                return {};
+            });
+        }
+
+        transactWrite(params) {
+            mockCalls.push(['transactWrite', params]);
+            return request(() => {
+                const items = params.TransactItems.map(({ Put, Update }) => {
+                    const operation = Put || Update;
+                    const id = Put ? Put.Item.id : Update.Key.id;
+                    const item = mockTable.get(id);
+
+                    if (!isConditionMet(item, operation.ConditionExpression, operation.ExpressionAttributeNames, operation.ExpressionAttributeValues)) {
+                        const err = new Error('Transaction cancelled, please refer cancellation reasons for specific reasons [ConditionalCheckFailed]');
+                        err.code = 'TransactionCanceledException';
+                        throw err;
+                    }
+
+                    return [id, Put
+                        ? Put.Item
+                        : applyUpdate(item || Update.Key, Update.UpdateExpression, Update.ExpressionAttributeNames, Update.ExpressionAttributeValues)];
+                });
+
+                for (const [id, item] of items) {
+                    mockTable.set(id, item);
+                }
+                return {};
+            });
+        }
+
+        batchWrite(params) {
+            mockCalls.push(['batchWrite', params]);
+            return request(() => {
+                for (const requests of Object.values(params.RequestItems)) {
+                    for (const { DeleteRequest } of requests) {
+                        mockTable.delete(DeleteRequest.Key.id);
+                    }
+                }
+                return {};
+            });
+        }
+    }
+
+    class DynamoDB {}
+    DynamoDB.DocumentClient = DocumentClient;
+
+    return DynamoDB;
+});
+
+// Record the services captured by X-Ray, without tracing them.
+const mockCapturedServices = [];
+jest.mock('aws-xray-sdk', () => ({
+    captureAWS: (sdk) => {
+        mockCapturedServices.push(...Object.keys(sdk));
+        return sdk;
+    },
+}));
+
+const aws = require('../../../../src/lambda/util/aws');
+
+describe('aws', () => {
+
+    beforeEach(() => {
+        mockTable.clear();
+        mockCalls.length = 0;
+    });
+
+    describe('claimWebhookDelivery and releaseWebhookDelivery', () => {
+        const entries = [
+            { id: 'delivery:1234', expireSeconds: 86400 },
+            { id: 'event:owner/repo:abc:push', expireSeconds: 60 },
+        ];
+
+        it('should claim every key in one transaction', async () => {
+            expect(await aws.claimWebhookDelivery('deliveries', entries, { traceId: 'trace' })).toBe(true);
+
+            expect(mockCalls.length).toBe(1);
+            expect(mockCalls[0][0]).toBe('transactWrite');
+            expect(mockCalls[0][1].TransactItems.map(({ Put }) => Put.Item.id)).toEqual([
+                'delivery:1234',
+                'event:owner/repo:abc:push',
+            ]);
+            expect(mockTable.get('event:owner/repo:abc:push').meta).toEqual({ traceId: 'trace' });
+        });
+
+        it('should not claim any key if one is already claimed', async () => {
+            expect(await aws.claimWebhookDelivery('deliveries', [entries[1]], {})).toBe(true);
+            expect(await aws.claimWebhookDelivery('deliveries', entries, {})).toBe(false);
+
+            expect(mockTable.has('delivery:1234')).toBe(false);
+        });
+
+        it('should claim keys again once they have expired', async () => {
+            mockTable.set('delivery:1234', {
+                id: 'delivery:1234',
+                expireTime: Date.now() - 1000,
+            });
+
+            expect(await aws.claimWebhookDelivery('deliveries', entries, {})).toBe(true);
+        });
+
+        it('should have X-Ray trace the DynamoDB service', async () => {
+            await aws.claimWebhookDelivery('deliveries', entries, {});
+
+            expect(mockCapturedServices).toEqual(['DynamoDB']);
+        });
+
+        it('should allow released keys to be claimed again', async () => {
+            expect(await aws.claimWebhookDelivery('deliveries', entries, {})).toBe(true);
+
+            await aws.releaseWebhookDelivery('deliveries', entries.map(({ id }) => id));
+            expect(mockTable.size).toBe(0);
+
+            expect(await aws.claimWebhookDelivery('deliveries', entries, {})).toBe(true);
+        });
+    });
+
+    describe('acquireBuildSlot, renewBuildSlots and releaseBuildSlots', () => {
+        const scopes = [
+            { id: 'account', limit: 2 },
+            { id: 'repo:1', limit: 1 },
+        ];
+
+        it('should take a lease in every scope in one transaction', async () => {
+            expect(await aws.acquireBuildSlot('slots', 'a', scopes, 600)).toBe(true);
+
+            expect(mockCalls.filter(([name]) => name === 'transactWrite').length).toBe(1);
+            expect(Object.keys(mockTable.get('account').leases)).toEqual(['a']);
+            expect(Object.keys(mockTable.get('repo:1').leases)).toEqual(['a']);
+            expect(mockTable.get('account').leases.a).toBeGreaterThan(Date.now() + 599000);
+        });
+
+        it('should not take any lease if a scope is at its limit', async () => {
+            expect(await aws.acquireBuildSlot('slots', 'a', scopes, 600)).toBe(true);
+            expect(await aws.acquireBuildSlot('slots', 'b', scopes, 600)).toBe(false);
+
+            expect(Object.keys(mockTable.get('account').leases)).toEqual(['a']);
+        });
+
+        it('should renew the lease of a holder that already has one', async () => {
+            expect(await aws.acquireBuildSlot('slots', 'a', scopes, 600)).toBe(true);
+            expect(await aws.acquireBuildSlot('slots', 'a', scopes, 1200)).toBe(true);
+
+            expect(mockTable.get('repo:1').leases.a).toBeGreaterThan(Date.now() + 1199000);
+        });
+
+        it('should not count expired leases, and remove them', async () => {
+            mockTable.set('repo:1', {
+                id: 'repo:1',
+                leases: {
+                    a: Date.now() - 1000,
+                },
+            });
+
+            expect(await aws.acquireBuildSlot('slots', 'b', scopes, 600)).toBe(true);
+
+            expect(Object.keys(mockTable.get('repo:1').leases)).toEqual(['b']);
+        });
+
+        it('should not take a lease if an expired lease is renewed after it was read', async () => {
+            mockTable.set('repo:1', {
+                id: 'repo:1',
+                leases: {
+                    a: Date.now() + 600000,
+                },
+            });
+
+            // Read the lease as it was before it was renewed.
+            const getTableItemByKey = aws.getTableItemByKey;
+            aws.getTableItemByKey = async (tableName, key) => (key.id === 'repo:1'
+                ? { id: 'repo:1', leases: { a: Date.now() - 1000 } }
+                : getTableItemByKey(tableName, key));
+
+            try {
+                expect(await aws.acquireBuildSlot('slots', 'b', scopes, 600)).toBe(false);
+            }
+            finally {
+                aws.getTableItemByKey = getTableItemByKey;
+            }
+
+            expect(Object.keys(mockTable.get('repo:1').leases)).toEqual(['a']);
+        });
+
+        it('should extend the leases of holders', async () => {
+            expect(await aws.acquireBuildSlot('slots', 'a', scopes, 60)).toBe(true);
+
+            await aws.renewBuildSlots('slots', { account: ['a'], 'repo:1': ['a'] }, 600);
+
+            expect(mockTable.get('account').leases.a).toBeGreaterThan(Date.now() + 599000);
+            expect(mockTable.get('repo:1').leases.a).toBeGreaterThan(Date.now() + 599000);
+        });
+
+        it('should free the slots of released holders', async () => {
+            expect(await aws.acquireBuildSlot('slots', 'a', scopes, 600)).toBe(true);
+
+            await aws.releaseBuildSlots('slots', { account: ['a'], 'repo:1': ['a'] });
+
+            expect(mockTable.get('account').leases).toEqual({});
+            expect(await aws.acquireBuildSlot('slots', 'b', scopes, 600)).toBe(true);
+        });
+
+        it('should skip scopes without leases', async () => {
+            await aws.releaseBuildSlots('slots', { 'repo:2': ['a'] });
+
+            expect(mockTable.has('repo:2')).toBe(false);
+        });
+    });
+});
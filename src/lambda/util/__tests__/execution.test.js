@@ -0,0 +1,47 @@
+'use strict';
+
+// The functions under test do not call AWS or GitHub.
+jest.mock('../../../../src/lambda/util/aws', () => ({}));
+jest.mock('../../../../src/lambda/util/github', () => ({}));
+
+const {
+    getDebounceSeconds,
+    getExecutionSummaryJSON,
+    EXPRESS_MAX_DURATION_SECONDS,
+    EXPRESS_HANDOFF_MARGIN_SECONDS,
+} = require('../../../../src/lambda/util/execution');
+
+describe('execution', () => {
+
+    describe('getDebounceSeconds', () => {
+        it('should not limit the debounce for standard state machines', () => {
+            expect(getDebounceSeconds({ stateMachineMode: 'standard' }, 300)).toBe(300);
+            expect(getDebounceSeconds({ stateMachineMode: 'fanout' }, 300)).toBe(300);
+        });
+
+        it('should leave time to run and hand off within an express workflow', () => {
+            const debounceSeconds = getDebounceSeconds({ stateMachineMode: 'express' }, 300);
+
+            expect(debounceSeconds).toBeLessThan(EXPRESS_MAX_DURATION_SECONDS - EXPRESS_HANDOFF_MARGIN_SECONDS);
+            expect(getDebounceSeconds({ stateMachineMode: 'express' }, 30)).toBe(30);
+        });
+    });
+
+    describe('getExecutionSummaryJSON', () => {
+        it('should only return the summary attributes', () => {
+            const json = getExecutionSummaryJSON({
+                repoId: 'owner/repo',
+                executionId: 'c0ffeec0ffeec0ffeec0ffeec0ffeec0ffeec0ff/1',
+                status: 'IN_PROGRESS',
+                meta: {},
+                waitTaskToken: 'token',
+                state: {},
+            });
+
+            expect(json.owner).toBe('owner');
+            expect(json.status).toBe('IN_PROGRESS');
+            expect(json.waitTaskToken).toBe(undefined);
+            expect(json.state).toBe(undefined);
+        });
+    });
+});
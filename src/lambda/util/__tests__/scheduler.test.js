@@ -0,0 +1,202 @@
+'use strict';
+
+const mockAws = {
+    getBuildSlots: jest.fn(),
+    acquireBuildSlot: jest.fn(),
+    renewBuildSlots: jest.fn(),
+    releaseBuildSlots: jest.fn(),
+};
+jest.mock('../../../../src/lambda/util/aws', () => mockAws);
+
+const scheduler = require('../../../../src/lambda/util/scheduler');
+
+function createCIApp(limits) {
+    return {
+        tableBuildSlotsName: 'slots',
+        buildConcurrencyLimits: {
+            account: 0,
+            project: 0,
+            repo: 0,
+            priorityReserve: 0,
+            ...limits,
+        },
+        logInfo: jest.fn(),
+        logError: jest.fn(),
+    };
+}
+
+describe('scheduler', () => {
+    const state = {
+        repoId: '1',
+        executionId: '2',
+        isDefaultBranch: false,
+        builds: {},
+    };
+    const buildState = {
+        buildKey: 'build',
+        buildParams: {
+            codeBuildProjectArn: 'arn:project',
+        },
+    };
+
+    beforeEach(() => {
+        for (const fn of Object.values(mockAws)) {
+            fn.mockReset();
+        }
+        buildState.slotScopeIds = null;
+    });
+
+    describe('getBuildSlotHolders', () => {
+        it('should only return holders whose leases have not expired', () => {
+            expect(scheduler.getBuildSlotHolders({
+                leases: {
+                    a: 2000,
+                    b: 999,
+                    c: 1000,
+                },
+            }, 1000)).toEqual(['a', 'c']);
+        });
+
+        it('should return no holders for missing semaphores', () => {
+            expect(scheduler.getBuildSlotHolders(null)).toEqual([]);
+        });
+    });
+
+    describe('getBuildSlotScopes', () => {
+        const ciApp = createCIApp({ account: 10, project: 3, repo: 2, priorityReserve: 4 });
+
+        it('should reserve account slots for the default branch', () => {
+            expect(scheduler.getBuildSlotScopes(ciApp, state, buildState)).toEqual([
+                { id: 'account', limit: 6 },
+                { id: 'project:arn:project', limit: 3 },
+                { id: 'repo:1', limit: 2 },
+            ]);
+
+            expect(scheduler.getBuildSlotScopes(ciApp, { ...state, isDefaultBranch: true }, buildState)[0]).toEqual({
+                id: 'account',
+                limit: 10,
+            });
+        });
+
+        it('should leave at least one account slot for other branches', () => {
+            const reservedCIApp = createCIApp({ account: 4, priorityReserve: 4 });
+
+            expect(scheduler.getBuildSlotScopes(reservedCIApp, state, buildState)).toEqual([
+                { id: 'account', limit: 1 },
+            ]);
+        });
+    });
+
+    describe('isOverFairShare', () => {
+        const ciApp = createCIApp({ account: 4 });
+
+        it('should not limit repos while there are enough free slots for the other repos', () => {
+            expect(scheduler.isOverFairShare(createCIApp({ account: 6 }), '1', ['1|a|x', '1|a|y', '2|b|x'])).toBe(false);
+        });
+
+        it('should limit repos using their fair share when slots are contested', () => {
+            expect(scheduler.isOverFairShare(ciApp, '1', ['1|a|x', '1|a|y', '2|b|x', '3|c|x'])).toBe(true);
+            expect(scheduler.isOverFairShare(ciApp, '2', ['1|a|x', '1|a|y', '2|b|x', '3|c|x'])).toBe(false);
+        });
+
+        it('should not limit repos without an account limit', () => {
+            expect(scheduler.isOverFairShare(createCIApp({ repo: 1 }), '1', ['1|a|x'])).toBe(false);
+        });
+    });
+
+    describe('acquireBuildSlot', () => {
+        it('should not use the semaphores when the scheduler is disabled', async () => {
+            expect(await scheduler.acquireBuildSlot(createCIApp({}), state, buildState)).toBe(true);
+
+            expect(mockAws.acquireBuildSlot.mock.calls.length).toBe(0);
+        });
+
+        it('should keep builds queued when their repo is over its fair share', async () => {
+            mockAws.getBuildSlots.mockResolvedValue({
+                leases: {
+                    '1|a|x': Date.now() + 60000,
+                    '1|a|y': Date.now() + 60000,
+                    '2|b|x': Date.now() + 60000,
+                    '3|c|x': Date.now() + 60000,
+                },
+            });
+
+            expect(await scheduler.acquireBuildSlot(createCIApp({ account: 5 }), state, buildState)).toBe(false);
+
+            expect(mockAws.acquireBuildSlot.mock.calls.length).toBe(0);
+        });
+
+        it('should not count expired leases towards the fair share', async () => {
+            mockAws.getBuildSlots.mockResolvedValue({
+                leases: {
+                    '1|a|x': Date.now() - 1000,
+                    '1|a|y': Date.now() - 1000,
+                    '2|b|x': Date.now() + 60000,
+                    '3|c|x': Date.now() + 60000,
+                },
+            });
+            mockAws.acquireBuildSlot.mockResolvedValue(true);
+
+            expect(await scheduler.acquireBuildSlot(createCIApp({ account: 4 }), state, buildState)).toBe(true);
+        });
+
+        it('should take a lease in every scope, and record the scopes', async () => {
+            mockAws.acquireBuildSlot.mockResolvedValue(true);
+
+            expect(await scheduler.acquireBuildSlot(createCIApp({ repo: 2 }), state, buildState)).toBe(true);
+
+            expect(mockAws.acquireBuildSlot.mock.calls[0]).toEqual([
+                'slots',
+                '1|2|build',
+                [{ id: 'repo:1', limit: 2 }],
+                600,
+            ]);
+            expect(buildState.slotScopeIds).toEqual(['repo:1']);
+        });
+
+        it('should keep builds queued when a limit has been reached', async () => {
+            mockAws.acquireBuildSlot.mockResolvedValue(false);
+
+            expect(await scheduler.acquireBuildSlot(createCIApp({ repo: 2 }), state, buildState)).toBe(false);
+
+            expect(buildState.slotScopeIds).toBe(null);
+        });
+    });
+
+    describe('renewBuildSlots and releaseAllBuildSlots', () => {
+        it('should renew the leases of builds holding slots', async () => {
+            buildState.slotScopeIds = ['account', 'repo:1'];
+
+            await scheduler.renewBuildSlots(createCIApp({ repo: 2 }), state, [buildState, { buildKey: 'queued' }]);
+
+            expect(mockAws.renewBuildSlots.mock.calls[0]).toEqual([
+                'slots',
+                {
+                    account: ['1|2|build'],
+                    'repo:1': ['1|2|build'],
+                },
+                600,
+            ]);
+        });
+
+        it('should release every slot the builds could hold', async () => {
+            buildState.slotScopeIds = ['account'];
+
+            await scheduler.releaseAllBuildSlots(createCIApp({ repo: 2 }), {
+                ...state,
+                builds: {
+                    build: buildState,
+                },
+            });
+
+            expect(mockAws.releaseBuildSlots.mock.calls[0]).toEqual([
+                'slots',
+                {
+                    account: ['1|2|build'],
+                    'repo:1': ['1|2|build'],
+                },
+            ]);
+            expect(buildState.slotScopeIds).toBe(null);
+        });
+    });
+});
@@ -1,23 +1,88 @@
 'use strict';
 
-const AWSXRay = (() => {
-    try {
-        return require('aws-xray-sdk');
+const util = require('../../common/util');
+
+// The aws-sdk is loaded one service at a time, on first use, rather than all of it
+// up front. This keeps the cold start of each lambda down to the services it calls.
+const SERVICE_MODULES = {
+    CloudWatchLogs: 'aws-sdk/clients/cloudwatchlogs',
+    CodeBuild: 'aws-sdk/clients/codebuild',
+    DynamoDB: 'aws-sdk/clients/dynamodb',
+    KMS: 'aws-sdk/clients/kms',
+    S3: 'aws-sdk/clients/s3',
+    SQS: 'aws-sdk/clients/sqs',
+    SSM: 'aws-sdk/clients/ssm',
+    StepFunctions: 'aws-sdk/clients/stepfunctions',
+};
+
+let AWSXRay;
+
+/**
+ * Have X-Ray trace the requests of a service, if aws-xray-sdk is installed.
+ *
+ * Only the services passed to "captureAWS" are patched, so each one is captured as it is loaded.
+ * Clients such as the DynamoDB DocumentClient use the patched service, so they are traced too.
+ *
+ * @param {string} serviceName
+ * @param {function} Service
+ * @returns {function}
+ */
+function captureService(serviceName, Service) {
+    if (AWSXRay === undefined) {
+        try {
+            AWSXRay = require('aws-xray-sdk');
+        }
+        catch (err) {
+            AWSXRay = null;
+        }
     }
-    catch (err) {
-        return {
-            captureAWS(sdk) {
-                return sdk;
-            },
-        };
+
+    if (AWSXRay) {
+        AWSXRay.captureAWS({ [serviceName]: Service });
     }
-})();
 
-const AWS = AWSXRay.captureAWS(require('aws-sdk'));
-const util = require('../../common/util');
+    return Service;
+}
+
+const AWS = Object.keys(SERVICE_MODULES).reduce((ret, serviceName) => {
+    let Service = null;
+
+    Object.defineProperty(ret, serviceName, {
+        enumerable: true,
+        get() {
+            if (!Service) {
+                Service = captureService(serviceName, require(SERVICE_MODULES[serviceName]));
+            }
+
+            return Service;
+        },
+    });
+
+    return ret;
+}, {});
 
 const AWS_REGION = process.env.AWS_REGION || process.env.AWS_DEFAULT_REGION || 'us-east-1';
 
+// Executions with these statuses have an "activeKey" attribute, so they are in the
+// sparse "active-createTime-index" of the executions table (see getActiveExecutions).
+const ACTIVE_EXECUTION_STATUSES = ['QUEUED', 'IN_PROGRESS'];
+const ACTIVE_EXECUTION_KEY = 'active';
+
+// The attributes of executions that are in the search indexes of the executions table.
+const EXECUTION_SUMMARY_ATTRIBUTES = [
+    'repoId',
+    'executionId',
+    'createTime',
+    'updateTime',
+    'status',
+    'conclusion',
+    'conclusionTime',
+    'meta',
+];
+
+// Max number of build slot leases set or removed by one update, to keep its expressions small.
+const BUILD_SLOT_MAX_UPDATED_LEASES = 50;
+
 /**
  * Put a file into S3.
  *
@@ -37,6 +102,23 @@ exports.putS3Object = async function putS3Object(params, serviceParams = {}) {
     return {};
 };
 
+/**
+ * Get a file from S3.
+ *
+ * @param {object} params - Such as Bucket, Key and Range.
+ * @param {object} [serviceParams]
+ * @returns {Promise<object>}
+ */
+exports.getS3Object = async function getS3Object(params, serviceParams = {}) {
+    const s3 = new AWS.S3({
+        apiVersion: '2006-03-01',
+        region: AWS_REGION,
+        ...serviceParams,
+    });
+
+    return await s3.getObject(params).promise();
+};
+
 /**
  * Start a CodeBuild execution.
  *
@@ -102,6 +184,69 @@ exports.startStepFunctionExecution = async function startStepFunctionExecution(p
     };
 };
 
+/**
+ * Complete a step function task that is waiting for a task token.
+ *
+ * @param {string} taskToken
+ * @param {object} output
+ * @param {object} [serviceParams]
+ * @returns {Promise<object>}
+ */
+exports.sendStepFunctionTaskSuccess = async function sendStepFunctionTaskSuccess(taskToken, output, serviceParams = {}) {
+    const stepFunctions = new AWS.StepFunctions({
+        apiVersion: '2016-11-23',
+        region: AWS_REGION,
+        ...serviceParams,
+    });
+
+    await stepFunctions.sendTaskSuccess({
+        taskToken,
+        output: JSON.stringify(output),
+    }).promise();
+
+    return {};
+};
+
+exports.sendSQSMessage = async function sendSQSMessage(params, serviceParams = {}) {
+    const sqs = new AWS.SQS({
+        apiVersion: '2012-11-05',
+        region: AWS_REGION,
+        ...serviceParams,
+    });
+
+    const response = await sqs.sendMessage(params).promise();
+
+    return {
+        messageId: response.MessageId,
+    };
+};
+
+exports.deleteSQSMessages = async function deleteSQSMessages(queueUrl, receiptHandles, serviceParams = {}) {
+    const sqs = new AWS.SQS({
+        apiVersion: '2012-11-05',
+        region: AWS_REGION,
+        ...serviceParams,
+    });
+
+    // DeleteMessageBatch accepts at most 10 entries per call.
+    const failed = [];
+    for (let i = 0; i < receiptHandles.length; i += 10) {
+        const response = await sqs.deleteMessageBatch({
+            QueueUrl: queueUrl,
+            Entries: receiptHandles.slice(i, i + 10).map((receiptHandle, j) => ({
+                Id: String(i + j),
+                ReceiptHandle: receiptHandle,
+            })),
+        }).promise();
+
+        failed.push(...response.Failed);
+    }
+
+    return {
+        failed,
+    };
+};
+
 exports.getLogEvents = async function getLogEvents(
     logGroupName,
     logStreamName,
@@ -164,7 +309,7 @@ exports.queryTable = async function queryTable(
     conditionExpression,
     expressionAttributeNames,
     expressionAttributeValues,
-    { limit, reverse = false, indexName = null } = {},
+    { limit, reverse = false, indexName = null, exclusiveStartKey = null } = {},
     serviceParams = {},
 ) {
     const dynamoDB = new AWS.DynamoDB({
@@ -190,6 +335,10 @@ exports.queryTable = async function queryTable(
         params.IndexName = indexName;
     }
 
+    if (exclusiveStartKey != null) {
+        params.ExclusiveStartKey = exclusiveStartKey;
+    }
+
     const response = await documentClient.query(params).promise();
 
     return {
@@ -398,6 +547,419 @@ exports.releaseLock = async function releaseLock(
     }).promise();
 };
 
+/**
+ * Record the latest execution for a supersede ID (e.g. a pull request),
+ * returning the previously recorded item if one exists.
+ *
+ * @param {string} tableName
+ * @param {string} id
+ * @param {string} traceId
+ * @param {object} meta
+ * @param {object} [serviceParams]
+ * @returns {Promise<object|undefined>}
+ */
+exports.setLatestExecution = async function setLatestExecution(
+    tableName,
+    id,
+    traceId,
+    meta,
+    serviceParams = {},
+) {
+    const dynamoDB = new AWS.DynamoDB({
+        apiVersion: '2012-08-10',
+        region: AWS_REGION,
+        ...serviceParams,
+    });
+
+    const documentClient = new AWS.DynamoDB.DocumentClient({
+        service: dynamoDB,
+    });
+
+    const response = await documentClient.put({
+        TableName: tableName,
+        Item: {
+            id,
+            traceId,
+            created: Date.now(),
+            meta,
+        },
+        ReturnValues: 'ALL_OLD',
+    }).promise();
+
+    return response.Attributes;
+};
+
+/**
+ * Record webhook delivery keys in the deliveries ledger, in one conditional write.
+ *
+ * Returns false if any of the keys were already recorded and have not yet expired.
+ *
+ * @param {string} tableName
+ * @param {{ id: string, expireSeconds: number }[]} entries
+ * @param {object} meta
+ * @param {object} [serviceParams]
+ * @returns {Promise<boolean>}
+ */
+exports.claimWebhookDelivery = async function claimWebhookDelivery(
+    tableName,
+    entries,
+    meta,
+    serviceParams = {},
+) {
+    const dynamoDB = new AWS.DynamoDB({
+        apiVersion: '2012-08-10',
+        region: AWS_REGION,
+        ...serviceParams,
+    });
+
+    const documentClient = new AWS.DynamoDB.DocumentClient({
+        service: dynamoDB,
+    });
+
+    const now = Date.now();
+
+    try {
+        await documentClient.transactWrite({
+            TransactItems: entries.map(({ id, expireSeconds }) => ({
+                Put: {
+                    TableName: tableName,
+                    Item: {
+                        id,
+                        createTime: now,
+                        expireTime: now + expireSeconds * 1000,
+                        ttlTime: Math.floor(now / 1000) + expireSeconds,
+                        meta,
+                    },
+                    // TTL deletes are lazy, so also allow overwriting expired items.
+                    ConditionExpression: 'attribute_not_exists(id) OR expireTime < :time',
+                    ExpressionAttributeValues: {
+                        ':time': now,
+                    },
+                },
+            })),
+        }).promise();
+    }
+    catch (err) {
+        if (err.code === 'TransactionCanceledException' || err.code === 'ConditionalCheckFailedException') {
+            return false;
+        }
+        throw err;
+    }
+
+    return true;
+};
+
+exports.releaseWebhookDelivery = async function releaseWebhookDelivery(
+    tableName,
+    ids,
+    serviceParams = {},
+) {
+    const dynamoDB = new AWS.DynamoDB({
+        apiVersion: '2012-08-10',
+        region: AWS_REGION,
+        ...serviceParams,
+    });
+
+    const documentClient = new AWS.DynamoDB.DocumentClient({
+        service: dynamoDB,
+    });
+
+    await documentClient.batchWrite({
+        RequestItems: {
+            [tableName]: ids.map((id) => ({
+                DeleteRequest: {
+                    Key: {
+                        id,
+                    },
+                },
+            })),
+        },
+    }).promise();
+};
+
+exports.getBuildSlots = async function getBuildSlots(tableName, id, serviceParams = {}) {
+    return exports.getTableItemByKey(
+        tableName,
+        { id },
+        serviceParams,
+    );
+};
+
+/**
+ * Take a build slot lease for a holder in the build slot semaphores for each scope, in one conditional write.
+ *
+ * Each scope's item has a "leases" map of holder to the time its lease expires.
+ * Expired leases (e.g. of builds whose execution crashed or was abandoned) do not
+ * count towards the limit, and are removed by the same write.
+ *
+ * Returns false if any of the scopes are at their limit, or have changed since
+ * they were read. Taking a lease for a holder that already has one renews it.
+ *
+ * @param {string} tableName
+ * @param {string} holder
+ * @param {{ id: string, limit: number }[]} scopes
+ * @param {number} leaseSeconds
+ * @param {object} [serviceParams]
+ * @returns {Promise<boolean>}
+ */
+exports.acquireBuildSlot = async function acquireBuildSlot(
+    tableName,
+    holder,
+    scopes,
+    leaseSeconds,
+    serviceParams = {},
+) {
+    const dynamoDB = new AWS.DynamoDB({
+        apiVersion: '2012-08-10',
+        region: AWS_REGION,
+        ...serviceParams,
+    });
+
+    const documentClient = new AWS.DynamoDB.DocumentClient({
+        service: dynamoDB,
+    });
+
+    const slots = await Promise.all(
+        scopes.map(({ id }) => exports.getBuildSlots(tableName, id, serviceParams)),
+    );
+
+    const now = Date.now();
+    const expireTime = now + leaseSeconds * 1000;
+
+    try {
+        await documentClient.transactWrite({
+            TransactItems: scopes.map(({ id, limit }, i) => {
+                const leases = slots[i] && slots[i].leases;
+
+                if (!leases) {
+                    return {
+                        Update: {
+                            TableName: tableName,
+                            Key: {
+                                id,
+                            },
+                            UpdateExpression: 'SET #leases = :leases, #updateTime = :time',
+                            ConditionExpression: 'attribute_not_exists(#leases)',
+                            ExpressionAttributeNames: {
+                                '#leases': 'leases',
+                                '#updateTime': 'updateTime',
+                            },
+                            ExpressionAttributeValues: {
+                                ':leases': {
+                                    [holder]: expireTime,
+                                },
+                                ':time': now,
+                            },
+                        },
+                    };
+                }
+
+                const expiredHolders = Object.keys(leases)
+                    .filter((key) => key !== holder && leases[key] < now)
+                    .slice(0, BUILD_SLOT_MAX_UPDATED_LEASES);
+
+                const expressionAttributeNames = {
+                    '#leases': 'leases',
+                    '#holder': holder,
+                    '#updateTime': 'updateTime',
+                };
+
+                // Only remove the expired leases if they have not been renewed since they were read.
+                const conditions = ['(attribute_exists(#leases.#holder) OR size(#leases) < :limit)'];
+                expiredHolders.forEach((expiredHolder, j) => {
+                    expressionAttributeNames[`#expired${j}`] = expiredHolder;
+                    conditions.push(`#leases.#expired${j} < :time`);
+                });
+
+                return {
+                    Update: {
+                        TableName: tableName,
+                        Key: {
+                            id,
+                        },
+                        UpdateExpression: 'SET #leases.#holder = :expireTime, #updateTime = :time'
+                            + (expiredHolders.length
+                                ? ` REMOVE ${expiredHolders.map((expiredHolder, j) => `#leases.#expired${j}`).join(', ')}`
+                                : ''),
+                        ConditionExpression: conditions.join(' AND '),
+                        ExpressionAttributeNames: expressionAttributeNames,
+                        ExpressionAttributeValues: {
+                            ':expireTime': expireTime,
+                            ':limit': limit + expiredHolders.length,
+                            ':time': now,
+                        },
+                    },
+                };
+            }),
+        }).promise();
+    }
+    catch (err) {
+        if (err.code === 'TransactionCanceledException' || err.code === 'ConditionalCheckFailedException') {
+            return false;
+        }
+        throw err;
+    }
+
+    return true;
+};
+
+/**
+ * Extend the build slot leases of holders, by scope.
+ *
+ * @param {string} tableName
+ * @param {Object<string, string[]>} holdersByScopeId
+ * @param {number} leaseSeconds
+ * @param {object} [serviceParams]
+ */
+exports.renewBuildSlots = async function renewBuildSlots(
+    tableName,
+    holdersByScopeId,
+    leaseSeconds,
+    serviceParams = {},
+) {
+    const now = Date.now();
+
+    await updateBuildSlotLeases(
+        tableName,
+        holdersByScopeId,
+        (holderNames) => `SET ${holderNames.map((name) => `#leases.${name} = :expireTime`).join(', ')}, #updateTime = :time`,
+        {
+            ':expireTime': now + leaseSeconds * 1000,
+            ':time': now,
+        },
+        serviceParams,
+    );
+};
+
+/**
+ * Remove the build slot leases of holders, by scope.
+ *
+ * @param {string} tableName
+ * @param {Object<string, string[]>} holdersByScopeId
+ * @param {object} [serviceParams]
+ */
+exports.releaseBuildSlots = async function releaseBuildSlots(
+    tableName,
+    holdersByScopeId,
+    serviceParams = {},
+) {
+    await updateBuildSlotLeases(
+        tableName,
+        holdersByScopeId,
+        (holderNames) => `REMOVE ${holderNames.map((name) => `#leases.${name}`).join(', ')} SET #updateTime = :time`,
+        {
+            ':time': Date.now(),
+        },
+        serviceParams,
+    );
+};
+
+/**
+ * Update the leases of holders in each scope's build slot semaphore,
+ * with one update per scope for every {@link BUILD_SLOT_MAX_UPDATED_LEASES} holders.
+ *
+ * Scopes that have no leases are skipped.
+ *
+ * @param {string} tableName
+ * @param {Object<string, string[]>} holdersByScopeId
+ * @param {function(string[]): string} buildUpdateExpression - Called with the attribute names of the holders.
+ * @param {object} expressionAttributeValues
+ * @param {object} serviceParams
+ */
+async function updateBuildSlotLeases(
+    tableName,
+    holdersByScopeId,
+    buildUpdateExpression,
+    expressionAttributeValues,
+    serviceParams,
+) {
+    const dynamoDB = new AWS.DynamoDB({
+        apiVersion: '2012-08-10',
+        region: AWS_REGION,
+        ...serviceParams,
+    });
+
+    const documentClient = new AWS.DynamoDB.DocumentClient({
+        service: dynamoDB,
+    });
+
+    const updates = [];
+    for (const [id, holders] of Object.entries(holdersByScopeId)) {
+        for (let i = 0; i < holders.length; i += BUILD_SLOT_MAX_UPDATED_LEASES) {
+            updates.push({ id, holders: holders.slice(i, i + BUILD_SLOT_MAX_UPDATED_LEASES) });
+        }
+    }
+
+    await Promise.all(updates.map(async ({ id, holders }) => {
+        const expressionAttributeNames = {
+            '#leases': 'leases',
+            '#updateTime': 'updateTime',
+        };
+
+        holders.forEach((holder, i) => {
+            expressionAttributeNames[`#holder${i}`] = holder;
+        });
+
+        try {
+            await documentClient.update({
+                TableName: tableName,
+                Key: {
+                    id,
+                },
+                UpdateExpression: buildUpdateExpression(holders.map((holder, i) => `#holder${i}`)),
+                ConditionExpression: 'attribute_exists(#leases)',
+                ExpressionAttributeNames: expressionAttributeNames,
+                ExpressionAttributeValues: expressionAttributeValues,
+            }).promise();
+        }
+        catch (err) {
+            if (err.code !== 'ConditionalCheckFailedException') {
+                throw err;
+            }
+        }
+    }));
+}
+
+exports.getBuildResult = async function getBuildResult(tableName, id, serviceParams = {}) {
+    return exports.getTableItemByKey(
+        tableName,
+        { id },
+        serviceParams,
+    );
+};
+
+/**
+ * Record the result of a successful build by its result key, so identical builds can reuse it.
+ *
+ * Results expire after 30 days.
+ *
+ * @param {string} tableName
+ * @param {string} id - The build's result key.
+ * @param {object} result
+ * @param {object} [serviceParams]
+ */
+exports.putBuildResult = async function putBuildResult(tableName, id, result, serviceParams = {}) {
+    const dynamoDB = new AWS.DynamoDB({
+        apiVersion: '2012-08-10',
+        region: AWS_REGION,
+        ...serviceParams,
+    });
+
+    const documentClient = new AWS.DynamoDB.DocumentClient({
+        service: dynamoDB,
+    });
+
+    await documentClient.put({
+        TableName: tableName,
+        Item: {
+            ...result,
+            id,
+            createTime: Date.now(),
+            ttlTime: Math.floor(Date.now() / 1000) + 2592000, // TTL in 30 days
+        },
+    }).promise();
+};
+
 exports.getNextExecutionId = async function getNextExecutionId(
     tableName,
     repoId,
@@ -435,7 +997,7 @@ exports.getExecutionsForCommit = async function getExecutionsForCommit(
     tableName,
     repoId,
     commit,
-    { limit = 10, reverse = true } = {},
+    { limit = 10, reverse = true, exclusiveStartKey = null } = {},
     serviceParams = {},
 ) {
     return await exports.queryTable(
@@ -453,6 +1015,7 @@ exports.getExecutionsForCommit = async function getExecutionsForCommit(
             limit,
             reverse,
             indexName: 'search-repoId-executionId-index',
+            exclusiveStartKey,
         },
         serviceParams,
     );
@@ -461,7 +1024,7 @@ exports.getExecutionsForCommit = async function getExecutionsForCommit(
 exports.getExecutionsForRepo = async function getExecutionsForRepo(
     tableName,
     repoId,
-    { limit = 10, reverse = true },
+    { limit = 10, reverse = true, exclusiveStartKey = null },
     serviceParams = {},
 ) {
     return await exports.queryTable(
@@ -477,6 +1040,40 @@ exports.getExecutionsForRepo = async function getExecutionsForRepo(
             limit,
             reverse,
             indexName: 'search-repoId-createTime-index',
+            exclusiveStartKey,
+        },
+        serviceParams,
+    );
+};
+
+/**
+ * List the executions that are queued or in progress, across all repos, oldest first.
+ *
+ * @param {string} tableName
+ * @param {object} [options]
+ * @param {number} [options.limit]
+ * @param {object} [options.exclusiveStartKey]
+ * @param {object} [serviceParams]
+ * @returns {Promise<{ items: object[], count: number, lastEvaluatedKey: object }>}
+ */
+exports.getActiveExecutions = async function getActiveExecutions(
+    tableName,
+    { limit = 50, exclusiveStartKey = null } = {},
+    serviceParams = {},
+) {
+    return await exports.queryTable(
+        tableName,
+        '#activeKey = :activeKey',
+        {
+            '#activeKey': 'activeKey',
+        },
+        {
+            ':activeKey': ACTIVE_EXECUTION_KEY,
+        },
+        {
+            limit,
+            indexName: 'active-createTime-index',
+            exclusiveStartKey,
         },
         serviceParams,
     );
@@ -515,9 +1112,11 @@ exports.createExecution = async function createExecution(
         repoId,
         executionId,
         status: 'QUEUED',
+        activeKey: ACTIVE_EXECUTION_KEY,
         createTime: new Date().toISOString(),
         updateTime: new Date().toISOString(),
         updates: 0,
+        stateVersion: 0,
         conclusion: null,
         conclusionTime: null,
         meta,
@@ -530,9 +1129,186 @@ exports.createExecution = async function createExecution(
         ConditionExpression: 'attribute_not_exists(executionId)',
     }).promise();
 
+    // Also point to the execution as the latest of its repo and commit,
+    // so those can be looked up by key (see getLatestExecutions).
+    // Executions of different commits may be created concurrently, so a pointer
+    // is only moved forward, and losing that race does not fail the creation.
+    const { commit } = util.parseExecutionId(executionId);
+    await Promise.all([null, commit].map(async (pointerCommit) => {
+        try {
+            await documentClient.update({
+                TableName: tableName,
+                Key: {
+                    repoId,
+                    executionId: util.buildLatestExecutionPointerId(pointerCommit),
+                },
+                UpdateExpression: 'SET latestExecutionId = :executionId, latestCreateTime = :createTime',
+                ConditionExpression: 'attribute_not_exists(latestCreateTime) OR latestCreateTime < :createTime',
+                ExpressionAttributeValues: {
+                    ':executionId': executionId,
+                    ':createTime': Item.createTime,
+                },
+            }).promise();
+        }
+        catch (err) {
+            if (err.code !== 'ConditionalCheckFailedException') {
+                throw err;
+            }
+        }
+    }));
+
     return Item;
 };
 
+/**
+ * Get items by their keys, in batches of up to 100 keys per request.
+ *
+ * Keys that DynamoDB does not process (e.g. when throttled) are requested again.
+ *
+ * @param {string} tableName
+ * @param {object[]} keys
+ * @param {object} [options]
+ * @param {string[]} [options.attributes] - Only get these attributes.
+ * @param {object} [serviceParams]
+ * @returns {Promise<object[]>} The items that were found, in no particular order.
+ */
+exports.batchGetTableItems = async function batchGetTableItems(
+    tableName,
+    keys,
+    { attributes = null } = {},
+    serviceParams = {},
+) {
+    const dynamoDB = new AWS.DynamoDB({
+        apiVersion: '2012-08-10',
+        region: AWS_REGION,
+        ...serviceParams,
+    });
+
+    const documentClient = new AWS.DynamoDB.DocumentClient({
+        service: dynamoDB,
+    });
+
+    const projection = attributes && {
+        ProjectionExpression: attributes.map((attribute, i) => `#a${i}`).join(', '),
+        ExpressionAttributeNames: attributes.reduce((ret, attribute, i) => {
+            ret[`#a${i}`] = attribute;
+            return ret;
+        }, {}),
+    };
+
+    const items = [];
+    let pendingKeys = keys.slice();
+    let retries = 0;
+
+    while (pendingKeys.length) {
+        const batchKeys = pendingKeys.slice(0, 100);
+        pendingKeys = pendingKeys.slice(100);
+
+        const response = await documentClient.batchGet({
+            RequestItems: {
+                [tableName]: {
+                    Keys: batchKeys,
+                    ...projection,
+                },
+            },
+        }).promise();
+
+        items.push(...response.Responses[tableName] || []);
+
+        const unprocessed = response.UnprocessedKeys && response.UnprocessedKeys[tableName];
+        if (unprocessed && unprocessed.Keys.length) {
+            if (++retries > 5) {
+                throw new Error(`Failed to get ${unprocessed.Keys.length} items from ${tableName} after ${retries - 1} retries`);
+            }
+
+            // Back off before requesting the unprocessed keys again.
+            await util.delay(50 * Math.pow(2, retries));
+            pendingKeys = unprocessed.Keys.concat(pendingKeys);
+        }
+    }
+
+    return items;
+};
+
+/**
+ * Get the latest execution of each repo, or of a commit of the repo, using batches of keys.
+ *
+ * Only the attributes of executions that are in the search indexes are returned.
+ *
+ * @param {string} tableName
+ * @param {Array<{ repoId: string, commit: string|null }>} lookups
+ * @param {object} [serviceParams]
+ * @returns {Promise<Array<object|null>>} The execution for each lookup, or null if it has none.
+ */
+exports.getLatestExecutions = async function getLatestExecutions(tableName, lookups, serviceParams = {}) {
+    const pointerKeys = lookups.map(({ repoId, commit }) => ({
+        repoId,
+        executionId: util.buildLatestExecutionPointerId(commit),
+    }));
+
+    const pointers = await exports.batchGetTableItems(
+        tableName,
+        uniqueKeys(pointerKeys),
+        {
+            attributes: ['repoId', 'executionId', 'latestExecutionId'],
+        },
+        serviceParams,
+    );
+
+    const executionKeys = pointers.map((pointer) => ({
+        repoId: pointer.repoId,
+        executionId: pointer.latestExecutionId,
+    }));
+
+    const executions = await exports.batchGetTableItems(
+        tableName,
+        uniqueKeys(executionKeys),
+        {
+            attributes: EXECUTION_SUMMARY_ATTRIBUTES,
+        },
+        serviceParams,
+    );
+
+    const pointersByKey = new Map(pointers.map((pointer) => [
+        `${pointer.repoId}|${pointer.executionId}`,
+        pointer,
+    ]));
+
+    const executionsByKey = new Map(executions.map((execution) => [
+        `${execution.repoId}|${execution.executionId}`,
+        execution,
+    ]));
+
+    return pointerKeys.map(({ repoId, executionId }) => {
+        const pointer = pointersByKey.get(`${repoId}|${executionId}`);
+        return pointer && executionsByKey.get(`${repoId}|${pointer.latestExecutionId}`) || null;
+    });
+};
+
+/**
+ * Update an execution record.
+ *
+ * "stateProps" and "builds" update individual props of the state and individual builds,
+ * so concurrent updates for different builds do not overwrite each other.
+ * They cannot be used together with "state".
+ *
+ * If "expectedStateVersion" is set, the state is only saved if its version has not changed,
+ * and its version is then incremented. Otherwise a "StateVersionConflictError" is thrown.
+ *
+ * @param {string} tableName
+ * @param {string} repoId
+ * @param {string} executionId
+ * @param {object} [updates]
+ * @param {string} [updates.status]
+ * @param {string} [updates.conclusion]
+ * @param {object} [updates.meta]
+ * @param {StateInput} [updates.state]
+ * @param {object} [updates.stateProps]
+ * @param {object} [updates.builds] - Build states keyed by build key.
+ * @param {number} [updates.expectedStateVersion]
+ * @param {object} [serviceParams]
+ * @returns {Promise<object>}
+ */
 exports.updateExecution = async function updateExecution(
     tableName,
     repoId,
@@ -541,7 +1317,11 @@ exports.updateExecution = async function updateExecution(
         status = null,
         conclusion = null,
         meta = null,
+        waitTaskToken = null,
         state = null,
+        stateProps = null,
+        builds = null,
+        expectedStateVersion = null,
     } = {},
     serviceParams = {},
 ) {
@@ -555,10 +1335,22 @@ exports.updateExecution = async function updateExecution(
         ':one': 1,
     };
 
+    let RemoveExpression = '';
+
     if (status) {
         UpdateExpression += ', #status = :status';
         ExpressionAttributeNames['#status'] = 'status';
         ExpressionAttributeValues[':status'] = status;
+
+        // Keep the execution in the active executions index only while it is active.
+        ExpressionAttributeNames['#activeKey'] = 'activeKey';
+        if (ACTIVE_EXECUTION_STATUSES.includes(status)) {
+            UpdateExpression += ', #activeKey = :activeKey';
+            ExpressionAttributeValues[':activeKey'] = ACTIVE_EXECUTION_KEY;
+        }
+        else {
+            RemoveExpression = ' REMOVE #activeKey';
+        }
     }
 
     if (conclusion) {
@@ -575,6 +1367,45 @@ exports.updateExecution = async function updateExecution(
         ExpressionAttributeValues[':state'] = state;
     }
 
+    // Not in "meta", so it is not copied into the search indexes, which are read by the API.
+    if (waitTaskToken) {
+        UpdateExpression += ', #waitTaskToken = :waitTaskToken';
+        ExpressionAttributeNames['#waitTaskToken'] = 'waitTaskToken';
+        ExpressionAttributeValues[':waitTaskToken'] = waitTaskToken;
+    }
+
+    let ConditionExpression = 'attribute_exists(executionId)';
+    if (expectedStateVersion != null) {
+        UpdateExpression += ', #stateVersion = :nextStateVersion';
+        ConditionExpression += ' AND #stateVersion = :stateVersion';
+        ExpressionAttributeNames['#stateVersion'] = 'stateVersion';
+        ExpressionAttributeValues[':stateVersion'] = expectedStateVersion;
+        ExpressionAttributeValues[':nextStateVersion'] = expectedStateVersion + 1;
+    }
+
+    if (stateProps || builds) {
+        ExpressionAttributeNames['#state'] = 'state';
+    }
+
+    if (stateProps) {
+        const keys = Object.keys(stateProps);
+        for (let i = 0; i < keys.length; i++) {
+            UpdateExpression += `, #state.#stateProp${i} = :stateProp${i}`;
+            ExpressionAttributeNames[`#stateProp${i}`] = keys[i];
+            ExpressionAttributeValues[`:stateProp${i}`] = stateProps[keys[i]];
+        }
+    }
+
+    if (builds) {
+        ExpressionAttributeNames['#builds'] = 'builds';
+        const keys = Object.keys(builds);
+        for (let i = 0; i < keys.length; i++) {
+            UpdateExpression += `, #state.#builds.#build${i} = :build${i}`;
+            ExpressionAttributeNames[`#build${i}`] = keys[i];
+            ExpressionAttributeValues[`:build${i}`] = builds[keys[i]];
+        }
+    }
+
     if (meta) {
         const keys = Object.keys(meta);
         for (let i = 0; i < keys.length; i++) {
@@ -594,18 +1425,29 @@ exports.updateExecution = async function updateExecution(
         service: dynamoDB,
     });
 
-    const response = await documentClient.update({
-        TableName: tableName,
-        Key: {
-            repoId,
-            executionId,
-        },
-        UpdateExpression,
-        ConditionExpression: 'attribute_exists(executionId)',
-        ExpressionAttributeNames,
-        ExpressionAttributeValues,
-        ReturnValues: 'ALL_NEW',
-    }).promise();
+    let response;
+    try {
+        response = await documentClient.update({
+            TableName: tableName,
+            Key: {
+                repoId,
+                executionId,
+            },
+            UpdateExpression: UpdateExpression + RemoveExpression,
+            ConditionExpression,
+            ExpressionAttributeNames,
+            ExpressionAttributeValues,
+            ReturnValues: 'ALL_NEW',
+        }).promise();
+    }
+    catch (err) {
+        if (expectedStateVersion != null && err.code === 'ConditionalCheckFailedException') {
+            const conflictErr = new Error(`State for execution "${executionId}" is no longer at version ${expectedStateVersion}`);
+            conflictErr.name = 'StateVersionConflictError';
+            throw conflictErr;
+        }
+        throw err;
+    }
 
     return response.Attributes;
 };
@@ -745,3 +1587,15 @@ function normalizeCodeBuildProps(build) {
         })),
     };
 }
+
+function uniqueKeys(keys) {
+    const seen = new Set();
+    return keys.filter(({ repoId, executionId }) => {
+        const id = `${repoId}|${executionId}`;
+        if (seen.has(id)) {
+            return false;
+        }
+        seen.add(id);
+        return true;
+    });
+}
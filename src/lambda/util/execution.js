@@ -1,12 +1,42 @@
 'use strict';
 
-const yaml = require('js-yaml');
+const crypto = require('crypto');
 const { VError } = require('../../common/v');
 const util = require('../../common/util');
 const schema = require('../../common/schema');
 const aws = require('./aws');
 const github = require('./github');
 
+// Express workflows are stopped after 5 minutes, so they hand off to a new execution before then.
+const EXPRESS_MAX_DURATION_SECONDS = 300;
+const EXPRESS_HANDOFF_MARGIN_SECONDS = 60;
+
+// Longest time the step lambda is expected to run for (the default StepLambdaTimeout).
+const EXPRESS_STEP_LAMBDA_SECONDS = 60;
+
+// The debounce wait is part of the first express workflow, which must still be able to
+// run the step lambda and hand off within the express workflow duration limit.
+const EXPRESS_MAX_DEBOUNCE_SECONDS = EXPRESS_MAX_DURATION_SECONDS
+    - EXPRESS_HANDOFF_MARGIN_SECONDS
+    - EXPRESS_STEP_LAMBDA_SECONDS;
+
+exports.EXPRESS_MAX_DURATION_SECONDS = EXPRESS_MAX_DURATION_SECONDS;
+exports.EXPRESS_HANDOFF_MARGIN_SECONDS = EXPRESS_HANDOFF_MARGIN_SECONDS;
+
+/**
+ * Get how long an execution's step function waits before its first run, to let
+ * newer pushes supersede it. Limited in "express" mode (see EXPRESS_MAX_DEBOUNCE_SECONDS).
+ *
+ * @param {CIApp} ciApp
+ * @param {number} debounceSeconds - From the repo's config.
+ * @returns {number}
+ */
+exports.getDebounceSeconds = function getDebounceSeconds(ciApp, debounceSeconds) {
+    return ciApp.stateMachineMode === 'express'
+        ? Math.min(debounceSeconds, EXPRESS_MAX_DEBOUNCE_SECONDS)
+        : debounceSeconds;
+};
+
 exports.getExecutionActions = function getExecutionActions(execution, forGitHubApp = false) {
     const actions = [];
 
@@ -20,6 +50,20 @@ exports.getExecutionActions = function getExecutionActions(execution, forGitHubA
                 }
                 : 'rerun'
         );
+
+        if (execution.conclusion === 'FAILED'
+            || execution.conclusion === 'STOPPED'
+            || execution.conclusion === 'ERROR') {
+            actions.push(
+                forGitHubApp
+                    ? {
+                        label: 'Re-Run Failed',
+                        description: 'Re-run builds that did not succeed.',
+                        identifier: 'rerun-failed',
+                    }
+                    : 'rerun-failed'
+            );
+        }
     }
     else if (!execution.meta.stop) {
         actions.push(
@@ -36,6 +80,93 @@ exports.getExecutionActions = function getExecutionActions(execution, forGitHubA
     return actions;
 };
 
+/**
+ * Stop the CodeBuild builds of an execution that are in progress, in parallel.
+ *
+ * @param {CIApp} ciApp
+ * @param {object} execution
+ * @returns {Promise<string[]>} The keys of the builds that failed to stop.
+ */
+exports.stopExecutionBuilds = async function stopExecutionBuilds(ciApp, execution) {
+    const builds = execution.state && execution.state.builds || {};
+    const failedBuildKeys = [];
+
+    await Promise.all(
+        Object.entries(builds)
+            .filter(([, buildState]) => buildState.codeBuild && buildState.codeBuild.buildStatus === 'IN_PROGRESS')
+            .map(async ([buildKey, buildState]) => {
+                try {
+                    ciApp.logInfo(`Stopping build "${buildKey}"...`);
+                    await aws.stopCodeBuild(
+                        aws.parseArn(buildState.codeBuild.arn).buildId,
+                    );
+                }
+                catch (err) {
+                    ciApp.logError(`Failed to stop build "${buildKey}" for execution "${execution.executionId}": ${err.stack}`);
+                    failedBuildKeys.push(buildKey);
+                }
+            }),
+    );
+
+    return failedBuildKeys;
+};
+
+/**
+ * End the current "Wait" state of an execution's step function early,
+ * so it can act on changes (e.g. a stop request) without waiting to poll.
+ *
+ * @param {CIApp} ciApp
+ * @param {object} execution
+ * @returns {Promise<boolean>} True if the step function was waiting and has been woken.
+ */
+exports.wakeExecution = async function wakeExecution(ciApp, execution) {
+    if (!execution.waitTaskToken) {
+        return false;
+    }
+
+    try {
+        ciApp.logInfo(`Waking step function for execution "${execution.executionId}"...`);
+        await aws.sendStepFunctionTaskSuccess(
+            execution.waitTaskToken,
+            {},
+        );
+        return true;
+    }
+    catch (err) {
+        // The token is stale if the step function is no longer waiting.
+        if (err.code === 'TaskTimedOut' || err.code === 'TaskDoesNotExist' || err.code === 'InvalidToken') {
+            ciApp.logInfo(`Step function for execution "${execution.executionId}" is not waiting: ${err.code}`);
+        }
+        else {
+            ciApp.logError(`Failed to wake step function for execution "${execution.executionId}": ${err.stack}`);
+        }
+        return false;
+    }
+};
+
+/**
+ * Get the JSON of an execution from the search indexes, which only have some of its attributes.
+ *
+ * @param {object} execution
+ * @returns {object}
+ */
+exports.getExecutionSummaryJSON = function getExecutionSummaryJSON(execution) {
+    return {
+        // Destruct the IDs into their parts.
+        ...util.parseRepoId(execution.repoId),
+        ...util.parseExecutionId(execution.executionId),
+
+        repoId: execution.repoId,
+        executionId: execution.executionId,
+        status: execution.status,
+        createTime: execution.createTime,
+        updateTime: execution.updateTime,
+        conclusion: execution.conclusion,
+        conclusionTime: execution.conclusionTime,
+        meta: execution.meta,
+    };
+};
+
 exports.getExecutionJSON = function getExecutionJSON(execution) {
     return {
         // Destruct the IDs into their parts.
@@ -72,11 +203,18 @@ exports.startExecution = async function startExecution(
     githubRepo,
     event,
     installationId,
-    commitSHA
+    commitSHA,
+    {
+        rerunFailedOf = null,
+    } = {},
 ) {
     const isForGitHubApp = installationId != null;
     const { owner, repo } = util.parseRepoId(repoConfig.id);
 
+    if (rerunFailedOf && !rerunFailedOf.executionId.startsWith(`${commitSHA}/`)) {
+        throwError(400, `Execution "${rerunFailedOf.executionId}" is not for commit ${commitSHA}`);
+    }
+
     // Download the repo's CBuildCI yaml file from the commit.
     ciApp.logInfo(`Getting ${ciApp.buildsYmlFile} for commit ${commitSHA}...`);
     let ymlContent;
@@ -113,7 +251,8 @@ exports.startExecution = async function startExecution(
     // Parse the repo's CBuildCI yaml file.
     let ymlConfig = null;
     try {
-        ymlConfig = yaml.safeLoad(ymlContent);
+        // Only loaded when an execution is created, rather than by every lambda that uses this module.
+        ymlConfig = require('js-yaml').safeLoad(ymlContent);
 
         ciApp.logInfo(`Parsing ${ciApp.buildsYmlFile}...`);
         ymlConfig = schema.validateBuildsYml(ymlConfig);
@@ -168,12 +307,20 @@ exports.startExecution = async function startExecution(
              * @property {string} buildKey
              * @property {string|null} status
              * @property {object|null} codeBuild
+             * @property {string[]|null} slotScopeIds
+             * @property {string|null} resultKey
+             * @property {object|null} reusedResult
+             * @property {{ bucket: string, key: string, indexKey: string }|null} logsArchive - Where the logs are archived once the build ends and they settle, which is done once the index exists.
              * @property {BuildParams} buildParams
              */
             builds[buildKey] = {
                 buildKey,
                 status: null,
                 codeBuild: null,
+                slotScopeIds: null,
+                resultKey: null,
+                reusedResult: null,
+                logsArchive: null,
                 waitingForDeps: [],
                 buildParams: schema.validateBuildParams({
                     ...ciApp.globalBuildDefaults,
@@ -183,6 +330,8 @@ exports.startExecution = async function startExecution(
                 }),
             };
 
+            builds[buildKey].waitingForDeps = [...new Set(builds[buildKey].buildParams.dependsOn)];
+
             // Fail if a build references a CodeBuild project ARN that is not in the whitelist.
             const codeBuildProjectArn = builds[buildKey].buildParams.codeBuildProjectArn;
             if (!repoConfig.codeBuildProjectArns.includes(codeBuildProjectArn)) {
@@ -211,13 +360,16 @@ exports.startExecution = async function startExecution(
         throwError(400, `${ciApp.buildsYmlFile} is invalid: ${err.message}`);
     }
 
-    // Check for cyclic dependencies.
+    // Check for cyclic dependencies, and compile the dependency graph
+    // weighted by the durations of recent builds.
+    let graph;
     try {
-        schema.checkBuildDependencies(
+        graph = schema.compileBuildGraph(
             Object.entries(builds).reduce((ret, [buildKey, buildState]) => {
                 ret[buildKey] = buildState.buildParams;
                 return ret;
             }, {}),
+            await getRecentBuildDurations(ciApp, repoConfig.id),
         );
     }
     catch (err) {
@@ -238,15 +390,62 @@ exports.startExecution = async function startExecution(
         throwError(400, `${ciApp.buildsYmlFile}: ${err.message}`);
     }
 
+    // Skip builds whose "paths" and "pathsIgnore" filters do not match any changed files.
+    // Dependencies on skipped builds are treated as met, so dependents can still run.
     // TODO: Trim builds that would never run (e.g. the "branches" filter doesn't match).
-    // What happens to builds that aren't filtered out, but dependOn a build that is filtered out?
-    // Just skip them or report as failed? Maybe allow a flag in YML to decide?
+    const hasPathFilters = Object.values(builds)
+        .some((buildState) => buildState.buildParams.paths || buildState.buildParams.pathsIgnore);
+
+    const changedFiles = hasPathFilters
+        ? await getChangedFiles(ciApp, token, owner, repo, event, commitSHA)
+        : null;
+
+    if (changedFiles) {
+        for (const buildState of Object.values(builds)) {
+            const { paths, pathsIgnore } = buildState.buildParams;
+            if ((paths || pathsIgnore) && !util.isAffectedByChangedFiles(changedFiles, paths, pathsIgnore)) {
+                ciApp.logInfo(`Skipping build "${buildState.buildKey}" since no changed files match its paths`);
+                buildState.status = 'SKIPPED';
+                buildState.waitingForDeps = [];
+            }
+        }
+    }
+
+    // Copy the builds that succeeded in the execution being rerun,
+    // so only the builds that did not succeed and their dependents run again.
+    if (rerunFailedOf) {
+        copySucceededBuilds(rerunFailedOf, builds, graph);
+    }
+
+    // Skipped and copied dependencies are already met.
+    for (const buildState of Object.values(builds)) {
+        buildState.waitingForDeps = buildState.waitingForDeps
+            .filter((depBuildKey) => builds[depBuildKey].status !== 'SKIPPED'
+                && builds[depBuildKey].status !== 'SUCCEEDED');
+    }
+
+    // Identify the inputs of each build, so builds with "reuseResult" can
+    // reuse the result of an identical build that has already succeeded.
+    if (ciApp.tableBuildResultsName && Object.values(builds).some((buildState) => buildState.buildParams.reuseResult)) {
+        await setBuildResultKeys(
+            ciApp,
+            token,
+            owner,
+            repo,
+            repoConfig.id,
+            commitResponse.data.commit.tree.sha,
+            builds,
+            graph,
+        );
+    }
 
     /**
      * @typedef {object} StateInput
      * @property {boolean} isRunning
      * @property {boolean} stopRequested
+     * @property {string|null} stopSupersededBy
      * @property {number} waitSeconds
+     * @property {number} debounceSeconds
      * @property {string} runTask
      * @property {string} errorInfo
      * @property {string} repoId
@@ -258,15 +457,20 @@ exports.startExecution = async function startExecution(
      * @property {string|null} oAuthTokenExpiration
      * @property {string[]} sourcesUploaded
      * @property {BuildState[]} builds
+     * @property {{ levels: string[][], dependents: object, criticalPath: object }} graph
+     * @property {string[]} readyBuildKeys
      * @property {string} commitSHA
+     * @property {boolean} isDefaultBranch
      * @property {string} owner
      * @property {string} repo
      */
     const state = {
         isRunning: true,
         stopRequested: false,
+        stopSupersededBy: null,
         runTask: 'RunMain',
         waitSeconds: repoConfig.waitSeconds,
+        debounceSeconds: event.type === 'pull_request' ? exports.getDebounceSeconds(ciApp, ymlConfig.debounceSeconds) : 0,
         errorInfo: null,
         repoId: repoConfig.id,
         installationId,
@@ -283,7 +487,12 @@ exports.startExecution = async function startExecution(
         oAuthTokenExpiration: tokenExpiration,
         sourcesUploaded: [],
         builds,
+        graph,
+        readyBuildKeys: Object.values(builds)
+            .filter((buildState) => !buildState.status && !buildState.waitingForDeps.length)
+            .map((buildState) => buildState.buildKey),
         commitSHA,
+        isDefaultBranch: Boolean(event.head_branch && event.head_branch === event.default_branch),
         owner,
         repo,
     };
@@ -423,10 +632,54 @@ exports.startExecution = async function startExecution(
         }
     }
 
+    // Push statuses for skipped and copied builds, since the step function will not check them.
+    for (const buildState of Object.values(builds)) {
+        if ((buildState.status === 'SKIPPED' || buildState.status === 'SUCCEEDED') && buildState.buildParams.commitStatus) {
+            const { commit, executionNum } = util.parseExecutionId(state.executionId);
+            await github.pushCommitStatus(
+                ciApp.githubApiUrl,
+                token,
+                owner,
+                repo,
+                commitSHA,
+                'success',
+                buildState.buildParams.commitStatus,
+                buildState.status === 'SKIPPED'
+                    ? 'Skipped: No changed files match paths'
+                    : 'Successful (reused result)',
+                `${ciApp.baseUrl}/api/v1/repo/${state.repoId}/commit/${commit}/exec/${executionNum}/build/${buildState.buildKey}`,
+            );
+        }
+    }
+
     // Start a AWS step function that will orchestrate this execution of builds.
+    // The state is passed by reference, since the step lambda loads and saves it
+    // in the execution record. The "fanout" state machine also needs the builds
+    // that have yet to run.
     const execResult = await aws.startStepFunctionExecution({
         stateMachineArn: ciApp.stateMachineArn,
-        input: JSON.stringify(state),
+        input: JSON.stringify(ciApp.stateMachineMode === 'fanout'
+            ? {
+                runTask: 'RunMain',
+                errorInfo: null,
+                repoId: state.repoId,
+                executionId: state.executionId,
+                waitSeconds: state.waitSeconds,
+                debounceSeconds: state.debounceSeconds,
+                levels: graph.levels
+                    .map((level) => level.filter((buildKey) => !builds[buildKey].status))
+                    .filter((level) => level.length),
+            }
+            : {
+                runTask: state.runTask,
+                errorInfo: null,
+                repoId: state.repoId,
+                executionId: state.executionId,
+                stateVersion: execution.stateVersion,
+                isRunning: state.isRunning,
+                waitSeconds: state.waitSeconds,
+                debounceSeconds: state.debounceSeconds,
+            }),
     });
 
     ciApp.logInfo(`State machine executed ARN:${execResult.executionArn}`);
@@ -444,6 +697,20 @@ exports.startExecution = async function startExecution(
         },
     );
 
+    // Stop the previous execution for the pull request, if enabled.
+    if (event.type === 'pull_request' && ymlConfig.supersede) {
+        try {
+            await supersedePreviousExecution(
+                ciApp,
+                state,
+                event,
+            );
+        }
+        catch (err) {
+            ciApp.logError(`Failed to supersede previous execution: ${err.stack}`);
+        }
+    }
+
     // TODO: Should we push pending status to GitHub now for all builds that will run?
     // This may not be important if we can use the GitHub "Checks" feature. Then we can just use one status for all builds.
 
@@ -456,6 +723,365 @@ exports.startExecution = async function startExecution(
     };
 };
 
+/**
+ * Get the files changed by a pull request, or by the push that the commit is the head of
+ * if the event is not for one pull request.
+ *
+ * Returns null if the changed files could not be fully listed, in which case no builds should be skipped.
+ *
+ * @param {CIApp} ciApp
+ * @param {string} token
+ * @param {string} owner
+ * @param {string} repo
+ * @param {object} event
+ * @param {string} commitSHA
+ * @returns {Promise<string[]|null>}
+ */
+async function getChangedFiles(ciApp, token, owner, repo, event, commitSHA) {
+    const pullRequestNumber = event.type === 'pull_request'
+        ? event.pull_request.number
+        : event.pull_requests && event.pull_requests.length === 1
+            ? event.pull_requests[0].number
+            : null;
+
+    if (pullRequestNumber == null) {
+        // The base is unknown for new branches, and for executions not started by a push.
+        if (!event.before || /^0+$/.test(event.before)) {
+            return null;
+        }
+
+        ciApp.logInfo(`Getting changed files for ${event.before}...${commitSHA}...`);
+        const response = await github.compareCommits(
+            ciApp.githubApiUrl,
+            token,
+            owner,
+            repo,
+            event.before,
+            commitSHA,
+        );
+
+        if (response.statusCode !== 200) {
+            ciApp.logWarn(`Failed to get changed files for ${event.before}...${commitSHA}: [${response.statusCode}]`);
+            return null;
+        }
+
+        // The diff is from the merge base, so it only covers the push if it was not a force push.
+        // The compare API lists at most 300 files.
+        const files = response.data.files || [];
+        return response.data.status === 'ahead' && files.length < 300
+            ? getFileNames(files)
+            : null;
+    }
+
+    ciApp.logInfo(`Getting changed files for pull request #${pullRequestNumber}...`);
+    const changedFiles = [];
+
+    // The pull request files API lists at most 3000 files.
+    for (let page = 1; page <= 30; page++) {
+        const response = await github.getPullRequestFiles(
+            ciApp.githubApiUrl,
+            token,
+            owner,
+            repo,
+            pullRequestNumber,
+            {
+                page,
+            },
+        );
+
+        if (response.statusCode !== 200) {
+            ciApp.logWarn(`Failed to get changed files for pull request #${pullRequestNumber}: [${response.statusCode}]`);
+            return null;
+        }
+
+        changedFiles.push(...getFileNames(response.data));
+
+        if (response.data.length < 100) {
+            return changedFiles;
+        }
+    }
+
+    return null;
+}
+
+/**
+ * Get the names of changed files from GitHub's file list, including the old names of renamed files.
+ *
+ * @param {object[]} files
+ * @returns {string[]}
+ */
+function getFileNames(files) {
+    return files.reduce((ret, file) => {
+        ret.push(file.filename);
+        if (file.previous_filename) {
+            ret.push(file.previous_filename);
+        }
+        return ret;
+    }, []);
+}
+
+/**
+ * Copy the builds that succeeded in a previous execution for the same commit.
+ *
+ * A build is only copied if its params have not changed and all of its dependencies
+ * were also copied (or skipped), so builds that depend on a rerun build run again.
+ *
+ * @param {object} previousExecution
+ * @param {object} builds
+ * @param {{ levels: string[][] }} graph
+ */
+function copySucceededBuilds(previousExecution, builds, graph) {
+    const previousBuilds = previousExecution.state && previousExecution.state.builds || {};
+
+    for (const level of graph.levels) {
+        for (const buildKey of level) {
+            const buildState = builds[buildKey];
+            const previousBuildState = previousBuilds[buildKey];
+
+            if (buildState.status
+                || !previousBuildState
+                || previousBuildState.status !== 'SUCCEEDED'
+                || JSON.stringify(previousBuildState.buildParams) !== JSON.stringify(buildState.buildParams)
+                || buildState.buildParams.dependsOn.some((depBuildKey) => builds[depBuildKey].status !== 'SUCCEEDED'
+                    && builds[depBuildKey].status !== 'SKIPPED')) {
+                continue;
+            }
+
+            const previousCodeBuild = previousBuildState.codeBuild;
+
+            buildState.status = 'SUCCEEDED';
+            buildState.codeBuild = previousCodeBuild;
+            buildState.logsArchive = previousBuildState.logsArchive || null;
+            buildState.waitingForDeps = [];
+            buildState.reusedResult = previousBuildState.reusedResult || {
+                repoId: previousExecution.repoId,
+                executionId: previousExecution.executionId,
+                buildKey,
+                codeBuildArn: previousCodeBuild ? previousCodeBuild.arn : null,
+                artifactsLocation: previousCodeBuild && previousCodeBuild.artifacts && previousCodeBuild.artifacts.location || null,
+            };
+        }
+    }
+}
+
+/**
+ * Set the result key of each build from its inputs, in dependency order
+ * so each build's key includes the keys of its dependencies.
+ *
+ * Builds with "paths" or "pathsIgnore" are identified by only the files they match
+ * (and their buildspec), rather than the whole git tree, when the tree can be fully listed.
+ *
+ * @param {CIApp} ciApp
+ * @param {string} token
+ * @param {string} owner
+ * @param {string} repo
+ * @param {string} repoId
+ * @param {string} treeSHA
+ * @param {object} builds
+ * @param {{ levels: string[][] }} graph
+ */
+async function setBuildResultKeys(ciApp, token, owner, repo, repoId, treeSHA, builds, graph) {
+    const hasPathFilters = Object.values(builds)
+        .some((buildState) => buildState.buildParams.paths || buildState.buildParams.pathsIgnore);
+
+    const treeFiles = hasPathFilters
+        ? await getTreeFiles(ciApp, token, owner, repo, treeSHA)
+        : null;
+
+    for (const level of graph.levels) {
+        for (const buildKey of level) {
+            const buildState = builds[buildKey];
+            const { paths, pathsIgnore, buildspec, dependsOn } = buildState.buildParams;
+
+            let inputId = treeSHA;
+            if (treeFiles && (paths || pathsIgnore)) {
+                const hash = crypto.createHash('sha256');
+                const files = util.filterFilesByPaths(Object.keys(treeFiles), paths, pathsIgnore);
+
+                if (treeFiles[buildspec] && !files.includes(buildspec)) {
+                    files.push(buildspec);
+                }
+
+                for (const file of files.sort()) {
+                    hash.update(`${file}\0${treeFiles[file]}\n`);
+                }
+
+                inputId = `files:${hash.digest('hex')}`;
+            }
+
+            buildState.resultKey = util.buildResultKey(
+                repoId,
+                inputId,
+                buildState.buildParams,
+                dependsOn.reduce((ret, depBuildKey) => {
+                    ret[depBuildKey] = builds[depBuildKey].resultKey;
+                    return ret;
+                }, {}),
+            );
+        }
+    }
+}
+
+/**
+ * Get the object SHAs of all files in a git tree, keyed by path.
+ *
+ * Returns null if the tree could not be fully listed.
+ *
+ * @param {CIApp} ciApp
+ * @param {string} token
+ * @param {string} owner
+ * @param {string} repo
+ * @param {string} treeSHA
+ * @returns {Promise<object|null>}
+ */
+async function getTreeFiles(ciApp, token, owner, repo, treeSHA) {
+    ciApp.logInfo(`Getting git tree ${treeSHA}...`);
+    const response = await github.getTree(
+        ciApp.githubApiUrl,
+        token,
+        owner,
+        repo,
+        treeSHA,
+        {
+            recursive: true,
+        },
+    );
+
+    if (response.statusCode !== 200 || response.data.truncated) {
+        ciApp.logWarn(`Failed to list git tree ${treeSHA}: [${response.statusCode}]${response.data.truncated ? ' (truncated)' : ''}`);
+        return null;
+    }
+
+    return response.data.tree.reduce((ret, entry) => {
+        if (entry.type !== 'tree') {
+            ret[entry.path] = entry.sha;
+        }
+        return ret;
+    }, {});
+}
+
+/**
+ * Get the average duration in seconds of each build from the most recent completed executions.
+ *
+ * @param {CIApp} ciApp
+ * @param {string} repoId
+ * @returns {Promise<object>}
+ */
+async function getRecentBuildDurations(ciApp, repoId) {
+    try {
+        const { items } = await aws.getExecutionsForRepo(
+            ciApp.tableExecutionsName,
+            repoId,
+            {
+                limit: 10,
+            },
+        );
+
+        const executions = await Promise.all(
+            items
+                .filter((item) => item.status === 'COMPLETED')
+                .slice(0, 3)
+                .map((item) => aws.getExecution(
+                    ciApp.tableExecutionsName,
+                    item.repoId,
+                    item.executionId,
+                )),
+        );
+
+        const totals = {};
+        for (const execution of executions) {
+            for (const buildState of Object.values(execution && execution.state && execution.state.builds || {})) {
+                if (buildState.status !== 'SUCCEEDED'
+                    || buildState.reusedResult
+                    || !buildState.codeBuild
+                    || !buildState.codeBuild.endTime) {
+                    continue;
+                }
+
+                const duration = (Date.parse(buildState.codeBuild.endTime) - Date.parse(buildState.codeBuild.startTime)) / 1000;
+                if (duration > 0) {
+                    const total = totals[buildState.buildKey] || (totals[buildState.buildKey] = { sum: 0, count: 0 });
+                    total.sum += duration;
+                    total.count++;
+                }
+            }
+        }
+
+        return Object.entries(totals).reduce((ret, [buildKey, { sum, count }]) => {
+            ret[buildKey] = sum / count;
+            return ret;
+        }, {});
+    }
+    catch (err) {
+        ciApp.logWarn(`Failed to get recent build durations for "${repoId}": ${err.message}`);
+        return {};
+    }
+}
+
+/**
+ * Record the execution as the latest for its pull request,
+ * and request a stop for the one it replaces if still running.
+ *
+ * @param {CIApp} ciApp
+ * @param {StateInput} state
+ * @param {object} event
+ */
+async function supersedePreviousExecution(ciApp, state, event) {
+    const supersedeId = util.buildSupersedeId(
+        state.owner,
+        state.repo,
+        event.pull_request.number,
+    );
+
+    ciApp.logInfo(`Setting latest execution for "${supersedeId}"...`);
+    const prev = await aws.setLatestExecution(
+        ciApp.tableLocksName,
+        supersedeId,
+        state.traceId,
+        {
+            repoId: state.repoId,
+            executionId: state.executionId,
+        },
+    );
+
+    // Note: Webhooks are not guaranteed to arrive in order, so an older
+    // commit could supersede a newer one if its event is processed last.
+    if (!prev || !prev.meta
+        || prev.meta.repoId !== state.repoId
+        || prev.meta.executionId === state.executionId
+        || prev.meta.executionId.startsWith(`${state.commitSHA}/`)) {
+        return;
+    }
+
+    const prevExecution = await aws.getExecution(
+        ciApp.tableExecutionsName,
+        prev.meta.repoId,
+        prev.meta.executionId,
+    );
+
+    if (!prevExecution || prevExecution.status === 'COMPLETED' || prevExecution.meta.stop) {
+        return;
+    }
+
+    ciApp.logInfo(`Requesting stop for superseded execution "${prev.meta.executionId}"...`);
+    const stoppingExecution = await aws.updateExecution(
+        ciApp.tableExecutionsName,
+        prev.meta.repoId,
+        prev.meta.executionId,
+        {
+            meta: {
+                stop: {
+                    user: event.sender.login,
+                    requestTime: new Date().toISOString(),
+                    supersededBy: state.executionId,
+                },
+            },
+        },
+    );
+
+    await exports.wakeExecution(ciApp, stoppingExecution);
+}
+
 function clipCommitMessage(message) {
     if (typeof message !== 'string') {
         return '';
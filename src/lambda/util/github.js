@@ -1,7 +1,6 @@
 'use strict';
 
 const url = require('url');
-const jwt = require('jsonwebtoken');
 const { request } = require('./request');
 
 const USER_AGENT = 'CBuildCI https://github.com/cbuildci/cbuildci';
@@ -124,6 +123,22 @@ exports.getCommit = async function getCommit(
     );
 };
 
+exports.compareCommits = async function compareCommits(
+    githubApiUrl,
+    token,
+    owner,
+    repo,
+    base,
+    head,
+) {
+    return await apiRequest(
+        githubApiUrl,
+        token,
+        'GET',
+        `/repos/${owner}/${repo}/compare/${base}...${head}`,
+    );
+};
+
 exports.getPullRequest = async function getPullRequest(
     githubApiUrl,
     token,
@@ -160,6 +175,47 @@ exports.getPullRequestCommits = async function getPullRequestCommits(
     );
 };
 
+exports.getPullRequestFiles = async function getPullRequestFiles(
+    githubApiUrl,
+    token,
+    owner,
+    repo,
+    number,
+    { page = 1 } = {},
+) {
+    return await apiRequest(
+        githubApiUrl,
+        token,
+        'GET',
+        `/repos/${owner}/${repo}/pulls/${number}/files`,
+        {
+            query: {
+                page,
+                per_page: 100,
+            },
+        }
+    );
+};
+
+exports.getTree = async function getTree(
+    githubApiUrl,
+    token,
+    owner,
+    repo,
+    sha,
+    { recursive = false } = {},
+) {
+    return await apiRequest(
+        githubApiUrl,
+        token,
+        'GET',
+        `/repos/${owner}/${repo}/git/trees/${sha}`,
+        {
+            query: recursive ? { recursive: 1 } : null,
+        }
+    );
+};
+
 exports.getFileContent = async function getFileContent(
     githubApiUrl,
     token,
@@ -469,6 +525,9 @@ function trimToLength(str, maxLength, useEllipsis) {
 }
 
 function createJWT(appId, privateKey, expirationMinutes = 10) {
+    // Only loaded when an installation token is needed, rather than by every lambda that calls GitHub.
+    const jwt = require('jsonwebtoken');
+
     return jwt.sign({
         iat: Math.floor(Date.now() / 1000),
         exp: Math.floor(Date.now() / 1000) + expirationMinutes * 60,
@@ -0,0 +1,278 @@
+'use strict';
+
+const aws = require('./aws');
+
+const ACCOUNT_SCOPE_ID = 'account';
+
+// How long a build slot is held without being renewed. Running builds renew their
+// leases on every poll, which is at most 120 seconds apart, so leases only expire
+// if the execution that holds them has crashed or been abandoned.
+const BUILD_SLOT_LEASE_SECONDS = 600;
+
+/**
+ * Check if builds should be scheduled through the build slots table.
+ *
+ * @param {CIApp} ciApp
+ * @returns {boolean}
+ */
+exports.isSchedulerEnabled = function isSchedulerEnabled(ciApp) {
+    const limits = ciApp.buildConcurrencyLimits;
+    return Boolean(ciApp.tableBuildSlotsName && (limits.account || limits.project || limits.repo));
+};
+
+/**
+ * Build the value that identifies a build in the build slot semaphores.
+ *
+ * @param {StateInput} state
+ * @param {BuildState} buildState
+ * @returns {string}
+ */
+exports.buildSlotHolder = function buildSlotHolder(state, buildState) {
+    return `${state.repoId}|${state.executionId}|${buildState.buildKey}`;
+};
+
+/**
+ * Get the semaphore scopes a build must hold a slot in, and their limits.
+ *
+ * Builds that are not for the default branch cannot use the account slots
+ * reserved by "priorityReserve".
+ *
+ * @param {CIApp} ciApp
+ * @param {StateInput} state
+ * @param {BuildState} buildState
+ * @returns {{ id: string, limit: number }[]}
+ */
+exports.getBuildSlotScopes = function getBuildSlotScopes(ciApp, state, buildState) {
+    const limits = ciApp.buildConcurrencyLimits;
+    const scopes = [];
+
+    if (limits.account) {
+        scopes.push({
+            id: ACCOUNT_SCOPE_ID,
+            limit: state.isDefaultBranch
+                ? limits.account
+                : Math.max(1, limits.account - limits.priorityReserve),
+        });
+    }
+
+    if (limits.project) {
+        scopes.push({
+            id: `project:${buildState.buildParams.codeBuildProjectArn}`,
+            limit: limits.project,
+        });
+    }
+
+    if (limits.repo) {
+        scopes.push({
+            id: `repo:${state.repoId}`,
+            limit: limits.repo,
+        });
+    }
+
+    return scopes;
+};
+
+/**
+ * Get the holders of a build slot semaphore whose leases have not expired.
+ *
+ * @param {object|null} slots - The semaphore's item in the build slots table.
+ * @param {number} [now]
+ * @returns {string[]}
+ */
+exports.getBuildSlotHolders = function getBuildSlotHolders(slots, now = Date.now()) {
+    const leases = slots && slots.leases || {};
+    return Object.keys(leases).filter((holder) => leases[holder] >= now);
+};
+
+/**
+ * Check if a repo has more than its fair share of account slots while
+ * other repos are competing for the slots that are left.
+ *
+ * This is a soft limit since it is based on a read of the account semaphore,
+ * while the limits from {@link getBuildSlotScopes} are enforced atomically.
+ *
+ * @param {CIApp} ciApp
+ * @param {string} repoId
+ * @param {string[]} accountHolders
+ * @returns {boolean}
+ */
+exports.isOverFairShare = function isOverFairShare(ciApp, repoId, accountHolders) {
+    const accountLimit = ciApp.buildConcurrencyLimits.account;
+    if (!accountLimit) {
+        return false;
+    }
+
+    const heldByRepo = {};
+    for (const holder of accountHolders) {
+        const holderRepoId = holder.split('|')[0];
+        heldByRepo[holderRepoId] = (heldByRepo[holderRepoId] || 0) + 1;
+    }
+
+    const otherRepoCount = Object.keys(heldByRepo).filter((id) => id !== repoId).length;
+    const freeSlots = accountLimit - accountHolders.length;
+
+    // Only limit the repo when there are not enough free slots for the other active repos.
+    if (freeSlots > otherRepoCount) {
+        return false;
+    }
+
+    const fairShare = Math.max(1, Math.ceil(accountLimit / (otherRepoCount + 1)));
+    return (heldByRepo[repoId] || 0) >= fairShare;
+};
+
+/**
+ * Attempt to take a build slot in each scope for a build.
+ *
+ * @param {CIApp} ciApp
+ * @param {StateInput} state
+ * @param {BuildState} buildState
+ * @returns {Promise<boolean>} False if the build should stay queued.
+ */
+exports.acquireBuildSlot = async function acquireBuildSlot(ciApp, state, buildState) {
+    if (!exports.isSchedulerEnabled(ciApp)) {
+        return true;
+    }
+
+    const scopes = exports.getBuildSlotScopes(ciApp, state, buildState);
+
+    if (ciApp.buildConcurrencyLimits.account) {
+        const accountSlots = await aws.getBuildSlots(
+            ciApp.tableBuildSlotsName,
+            ACCOUNT_SCOPE_ID,
+        );
+
+        if (exports.isOverFairShare(ciApp, state.repoId, exports.getBuildSlotHolders(accountSlots))) {
+            ciApp.logInfo(`Build "${buildState.buildKey}" queued since "${state.repoId}" is using its fair share of build slots`);
+            return false;
+        }
+    }
+
+    const acquired = await aws.acquireBuildSlot(
+        ciApp.tableBuildSlotsName,
+        exports.buildSlotHolder(state, buildState),
+        scopes,
+        BUILD_SLOT_LEASE_SECONDS,
+    );
+
+    if (acquired) {
+        buildState.slotScopeIds = scopes.map(({ id }) => id);
+    }
+    else {
+        ciApp.logInfo(`Build "${buildState.buildKey}" queued since a concurrency limit has been reached`);
+    }
+
+    return acquired;
+};
+
+/**
+ * Renew the build slot leases of running builds, so they do not expire.
+ *
+ * @param {CIApp} ciApp
+ * @param {StateInput} state
+ * @param {BuildState[]} buildStates
+ */
+exports.renewBuildSlots = async function renewBuildSlots(ciApp, state, buildStates) {
+    const holdersByScopeId = {};
+    for (const buildState of buildStates) {
+        for (const scopeId of buildState.slotScopeIds || []) {
+            holdersByScopeId[scopeId] = holdersByScopeId[scopeId] || [];
+            holdersByScopeId[scopeId].push(exports.buildSlotHolder(state, buildState));
+        }
+    }
+
+    if (!Object.keys(holdersByScopeId).length) {
+        return;
+    }
+
+    try {
+        await aws.renewBuildSlots(
+            ciApp.tableBuildSlotsName,
+            holdersByScopeId,
+            BUILD_SLOT_LEASE_SECONDS,
+        );
+    }
+    catch (err) {
+        ciApp.logError(`Failed to renew build slots: ${err.stack}`);
+    }
+};
+
+/**
+ * Release the build slots held by a build, if any.
+ *
+ * @param {CIApp} ciApp
+ * @param {StateInput} state
+ * @param {BuildState} buildState
+ */
+exports.releaseBuildSlot = async function releaseBuildSlot(ciApp, state, buildState) {
+    if (!buildState.slotScopeIds || !buildState.slotScopeIds.length) {
+        return;
+    }
+
+    const holder = exports.buildSlotHolder(state, buildState);
+
+    try {
+        await aws.releaseBuildSlots(
+            ciApp.tableBuildSlotsName,
+            buildState.slotScopeIds.reduce((ret, scopeId) => {
+                ret[scopeId] = [holder];
+                return ret;
+            }, {}),
+        );
+        buildState.slotScopeIds = null;
+    }
+    catch (err) {
+        ciApp.logError(`Failed to release build slot for "${buildState.buildKey}": ${err.stack}`);
+    }
+};
+
+/**
+ * Release any build slots that may be held by the builds of an ending execution.
+ *
+ * The state may not record every slot that was taken (e.g. if the execution errored
+ * after a slot was taken, but before the state was saved), so each build is also
+ * removed from every scope it could have a slot in.
+ *
+ * @param {CIApp} ciApp
+ * @param {StateInput} state
+ */
+exports.releaseAllBuildSlots = async function releaseAllBuildSlots(ciApp, state) {
+    if (!ciApp.tableBuildSlotsName) {
+        return;
+    }
+
+    const isEnabled = exports.isSchedulerEnabled(ciApp);
+    const holdersByScopeId = {};
+
+    for (const buildState of Object.values(state.builds)) {
+        const scopeIds = new Set(buildState.slotScopeIds || []);
+
+        if (isEnabled) {
+            for (const { id } of exports.getBuildSlotScopes(ciApp, state, buildState)) {
+                scopeIds.add(id);
+            }
+        }
+
+        for (const scopeId of scopeIds) {
+            holdersByScopeId[scopeId] = holdersByScopeId[scopeId] || [];
+            holdersByScopeId[scopeId].push(exports.buildSlotHolder(state, buildState));
+        }
+    }
+
+    if (!Object.keys(holdersByScopeId).length) {
+        return;
+    }
+
+    try {
+        await aws.releaseBuildSlots(
+            ciApp.tableBuildSlotsName,
+            holdersByScopeId,
+        );
+
+        for (const buildState of Object.values(state.builds)) {
+            buildState.slotScopeIds = null;
+        }
+    }
+    catch (err) {
+        ciApp.logError(`Failed to release build slots: ${err.stack}`);
+    }
+};
@@ -0,0 +1,109 @@
+'use strict';
+
+const CIApp = require('../CIApp');
+const aws = require('../util/aws');
+const { initTokenCache, createEventContext } = require('./v1/util');
+const { handleEvent } = require('./v1/events');
+
+// CIApp contains logging and config.
+const ciApp = CIApp.create(process.env);
+
+exports.handler = (event, context, cb) => {
+    const traceId = `lambda:${context.logGroupName}:${context.logStreamName}:${context.awsRequestId}`;
+
+    queueHandler(event.Records || [], ciApp, traceId)
+        .then((result) => cb(null, result))
+        .catch((err) => cb(err));
+};
+
+/**
+ * Process a batch of webhook events that were queued by the webhook lambda.
+ *
+ * Events that fail with a client error (e.g. invalid YAML or an existing lock)
+ * are dropped since retrying them would fail the same way. Any other failure
+ * leaves the message on the queue to be retried, and eventually moved to the
+ * dead-letter queue.
+ *
+ * @param {object[]} records
+ * @param {CIApp} ciApp
+ * @param {string} traceId
+ * @returns {Promise<object>}
+ */
+async function queueHandler(records, ciApp, traceId) {
+    initTokenCache(ciApp);
+
+    const results = await Promise.all(records.map(async (record) => {
+        try {
+            await processRecord(record, ciApp, traceId);
+            return true;
+        }
+        catch (err) {
+            if (err.status && err.status < 500) {
+                ciApp.logInfo(`Dropping queued event ${record.messageId}: [${err.status}] ${err.message}`);
+                return true;
+            }
+
+            ciApp.logError(`Failed to process queued event ${record.messageId}: ${err.stack || err.message}`);
+            return false;
+        }
+    }));
+
+    const failedCount = results.filter((processed) => !processed).length;
+
+    if (failedCount) {
+        // Lambda only deletes the batch from the queue if the invocation succeeds,
+        // so delete the processed messages before failing to avoid running them again.
+        const processedReceiptHandles = records
+            .filter((record, i) => results[i])
+            .map((record) => record.receiptHandle);
+
+        if (processedReceiptHandles.length) {
+            const { failed } = await aws.deleteSQSMessages(
+                ciApp.webhookQueueUrl,
+                processedReceiptHandles,
+            );
+
+            if (failed.length) {
+                ciApp.logWarn(`Failed to delete ${failed.length} processed message(s) from the webhook queue`);
+            }
+        }
+
+        throw new Error(`Failed to process ${failedCount} of ${records.length} queued event(s)`);
+    }
+
+    return {
+        processed: records.length,
+    };
+}
+
+async function processRecord(record, ciApp, traceId) {
+    const {
+        repoId,
+        gitHubEventType,
+        deliveryId,
+        traceId: webhookTraceId,
+        ghEvent,
+    } = JSON.parse(record.body);
+
+    ciApp.logInfo(`Processing queued ${gitHubEventType} event ${record.messageId} (delivery ${deliveryId}, webhook ${webhookTraceId})...`);
+
+    const ctx = createEventContext(
+        ciApp,
+        `${traceId}:${record.messageId}`,
+        repoId,
+        {
+            'x-github-event': gitHubEventType,
+            'x-github-delivery': deliveryId,
+        },
+    );
+
+    // The repo config is reloaded by the event handlers.
+    await handleEvent(
+        ctx,
+        gitHubEventType,
+        ghEvent,
+        null,
+    );
+
+    ciApp.logInfo(`Queued event ${record.messageId} result: ${JSON.stringify(ctx.body)}`);
+}
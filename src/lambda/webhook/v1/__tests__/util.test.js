@@ -0,0 +1,57 @@
+'use strict';
+
+// The GitHub client is not used by the functions under test.
+jest.mock('../../../../../src/lambda/util/github', () => ({}));
+
+const { getEventDedupeKey } = require('../../../../../src/lambda/webhook/v1/util');
+
+describe('webhook/v1/util', () => {
+
+    describe('getEventDedupeKey', () => {
+        const sha = 'c0ffeec0ffeec0ffeec0ffeec0ffeec0ffeec0ff';
+        const repository = {
+            name: 'Repo',
+            owner: {
+                login: 'Owner',
+            },
+        };
+
+        it('should build a key from the repo, commit, event and action', () => {
+            expect(getEventDedupeKey('pull_request', {
+                action: 'synchronize',
+                repository,
+                pull_request: {
+                    head: { sha },
+                },
+            })).toBe(`event:owner/repo/${sha}/pull_request:synchronize`);
+        });
+
+        it('should include the check run ID for check run events', () => {
+            const ghEvent = (id) => ({
+                action: 'rerequested',
+                repository,
+                check_run: { id, head_sha: sha },
+            });
+
+            expect(getEventDedupeKey('check_run', ghEvent(1))).toBe(`event:owner/repo/${sha}/check_run:1:rerequested`);
+            expect(getEventDedupeKey('check_run', ghEvent(1))).not.toBe(getEventDedupeKey('check_run', ghEvent(2)));
+        });
+
+        it('should not build a key for actions requested by a user', () => {
+            expect(getEventDedupeKey('check_run', {
+                action: 'requested_action',
+                repository,
+                check_run: { id: 1, head_sha: sha },
+                requested_action: { identifier: 'stop' },
+            })).toBe(null);
+        });
+
+        it('should not build a key without a valid commit', () => {
+            expect(getEventDedupeKey('check_suite', {
+                action: 'requested',
+                repository,
+                check_suite: { id: 1, head_sha: 'invalid' },
+            })).toBe(null);
+        });
+    });
+});
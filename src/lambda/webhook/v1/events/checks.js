@@ -6,7 +6,7 @@ const schema = require('../../../../common/schema');
 const aws = require('../../../util/aws');
 const github = require('../../../util/github');
 const webhookUtil = require('../util');
-const { startExecution } = require('../../../util/execution');
+const { startExecution, wakeExecution } = require('../../../util/execution');
 
 /**
  * @param {object} ctx
@@ -38,7 +38,7 @@ module.exports = async function handleCheckEvent(ctx, gitHubEventType, ghEvent,
             ctx.throw(400, 'Execution is already stopping');
         }
 
-        await aws.updateExecution(
+        const stoppingExecution = await aws.updateExecution(
             ctx.ciApp.tableExecutionsName,
             execution.repoId,
             execution.executionId,
@@ -52,12 +52,16 @@ module.exports = async function handleCheckEvent(ctx, gitHubEventType, ghEvent,
             },
         );
 
+        // Wake the step function so it stops the builds now.
+        await wakeExecution(ctx.ciApp, stoppingExecution);
+
         ctx.body = {
             message: 'Requested Stop',
         };
     }
     else if ((gitHubEventType === 'check_suite' || gitHubEventType === 'check_run') && ghEvent.action === 'rerequested'
-        || gitHubEventType === 'check_run' && ghEvent.action === 'requested_action' && ghEvent.requested_action.identifier === 'rerun') {
+        || gitHubEventType === 'check_run' && ghEvent.action === 'requested_action' && ghEvent.requested_action.identifier === 'rerun'
+        || gitHubEventType === 'check_run' && ghEvent.action === 'requested_action' && ghEvent.requested_action.identifier === 'rerun-failed') {
 
         const eventRepoId = util.buildRepoId(
             ghEvent.repository.owner.login,
@@ -120,6 +124,23 @@ module.exports = async function handleCheckEvent(ctx, gitHubEventType, ghEvent,
                 expires_at: null,
             };
 
+        // Load the execution being rerun, if only its failed builds should run again.
+        let rerunFailedOf = null;
+        if (gitHubEventType === 'check_run' && ghEvent.action === 'requested_action' && ghEvent.requested_action.identifier === 'rerun-failed') {
+            const { owner, repo, commit, executionNum } = util.parseLongExecutionId(ghEvent.check_run.external_id);
+
+            rerunFailedOf = await aws.getExecution(
+                ctx.ciApp.tableExecutionsName,
+                util.buildRepoId(owner, repo),
+                util.buildExecutionId(commit, executionNum),
+            );
+
+            if (!rerunFailedOf || !rerunFailedOf.conclusion) {
+                ctx.logInfo('Aborting as execution is not completed');
+                ctx.throw(400, 'Execution is not completed');
+            }
+        }
+
         ctx.body = await startExecution(
             ctx.ciApp,
             ctx.throw,
@@ -139,6 +160,9 @@ module.exports = async function handleCheckEvent(ctx, gitHubEventType, ghEvent,
             {
                 type: gitHubEventType,
                 action: ghEvent.action,
+                head_branch: (gitHubEventType === 'check_suite' ? ghEvent.check_suite : ghEvent.check_run.check_suite || {}).head_branch || null,
+                before: (gitHubEventType === 'check_suite' ? ghEvent.check_suite : ghEvent.check_run.check_suite || {}).before || null,
+                default_branch: ghEvent.repository.default_branch || null,
                 sender: {
                     id: ghEvent.sender.id,
                     login: ghEvent.sender.login,
@@ -165,6 +189,9 @@ module.exports = async function handleCheckEvent(ctx, gitHubEventType, ghEvent,
             },
             isForGitHubApp ? ghEvent.installation.id : null,
             ghEvent[gitHubEventType].head_sha,
+            {
+                rerunFailedOf,
+            },
         );
     }
     else if (ghEvent.action === 'rerequested') {
@@ -0,0 +1,51 @@
+'use strict';
+
+const handlePullRequestEvent = require('./pullRequest');
+const handleCheckEvent = require('./checks');
+
+const SUPPORTED_EVENT_TYPES = [
+    'pull_request',
+    'check_suite',
+    'check_run',
+];
+
+/**
+ * Check if a GitHub event type is handled by CBuildCI.
+ *
+ * @param {string} gitHubEventType
+ * @returns {boolean}
+ */
+exports.isSupportedEventType = function isSupportedEventType(gitHubEventType) {
+    return SUPPORTED_EVENT_TYPES.includes(gitHubEventType);
+};
+
+/**
+ * Route a verified GitHub event to its handler.
+ *
+ * @param {object} ctx
+ * @param {string} gitHubEventType
+ * @param {object} ghEvent
+ * @param {RepoConfig|null} repoConfig
+ */
+exports.handleEvent = async function handleEvent(ctx, gitHubEventType, ghEvent, repoConfig) {
+    if (gitHubEventType === 'pull_request') {
+        ctx.logInfo(`Processing ${gitHubEventType} GitHub event...`);
+        await handlePullRequestEvent(
+            ctx,
+            ghEvent,
+            repoConfig,
+        );
+    }
+    else if (gitHubEventType === 'check_suite' || gitHubEventType === 'check_run') {
+        ctx.logInfo(`Processing ${gitHubEventType} GitHub event...`);
+        await handleCheckEvent(
+            ctx,
+            gitHubEventType,
+            ghEvent,
+            repoConfig,
+        );
+    }
+    else {
+        ctx.throw(400, `Unsupported GitHub event type: ${gitHubEventType}`);
+    }
+};
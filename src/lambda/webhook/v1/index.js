@@ -4,14 +4,10 @@ const bodyParser = require('koa-bodyparser');
 const koaRouter = require('koa-router');
 const crypto = require('crypto');
 const util = require('../../../common/util');
-const cacheUtil = require('../../../common/cache');
 const schema = require('../../../common/schema');
 const aws = require('../../util/aws');
-const github = require('../../util/github');
-const { validateRepositoryEvent } = require('./util');
-
-const handlePullRequestEvent = require('./events/pullRequest');
-const handleCheckEvent = require('./events/checks');
+const { validateRepositoryEvent, initTokenCache, getEventDedupeKey } = require('./util');
+const { handleEvent, isSupportedEventType } = require('./events');
 
 module.exports = koaRouter()
     .use(bodyParser({
@@ -22,21 +18,7 @@ module.exports = koaRouter()
         },
     }))
     .use(async (ctx, next) => {
-        // Init cache GitHub app installation access tokens, if missing.
-        if (!ctx.ciApp[cacheUtil.INSTALLATION_TOKEN_CACHE]) {
-            ctx.ciApp[cacheUtil.INSTALLATION_TOKEN_CACHE] = {};
-            ctx.ciApp[cacheUtil.INSTALLATION_TOKEN_CACHE_LAST_PRUNE] = Date.now();
-        }
-
-        // Prune expired tokens from the cache.
-        else if (ctx.ciApp[cacheUtil.INSTALLATION_TOKEN_CACHE_LAST_PRUNE] + 300000 < Date.now()) {
-            cacheUtil.pruneCache(
-                ctx.ciApp[cacheUtil.INSTALLATION_TOKEN_CACHE],
-                (cached, key) => !key.startsWith('userToken:') || !github.isTokenExpired(cached.expires_at, 0),
-            );
-            ctx.ciApp[cacheUtil.INSTALLATION_TOKEN_CACHE_LAST_PRUNE] = Date.now();
-        }
-
+        initTokenCache(ctx.ciApp);
         await next();
     })
     .post('/:repoId', async (ctx) => {
@@ -146,24 +128,107 @@ async function webhookRoute(ctx) {
 
     const gitHubEventType = ctx.headers['x-github-event'];
 
-    if (gitHubEventType === 'pull_request') {
-        ctx.logInfo(`Processing ${gitHubEventType} GitHub event...`);
-        await handlePullRequestEvent(
-            ctx,
-            ghEvent,
-            repoConfig,
-        );
+    // Record the delivery in the deliveries ledger, and skip the event if it is a
+    // redelivery or a duplicate of an event for the same commit and action.
+    // This is done after verifying the signature so unsigned requests cannot
+    // suppress legitimate events.
+    const dedupeIds = [];
+    if (ctx.ciApp.tableWebhookDeliveriesName) {
+        const dedupeEntries = [];
+        const deliveryId = ctx.headers['x-github-delivery'];
+        const eventDedupeKey = getEventDedupeKey(gitHubEventType, ghEvent);
+
+        if (typeof deliveryId === 'string' && deliveryId) {
+            dedupeEntries.push({
+                id: `delivery:${deliveryId}`,
+                expireSeconds: ctx.ciApp.webhookDeliveryDedupeSeconds,
+            });
+        }
+
+        if (eventDedupeKey) {
+            dedupeEntries.push({
+                id: eventDedupeKey,
+                expireSeconds: ctx.ciApp.webhookEventDedupeSeconds,
+            });
+        }
+
+        if (dedupeEntries.length) {
+            ctx.logInfo('Recording delivery in deliveries ledger...');
+            const isNew = await aws.claimWebhookDelivery(
+                ctx.ciApp.tableWebhookDeliveriesName,
+                dedupeEntries,
+                {
+                    traceId: ctx.req.traceId,
+                    gitHubEventType,
+                },
+            );
+
+            if (!isNew) {
+                const message = 'Skipping event: Duplicate delivery or event';
+                ctx.logInfo(message);
+                ctx.body = {
+                    message,
+                };
+                return;
+            }
+
+            dedupeIds.push(...dedupeEntries.map((entry) => entry.id));
+        }
     }
-    else if (gitHubEventType === 'check_suite' || gitHubEventType === 'check_run') {
-        ctx.logInfo(`Processing ${gitHubEventType} GitHub event...`);
-        await handleCheckEvent(
-            ctx,
-            gitHubEventType,
-            ghEvent,
-            repoConfig,
-        );
+
+    try {
+        await dispatchEvent(ctx, repoId, gitHubEventType, ghEvent, repoConfig);
+    }
+    catch (err) {
+        // Allow the event to be redelivered if it failed due to a server error.
+        if (dedupeIds.length && !(err.status && err.status < 500)) {
+            try {
+                await aws.releaseWebhookDelivery(
+                    ctx.ciApp.tableWebhookDeliveriesName,
+                    dedupeIds,
+                );
+            }
+            catch (releaseErr) {
+                ctx.logError(`Failed to release delivery from deliveries ledger: ${releaseErr.stack}`);
+            }
+        }
+
+        throw err;
     }
-    else {
-        ctx.throw(400, `Unsupported GitHub event type: ${gitHubEventType}`);
+}
+
+async function dispatchEvent(ctx, repoId, gitHubEventType, ghEvent, repoConfig) {
+    // Hand off the verified event to the webhook queue, if enabled,
+    // so the delivery returns well within GitHub's timeout.
+    if (ctx.ciApp.webhookQueueUrl) {
+        if (!isSupportedEventType(gitHubEventType)) {
+            ctx.throw(400, `Unsupported GitHub event type: ${gitHubEventType}`);
+        }
+
+        ctx.logInfo(`Queueing ${gitHubEventType} GitHub event...`);
+        const { messageId } = await aws.sendSQSMessage({
+            QueueUrl: ctx.ciApp.webhookQueueUrl,
+            MessageBody: JSON.stringify({
+                repoId,
+                gitHubEventType,
+                deliveryId: ctx.headers['x-github-delivery'] || null,
+                traceId: ctx.req.traceId,
+                ghEvent,
+            }),
+        });
+
+        ctx.status = 202;
+        ctx.body = {
+            message: 'Queued event',
+            messageId,
+        };
+        return;
     }
+
+    await handleEvent(
+        ctx,
+        gitHubEventType,
+        ghEvent,
+        repoConfig,
+    );
 }
@@ -1,5 +1,110 @@
 'use strict';
 
+const util = require('../../../common/util');
+const cacheUtil = require('../../../common/cache');
+const github = require('../../util/github');
+
+/**
+ * Init or prune the cache of GitHub app installation access tokens.
+ *
+ * @param {CIApp} ciApp
+ */
+exports.initTokenCache = function initTokenCache(ciApp) {
+    // Init cache GitHub app installation access tokens, if missing.
+    if (!ciApp[cacheUtil.INSTALLATION_TOKEN_CACHE]) {
+        ciApp[cacheUtil.INSTALLATION_TOKEN_CACHE] = {};
+        ciApp[cacheUtil.INSTALLATION_TOKEN_CACHE_LAST_PRUNE] = Date.now();
+    }
+
+    // Prune expired tokens from the cache.
+    else if (ciApp[cacheUtil.INSTALLATION_TOKEN_CACHE_LAST_PRUNE] + 300000 < Date.now()) {
+        cacheUtil.pruneCache(
+            ciApp[cacheUtil.INSTALLATION_TOKEN_CACHE],
+            (cached, key) => !key.startsWith('userToken:') || !github.isTokenExpired(cached.expires_at, 0),
+        );
+        ciApp[cacheUtil.INSTALLATION_TOKEN_CACHE_LAST_PRUNE] = Date.now();
+    }
+};
+
+/**
+ * Create a minimal Koa-like context so webhook event handlers
+ * can run outside of a Koa request (e.g. from the webhook queue).
+ *
+ * @param {CIApp} ciApp
+ * @param {string} traceId
+ * @param {string} repoId - The webhook identifier, which is "app" for GitHub App webhooks.
+ * @param {object} headers
+ * @returns {object}
+ */
+exports.createEventContext = function createEventContext(ciApp, traceId, repoId, headers) {
+    return {
+        ciApp,
+        params: {
+            repoId,
+        },
+        headers,
+        req: {
+            traceId,
+        },
+        status: 200,
+        body: null,
+        logInfo: ciApp.logInfo.bind(ciApp),
+        logWarn: ciApp.logWarn.bind(ciApp),
+        logTrace: ciApp.logTrace.bind(ciApp),
+        logDebug: ciApp.logDebug.bind(ciApp),
+        logError: ciApp.logError.bind(ciApp),
+        throw(status, message, props = {}) {
+            const err = new Error(message);
+            err.status = status;
+            err.expose = status < 500;
+            Object.assign(err, props);
+            throw err;
+        },
+    };
+};
+
+/**
+ * Build the key used to detect duplicate events for the same repo, commit and action,
+ * or null if the event does not have enough data to build one.
+ *
+ * Actions requested by a user on a check run (e.g. "stop", then "rerun") are never
+ * duplicates of each other, so they get no key, and only redeliveries are skipped.
+ * Check run and check suite events include their ID, since a commit can have several.
+ *
+ * @param {string} gitHubEventType
+ * @param {object} ghEvent
+ * @returns {string|null}
+ */
+exports.getEventDedupeKey = function getEventDedupeKey(gitHubEventType, ghEvent) {
+    const repository = ghEvent.repository;
+    if (!repository || !repository.owner
+        || typeof repository.owner.login !== 'string'
+        || typeof repository.name !== 'string') {
+        return null;
+    }
+
+    const baseEventObject = ghEvent[gitHubEventType];
+    const sha = baseEventObject && (
+        gitHubEventType === 'pull_request'
+            ? baseEventObject.head && baseEventObject.head.sha
+            : baseEventObject.head_sha
+    );
+
+    if (!util.isValidSha(sha)) {
+        return null;
+    }
+
+    if (ghEvent.action === 'requested_action') {
+        return null;
+    }
+
+    const eventType = (gitHubEventType === 'check_run' || gitHubEventType === 'check_suite') && baseEventObject.id != null
+        ? `${gitHubEventType}:${baseEventObject.id}`
+        : gitHubEventType;
+
+    return `event:${util.buildLockId(repository.owner.login, repository.name, sha)}/${eventType}:${ghEvent.action}`;
+};
+
 /**
  * Validate that an event contains repository metadata.
  *